@@ -12,12 +12,28 @@ ptr_params = {
     "test_suite": "json2netns.tests.base",
     "test_suite_timeout": 120,
     "required_coverage": {
+        "json2netns/backend.py": 90,
+        "json2netns/batch.py": 90,
         "json2netns/config.py": 90,
         "json2netns/consts.py": 100,
+        "json2netns/dryrun.py": 90,
         "json2netns/interfaces.py": 90,
+        "json2netns/inventory.py": 90,
+        "json2netns/journal.py": 90,
         "json2netns/main.py": 70,
+        "json2netns/metrics.py": 90,
+        "json2netns/model.py": 90,
+        "json2netns/netlink.py": 70,
         "json2netns/netns.py": 76,
+        "json2netns/nsenter.py": 80,
+        "json2netns/plancache.py": 90,
+        "json2netns/reconcile.py": 90,
         "json2netns/route.py": 76,
+        "json2netns/routefeed.py": 90,
+        "json2netns/scheduler.py": 90,
+        "json2netns/teardown.py": 90,
+        "json2netns/trace.py": 90,
+        "json2netns/watch.py": 90,
     },
     "run_usort": True,
     "run_black": True,
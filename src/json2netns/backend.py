@@ -0,0 +1,191 @@
+import logging
+from functools import partial
+from subprocess import CompletedProcess, PIPE, run
+from typing import Any, Dict, Optional, Sequence, TYPE_CHECKING
+
+from json2netns.consts import DEFAULT_IP, DEFAULT_MAX_IN_FLIGHT
+from json2netns.metrics import get_metrics, SUBPROCESSES
+from json2netns.nsenter import pinned_netns, switch_netns
+from json2netns.trace import command_type, span
+
+if TYPE_CHECKING:  # pragma: nocover
+    # Only asyncio actions pay its import - see main.py
+    import asyncio
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Backend:
+    """How Interface, Namespace and Route objects execute `ip` commands
+    - run() takes the same arguments as subprocess.run() + the netns to run in"""
+
+    IP = DEFAULT_IP
+    name = "Backend"
+
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> None:
+        self.max_in_flight = max_in_flight
+        self._semaphore: Optional["asyncio.Semaphore"] = None
+        self._semaphore_loop: Optional["asyncio.AbstractEventLoop"] = None
+
+    def close(self) -> None:
+        """Release any resources (sockets etc.) the backend holds"""
+        pass
+
+    def semaphore(self) -> "asyncio.Semaphore":
+        """Bounds run_async() commands in flight - one per event loop"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def run(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        raise NotImplementedError("Each backend needs to overload run")
+
+    async def run_async(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        """Coroutine run() - backends that can't avoid blocking use a thread"""
+        import asyncio
+
+        async with self.semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                None, partial(self.run, cmd, netns_name, **kwargs)
+            )
+
+
+class SubprocessBackend(Backend):
+    """Fork + exec `ip` (via `ip netns exec` for netns commands) per command
+    - Threads pinned to a netns run its commands directly from inside it"""
+
+    name = "subprocess"
+
+    def run(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        run_metrics = get_metrics()
+        if run_metrics:
+            run_metrics.inc(SUBPROCESSES, command=command_type(cmd))
+        pinned = pinned_netns()
+        if pinned is not None:
+            # Children inherit the thread's netns so enter (or leave) it first
+            in_pinned_netns = bool(netns_name) and netns_name == pinned
+            switch_netns(netns_name if in_pinned_netns else "")
+            if in_pinned_netns:
+                LOG.debug(f"Running from inside {netns_name} netns: {' '.join(cmd)}")
+                return run(cmd, **kwargs)
+
+        if netns_name:
+            cmd = [self.IP, "netns", "exec", netns_name] + list(cmd)
+            LOG.debug(f"Running in {netns_name} netns: {' '.join(cmd)}")
+        else:
+            LOG.debug(f"Running: {' '.join(cmd)}")
+        return run(cmd, **kwargs)
+
+    async def run_async(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        """run() via asyncio.create_subprocess_exec - no thread per command
+        - Supports the check, encoding, input, stdout + stderr run() kwargs"""
+        check = kwargs.pop("check", False)
+        encoding = kwargs.pop("encoding", None)
+        input_data = kwargs.pop("input", None)
+        stdout = kwargs.pop("stdout", None)
+        stderr = kwargs.pop("stderr", None)
+        if kwargs:
+            raise TypeError(f"run_async() does not support {', '.join(kwargs)}")
+        import asyncio
+
+        if isinstance(input_data, str):
+            input_data = input_data.encode(encoding if encoding else "utf-8")
+        run_metrics = get_metrics()
+        if run_metrics:
+            run_metrics.inc(SUBPROCESSES, command=command_type(cmd))
+
+        if netns_name:
+            cmd = [self.IP, "netns", "exec", netns_name] + list(cmd)
+        LOG.debug(f"Running async: {' '.join(cmd)}")
+        async with self.semaphore():
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=PIPE if input_data is not None else None,
+                stdout=stdout,
+                stderr=stderr,
+            )
+            out, err = await proc.communicate(input_data)
+
+        stdout_data: Any = out
+        stderr_data: Any = err
+        if encoding:
+            stdout_data = out.decode(encoding) if out is not None else None
+            stderr_data = err.decode(encoding) if err is not None else None
+        cp = CompletedProcess(
+            list(cmd), int(proc.returncode or 0), stdout_data, stderr_data
+        )
+        if check:
+            cp.check_returncode()
+        return cp
+
+
+class TracingBackend(Backend):
+    """Wraps another backend + records a span per command (for --trace)
+    - Only installed when tracing so untraced runs pay nothing"""
+
+    def __init__(self, backend: Backend) -> None:
+        super().__init__(backend.max_in_flight)
+        self.backend = backend
+        self.IP = backend.IP
+        self.name = f"{backend.name}+trace"
+
+    def close(self) -> None:
+        self.backend.close()
+
+    def _span_args(self, cmd: Sequence[str], netns_name: str, kwargs: Any) -> Dict:
+        args: Dict[str, Any] = {"cmd": " ".join(cmd)}
+        if netns_name:
+            args["namespace"] = netns_name
+        batch_input = kwargs.get("input")
+        if isinstance(batch_input, str):
+            args["lines"] = batch_input.count("\n")
+        elif isinstance(batch_input, bytes):
+            args["lines"] = batch_input.count(b"\n")
+        return args
+
+    def run(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        args = self._span_args(cmd, netns_name, kwargs)
+        with span(command_type(cmd), "command", **args) as cmd_span:
+            cp = self.backend.run(cmd, netns_name, **kwargs)
+            cmd_span.set(rc=cp.returncode)
+            return cp
+
+    async def run_async(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        args = self._span_args(cmd, netns_name, kwargs)
+        with span(command_type(cmd), "command", **args) as cmd_span:
+            cp = await self.backend.run_async(cmd, netns_name, **kwargs)
+            cmd_span.set(rc=cp.returncode)
+            return cp
+
+
+_backend: Backend = SubprocessBackend()
+
+
+def get_backend() -> Backend:
+    return _backend
+
+
+def set_backend(backend: Backend) -> Backend:
+    """Set the backend all objects use + return the previous one"""
+    global _backend
+    previous = _backend
+    _backend = backend
+    LOG.debug(f"Using {backend.name} backend")
+    return previous
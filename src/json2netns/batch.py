@@ -0,0 +1,188 @@
+import logging
+import re
+from dataclasses import dataclass
+from subprocess import CompletedProcess, PIPE
+from typing import Any, Dict, List, Sequence
+
+from json2netns.backend import get_backend
+from json2netns.consts import DEFAULT_IP
+
+
+LOG = logging.getLogger(__name__)
+# `ip -batch` reports each failing line as "Command failed <file>:<line_number>"
+FAILED_LINE_RE = re.compile(r"^Command failed (?P<file>\S+):(?P<line>\d+)$")
+# Errors we see when the object we're adding is already present
+EXISTS_MESSAGES = ("File exists", "already assigned")
+
+
+@dataclass
+class BatchCommand:
+    args: Sequence[str]
+    description: str
+    check: bool = True
+    exists_ok: bool = False
+
+
+@dataclass
+class BatchFailure:
+    line: int
+    command: BatchCommand
+    message: str
+
+    def __str__(self) -> str:
+        return (
+            f"line {self.line} '{' '.join(self.command.args)}' "
+            + f"({self.command.description}): {self.message}"
+        )
+
+
+def nexthop_round(args: Sequence[str]) -> bool:
+    """Nexthop objects + the routes using them need their devices' carrier up
+    - i.e. veth peers up in other namespaces, so they're batched after every
+      namespace's links + addresses"""
+    return bool(args) and (
+        args[0] == "nexthop" or (args[0] == "route" and "nhid" in args)
+    )
+
+
+class Batch:
+    """Collect `ip` commands to be ran by one `ip -batch` process
+    - Commands run in netns_name if set, otherwise the default namespace"""
+
+    IP = DEFAULT_IP
+
+    def __init__(self, netns_name: str = "") -> None:
+        self.netns_name = netns_name
+        self.commands: List[BatchCommand] = []
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    @property
+    def label(self) -> str:
+        return self.netns_name if self.netns_name else "default"
+
+    def add(
+        self,
+        args: Sequence[str],
+        description: str,
+        *,
+        check: bool = True,
+        exists_ok: bool = False,
+    ) -> None:
+        """Add a command to the batch - args should not include the ip binary"""
+        self.commands.append(
+            BatchCommand(list(args), description, check=check, exists_ok=exists_ok)
+        )
+
+    def cmd(self) -> List[str]:
+        cmd = [self.IP]
+        if self.netns_name:
+            cmd.extend(["-n", self.netns_name])
+        # -force keeps ip going after a failed line so we see every error
+        cmd.extend(["-force", "-batch", "-"])
+        return cmd
+
+    def lines(self) -> List[str]:
+        return [" ".join(command.args) for command in self.commands]
+
+    def parse_failures(self, stderr: str) -> List[BatchFailure]:
+        """Map `ip -batch` stderr back to the BatchCommand that caused each error"""
+        failures: List[BatchFailure] = []
+        messages: List[str] = []
+        for err_line in stderr.splitlines():
+            match = FAILED_LINE_RE.match(err_line.strip())
+            if not match:
+                if err_line.strip():
+                    messages.append(err_line.strip())
+                continue
+
+            line_number = int(match.group("line"))
+            if 0 < line_number <= len(self.commands):
+                failures.append(
+                    BatchFailure(
+                        line_number,
+                        self.commands[line_number - 1],
+                        " ".join(messages),
+                    )
+                )
+            else:
+                LOG.error(
+                    f"ip -batch reported failure for unknown line {line_number} "
+                    + f"in {self.label} namespace: {' '.join(messages)}"
+                )
+            messages = []
+
+        # Errors after the last "Command failed" line belong to it
+        if messages and failures:
+            failures[-1].message = " ".join([failures[-1].message] + messages).strip()
+        return failures
+
+    def run(self) -> List[BatchFailure]:
+        """Run all commands with one `ip` process and return the failures we care about
+        - Failures of check=False commands + already exists errors are only logged"""
+        if not self.commands:
+            LOG.debug(f"No commands to batch for {self.label} namespace")
+            return []
+
+        LOG.debug(
+            f"Running {len(self.commands)} commands via ip -batch in "
+            + f"{self.label} namespace"
+        )
+        cp = get_backend().run(self.cmd(), **self._run_kwargs())
+        return self._failures(cp)
+
+    async def run_async(self) -> List[BatchFailure]:
+        """Coroutine run() - the `ip -batch` process doesn't block the event loop"""
+        if not self.commands:
+            LOG.debug(f"No commands to batch for {self.label} namespace")
+            return []
+
+        LOG.debug(
+            f"Running {len(self.commands)} commands via async ip -batch in "
+            + f"{self.label} namespace"
+        )
+        cp = await get_backend().run_async(self.cmd(), **self._run_kwargs())
+        return self._failures(cp)
+
+    def _run_kwargs(self) -> Dict[str, Any]:
+        return {
+            "input": "\n".join(self.lines()) + "\n",
+            "stdout": PIPE,
+            "stderr": PIPE,
+            "encoding": "utf-8",
+        }
+
+    def _failures(self, cp: CompletedProcess) -> List[BatchFailure]:
+        parsed = self.parse_failures(cp.stderr or "")
+        if cp.returncode and not parsed:
+            # ip itself failed (e.g. no such netns) so no line ran
+            message = (cp.stderr or "").strip() or f"ip -batch returned {cp.returncode}"
+            return [
+                BatchFailure(line_number, command, message)
+                for line_number, command in enumerate(self.commands, 1)
+            ]
+
+        failures: List[BatchFailure] = []
+        for failure in parsed:
+            if failure.command.exists_ok and any(
+                msg in failure.message for msg in EXISTS_MESSAGES
+            ):
+                LOG.debug(f"{self.label}: {failure.command.description} exists")
+            elif not failure.command.check:
+                LOG.debug(f"{self.label}: ignoring failed {failure}")
+            else:
+                failures.append(failure)
+
+        if cp.returncode and not failures:
+            LOG.debug(
+                f"ip -batch returned {cp.returncode} in {self.label} namespace "
+                + "with only ignorable failures"
+            )
+        return failures
+
+
+def log_failures(failures: Sequence[BatchFailure], netns_name: str = "") -> None:
+    label = netns_name if netns_name else "default"
+    for failure in failures:
+        LOG.error(f"{label} namespace batch failed {failure}")
@@ -1,11 +1,438 @@
 import logging
-from json import load
+from bisect import bisect_right
+from collections import defaultdict
+from json import JSONDecodeError, JSONDecoder, load
 from pathlib import Path
-from typing import Dict
+from typing import Any, DefaultDict, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from json2netns.consts import MAX_WEIGHT
+from json2netns.model import address_str, network_range, parse_address, parse_prefix
 
 
 LOG = logging.getLogger(__name__)
 
+CONFIG_CHUNK_SIZE = 1 << 20
+DECODER = JSONDecoder()
+WHITESPACE = " \t\n\r"
+
+# Linux IFNAMSIZ (16) including the trailing NUL
+MAX_INTERFACE_NAME_LEN = 15
+VALID_INTERFACE_TYPES = {"lo", "loopback", "macvlan", "veth"}
+# Sorts after any (version, address) so bisect finds networks starting at address
+MAX_ADDRESS = 1 << 128
+MAX_NEXTHOP_ID = (1 << 32) - 1
+
+
+def format_address(address: Tuple[int, int, str, str]) -> str:
+    return address_str(address[0], address[1])
+
+
+def valid_weight(weight: Any) -> bool:
+    return (
+        isinstance(weight, int)
+        and not isinstance(weight, bool)
+        and 1 <= weight <= MAX_WEIGHT
+    )
+
+
+class ConfigValidator:
+    """One pass over the config building indexes, then sorted sweeps over them
+    - Never runs a command so it's safe before touching the kernel"""
+
+    def __init__(self, config: Dict) -> None:
+        self.config = config
+        self.errors: List[str] = []
+        # netns -> interface name -> interface config
+        self.interfaces: Dict[str, Dict[str, Dict]] = {}
+        # veth name -> (netns, peer name) - veths are created in the default netns
+        self.veths: Dict[str, Tuple[str, str]] = {}
+        # netns -> (version, first, last, interface, prefix) of every connected network
+        self.networks: DefaultDict[
+            str, List[Tuple[int, int, int, str, str]]
+        ] = defaultdict(list)
+        # (version, address, netns, interface) of every address we configure
+        self.addresses: List[Tuple[int, int, str, str]] = []
+
+    def error(self, msg: str) -> None:
+        self.errors.append(msg)
+
+    def add_prefix(self, ns_name: str, int_name: str, prefix: Any) -> None:
+        try:
+            version, addr, length = parse_prefix(str(prefix))
+        except ValueError as ve:
+            self.error(f"{ns_name} {int_name}: {ve}")
+            return
+        first, last = network_range(version, addr, length)
+        self.networks[ns_name].append((version, first, last, int_name, str(prefix)))
+        self.addresses.append((version, addr, ns_name, int_name))
+
+    def index_namespaces(self) -> None:
+        namespaces = self.config.get("namespaces")
+        if not isinstance(namespaces, dict) or not namespaces:
+            self.error("Config has no namespaces")
+            return
+
+        ids: Dict[Any, str] = {}
+        for ns_name, ns_config in namespaces.items():
+            if not ns_name or "/" in ns_name or ns_name in {".", ".."}:
+                self.error(f"'{ns_name}' is not a valid namespace name")
+            ns_id = ns_config.get("id")
+            if not isinstance(ns_id, int) or isinstance(ns_id, bool) or ns_id < 1:
+                self.error(f"{ns_name}: id must be an integer > 0 (got {ns_id})")
+            elif ns_id in ids:
+                self.error(f"{ns_name}: id {ns_id} is already used by {ids[ns_id]}")
+            else:
+                ids[ns_id] = ns_name
+            self.index_interfaces(ns_name, ns_config.get("interfaces", {}))
+            if ns_config.get("oob"):
+                self.index_oob(ns_name, ns_id)
+
+    def index_interfaces(self, ns_name: str, interfaces: Dict) -> None:
+        ns_interfaces: Dict[str, Dict] = {}
+        self.interfaces[ns_name] = ns_interfaces
+        for int_name, int_config in interfaces.items():
+            int_type = str(int_config.get("type", "")).lower()
+            if int_type not in VALID_INTERFACE_TYPES:
+                self.error(f"{ns_name} {int_name}: unsupported type '{int_type}'")
+                continue
+            # Loopbacks are always lo whatever they're called in the config
+            name = "lo" if int_type in {"lo", "loopback"} else int_name
+            if name in ns_interfaces:
+                self.error(f"{ns_name}: more than one {name} interface")
+            if (
+                len(name) > MAX_INTERFACE_NAME_LEN
+                or not name.isprintable()
+                or "/" in name
+                or " " in name
+            ):
+                self.error(f"{ns_name} {name}: not a valid interface name")
+            ns_interfaces[name] = int_config
+
+            if int_type == "veth":
+                if name in self.veths:
+                    self.error(
+                        f"{ns_name} {name}: veth name already used in "
+                        + f"{self.veths[name][0]} (veths are created in one netns)"
+                    )
+                self.veths[name] = (ns_name, str(int_config.get("peer_name", "")))
+            elif int_type == "macvlan" and not self.config.get("physical_int"):
+                self.error(f"{ns_name} {name}: macvlan needs a physical_int")
+
+            for prefix in int_config.get("prefixes", []):
+                self.add_prefix(ns_name, name, prefix)
+
+    def index_oob(self, ns_name: str, ns_id: Any) -> None:
+        if not self.config.get("physical_int"):
+            self.error(f"{ns_name}: oob needs a physical_int")
+        oob_prefixes = self.config.get("oob", {}).get("prefixes", [])
+        if not oob_prefixes:
+            self.error(f"{ns_name}: oob needs global oob prefixes")
+        if not isinstance(ns_id, int):
+            return
+
+        int_name = f"oob{ns_id}"
+        self.interfaces[ns_name][int_name] = {"type": "macvlan"}
+        for prefix in oob_prefixes:
+            try:
+                version, addr, length = parse_prefix(str(prefix))
+            except ValueError as ve:
+                self.error(f"oob: {ve}")
+                continue
+            first, last = network_range(version, addr, length)
+            if first + ns_id >= last:
+                self.error(f"{ns_name}: id {ns_id} does not fit in oob {prefix}")
+                continue
+            self.networks[ns_name].append((version, first, last, int_name, prefix))
+            self.addresses.append((version, first + ns_id, ns_name, int_name))
+
+    def check_veth_peers(self) -> None:
+        for name, (ns_name, peer) in self.veths.items():
+            if not peer:
+                self.error(f"{ns_name} {name}: veth has no peer_name")
+            elif peer not in self.veths:
+                self.error(f"{ns_name} {name}: veth peer {peer} is not configured")
+            elif self.veths[peer][1] != name:
+                self.error(
+                    f"{ns_name} {name}: peer {peer} ({self.veths[peer][0]}) has "
+                    + f"peer_name {self.veths[peer][1]}, not {name}"
+                )
+
+    def check_addresses(self) -> None:
+        """Sorted sweep for the same address configured twice"""
+        self.addresses.sort()
+        for previous, current in zip(self.addresses, self.addresses[1:]):
+            if previous[:2] == current[:2]:
+                self.error(
+                    f"{current[2]} {current[3]}: address {format_address(current)} "
+                    + f"is also on {previous[2]} {previous[3]}"
+                )
+
+    def check_overlaps(self) -> None:
+        """Sorted interval sweep per netns for connected networks that overlap
+        - Multiple prefixes from one network on one interface are fine"""
+        for ns_name, networks in self.networks.items():
+            networks.sort()
+            highest = networks[0] if networks else None
+            for network in networks[1:]:
+                assert highest is not None
+                version, first, last, int_name, prefix = network
+                if version == highest[0] and first <= highest[2]:
+                    same_network = (first, last) == highest[1:3]
+                    if int_name != highest[3] or not same_network:
+                        self.error(
+                            f"{ns_name} {int_name}: {prefix} overlaps "
+                            + f"{highest[4]} on {highest[3]}"
+                        )
+                if version != highest[0] or last > highest[2]:
+                    highest = network
+
+    def check_next_hop(
+        self,
+        label: str,
+        ns_name: str,
+        next_hop: str,
+        egress: str,
+        dest_version: int = 0,
+    ) -> Optional[int]:
+        """Check a next hop is on a connected network (of egress if given)
+        - Returns its IP version (0 if it's only an egress interface), None if bad"""
+        if egress and egress not in self.interfaces.get(ns_name, {}):
+            self.error(f"{label}: egress interface {egress} does not exist")
+        if not next_hop:
+            if not egress:
+                self.error(f"{label}: needs a next_hop_ip or egress_if_name")
+                return None
+            return 0
+
+        try:
+            version, addr = parse_address(next_hop)
+        except ValueError as ve:
+            self.error(f"{label}: {ve}")
+            return None
+        if dest_version and version != dest_version:
+            self.error(f"{label}: next hop {next_hop} is not IPv{dest_version}")
+            return None
+
+        # Walk back from the last network starting <= next hop
+        networks = self.networks.get(ns_name, [])
+        index = bisect_right(networks, (version, addr, MAX_ADDRESS)) - 1
+        while index >= 0 and networks[index][0] == version:
+            _, first, last, int_name, _ = networks[index]
+            if first <= addr <= last and (not egress or int_name == egress):
+                return version
+            index -= 1
+        via = f" via {egress}" if egress else ""
+        self.error(f"{label}: next hop {next_hop} is not connected{via}")
+        return None
+
+    def check_nexthops(self, ns_name: str, nexthops: Dict) -> Dict[str, int]:
+        """Check nexthop objects - returns name -> IP version (0 for any)"""
+        versions: Dict[str, int] = {}
+        ids: Dict[Any, str] = {}
+        groups: Dict[str, Any] = {}
+        for nh_name, nexthop in nexthops.items():
+            label = f"{ns_name} nexthop {nh_name}"
+            nh_id = nexthop.get("id")
+            if (
+                not isinstance(nh_id, int)
+                or isinstance(nh_id, bool)
+                or not 1 <= nh_id <= MAX_NEXTHOP_ID
+            ):
+                self.error(f"{label}: id must be an integer 1 - {MAX_NEXTHOP_ID}")
+            elif nh_id in ids:
+                self.error(f"{label}: id {nh_id} is already used by {ids[nh_id]}")
+            else:
+                ids[nh_id] = nh_name
+
+            if "group" in nexthop:
+                if nexthop.get("next_hop_ip") or nexthop.get("egress_if_name"):
+                    self.error(f"{label}: a group has no next_hop_ip / egress_if_name")
+                groups[nh_name] = nexthop["group"]
+                continue
+            if not nexthop.get("egress_if_name"):
+                self.error(f"{label}: needs an egress_if_name")
+                continue
+            version = self.check_next_hop(
+                label,
+                ns_name,
+                nexthop.get("next_hop_ip", ""),
+                nexthop["egress_if_name"],
+            )
+            if version is not None:
+                versions[nh_name] = version
+
+        # Groups can only contain gateway nexthops of one IP version
+        for nh_name, group in groups.items():
+            label = f"{ns_name} nexthop {nh_name}"
+            if not isinstance(group, dict) or not group:
+                self.error(f"{label}: group needs at least one nexthop")
+                continue
+            group_versions = set()
+            for member, weight in group.items():
+                if member in groups:
+                    self.error(f"{label}: group member {member} is a group")
+                elif member not in nexthops:
+                    self.error(f"{label}: group member {member} is not configured")
+                elif member in versions:
+                    group_versions.add(versions[member])
+                if not valid_weight(weight):
+                    self.error(f"{label}: {member} weight must be 1 - {MAX_WEIGHT}")
+            group_versions.discard(0)
+            if len(group_versions) > 1:
+                self.error(f"{label}: group mixes IPv4 and IPv6 nexthops")
+            else:
+                versions[nh_name] = group_versions.pop() if group_versions else 0
+        return versions
+
+    def check_routes(self) -> None:
+        namespaces = self.config.get("namespaces", {})
+        for ns_name, ns_config in namespaces.items():
+            nexthop_versions = self.check_nexthops(
+                ns_name, ns_config.get("nexthops", {})
+            )
+            for route_name, route in ns_config.get("routes", {}).items():
+                label = f"{ns_name} {route_name}"
+                try:
+                    dest_version, dest, length = parse_prefix(
+                        str(route.get("dest_prefix", ""))
+                    )
+                except ValueError as ve:
+                    self.error(f"{label}: {ve}")
+                    continue
+                if network_range(dest_version, dest, length)[0] != dest:
+                    self.error(f"{label}: {route['dest_prefix']} has host bits set")
+
+                if "nexthop" in route:
+                    nexthop = route["nexthop"]
+                    if nexthop not in ns_config.get("nexthops", {}):
+                        self.error(f"{label}: nexthop {nexthop} is not configured")
+                    elif nexthop_versions.get(nexthop, 0) not in (0, dest_version):
+                        self.error(
+                            f"{label}: nexthop {nexthop} is not IPv{dest_version}"
+                        )
+                    continue
+
+                if "multipath" in route:
+                    multipath = route["multipath"]
+                    if not isinstance(multipath, list) or not multipath:
+                        self.error(f"{label}: multipath needs at least one next hop")
+                        continue
+                    for hop in multipath:
+                        if not valid_weight(hop.get("weight", 1)):
+                            self.error(f"{label}: weight must be 1 - {MAX_WEIGHT}")
+                        self.check_next_hop(
+                            label,
+                            ns_name,
+                            hop.get("next_hop_ip", ""),
+                            hop.get("egress_if_name", ""),
+                            dest_version,
+                        )
+                    continue
+
+                self.check_next_hop(
+                    label,
+                    ns_name,
+                    route.get("next_hop_ip", ""),
+                    route.get("egress_if_name", ""),
+                    dest_version,
+                )
+
+    def check_route_files(self) -> None:
+        """Their routes are checked as they're streamed in - too many to index"""
+        for ns_name, ns_config in self.config.get("namespaces", {}).items():
+            route_files = ns_config.get("route_files", [])
+            if not isinstance(route_files, list) or not all(
+                isinstance(route_file, str) for route_file in route_files
+            ):
+                self.error(f"{ns_name}: route_files must be a list of file paths")
+                continue
+            for route_file in route_files:
+                if not Path(route_file).is_file():
+                    self.error(f"{ns_name}: route file {route_file} does not exist")
+
+    def validate(self) -> List[str]:
+        self.index_namespaces()
+        self.check_veth_peers()
+        self.check_addresses()
+        self.check_overlaps()
+        self.check_routes()
+        self.check_route_files()
+        return self.errors
+
+
+class JSONStream:
+    """Incrementally parse a JSON object from a file one chunk at a time
+    - Only the value being decoded + the unread chunk are held in memory"""
+
+    def __init__(self, fp: TextIO, chunk_size: int = CONFIG_CHUNK_SIZE) -> None:
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what we've already parsed
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non whitespace character ("" at the end of the file)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(
+                f"Expected '{char}' in JSON config, got '{self.peek() or 'EOF'}'"
+            )
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next complete value - reading more of the file if needed"""
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+            except JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end < len(self.buffer) or not self._fill():
+                self.pos = end
+                return value
+
+    def object_keys(self) -> Iterator[str]:
+        """Yield each key of an object - the caller must consume each value"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError(f"JSON config object key {key} is not a string")
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
 
 class Config:
     """Handle the JSON config file"""
@@ -18,7 +445,43 @@ class Config:
         with self.path.open("rb") as cfp:
             return dict(load(cfp))
 
-    # TODO: Validate config
-    def validate(self, config: Dict) -> None:
-        """High level config validator"""
-        pass
+    def iter_topology(
+        self, chunk_size: int = CONFIG_CHUNK_SIZE
+    ) -> Iterator[Tuple[str, Any]]:
+        """Stream the config - yields ("namespaces/<name>", config) for each
+        namespace as it's parsed + (key, value) for every other top level key"""
+        with self.path.open("r", encoding="utf-8") as cfp:
+            stream = JSONStream(cfp, chunk_size)
+            for key in stream.object_keys():
+                if key != "namespaces":
+                    yield key, stream.value()
+                    continue
+                for ns_name in stream.object_keys():
+                    yield f"namespaces/{ns_name}", stream.value()
+            if stream.peek():
+                raise ValueError(f"Extra data after the JSON config in {self.path}")
+
+    def iter_namespaces(
+        self, chunk_size: int = CONFIG_CHUNK_SIZE
+    ) -> Iterator[Tuple[str, Dict]]:
+        """Yield (name, config) of each namespace as it's parsed"""
+        for key, value in self.iter_topology(chunk_size):
+            if key.startswith("namespaces/"):
+                yield key[len("namespaces/") :], value
+
+    def load_streaming(self, chunk_size: int = CONFIG_CHUNK_SIZE) -> Dict:
+        """load() without ever holding the whole file in memory"""
+        config: Dict[str, Any] = {"namespaces": {}}
+        for key, value in self.iter_topology(chunk_size):
+            if key.startswith("namespaces/"):
+                config["namespaces"][key[len("namespaces/") :]] = value
+            else:
+                config[key] = value
+        return config
+
+    def validate(self, config: Dict) -> List[str]:
+        """High level config validator - returns every problem found"""
+        errors = ConfigValidator(config).validate()
+        for error in errors:
+            LOG.error(f"{self.path}: {error}")
+        return errors
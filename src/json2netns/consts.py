@@ -1,9 +1,27 @@
-from ipaddress import IPv4Interface, IPv6Interface
+import os
+from ipaddress import IPv4Interface, IPv4Network, IPv6Interface, IPv6Network
+from pathlib import Path
 from typing import Union
 
 
-DEFAULT_IP = "/usr/sbin/ip"
+DEFAULT_BACKEND = "subprocess"
+# Overridable so benchmarks + tests can point us at a stand-in ip
+DEFAULT_IP = os.environ.get("JSON2NETNS_IP", "/usr/sbin/ip")
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_NAMESPACE_CACHE = 1024
+DEFAULT_PLAN_CACHE_SIZE = 16
+# route_files routes per `ip -batch` - bounds the memory a big feed needs
+DEFAULT_ROUTE_CHUNK_SIZE = 20000
+DEFAULT_STATE_DIR = Path("/run/json2netns")
+DEFAULT_TEARDOWN_TIMEOUT = 60.0
 GLOBAL_OOB_INTERFACE = "oob0"
+NETNS_RUN_DIR = Path(os.environ.get("JSON2NETNS_NETNS_DIR", "/run/netns"))
 IPInterface = Union[IPv4Interface, IPv6Interface]
-VALID_ACTIONS = {"create", "delete", "check"}
+IPNetwork = Union[IPv4Network, IPv6Network]
+# ECMP next hop + nexthop group member weights
+MAX_WEIGHT = 256
+VALID_BACKENDS = ("netlink", "subprocess")
+# Seconds a config must be left alone after a save before watch applies it
+DEFAULT_WATCH_DEBOUNCE = 0.5
+VALID_ACTIONS = {"apply", "create", "delete", "check", "plan", "watch"}
 VALID_SORTED_ACTIONS = sorted(VALID_ACTIONS)
@@ -0,0 +1,205 @@
+import logging
+import shlex
+from contextlib import contextmanager
+from json import dumps
+from pathlib import Path
+from subprocess import CompletedProcess, PIPE
+from tempfile import TemporaryDirectory
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Set, Tuple
+
+from json2netns.backend import Backend
+from json2netns.batch import nexthop_round
+from json2netns.consts import DEFAULT_MAX_IN_FLIGHT
+from json2netns.nsenter import set_netns_dir
+
+
+LOG = logging.getLogger(__name__)
+APPLY_SCRIPT = "apply.sh"
+DEFAULT_BATCH = "default.batch"
+# Leading ip options of queries e.g. ip -j -4 route show
+QUERY_OPTIONS = {"-4", "-6", "-d", "-j", "-s"}
+QUERY_VERBS = {"list", "lst", "show"}
+
+
+class DryRunBackend(Backend):
+    """Records the commands create / delete would run instead of running them
+    - Pretends to be a host with nothing configured unless assume_created() is called
+    - `netns add` / `del` create + remove files in a pretend /run/netns (netns_dir)
+    - Queries (link show etc.) are answered from the links the commands made"""
+
+    name = "dry-run"
+
+    def __init__(
+        self, netns_dir: Path, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT
+    ) -> None:
+        super().__init__(max_in_flight)
+        self.netns_dir = netns_dir
+        self.lock = Lock()
+        # (netns, ip args without the ip binary) in the order they were ran
+        self.commands: List[Tuple[str, List[str]]] = []
+        # netns ("" is the default netns) -> link names
+        self.links: Dict[str, Set[str]] = {"": set()}
+
+    def assume_created(
+        self, netns_names: Iterable[str], default_links: Iterable[str] = ()
+    ) -> None:
+        """Pretend the namespaces + default netns links exist (e.g. to plan a delete)"""
+        for netns_name in netns_names:
+            self._netns_add(netns_name)
+        self.links[""].update(default_links)
+
+    def _netns_add(self, netns_name: str) -> None:
+        (self.netns_dir / netns_name).touch()
+        self.links.setdefault(netns_name, {"lo"})
+
+    def _apply(self, netns_name: str, args: Sequence[str]) -> None:
+        """Track the netns + links a recorded command would add, move or delete"""
+        obj, verb, rest = args[0], args[1] if len(args) > 1 else "", list(args[2:])
+        links = self.links.setdefault(netns_name, set())
+        if obj == "netns" and verb == "add" and rest:
+            self._netns_add(rest[0])
+        elif obj == "netns" and verb in {"del", "delete"} and rest:
+            (self.netns_dir / rest[0]).unlink(missing_ok=True)
+            self.links.pop(rest[0], None)
+        elif obj == "link" and verb == "add" and rest:
+            links.add(rest[0])
+            if "peer" in rest[:-1]:
+                links.add(rest[rest.index("peer") + 1])
+        elif obj == "link" and verb == "set" and "netns" in rest[:-1]:
+            links.discard(rest[0])
+            self.links.setdefault(rest[rest.index("netns") + 1], set()).add(rest[0])
+        elif obj == "link" and verb in {"del", "delete"} and rest:
+            links.discard(rest[0])
+
+    def _query(self, netns_name: str, args: Sequence[str]) -> Tuple[int, str]:
+        links = self.links.get(netns_name, set())
+        if args[:2] == ["link", "show"] and "dev" in args:
+            return (0 if args[args.index("dev") + 1] in links else 1), ""
+        if args[:2] == ["link", "show"]:
+            return 0, dumps([{"ifname": name} for name in sorted(links)])
+        # Nothing we'd add is there yet (routes, addresses etc.)
+        return 0, "[]"
+
+    def _record(self, netns_name: str, args: List[str]) -> None:
+        with self.lock:
+            self.commands.append((netns_name, args))
+            self._apply(netns_name, args)
+
+    def run(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        args = list(cmd[1:])
+        if args[:1] == ["-n"]:
+            netns_name, args = args[1], args[2:]
+
+        stdout = ""
+        returncode = 0
+        if "-batch" in args:
+            batch_input = kwargs.get("input") or ""
+            if isinstance(batch_input, bytes):
+                batch_input = batch_input.decode("utf-8")
+            for line in batch_input.splitlines():
+                if line.strip():
+                    self._record(netns_name, line.split())
+        else:
+            verb_args = args
+            while verb_args and verb_args[0] in QUERY_OPTIONS:
+                verb_args = verb_args[1:]
+            if len(verb_args) > 1 and verb_args[1] in QUERY_VERBS:
+                with self.lock:
+                    returncode, stdout = self._query(netns_name, verb_args)
+            else:
+                self._record(netns_name, args)
+
+        output: Any = stdout if kwargs.get("stdout") == PIPE else None
+        errors: Any = "" if kwargs.get("stderr") == PIPE else None
+        if not kwargs.get("encoding") and output is not None:
+            output = output.encode("utf-8")
+        if not kwargs.get("encoding") and errors is not None:
+            errors = errors.encode("utf-8")
+        cp = CompletedProcess(list(cmd), returncode, output, errors)
+        if kwargs.get("check"):
+            cp.check_returncode()
+        return cp
+
+    async def run_async(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        """Nothing blocks so no executor thread"""
+        return self.run(cmd, netns_name, **kwargs)
+
+    def script(self, header: str = "") -> str:
+        """The recorded commands as a shell script - stops at the first failure"""
+        lines = ["#!/bin/sh"]
+        if header:
+            lines.append(f"# {header}")
+        lines.append("set -e")
+        for netns_name, args in self.commands:
+            netns_args = ["-n", netns_name] if netns_name else []
+            lines.append(shlex.join([self.IP] + netns_args + args))
+        return "\n".join(lines) + "\n"
+
+    def batches(self) -> List[Tuple[str, List[str]]]:
+        """The recorded commands as (netns, `ip -batch` lines) in the order to run
+        - The default netns (netns, link creation + moves) is first
+        - Then each netns's, then each netns's nexthop round (a netns's second
+          entry) as nexthops need every link up"""
+        batches: Dict[str, List[str]] = {"": []}
+        nexthop_batches: Dict[str, List[str]] = {}
+        for netns_name, args in self.commands:
+            ns_batches = nexthop_batches if nexthop_round(args) else batches
+            ns_batches.setdefault(netns_name, []).append(" ".join(args))
+        return list(batches.items()) + list(nexthop_batches.items())
+
+    def write_batches(self, directory: Path, header: str = "") -> List[Path]:
+        """One `ip -batch` file per netns + an apply.sh running them in order"""
+        batches = self.batches()
+        directory.mkdir(parents=True, exist_ok=True)
+        apply_lines = ["#!/bin/sh"]
+        if header:
+            apply_lines.append(f"# {header}")
+        apply_lines.extend(["set -e", 'cd "$(dirname "$0")"'])
+        paths: List[Path] = []
+        written: Set[str] = set()
+        for netns_name, batch_lines in batches:
+            if not batch_lines:
+                continue
+            if not netns_name:
+                batch_path = directory / DEFAULT_BATCH
+            elif netns_name in written:
+                batch_path = directory / f"nexthops-{netns_name}.batch"
+            else:
+                batch_path = directory / f"netns-{netns_name}.batch"
+            written.add(netns_name)
+            batch_path.write_text("\n".join(batch_lines) + "\n")
+            paths.append(batch_path)
+            netns_args = ["-n", netns_name] if netns_name else []
+            apply_lines.append(
+                shlex.join([self.IP] + netns_args + ["-batch", batch_path.name])
+            )
+
+        apply_path = directory / APPLY_SCRIPT
+        apply_path.write_text("\n".join(apply_lines) + "\n")
+        apply_path.chmod(0o755)
+        LOG.info(
+            f"Wrote {len(self.commands)} commands to {len(paths)} batch files + "
+            + f"{apply_path}"
+        )
+        return [apply_path] + paths
+
+
+@contextmanager
+def dry_run_host(
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+) -> Iterator[Tuple[DryRunBackend, Path]]:
+    """A DryRunBackend with its own pretend /run/netns for the with block
+    - Also yields a scratch state dir so dry runs leave the real journal alone"""
+    with TemporaryDirectory(prefix="json2netns-dry-run-") as td:
+        netns_dir = Path(td) / "netns"
+        netns_dir.mkdir()
+        previous_netns_dir = set_netns_dir(netns_dir)
+        try:
+            yield DryRunBackend(netns_dir, max_in_flight), Path(td) / "state"
+        finally:
+            set_netns_dir(previous_netns_dir)
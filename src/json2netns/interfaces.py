@@ -1,41 +1,78 @@
 import logging
 from ipaddress import ip_interface
-from subprocess import CompletedProcess, DEVNULL, PIPE, run
-from typing import Any, Optional, Sequence, Union
+from subprocess import CompletedProcess, DEVNULL, PIPE
+from typing import Any, List, Optional, Sequence, Tuple, Union
 
+from json2netns.backend import get_backend
+from json2netns.batch import Batch
 from json2netns.consts import DEFAULT_IP, IPInterface
+from json2netns.inventory import get_inventory
+from json2netns.metrics import count, INTERFACES
+from json2netns.model import intern_name, Prefix
 
 
 LOG = logging.getLogger(__name__)
+PrefixLike = Union[Prefix, IPInterface, str]
 
 
 def _run(ip: str, *args: Any, **kwargs: Any) -> CompletedProcess:
-    """Subprocess run wrapper to allow for running within a netns
+    """Run wrapper to allow for running within a netns via the selected backend
     - We only support CMD Sequence as the only non kwarg"""
-    if "netns_name" in kwargs:
-        if kwargs["netns_name"]:
-            args = ([ip, "netns", "exec", kwargs["netns_name"]] + args[0],)
-            LOG.debug(f"Running in {kwargs['netns_name']} netns: {' '.join(args[0])}")
-        del kwargs["netns_name"]
-    else:
-        LOG.debug(f"Running: {' '.join(args[0])}")
-    return run(*args, **kwargs)
+    netns_name = kwargs.pop("netns_name", "")
+    return get_backend().run(args[0], netns_name, **kwargs)
+
+
+async def _run_async(ip: str, *args: Any, **kwargs: Any) -> CompletedProcess:
+    """Coroutine _run() - commands run as asyncio subprocesses (or netlink)"""
+    netns_name = kwargs.pop("netns_name", "")
+    return await get_backend().run_async(args[0], netns_name, **kwargs)
 
 
 class Interface:
+    """Base of every interface type
+    - Slotted + prefixes kept packed as they add up over 100ks of interfaces"""
+
+    __slots__ = ("name", "type", "packed_prefixes")
     IP = DEFAULT_IP
-    name = "Interface"
-    type = "Interface"
-    prefixes: Sequence[IPInterface] = ()
+    trace_arg = "interface"
+
+    def __init__(
+        self,
+        name: str = "Interface",
+        int_type: str = "Interface",
+        prefixes: Sequence[PrefixLike] = (),
+    ) -> None:
+        self.name = intern_name(name)
+        self.type = intern_name(int_type)
+        self.packed_prefixes: Tuple[Prefix, ...] = tuple(
+            Prefix.parse(prefix) for prefix in prefixes
+        )
+
+    @property
+    def prefixes(self) -> List[IPInterface]:
+        """ipaddress objects of the prefixes - built on each access"""
+        return [prefix.interface() for prefix in self.packed_prefixes]
 
     def _convert_to_ip_interfaces(
         self, prefixes: Sequence[Union[IPInterface, str]]
     ) -> Sequence[IPInterface]:
         return [ip_interface(i) for i in prefixes]
 
+    def add_prefix_args(self, prefix: Union[Prefix, IPInterface]) -> List[str]:
+        return ["addr", "add", str(prefix), "dev", self.name]
+
+    def create_args(self) -> List[str]:
+        raise NotImplementedError("Each interface type needs to overload create_args")
+
+    def set_link_up_args(self) -> List[str]:
+        return ["link", "set", "up", "dev", self.name]
+
+    def set_netns_args(self, netns_name: str) -> List[str]:
+        return ["link", "set", self.name, "netns", netns_name]
+
     def add_prefixes(self, netns_name: str = "") -> None:
-        for prefix in self.prefixes:
-            cmd = [self.IP, "addr", "add", str(prefix), "dev", self.name]
+        for prefix in self.packed_prefixes:
+            cmd = [self.IP] + self.add_prefix_args(prefix)
             _run(
                 self.IP,
                 cmd,
@@ -49,11 +86,71 @@ class Interface:
                 log_msg += f" in {netns_name} namespace"
             LOG.info(log_msg)
 
+    async def add_prefixes_async(self, netns_name: str = "") -> None:
+        import asyncio
+
+        await asyncio.gather(
+            *[
+                _run_async(
+                    self.IP,
+                    [self.IP] + self.add_prefix_args(prefix),
+                    check=True,
+                    stdout=PIPE,
+                    stderr=PIPE,
+                    netns_name=netns_name,
+                )
+                for prefix in self.packed_prefixes
+            ]
+        )
+        if self.packed_prefixes:
+            ns_label = f" in {netns_name} namespace" if netns_name else ""
+            LOG.info(
+                f"Added {len(self.packed_prefixes)} prefixes to {self.name}{ns_label}"
+            )
+
+    def batch_configure(self, batch: Batch) -> None:
+        """Add prefix + link up commands to batch (ran in the interface's netns)"""
+        for prefix in self.packed_prefixes:
+            batch.add(
+                self.add_prefix_args(prefix),
+                f"add {prefix} to {self.name}",
+                exists_ok=True,
+            )
+        batch.add(self.set_link_up_args(), f"set {self.name} link up", check=False)
+
+    def batch_create(self, batch: Batch, netns_name: str = "") -> None:
+        """Add create + optional move to netns commands to a default netns batch"""
+        batch.add(self.create_args(), f"create {self.type} {self.name}", exists_ok=True)
+        count(INTERFACES, result="created", type=self.type)
+        if netns_name:
+            self.batch_set_netns(batch, netns_name)
+
+    def batch_set_netns(self, batch: Batch, netns_name: str) -> None:
+        batch.add(
+            self.set_netns_args(netns_name),
+            f"move {self.name} to {netns_name} namespace",
+            check=False,
+        )
+        count(INTERFACES, result="moved", type=self.type)
+
     def create(self) -> CompletedProcess:
         raise NotImplementedError("Each interface type needs to overload create")
 
+    async def create_async(self) -> Optional[CompletedProcess]:
+        """Coroutine create() of the create_args() link in the default netns"""
+        cp = await _run_async(self.IP, [self.IP] + self.create_args(), check=True)
+        LOG.info(f"Created {self.type} {self.name}")
+        self._record_created()
+        return cp
+
+    def _record_created(self) -> None:
+        count(INTERFACES, result="created", type=self.type)
+        inventory = get_inventory()
+        if inventory:
+            inventory.add(self.name)
+
     def delete(self, netns_name: str = "") -> Optional[CompletedProcess]:
-        if not self.exists():
+        if not self.exists(netns_name):
             LOG.debug(
                 f"Not deleting {self.name} {self.type} interface as it does not exist ..."
             )
@@ -61,12 +158,22 @@ class Interface:
 
         cmd = [self.IP, "link", "del", self.name]
         LOG.info(f"Deleting {self.type} interface {self.name}")
-        return _run(
+        cp = _run(
             self.IP, cmd, check=True, stdout=PIPE, stderr=PIPE, netns_name=netns_name
         )
+        count(INTERFACES, result="deleted", type=self.type)
+        inventory = get_inventory()
+        if inventory:
+            inventory.remove(self.name, netns_name)
+        return cp
 
     def exists(self, netns_name: str = "") -> bool:
-        """Check if a interface device exists"""
+        """Check if a interface device exists
+        - Answered from the active LinkInventory if there is one"""
+        inventory = get_inventory()
+        if inventory:
+            return inventory.exists(self.name, netns_name)
+
         cmd = [self.IP, "link", "show", "dev", self.name]
         return (
             _run(
@@ -75,9 +182,20 @@ class Interface:
             == 0
         )
 
+    async def exists_async(self, netns_name: str = "") -> bool:
+        inventory = get_inventory()
+        if inventory:
+            return self.name in await inventory.links_in_async(netns_name)
+
+        cmd = [self.IP, "link", "show", "dev", self.name]
+        cp = await _run_async(
+            self.IP, cmd, stdout=DEVNULL, stderr=DEVNULL, netns_name=netns_name
+        )
+        return cp.returncode == 0
+
     def set_link_up(self, netns_name: str = "") -> bool:
         """Set the link to be administratively operational"""
-        cmd = [self.IP, "link", "set", "up", "dev", self.name]
+        cmd = [self.IP] + self.set_link_up_args()
         return (
             _run(
                 self.IP, cmd, stdout=DEVNULL, stderr=DEVNULL, netns_name=netns_name
@@ -87,43 +205,67 @@ class Interface:
 
     def set_netns(self, netns_name: str) -> bool:
         """Set what namesapce the interface should be in"""
-        cmd = [self.IP, "link", "set", self.name, "netns", netns_name]
-        return run(cmd, stdout=DEVNULL, stderr=DEVNULL).returncode == 0
+        cmd = [self.IP] + self.set_netns_args(netns_name)
+        moved = _run(self.IP, cmd, stdout=DEVNULL, stderr=DEVNULL).returncode == 0
+        if moved:
+            self._record_moved(netns_name)
+        return moved
+
+    async def set_link_up_async(self, netns_name: str = "") -> bool:
+        cmd = [self.IP] + self.set_link_up_args()
+        cp = await _run_async(
+            self.IP, cmd, stdout=DEVNULL, stderr=DEVNULL, netns_name=netns_name
+        )
+        return cp.returncode == 0
+
+    async def set_netns_async(self, netns_name: str) -> bool:
+        cmd = [self.IP] + self.set_netns_args(netns_name)
+        cp = await _run_async(self.IP, cmd, stdout=DEVNULL, stderr=DEVNULL)
+        if cp.returncode == 0:
+            self._record_moved(netns_name)
+        return cp.returncode == 0
+
+    def _record_moved(self, netns_name: str) -> None:
+        count(INTERFACES, result="moved", type=self.type)
+        inventory = get_inventory()
+        if inventory:
+            inventory.move(self.name, netns_name)
 
 
 class Loopback(Interface):
     """Class to only support what we need for loopback interfaces"""
 
-    name = "lo"
-    type = "loopback"
+    __slots__ = ()
 
-    def __init__(self, prefixes: Sequence[str]) -> None:
-        self.prefixes = self._convert_to_ip_interfaces(prefixes)
+    def __init__(self, prefixes: Sequence[PrefixLike]) -> None:
+        super().__init__("lo", "loopback", prefixes)
 
     def create(self) -> CompletedProcess:
         pass
 
+    async def create_async(self) -> Optional[CompletedProcess]:
+        return None
+
 
 class MacVlan(Interface):
     """Class to create macvlan interfaces Prefix assignment + interface creation"""
 
+    __slots__ = ("physical_interface", "mode")
+
     def __init__(
         self,
         name: str,
         physical_int: str,
-        prefixes: Sequence[Union[IPInterface, str]],
+        prefixes: Sequence[PrefixLike],
         *,
         mode: str = "bridge",
     ) -> None:
-        self.name = name
-        self.physical_interface = physical_int
-        self.type = "macvlan"
-        self.mode = mode
-        self.prefixes = self._convert_to_ip_interfaces(prefixes)
+        super().__init__(name, "macvlan", prefixes)
+        self.physical_interface = intern_name(physical_int)
+        self.mode = intern_name(mode)
 
-    def create(self) -> CompletedProcess:
-        cmd = [
-            self.IP,
+    def create_args(self) -> List[str]:
+        return [
             "link",
             "add",
             self.name,
@@ -134,24 +276,46 @@ class MacVlan(Interface):
             "mode",
             self.mode,
         ]
+
+    def create(self) -> CompletedProcess:
+        cmd = [self.IP] + self.create_args()
         LOG.info(
             f"Created {self.type} {self.name} bridged to {self.physical_interface}"
         )
-        return run(cmd, check=True)
+        cp = _run(self.IP, cmd, check=True)
+        self._record_created()
+        return cp
 
 
 class Veth(Interface):
     """Veths pairs need to be made in default namespace then moved to NetNS"""
 
-    def __init__(
-        self, name: str, peer: str, prefixes: Sequence[Union[IPInterface, str]]
-    ) -> None:
-        self.name = name
-        self.peer = peer
-        self.type = "veth"
-        self.prefixes = self._convert_to_ip_interfaces(prefixes)
+    __slots__ = ("peer",)
+
+    def __init__(self, name: str, peer: str, prefixes: Sequence[PrefixLike]) -> None:
+        super().__init__(name, "veth", prefixes)
+        self.peer = intern_name(peer)
+
+    def create_args(self) -> List[str]:
+        return ["link", "add", self.name, "type", self.type, "peer", self.peer]
 
     def create(self) -> CompletedProcess:
-        cmd = [self.IP, "link", "add", self.name, "type", self.type, "peer", self.peer]
+        cmd = [self.IP] + self.create_args()
         LOG.info(f"Created veth {self.name} with peer {self.peer}")
-        return run(cmd, check=True)
+        cp = _run(self.IP, cmd, check=True)
+        self._record_created()
+        return cp
+
+    def _record_created(self) -> None:
+        super()._record_created()
+        inventory = get_inventory()
+        if inventory:
+            inventory.add(self.peer)
+
+    def delete(self, netns_name: str = "") -> Optional[CompletedProcess]:
+        cp = super().delete(netns_name)
+        inventory = get_inventory()
+        if cp and inventory:
+            # Deleting one end of a veth pair deletes the peer wherever it is
+            inventory.remove_everywhere(self.peer)
+        return cp
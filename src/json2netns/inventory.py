@@ -0,0 +1,124 @@
+import logging
+from contextlib import contextmanager
+from json import loads
+from subprocess import PIPE
+from threading import Lock
+from typing import Dict, Iterator, Optional, Set
+
+from json2netns.backend import get_backend
+from json2netns.consts import DEFAULT_IP
+from json2netns.nsenter import netns_path
+
+
+LOG = logging.getLogger(__name__)
+
+
+class LinkInventory:
+    """Cache of the link names in each netns ("" is the default netns)
+    - Each netns is loaded with one `ip -j link show` the first time it's asked about
+    - Interface objects keep it up to date as they create, move + delete links"""
+
+    IP = DEFAULT_IP
+
+    def __init__(self) -> None:
+        self.links: Dict[str, Set[str]] = {}
+        self.lock = Lock()
+        self.load_locks: Dict[str, Lock] = {}
+        self.dumps = 0
+
+    def _parse(self, stdout: bytes) -> Set[str]:
+        output = stdout.decode("utf-8").strip()
+        self.dumps += 1
+        return {link["ifname"] for link in (loads(output) if output else [])}
+
+    def _load(self, netns_name: str) -> Set[str]:
+        if netns_name and not netns_path(netns_name).exists():
+            LOG.debug(f"{netns_name} namespace does not exist yet - no links")
+            return set()
+
+        cp = get_backend().run(
+            [self.IP, "-j", "link", "show"], netns_name, check=True, stdout=PIPE
+        )
+        return self._parse(cp.stdout)
+
+    async def links_in_async(self, netns_name: str = "") -> Set[str]:
+        """Coroutine links_in() - concurrent first loads of a netns are harmless
+        as only the first result is kept"""
+        with self.lock:
+            if netns_name in self.links:
+                return self.links[netns_name]
+
+        links: Set[str] = set()
+        if not netns_name or netns_path(netns_name).exists():
+            cp = await get_backend().run_async(
+                [self.IP, "-j", "link", "show"], netns_name, check=True, stdout=PIPE
+            )
+            links = self._parse(cp.stdout)
+        with self.lock:
+            return self.links.setdefault(netns_name, links)
+
+    def links_in(self, netns_name: str = "") -> Set[str]:
+        with self.lock:
+            if netns_name in self.links:
+                return self.links[netns_name]
+            load_lock = self.load_locks.setdefault(netns_name, Lock())
+
+        # Only one thread dumps each netns - others wait for its result
+        with load_lock:
+            with self.lock:
+                if netns_name in self.links:
+                    return self.links[netns_name]
+            links = self._load(netns_name)
+            with self.lock:
+                self.links[netns_name] = links
+            ns_label = netns_name if netns_name else "default"
+            LOG.debug(f"Loaded {len(links)} links from {ns_label} namespace")
+            return links
+
+    def exists(self, name: str, netns_name: str = "") -> bool:
+        return name in self.links_in(netns_name)
+
+    def add(self, name: str, netns_name: str = "") -> None:
+        links = self.links_in(netns_name)
+        with self.lock:
+            links.add(name)
+
+    def remove(self, name: str, netns_name: str = "") -> None:
+        links = self.links_in(netns_name)
+        with self.lock:
+            links.discard(name)
+
+    def remove_everywhere(self, name: str) -> None:
+        with self.lock:
+            for links in self.links.values():
+                links.discard(name)
+
+    def move(self, name: str, netns_name: str, from_netns_name: str = "") -> None:
+        self.remove(name, from_netns_name)
+        self.add(name, netns_name)
+
+    def forget(self, netns_name: str) -> None:
+        """Drop a netns's links (e.g. it was deleted or needs re-reading)"""
+        with self.lock:
+            self.links.pop(netns_name, None)
+
+
+_inventory: Optional[LinkInventory] = None
+
+
+def get_inventory() -> Optional[LinkInventory]:
+    """The active LinkInventory - None means always ask the kernel"""
+    return _inventory
+
+
+@contextmanager
+def link_inventory() -> Iterator[LinkInventory]:
+    """Cache links for the duration of the with block (i.e. an action)"""
+    global _inventory
+    previous = _inventory
+    _inventory = LinkInventory()
+    try:
+        yield _inventory
+    finally:
+        LOG.debug(f"Link inventory used {_inventory.dumps} link dumps")
+        _inventory = previous
@@ -0,0 +1,76 @@
+import logging
+import os
+from json import dumps, loads
+from pathlib import Path
+from typing import Dict, Set
+
+from json2netns.consts import DEFAULT_STATE_DIR
+from json2netns.netns import NamespaceIndex
+from json2netns.nsenter import netns_path
+
+
+LOG = logging.getLogger(__name__)
+
+# 3: config hashes are of the raw namespace config
+JOURNAL_VERSION = 3
+
+
+class AppliedJournal:
+    """Config hashes of the namespaces we last successfully created
+    - Lives in /run so it goes away with the namespaces on reboot"""
+
+    def __init__(self, state_dir: Path = DEFAULT_STATE_DIR) -> None:
+        self.path = state_dir / "applied.json"
+        self.hashes: Dict[str, str] = {}
+
+    def load(self) -> None:
+        if not self.path.exists():
+            LOG.debug(f"No applied state journal at {self.path}")
+            return
+
+        try:
+            journal = loads(self.path.read_text())
+        except ValueError as ve:
+            LOG.error(f"Ignoring corrupt applied state journal {self.path}: {ve}")
+            return
+
+        if journal.get("version") != JOURNAL_VERSION:
+            LOG.info(f"Ignoring applied state journal version {journal.get('version')}")
+            return
+        self.hashes = dict(journal.get("namespaces", {}))
+
+    def save(self) -> None:
+        """Atomically replace the journal so a crash never leaves half a file"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(
+            dumps(
+                {"version": JOURNAL_VERSION, "namespaces": self.hashes},
+                indent=2,
+                sort_keys=True,
+            )
+        )
+        os.replace(tmp_path, self.path)
+
+    def unchanged(self, netns_name: str, ns_hash: str) -> bool:
+        return self.hashes.get(netns_name) == ns_hash and netns_path(netns_name).exists()
+
+    def record(self, netns_name: str, ns_hash: str) -> None:
+        self.hashes[netns_name] = ns_hash
+
+    def forget(self, netns_name: str) -> None:
+        self.hashes.pop(netns_name, None)
+
+
+def unchanged_namespaces(index: NamespaceIndex, journal: AppliedJournal) -> Set[str]:
+    """Namespaces safe to skip - unchanged themselves + so are all their veth peers
+    - index needs its hashes so no Namespace objects get built"""
+    unchanged = {
+        name
+        for name, ns_hash in index.hashes.items()
+        if journal.unchanged(name, ns_hash)
+    }
+    for name in index.hashes:
+        if name not in unchanged:
+            unchanged.difference_update(index.peer_namespaces(name))
+    return unchanged
@@ -1,18 +1,39 @@
 #!/usr/bin/env python3
 
 import argparse
-import asyncio
 import logging
 import sys
-from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from copy import copy
+from functools import partial
 from getpass import getuser
+from json import dumps
 from pathlib import Path
-from typing import Awaitable, Dict, List
+from time import monotonic
+from typing import Any, Dict, List, Optional, Tuple, Type, TYPE_CHECKING
 
-from json2netns.config import Config
-from json2netns.consts import GLOBAL_OOB_INTERFACE, VALID_ACTIONS, VALID_SORTED_ACTIONS
-from json2netns.interfaces import MacVlan
-from json2netns.netns import Namespace, setup_all_veths, setup_global_oob
+from json2netns.consts import (
+    DEFAULT_BACKEND,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_PLAN_CACHE_SIZE,
+    DEFAULT_STATE_DIR,
+    DEFAULT_TEARDOWN_TIMEOUT,
+    DEFAULT_WATCH_DEBOUNCE,
+    GLOBAL_OOB_INTERFACE,
+    VALID_ACTIONS,
+    VALID_BACKENDS,
+    VALID_SORTED_ACTIONS,
+)
+from json2netns.trace import traced
+
+# Each action imports the modules it needs when it runs so `check` + --help
+# don't pay for asyncio, the reconciler, plan cache etc. - see bench_startup.py
+if TYPE_CHECKING:  # pragma: nocover
+    from json2netns.backend import Backend
+    from json2netns.dryrun import DryRunBackend
+    from json2netns.netns import LazyNamespaces
+    from json2netns.nsenter import NetnsWorkerPool
+    from json2netns.plancache import CompiledPlan
 
 LOG = logging.getLogger(__name__)
 
@@ -21,76 +42,451 @@ def amiroot() -> bool:
     return getuser() == "root"
 
 
-async def async_main(args: argparse.Namespace) -> int:
+def backend_class(name: str) -> Type["Backend"]:
+    """Only the chosen backend's module is imported"""
+    if name == "netlink":
+        from json2netns.netlink import NetlinkBackend
+
+        return NetlinkBackend
+    from json2netns.backend import SubprocessBackend
+
+    return SubprocessBackend
+
+
+def load_namespaces(
+    args: argparse.Namespace,
+) -> Tuple[int, Dict[str, Any], Optional["LazyNamespaces"]]:
+    """Stream in the config - namespaces are only built when they're worked on
+    - Only the --namespace namespaces (if any) are selected"""
+    from json2netns.config import Config
+    from json2netns.netns import LazyNamespaces
+
     config = Config(Path(args.config))
-    topology_config = config.load()
-    executor = ThreadPoolExecutor(max_workers=args.workers)
+    topology_config = config.load_streaming()
+    if args.validate:
+        # Catch bad configs before we run a single ip command
+        errors = config.validate(topology_config)
+        if errors:
+            LOG.error(f"{len(errors)} problems found in {args.config}")
+            return 3, topology_config, None
+        LOG.debug(f"{args.config} is valid")
 
-    namespaces: Dict[str, Namespace] = {}
-    for ns_name, ns_config in topology_config["namespaces"].items():
-        namespaces[ns_name] = Namespace(ns_name, ns_config, topology_config)
+    namespaces = LazyNamespaces(topology_config)
+    if args.namespace:
+        unknown = [name for name in args.namespace if name not in namespaces]
+        if unknown:
+            LOG.error(f"No {', '.join(unknown)} namespace in {args.config}")
+            return 2, topology_config, None
+        namespaces = namespaces.subset(args.namespace)
+    return 0, topology_config, namespaces
 
-    if not amiroot():
-        LOG.error("Please `sudo` / become root to run netns commands")
-        return 69
+
+def check_namespaces(
+    args: argparse.Namespace,
+    namespaces: "LazyNamespaces",
+    pool: "NetnsWorkerPool",
+) -> int:
+    """Check all namespaces at once (up to --workers) - printed in config order"""
+    from json2netns.netns import run_namespace
+
+    start = monotonic()
+    results = pool.map(
+        namespaces,
+        partial(
+            run_namespace, namespaces, method="check_result", json_output=args.json
+        ),
+    )
+    elapsed = monotonic() - start
+    if args.json:
+        print(
+            dumps(
+                {
+                    "namespaces": {result.name: result.to_dict() for result in results},
+                    "seconds": round(elapsed, 6),
+                },
+                indent=2,
+            ),
+            flush=True,
+        )
+    else:
+        print("\n\n".join(result.render() for result in results), flush=True)
+
+    for result in results:
+        LOG.debug(f"Checked {result.name} in {result.seconds:.3f}s")
+        for header, error in result.errors.items():
+            LOG.error(f"{result.name} {header.strip('# ')} failed: {error}")
+    if results:
+        slowest = max(results, key=lambda result: result.seconds)
+        LOG.info(
+            f"Checked {len(results)} namespaces in {elapsed:.3f}s "
+            + f"(slowest {slowest.name} {slowest.seconds:.3f}s)"
+        )
+    return 0
+
+
+def check_main(args: argparse.Namespace) -> int:
+    """check only runs threads - no event loop or asyncio import needed"""
+    from json2netns.nsenter import NetnsWorkerPool
+
+    returncode, _, namespaces = load_namespaces(args)
+    if namespaces is None:
+        return returncode
+    pool = NetnsWorkerPool(args.workers, pin=args.setns)
+    try:
+        return check_namespaces(args, namespaces, pool)
+    finally:
+        pool.shutdown()
+
+
+def watch_main(args: argparse.Namespace) -> int:
+    """Apply the config then each save's changes until interrupted
+    - Workers, backend + event loop stay up between saves"""
+    from json2netns.nsenter import NetnsWorkerPool
+    from json2netns.watch import ConfigWatcher, WatchDaemon
+
+    pool = NetnsWorkerPool(args.workers, pin=args.setns)
+    watcher = ConfigWatcher(Path(args.config), args.debounce)
+    daemon = WatchDaemon(
+        Path(args.config),
+        pool,
+        args.validate,
+        args.namespace,
+        GLOBAL_OOB_INTERFACE,
+        args.delete_timeout,
+    )
+    try:
+        return daemon.serve(watcher)
+    finally:
+        daemon.close()
+        watcher.close()
+        pool.shutdown()
+
+
+async def async_main(
+    args: argparse.Namespace, dry_run: Optional["DryRunBackend"] = None
+) -> int:
+    from json2netns.nsenter import NetnsWorkerPool
+
+    returncode, topology_config, namespaces = load_namespaces(args)
+    if namespaces is None:
+        return returncode
+    # Workers optionally setns() into the netns they're working on
+    pool = NetnsWorkerPool(args.workers, pin=args.setns)
+    try:
+        return await apply_action(args, topology_config, namespaces, pool, dry_run)
+    finally:
+        pool.shutdown()
+
+
+async def apply_action(
+    args: argparse.Namespace,
+    topology_config: Dict[str, Any],
+    namespaces: "LazyNamespaces",
+    pool: "NetnsWorkerPool",
+    dry_run: Optional["DryRunBackend"] = None,
+) -> int:
+    """Run the action on namespaces with pool's workers - async_main() owns pool"""
+    import asyncio
+
+    from json2netns.batch import BatchFailure, log_failures
+    from json2netns.journal import AppliedJournal, unchanged_namespaces
+    from json2netns.metrics import count, NAMESPACES
+    from json2netns.netns import (
+        build_create_graph,
+        build_delete_graph,
+        compile_default_batch,
+        global_oob_interface,
+        NamespaceIndex,
+        run_namespace,
+    )
+    from json2netns.reconcile import Reconciler
+    from json2netns.teardown import Teardown
 
     lower_action = args.action.lower()
+    if dry_run and lower_action == "delete":
+        # Plan the delete of a host with everything in the config created
+        oob_int = global_oob_interface(
+            GLOBAL_OOB_INTERFACE, namespaces, topology_config
+        )
+        dry_run.assume_created(namespaces, [oob_int.name] if oob_int else [])
     if lower_action == "check":
-        ns_count = 0
-        for ns_name, ns in namespaces.items():
-            if ns_count != 0:
-                print("")
-            print(f"# Checking {ns_name}")
-            ns.check()
-            ns_count += 1
-
-        LOG.debug(f"Ran check commands for {ns_count} NSs")
+        return check_namespaces(args, namespaces, pool)
+
+    if lower_action in {"apply", "plan"}:
+        # Diff the config against one read of the kernel state
+        reconciler = Reconciler(namespaces, topology_config, GLOBAL_OOB_INTERFACE)
+        plan = reconciler.plan(await reconciler.load_states(pool))
+        if lower_action == "plan":
+            print(plan.render(), flush=True)
+            return 0
+
+        failures = await plan.apply(pool)
+        if failures:
+            LOG.error(f"{len(failures)} of {len(plan)} planned changes failed")
+            return 11
+        LOG.info(f"Applied {len(plan)} changes")
         return 0
 
-    # Perform non co-ro fun
+    journal = AppliedJournal(Path(args.state_dir))
+    journal.load()
+    # One pass over the raw config - Namespace objects are only built by tasks
+    index = NamespaceIndex.build(
+        topology_config, namespaces, hashes=lower_action == "create"
+    )
     if lower_action == "create":
-        # veth pairs need to be setup then moved to namespaces
-        setup_all_veths(namespaces)
-        # Add global oob if wanted
-        setup_global_oob(GLOBAL_OOB_INTERFACE, namespaces, topology_config)
-    elif lower_action == "delete":
-        # Check if we have an oob device and clean it up
-        oob_int = MacVlan(GLOBAL_OOB_INTERFACE, "deleting_only", [])
-        oob_int.delete()
-
-    # Create NS Coros and run in parallel
-    loop = asyncio.get_running_loop()
-    namespace_coros: List[Awaitable] = []
-    for _ns_name, ns in namespaces.items():
-        if lower_action == "create":
-            namespace_coros.append(loop.run_in_executor(executor, ns.setup))
-        elif lower_action == "delete":
-            namespace_coros.append(loop.run_in_executor(executor, ns.delete))
+        skipped = set() if args.force else unchanged_namespaces(index, journal)
+        if skipped:
+            LOG.info(f"Skipping {len(skipped)} namespaces unchanged since last create")
+            count(NAMESPACES, len(skipped), result="unchanged")
+            namespaces = namespaces.subset(
+                name for name in namespaces if name not in skipped
+            )
+        if not namespaces:
+            LOG.info("Nothing has changed since the last create")
+            return 0
+
+    if lower_action == "create" and args.batch:
+        # One `ip -batch` for the default netns then one per netns
+        default_batch = compile_default_batch(
+            GLOBAL_OOB_INTERFACE, namespaces, topology_config
+        )
+        failures = default_batch.run()
+        log_failures(failures)
+        ns_failures: Dict[str, List[BatchFailure]] = dict(
+            zip(
+                namespaces,
+                await asyncio.gather(
+                    *[
+                        pool.run(
+                            ns_name,
+                            partial(
+                                run_namespace, namespaces, ns_name, "setup_batched"
+                            ),
+                        )
+                        for ns_name in namespaces
+                    ]
+                ),
+            )
+        )
+        # Nexthops need every veth peer up so they're a second round
+        nexthop_namespaces = namespaces.with_nexthops()
+        nexthop_failures = await asyncio.gather(
+            *[
+                pool.run(
+                    ns_name,
+                    partial(
+                        run_namespace, namespaces, ns_name, "setup_nexthops_batched"
+                    ),
+                )
+                for ns_name in nexthop_namespaces
+            ]
+        )
+        for ns_name, ns_failure in zip(nexthop_namespaces, nexthop_failures):
+            ns_failures[ns_name].extend(ns_failure)
+        for ns_name, ns_failure in ns_failures.items():
+            if not failures and not ns_failure:
+                journal.record(ns_name, index.hashes[ns_name])
+            else:
+                count(NAMESPACES, result="failed")
+        journal.save()
+        failure_count = len(failures) + sum(len(f) for f in ns_failures.values())
+        if failure_count:
+            LOG.error(f"{failure_count} batched commands failed")
+            return 11
+        return 0
+
+    if lower_action == "delete" and args.batch:
+        # One `ip -batch` of `netns del` then wait for the kernel to finish
+        teardown = Teardown(
+            namespaces, GLOBAL_OOB_INTERFACE, timeout=args.delete_timeout
+        )
+        failures = await pool.run("", teardown.run)
+        remaining = set(await pool.run("", teardown.wait))
+        for ns_name in namespaces:
+            if ns_name not in remaining:
+                journal.forget(ns_name)
+            else:
+                count(NAMESPACES, result="failed")
+        if journal.path.exists():
+            journal.save()
+        if failures or remaining:
+            return 11
+        return 0
 
-    if not namespace_coros:
+    # Run create / delete as a DAG - tasks start as soon as their deps finish
+    if lower_action == "create":
+        graph = build_create_graph(
+            GLOBAL_OOB_INTERFACE,
+            namespaces,
+            topology_config,
+            use_async=args.asyncio,
+            index=index,
+        )
+    elif lower_action == "delete":
+        graph = build_delete_graph(
+            GLOBAL_OOB_INTERFACE, namespaces, use_async=args.asyncio
+        )
+    else:
         LOG.error(f"Nothing to do. Is {lower_action} a valid action?")
         return 10
 
-    await asyncio.gather(*namespace_coros)
+    not_ok = await graph.run(pool)
+    graph.log_critical_path()
+    failed_namespaces = graph.failed_owners(not_ok)
+    for ns_name in namespaces:
+        if ns_name in failed_namespaces:
+            count(NAMESPACES, result="failed")
+            continue
+        if lower_action == "create":
+            journal.record(ns_name, index.hashes[ns_name])
+        else:
+            journal.forget(ns_name)
+    if lower_action == "create" or journal.path.exists():
+        journal.save()
+
+    if not_ok:
+        LOG.error(f"{len(not_ok)} of {len(graph)} {lower_action} tasks did not run")
+        return 12
+    return 0
+
+
+@traced
+async def compile_plan(
+    args: argparse.Namespace,
+) -> Tuple[int, Optional["CompiledPlan"]]:
+    """Dry run the action in process + return its commands as a CompiledPlan"""
+    from json2netns.backend import set_backend
+    from json2netns.config import Config
+    from json2netns.dryrun import dry_run_host
+    from json2netns.inventory import link_inventory
+    from json2netns.journal import AppliedJournal
+    from json2netns.metrics import set_metrics
+    from json2netns.plancache import CompiledPlan
+
+    with dry_run_host(args.max_in_flight) as (dry_run, state_dir):
+        compile_args = copy(args)
+        compile_args.force = True
+        compile_args.setns = False
+        compile_args.state_dir = str(state_dir)
+        previous_backend = set_backend(dry_run)
+        # Counted when the plan is applied
+        previous_metrics = set_metrics(None)
+        try:
+            with link_inventory():
+                returncode = await async_main(compile_args, dry_run)
+        finally:
+            set_backend(previous_backend)
+            set_metrics(previous_metrics)
+        if returncode:
+            return returncode, None
+
+        journal = AppliedJournal(state_dir)
+        journal.load()
+        return 0, CompiledPlan(
+            args.action.lower(),
+            [
+                ns_name
+                for ns_name, _ in Config(Path(args.config)).iter_namespaces()
+                if not args.namespace or ns_name in args.namespace
+            ],
+            dry_run.batches(),
+            journal.hashes,
+            bool(args.validate),
+        )
+
+
+async def cached_main(args: argparse.Namespace) -> int:
+    """create / delete via a cached CompiledPlan - compiled + cached on a miss
+    - Hosts that don't look like the plan expects take the async_main() path"""
+    from json2netns.journal import AppliedJournal
+    from json2netns.metrics import count, NAMESPACES
+    from json2netns.nsenter import NetnsWorkerPool
+    from json2netns.plancache import PlanCache
+
+    lower_action = args.action.lower()
+    cache = PlanCache(Path(args.state_dir) / "plans", args.plan_cache_size)
+    key = cache.key(Path(args.config), lower_action, args.namespace or ())
+    plan = cache.load(key)
+    if plan and args.validate and not plan.validated:
+        LOG.debug("Cached plan was compiled without --validate - recompiling")
+        plan = None
+    if plan is None:
+        returncode, plan = await compile_plan(args)
+        if plan is None:
+            return returncode
+        cache.store(key, plan)
+        LOG.info(f"Cached {lower_action} plan of {len(plan)} commands as {key}")
+    else:
+        LOG.info(f"Using cached {lower_action} plan {key} ({len(plan)} commands)")
+
+    if not plan.applies():
+        return await async_main(args)
+
+    pool = NetnsWorkerPool(args.workers, pin=args.setns)
+    try:
+        failed = await plan.apply(pool)
+    finally:
+        pool.shutdown()
+    journal = AppliedJournal(Path(args.state_dir))
+    journal.load()
+    for ns_name in plan.namespaces:
+        if ns_name in failed:
+            count(NAMESPACES, result="failed")
+        elif lower_action == "create":
+            count(NAMESPACES, result="created")
+            journal.hashes[ns_name] = plan.hashes[ns_name]
+        else:
+            count(NAMESPACES, result="deleted")
+            journal.forget(ns_name)
+    if lower_action == "create" or journal.path.exists():
+        journal.save()
+    if failed:
+        LOG.error(f"{len(failed)} namespaces failed to {lower_action}")
+        return 11
     return 0
 
 
 def validate_args(args: argparse.Namespace) -> int:
     """Look at args and make sure that are valid"""
-    config_path = Path(args.config)
-    if not config_path.exists():
-        LOG.error("We need a JSON topology config to do anything")
-        return 1
-
     if args.action.lower() not in VALID_ACTIONS:
         LOG.error(
             f"{args.action} is not a valid action choice! Valid choices: "
             + f"'{' '.join(VALID_SORTED_ACTIONS)}'"
         )
         return 2
+
+    config_path = Path(args.config)
+    if not config_path.exists():
+        LOG.error("We need a JSON topology config to do anything")
+        return 1
+
+    if (args.dry_run or args.dry_run_batch) and args.action.lower() not in {
+        "create",
+        "delete",
+    }:
+        LOG.error("--dry-run only supports the create + delete actions")
+        return 2
+    if (args.dry_run or args.dry_run_batch) and args.setns:
+        LOG.error("--dry-run can't --setns into namespaces that don't exist")
+        return 2
+    if args.plan_cache and args.action.lower() not in {"create", "delete"}:
+        LOG.error("--plan-cache only supports the create + delete actions")
+        return 2
     return 0
 
 
+def write_dry_run(args: argparse.Namespace, dry_run: "DryRunBackend") -> None:
+    """Print the recorded commands as a shell script or write them as batch files"""
+    header = (
+        f"json2netns {args.action.lower()} plan for {args.config} "
+        + f"({len(dry_run.commands)} commands)"
+    )
+    if args.dry_run_batch:
+        dry_run.write_batches(Path(args.dry_run_batch), header)
+    else:
+        print(dry_run.script(header), end="", flush=True)
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -98,10 +494,103 @@ def main() -> int:
     parser.add_argument(
         "-d", "--debug", action="store_true", help="Verbose debug output"
     )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Run create/delete commands as asyncio subprocesses - not on workers",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=VALID_BACKENDS,
+        default=DEFAULT_BACKEND,
+        help="How to run ip commands - netlink talks rtnetlink directly",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Run each namespace's commands via one `ip -batch` process",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEFAULT_WATCH_DEBOUNCE,
+        help="Seconds watch waits after a config save for more saves before applying",
+    )
+    parser.add_argument(
+        "--delete-timeout",
+        type=float,
+        default=DEFAULT_TEARDOWN_TIMEOUT,
+        help="Seconds `delete --batch` waits for the kernel to remove everything",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="create/delete print the commands they'd run as a shell script "
+        + "(planned for a host with nothing / everything created) - no root needed",
+    )
+    parser.add_argument(
+        "--dry-run-batch",
+        metavar="DIR",
+        help="--dry-run writing one `ip -batch` file per namespace + apply.sh to DIR",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Create every namespace - even those unchanged since the last create",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="check prints one JSON document of `ip -j` output + timings",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help="Max concurrent --asyncio ip commands",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Write Prometheus textfile collector metrics of the run to this path "
+        + "e.g. /var/lib/node_exporter/textfile/json2netns_create.prom",
+    )
+    parser.add_argument(
+        "-n",
+        "--namespace",
+        action="append",
+        help="Only work on this namespace (repeatable) - default is every namespace",
+    )
+    parser.add_argument(
+        "--plan-cache",
+        action="store_true",
+        help="create/delete run a cached compiled plan of the config (compiled via a "
+        + "dry run + kept in STATE_DIR/plans on a miss)",
+    )
+    parser.add_argument(
+        "--plan-cache-size",
+        type=int,
+        default=DEFAULT_PLAN_CACHE_SIZE,
+        help="Most recently used compiled plans to keep",
+    )
+    parser.add_argument(
+        "--setns",
+        action="store_true",
+        help="Workers setns() into each netns + run its commands from inside it",
+    )
+    parser.add_argument(
+        "--state-dir",
+        default=str(DEFAULT_STATE_DIR),
+        help="Where to keep the journal of applied namespace config hashes",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write a Chrome trace of every phase + command to this path and "
+        + "print the slowest namespaces + command types to stderr",
+    )
     parser.add_argument(
         "--validate",
         action="store_true",
-        help="Validate JSON config (not yet implemented)",
+        help="Validate the JSON config before running the action",
     )
     parser.add_argument(
         "--workers",
@@ -124,7 +613,73 @@ def main() -> int:
     error_value = validate_args(args)
     if error_value:
         return error_value
-    return int(asyncio.run(async_main(args)))
+    # Before any config is read or namespace built
+    if not (args.dry_run or args.dry_run_batch) and not amiroot():
+        LOG.error("Please `sudo` / become root to run netns commands")
+        return 69
+
+    with ExitStack() as stack:
+        dry_run = None
+        if args.dry_run or args.dry_run_batch:
+            from json2netns.dryrun import dry_run_host
+
+            # Pretend /run/netns + journal so the plan is for a fresh host
+            dry_run, state_dir = stack.enter_context(dry_run_host(args.max_in_flight))
+            args.state_dir = str(state_dir)
+            LOG.info("Dry run - recording commands, nothing will be changed")
+        return run_action(args, dry_run)
+
+
+def run_action(args: argparse.Namespace, dry_run: Optional["DryRunBackend"]) -> int:
+    from json2netns.backend import set_backend, TracingBackend
+    from json2netns.inventory import link_inventory
+    from json2netns.metrics import Metrics, set_metrics
+    from json2netns.trace import set_tracer, span, Tracer
+
+    backend: "Backend" = (
+        dry_run
+        if dry_run
+        else backend_class(args.backend)(max_in_flight=args.max_in_flight)
+    )
+    tracer = None
+    if args.trace:
+        tracer = Tracer()
+        set_tracer(tracer)
+        backend = TracingBackend(backend)
+    set_backend(backend)
+    run_metrics = None
+    if args.metrics:
+        run_metrics = Metrics({"action": args.action.lower()})
+        set_metrics(run_metrics)
+    start = monotonic()
+    returncode = 1
+    try:
+        # One link dump per netns for the whole action vs. a fork per exists()
+        with link_inventory(), span(f"json2netns {args.action}", "action"):
+            if args.action.lower() == "check":
+                returncode = check_main(args)
+            elif args.action.lower() == "watch":
+                returncode = watch_main(args)
+            else:
+                import asyncio
+
+                if args.plan_cache and not dry_run:
+                    returncode = int(asyncio.run(cached_main(args)))
+                else:
+                    returncode = int(asyncio.run(async_main(args, dry_run)))
+        if dry_run and not returncode:
+            write_dry_run(args, dry_run)
+        return returncode
+    finally:
+        backend.close()
+        if tracer:
+            set_tracer(None)
+            tracer.write(Path(args.trace))
+            print(tracer.summary(), file=sys.stderr, flush=True)
+        if run_metrics:
+            set_metrics(None)
+            run_metrics.record_run(returncode, monotonic() - start)
+            run_metrics.write(Path(args.metrics))
 
 
 if __name__ == "__main__":  # pragma: nocover
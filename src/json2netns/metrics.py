@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+from bisect import bisect_left
+from pathlib import Path
+from time import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+LOG = logging.getLogger(__name__)
+
+ACTION_SECONDS = "json2netns_action_duration_seconds"
+EXIT_CODE = "json2netns_last_run_exit_code"
+INTERFACES = "json2netns_interfaces_total"
+LAST_RUN = "json2netns_last_run_timestamp_seconds"
+NAMESPACES = "json2netns_namespaces_total"
+NEXTHOPS = "json2netns_nexthops_total"
+PHASE_SECONDS = "json2netns_phase_duration_seconds"
+ROUTES = "json2netns_routes_total"
+SUBPROCESSES = "json2netns_subprocesses_total"
+
+# name -> (type, help)
+METRICS: Dict[str, Tuple[str, str]] = {
+    ACTION_SECONDS: ("histogram", "Wall time of the json2netns action"),
+    EXIT_CODE: ("gauge", "Exit code of the last json2netns run"),
+    INTERFACES: ("counter", "Interfaces created, moved or deleted by result + type"),
+    LAST_RUN: ("gauge", "Unix time the last json2netns run finished"),
+    NAMESPACES: (
+        "counter",
+        "Namespaces by result (created, deleted, skipped, unchanged, failed)",
+    ),
+    NEXTHOPS: ("counter", "Nexthop objects by result (installed, failed)"),
+    PHASE_SECONDS: ("histogram", "Wall time of each phase e.g. Namespace.create"),
+    ROUTES: (
+        "counter",
+        "Routes by result (installed, replaced, unchanged, skipped, invalid, failed)",
+    ),
+    SUBPROCESSES: ("counter", "ip processes ran by command type"),
+}
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _label_value(value: Any) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_label_value(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """Counters, gauges + histograms of one run in Prometheus text format
+    - write() is for node_exporter's textfile collector (*.prom files)
+    - labels (e.g. the action) are added to every sample"""
+
+    def __init__(
+        self, labels: Optional[Dict[str, str]] = None, buckets: Sequence[float] = ()
+    ) -> None:
+        self.labels: Labels = tuple(sorted((labels or {}).items()))
+        self.buckets = tuple(buckets) if buckets else DEFAULT_BUCKETS
+        self.lock = threading.Lock()
+        # (name, labels) -> value
+        self.values: Dict[Tuple[str, Labels], float] = {}
+        # (name, labels) -> [per bucket counts..., +Inf count, sum]
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+
+    def _key(self, name: str, labels: Dict[str, Any]) -> Tuple[str, Labels]:
+        if name not in METRICS:
+            raise ValueError(f"{name} is not a known metric")
+        return name, self.labels + tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0.0] * (len(self.buckets) + 2)
+            histogram[bisect_left(self.buckets, value)] += 1
+            histogram[-1] += value
+
+    def get(self, name: str, **labels: Any) -> float:
+        return self.values.get(self._key(name, labels), 0)
+
+    def record_run(self, returncode: int, seconds: float) -> None:
+        """Action duration, exit code + finish time - call once at the end of a run"""
+        self.observe(ACTION_SECONDS, seconds)
+        self.set(EXIT_CODE, returncode)
+        self.set(LAST_RUN, round(time(), 3))
+
+    def render(self) -> str:
+        samples: Dict[str, List[str]] = {}
+        with self.lock:
+            for (name, labels), value in sorted(self.values.items()):
+                samples.setdefault(name, []).append(
+                    f"{name}{_format_labels(labels)} {_format_value(value)}"
+                )
+            # Buckets stay in le order
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                lines = samples.setdefault(name, [])
+                cumulative = 0.0
+                for le, bucket_count in zip(self.buckets + (float("inf"),), histogram):
+                    cumulative += bucket_count
+                    le_label = "+Inf" if le == float("inf") else repr(le)
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels + (('le', le_label),))} "
+                        + _format_value(cumulative)
+                    )
+                lines.append(
+                    f"{name}_sum{_format_labels(labels)} {_format_value(histogram[-1])}"
+                )
+                lines.append(
+                    f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}"
+                )
+
+        output: List[str] = []
+        for name in sorted(samples):
+            metric_type, help_text = METRICS[name]
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(samples[name])
+        return "\n".join(output) + "\n"
+
+    def write(self, path: Path) -> None:
+        """Write via a temp file + rename so the collector never reads half a file"""
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+        tmp_path.write_text(self.render())
+        os.replace(tmp_path, path)
+        LOG.debug(f"Wrote {len(self.values) + len(self.histograms)} metrics to {path}")
+
+
+_metrics: Optional[Metrics] = None
+
+
+def get_metrics() -> Optional[Metrics]:
+    return _metrics
+
+
+def set_metrics(metrics: Optional[Metrics]) -> Optional[Metrics]:
+    """Turn metrics on (or off with None) + return the previous Metrics"""
+    global _metrics
+    previous = _metrics
+    _metrics = metrics
+    return previous
+
+
+def count(name: str, value: float = 1, **labels: Any) -> None:
+    """Increment a counter - a no-op when metrics are off"""
+    metrics = _metrics
+    if metrics is not None:
+        metrics.inc(name, value, **labels)
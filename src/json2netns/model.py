@@ -0,0 +1,172 @@
+import socket
+import sys
+from functools import lru_cache
+from ipaddress import ip_interface, ip_network, IPv4Interface, IPv6Interface
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from json2netns.consts import IPInterface, IPNetwork
+
+
+NEXT_HOP_CACHE = 65536
+
+# version -> (inet_pton family, address bits)
+IP_FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+
+
+def intern_name(name: Any) -> str:
+    """One copy of each namespace / interface / route name however many use it"""
+    return sys.intern(str(name))
+
+
+def parse_address(address: str) -> Tuple[int, int]:
+    """Fast ip_address() -> (version, int) - raises ValueError if invalid"""
+    version = 6 if ":" in address else 4
+    try:
+        packed = socket.inet_pton(IP_FAMILIES[version][0], address)
+    except OSError:
+        raise ValueError(f"{address} is not a valid IP address") from None
+    return version, int.from_bytes(packed, "big")
+
+
+def parse_prefix(prefix: str) -> Tuple[int, int, int]:
+    """Fast ip_interface() -> (version, int address, prefix length)"""
+    address, _, length = prefix.partition("/")
+    version, addr = parse_address(address)
+    max_length = IP_FAMILIES[version][1]
+    if not length:
+        return version, addr, max_length
+    if not length.isdigit() or int(length) > max_length:
+        raise ValueError(f"{prefix} has an invalid prefix length")
+    return version, addr, int(length)
+
+
+def network_range(version: int, addr: int, length: int) -> Tuple[int, int]:
+    """First + last address of the network addr/length is in"""
+    host_bits = IP_FAMILIES[version][1] - length
+    first = (addr >> host_bits) << host_bits
+    return first, first + (1 << host_bits) - 1
+
+
+def address_str(version: int, addr: int) -> str:
+    family, bits = IP_FAMILIES[version]
+    return socket.inet_ntop(family, addr.to_bytes(bits // 8, "big"))
+
+
+class Prefix:
+    """An address + prefix length as ints - a fraction of an ipaddress object's size
+    - str() gives what `ip` wants, interface() / network() for ipaddress objects"""
+
+    __slots__ = ("version", "addr", "prefixlen")
+
+    def __init__(self, version: int, addr: int, prefixlen: int) -> None:
+        self.version = version
+        self.addr = addr
+        self.prefixlen = prefixlen
+
+    @classmethod
+    def parse(cls, prefix: Union[str, IPInterface, IPNetwork, "Prefix"]) -> "Prefix":
+        if isinstance(prefix, Prefix):
+            return prefix
+        if isinstance(prefix, str):
+            return cls(*parse_prefix(prefix))
+        if isinstance(prefix, (IPv4Interface, IPv6Interface)):
+            return cls(prefix.version, int(prefix.ip), prefix.network.prefixlen)
+        return cls(prefix.version, int(prefix.network_address), prefix.prefixlen)
+
+    def __str__(self) -> str:
+        return f"{address_str(self.version, self.addr)}/{self.prefixlen}"
+
+    def __repr__(self) -> str:
+        return f"Prefix('{self}')"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Prefix):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def key(self) -> Tuple[int, int, int]:
+        return (self.version, self.addr, self.prefixlen)
+
+    @property
+    def address(self) -> str:
+        return address_str(self.version, self.addr)
+
+    def interface(self) -> IPInterface:
+        return ip_interface(str(self))
+
+    def network(self) -> IPNetwork:
+        return ip_network(str(self), strict=False)
+
+    def range(self) -> Tuple[int, int]:
+        return network_range(self.version, self.addr, self.prefixlen)
+
+
+class RouteEntry:
+    """Compact copy of a namespace route's config - Route objects are built from it
+    - multipath is an ECMP route's (next hop, egress interface, weight) legs
+    - nexthop names a shared nexthop object the route points at"""
+
+    __slots__ = ("name", "dest", "next_hop", "egress_if_name", "multipath", "nexthop")
+
+    def __init__(
+        self,
+        name: str,
+        dest_prefix: str,
+        next_hop_ip: str,
+        egress_if_name: str,
+        multipath: Iterable[Dict[str, Any]] = (),
+        nexthop: str = "",
+    ) -> None:
+        self.name = intern_name(name)
+        # Unparsable values are kept as is so Route validation can log why
+        self.dest = parse_or_keep(dest_prefix)
+        self.next_hop = shared_next_hop(next_hop_ip) if next_hop_ip else None
+        self.egress_if_name = intern_name(egress_if_name)
+        self.multipath: Tuple[Tuple[Any, str, int], ...] = tuple(
+            (
+                shared_next_hop(hop["next_hop_ip"]) if hop.get("next_hop_ip") else None,
+                intern_name(hop.get("egress_if_name", "")),
+                hop.get("weight", 1),
+            )
+            for hop in multipath
+        )
+        self.nexthop = intern_name(nexthop)
+
+    @property
+    def dest_prefix(self) -> str:
+        return str(self.dest)
+
+    @property
+    def next_hop_ip(self) -> str:
+        return next_hop_str(self.next_hop)
+
+    @property
+    def hops(self) -> Tuple[Tuple[str, str, int], ...]:
+        return tuple(
+            (next_hop_str(next_hop), egress_if_name, weight)
+            for next_hop, egress_if_name, weight in self.multipath
+        )
+
+
+def next_hop_str(next_hop: Optional[Any]) -> str:
+    if next_hop is None:
+        return ""
+    if isinstance(next_hop, Prefix):
+        return next_hop.address
+    return str(next_hop)
+
+
+def parse_or_keep(value: Any) -> Any:
+    try:
+        return Prefix(*parse_prefix(str(value)))
+    except ValueError:
+        return value
+
+
+@lru_cache(maxsize=NEXT_HOP_CACHE)
+def shared_next_hop(value: Any) -> Any:
+    """Routes mostly point at a handful of next hops - share one Prefix per hop"""
+    return parse_or_keep(value)
@@ -0,0 +1,769 @@
+import errno
+import logging
+import os
+import shlex
+import socket
+import struct
+import sys
+from ipaddress import ip_address, ip_interface, ip_network
+from json import dumps
+from subprocess import CalledProcessError, CompletedProcess, PIPE
+from threading import Lock
+from typing import AbstractSet, Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from json2netns.backend import Backend, SubprocessBackend
+from json2netns.consts import DEFAULT_MAX_IN_FLIGHT
+from json2netns.nsenter import (
+    delete_netns,
+    enter_netns,
+    netns_path,
+    pinned_netns,
+    switch_netns,
+)
+
+
+LOG = logging.getLogger(__name__)
+
+# linux/netlink.h
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+NLMSG_HDR = struct.Struct("=LHHLL")
+NLA_HDR = struct.Struct("=HH")
+NLA_F_NESTED = 0x8000
+# linux/rtnetlink.h
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_LINK = 253
+RT_SCOPE_NOWHERE = 255
+RTN_UNICAST = 1
+# Names `ip -j route show` uses for rtm_type
+ROUTE_TYPES = {
+    1: "unicast",
+    2: "local",
+    3: "broadcast",
+    4: "anycast",
+    5: "multicast",
+    6: "blackhole",
+    7: "unreachable",
+    8: "prohibit",
+    9: "throw",
+    10: "nat",
+}
+ROUTE_TABLES = {253: "default", 254: "main", 255: "local"}
+ROUTE_PROTOCOLS = {1: "redirect", 2: "kernel", 3: "boot", 4: "static", 9: "ra"}
+SCOPES = {0: "global", 200: "site", 253: "link", 254: "host"}
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_MULTIPATH = 9
+RTA_TABLE = 15
+RTA_NH_ID = 30
+IFINFOMSG = struct.Struct("=BxHiII")
+IFADDRMSG = struct.Struct("=BBBBi")
+RTMSG = struct.Struct("=BBBBBBBBI")
+RTNEXTHOP = struct.Struct("=HBBi")
+# linux/if_link.h + linux/if_addr.h + linux/veth.h
+IFF_UP = 0x1
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFLA_IFNAME = 3
+IFLA_LINK = 5
+IFLA_LINKINFO = 18
+IFLA_NET_NS_FD = 28
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+IFLA_MACVLAN_MODE = 1
+VETH_INFO_PEER = 1
+# `ip` global options we accept without arguments
+GLOBAL_FLAGS = {"-4", "-6", "-force", "-j", "-json"}
+MACVLAN_MODES = {
+    "private": 1,
+    "vepa": 2,
+    "bridge": 4,
+    "passthru": 8,
+    "source": 16,
+}
+
+
+class NetlinkError(OSError):
+    pass
+
+
+class UnsupportedCommand(Exception):
+    """Raised for `ip` commands we don't translate to rtnetlink"""
+
+    pass
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def nla(attr_type: int, data: bytes) -> bytes:
+    """Pack a netlink attribute (TLV) padded to 4 bytes"""
+    length = NLA_HDR.size + len(data)
+    return NLA_HDR.pack(length, attr_type) + data + b"\0" * (_align(length) - length)
+
+
+def nla_nested(attr_type: int, *attrs: bytes) -> bytes:
+    return nla(attr_type | NLA_F_NESTED, b"".join(attrs))
+
+
+def nla_str(attr_type: int, value: str) -> bytes:
+    return nla(attr_type, value.encode("utf-8") + b"\0")
+
+
+def nla_u32(attr_type: int, value: int) -> bytes:
+    return nla(attr_type, struct.pack("=I", value))
+
+
+def parse_multipath(data: bytes, link_names: Dict[int, str]) -> List[Dict[str, Any]]:
+    """RTA_MULTIPATH's rtnexthops as `ip -j route` shows them"""
+    nexthops: List[Dict[str, Any]] = []
+    offset = 0
+    while offset + RTNEXTHOP.size <= len(data):
+        length, _, hops, index = RTNEXTHOP.unpack_from(data, offset)
+        if length < RTNEXTHOP.size:
+            break
+        nexthop: Dict[str, Any] = {}
+        attrs = parse_nlas(data[offset + RTNEXTHOP.size : offset + length])
+        if RTA_GATEWAY in attrs:
+            nexthop["gateway"] = str(ip_address(attrs[RTA_GATEWAY]))
+        nexthop["dev"] = link_names.get(index, str(index))
+        # The kernel stores weight - 1
+        nexthop["weight"] = hops + 1
+        nexthops.append(nexthop)
+        offset += _align(length)
+    return nexthops
+
+
+def parse_nlas(data: bytes) -> Dict[int, bytes]:
+    """Unpack a run of netlink attributes into {type: payload}"""
+    attrs: Dict[int, bytes] = {}
+    offset = 0
+    while offset + NLA_HDR.size <= len(data):
+        length, attr_type = NLA_HDR.unpack_from(data, offset)
+        if length < NLA_HDR.size:
+            break
+        attrs[attr_type & ~NLA_F_NESTED] = data[offset + NLA_HDR.size : offset + length]
+        offset += _align(length)
+    return attrs
+
+
+class NetlinkSocket:
+    """A NETLINK_ROUTE socket bound to one network namespace"""
+
+    def __init__(self, netns_name: str = "") -> None:
+        self.netns_name = netns_name
+        if netns_name:
+            # Sockets belong to the netns of the thread that opens them
+            with enter_netns(netns_name):
+                self.sock = socket.socket(
+                    socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE
+                )
+        else:
+            if pinned_netns() is not None:
+                # Pinned threads may be in another netns - go back to the original
+                switch_netns("")
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+        self.lock = Lock()
+        self.seq = 0
+
+    def close(self) -> None:
+        self.sock.close()
+
+    def request(self, msg_type: int, flags: int, payload: bytes) -> List[bytes]:
+        """Send one request + return the payload of each reply until the ack
+        - Raises NetlinkError with the kernel's errno on failure"""
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+            msg = NLMSG_HDR.pack(
+                NLMSG_HDR.size + len(payload),
+                msg_type,
+                flags | NLM_F_REQUEST | NLM_F_ACK,
+                seq,
+                0,
+            )
+            self.sock.send(msg + payload)
+
+            replies: List[bytes] = []
+            while True:
+                data = self.sock.recv(65536)
+                offset = 0
+                while offset + NLMSG_HDR.size <= len(data):
+                    length, reply_type, _, reply_seq, _ = NLMSG_HDR.unpack_from(
+                        data, offset
+                    )
+                    body = data[offset + NLMSG_HDR.size : offset + length]
+                    offset += _align(length)
+                    if reply_seq != seq:
+                        continue
+                    if reply_type == NLMSG_ERROR:
+                        (error,) = struct.unpack_from("=i", body)
+                        if error:
+                            raise NetlinkError(-error, os.strerror(-error))
+                        return replies
+                    if reply_type == NLMSG_DONE:
+                        return replies
+                    replies.append(body)
+
+    def link_index(self, name: str) -> int:
+        try:
+            replies = self.request(
+                RTM_GETLINK,
+                0,
+                IFINFOMSG.pack(0, 0, 0, 0, 0) + nla_str(IFLA_IFNAME, name),
+            )
+        except NetlinkError as ne:
+            if ne.errno == errno.ENODEV:
+                raise NetlinkError(ne.errno, f'Cannot find device "{name}"') from ne
+            raise
+        return int(IFINFOMSG.unpack_from(replies[0])[2])
+
+    def link_exists(self, name: str) -> bool:
+        try:
+            self.link_index(name)
+        except NetlinkError as ne:
+            if ne.errno == errno.ENODEV:
+                return False
+            raise
+        return True
+
+    def link_dump(self) -> List[Dict[str, Any]]:
+        """Dump links in the same shape (ifindex/ifname/flags) as `ip -j link show`
+        - UP is the only flag we report"""
+        links: List[Dict[str, Any]] = []
+        for reply in self.request(
+            RTM_GETLINK, NLM_F_DUMP, IFINFOMSG.pack(0, 0, 0, 0, 0)
+        ):
+            _, _, index, flags, _ = IFINFOMSG.unpack_from(reply)
+            attrs = parse_nlas(reply[IFINFOMSG.size :])
+            if IFLA_IFNAME not in attrs:
+                continue
+            links.append(
+                {
+                    "ifindex": index,
+                    "ifname": attrs[IFLA_IFNAME].rstrip(b"\x00").decode("utf-8"),
+                    "flags": ["UP"] if flags & IFF_UP else [],
+                }
+            )
+        return links
+
+    def link_names(self) -> Dict[int, str]:
+        return {link["ifindex"]: link["ifname"] for link in self.link_dump()}
+
+    def addr_dump(self) -> List[Dict[str, Any]]:
+        """Dump links + their addresses in the same shape as `ip -j addr show`"""
+        links = self.link_dump()
+        links_by_index = {link["ifindex"]: link for link in links}
+        for link in links:
+            link["addr_info"] = []
+        for reply in self.request(
+            RTM_GETADDR, NLM_F_DUMP, IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        ):
+            family, prefixlen, _, scope, index = IFADDRMSG.unpack_from(reply)
+            attrs = parse_nlas(reply[IFADDRMSG.size :])
+            address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+            if index not in links_by_index or address is None:
+                continue
+            links_by_index[index]["addr_info"].append(
+                {
+                    "family": "inet" if family == socket.AF_INET else "inet6",
+                    "local": str(ip_address(address)),
+                    "prefixlen": prefixlen,
+                    "scope": SCOPES.get(scope, str(scope)),
+                }
+            )
+        return links
+
+    def link_add(self, name: str, kind: str, *attrs: bytes, data: bytes = b"") -> None:
+        info = [nla_str(IFLA_INFO_KIND, kind)]
+        if data:
+            info.append(nla(IFLA_INFO_DATA | NLA_F_NESTED, data))
+        self.request(
+            RTM_NEWLINK,
+            NLM_F_CREATE | NLM_F_EXCL,
+            IFINFOMSG.pack(0, 0, 0, 0, 0)
+            + nla_str(IFLA_IFNAME, name)
+            + b"".join(attrs)
+            + nla_nested(IFLA_LINKINFO, *info),
+        )
+
+    def link_add_veth(self, name: str, peer: str) -> None:
+        peer_info = IFINFOMSG.pack(0, 0, 0, 0, 0) + nla_str(IFLA_IFNAME, peer)
+        self.link_add(name, "veth", data=nla(VETH_INFO_PEER, peer_info))
+
+    def link_add_macvlan(self, name: str, parent: str, mode: str) -> None:
+        self.link_add(
+            name,
+            "macvlan",
+            nla_u32(IFLA_LINK, self.link_index(parent)),
+            data=nla_u32(IFLA_MACVLAN_MODE, MACVLAN_MODES[mode]),
+        )
+
+    def link_del(self, name: str) -> None:
+        self.request(RTM_DELLINK, 0, IFINFOMSG.pack(0, 0, self.link_index(name), 0, 0))
+
+    def link_set_up(self, name: str) -> None:
+        self.request(
+            RTM_NEWLINK, 0, IFINFOMSG.pack(0, 0, self.link_index(name), IFF_UP, IFF_UP)
+        )
+
+    def link_set_netns(self, name: str, netns_name: str) -> None:
+        index = self.link_index(name)
+        ns_fd = os.open(str(netns_path(netns_name)), os.O_RDONLY)
+        try:
+            self.request(
+                RTM_NEWLINK,
+                0,
+                IFINFOMSG.pack(0, 0, index, 0, 0) + nla_u32(IFLA_NET_NS_FD, ns_fd),
+            )
+        finally:
+            os.close(ns_fd)
+
+    def addr_add(self, prefix: str, name: str, replace: bool = False) -> None:
+        self._addr_request(
+            RTM_NEWADDR,
+            NLM_F_CREATE | (NLM_F_REPLACE if replace else NLM_F_EXCL),
+            prefix,
+            name,
+        )
+
+    def addr_del(self, prefix: str, name: str) -> None:
+        self._addr_request(RTM_DELADDR, 0, prefix, name)
+
+    def _addr_request(self, msg_type: int, flags: int, prefix: str, name: str) -> None:
+        interface = ip_interface(prefix)
+        family = socket.AF_INET if interface.version == 4 else socket.AF_INET6
+        packed = interface.ip.packed
+        attrs = nla(IFA_ADDRESS, packed)
+        if interface.version == 4:
+            attrs += nla(IFA_LOCAL, packed)
+        self.request(
+            msg_type,
+            flags,
+            IFADDRMSG.pack(
+                family,
+                interface.network.prefixlen,
+                0,
+                RT_SCOPE_UNIVERSE,
+                self.link_index(name),
+            )
+            + attrs,
+        )
+
+    def route_dump(self, family: int, all_tables: bool = False) -> List[Dict[str, Any]]:
+        """Dump routes in the same shape (dst/gateway/dev/protocol/type/table)
+        as `ip -j route` - Only the main table unless all_tables"""
+        routes: List[Dict[str, Any]] = []
+        link_names: Optional[Dict[int, str]] = None
+        for reply in self.request(
+            RTM_GETROUTE, NLM_F_DUMP, RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0)
+        ):
+            (
+                rtm_family,
+                dst_len,
+                _,
+                _,
+                rtm_table,
+                rtm_protocol,
+                _,
+                rtm_type,
+                _,
+            ) = RTMSG.unpack_from(reply)
+            attrs = parse_nlas(reply[RTMSG.size :])
+            table = (
+                struct.unpack("=I", attrs[RTA_TABLE])[0]
+                if RTA_TABLE in attrs
+                else rtm_table
+            )
+            if rtm_family != family or (not all_tables and table != RT_TABLE_MAIN):
+                continue
+
+            route: Dict[str, Any] = {}
+            if rtm_type != RTN_UNICAST:
+                route["type"] = ROUTE_TYPES.get(rtm_type, str(rtm_type))
+            if RTA_DST in attrs:
+                dst = str(ip_address(attrs[RTA_DST]))
+                max_len = 32 if family == socket.AF_INET else 128
+                route["dst"] = dst if dst_len == max_len else f"{dst}/{dst_len}"
+            else:
+                route["dst"] = "default"
+            if RTA_NH_ID in attrs:
+                route["nhid"] = struct.unpack("=I", attrs[RTA_NH_ID])[0]
+            if RTA_GATEWAY in attrs:
+                route["gateway"] = str(ip_address(attrs[RTA_GATEWAY]))
+            if RTA_OIF in attrs or RTA_MULTIPATH in attrs:
+                if link_names is None:
+                    link_names = self.link_names()
+                if RTA_OIF in attrs:
+                    index = struct.unpack("=I", attrs[RTA_OIF])[0]
+                    route["dev"] = link_names.get(index, str(index))
+                if RTA_MULTIPATH in attrs:
+                    route["nexthops"] = parse_multipath(
+                        attrs[RTA_MULTIPATH], link_names
+                    )
+            route["protocol"] = ROUTE_PROTOCOLS.get(rtm_protocol, str(rtm_protocol))
+            if table != RT_TABLE_MAIN:
+                route["table"] = ROUTE_TABLES.get(table, str(table))
+            routes.append(route)
+        return routes
+
+    def route_add(
+        self,
+        dest_prefix: str,
+        via: str = "",
+        dev: str = "",
+        replace: bool = False,
+        nhid: int = 0,
+    ) -> None:
+        """nhid points the route at a nexthop object instead of via / dev"""
+        dest = ip_network(dest_prefix)
+        family = socket.AF_INET if dest.version == 4 else socket.AF_INET6
+        attrs = nla(RTA_DST, dest.network_address.packed)
+        attrs += nla_u32(RTA_TABLE, RT_TABLE_MAIN)
+        if nhid:
+            attrs += nla_u32(RTA_NH_ID, nhid)
+        if via:
+            attrs += nla(RTA_GATEWAY, ip_interface(via).ip.packed)
+        if dev:
+            attrs += nla_u32(RTA_OIF, self.link_index(dev))
+        self.request(
+            RTM_NEWROUTE,
+            NLM_F_CREATE | (NLM_F_REPLACE if replace else NLM_F_EXCL),
+            RTMSG.pack(
+                family,
+                dest.prefixlen,
+                0,
+                0,
+                RT_TABLE_MAIN,
+                RTPROT_BOOT,
+                RT_SCOPE_UNIVERSE if via or nhid else RT_SCOPE_LINK,
+                RTN_UNICAST,
+                0,
+            )
+            + attrs,
+        )
+
+    def route_del(self, dest_prefix: str) -> None:
+        dest = ip_network(dest_prefix)
+        family = socket.AF_INET if dest.version == 4 else socket.AF_INET6
+        self.request(
+            RTM_DELROUTE,
+            0,
+            RTMSG.pack(
+                family,
+                dest.prefixlen,
+                0,
+                0,
+                RT_TABLE_MAIN,
+                0,
+                RT_SCOPE_NOWHERE,
+                0,
+                0,
+            )
+            + nla(RTA_DST, dest.network_address.packed)
+            + nla_u32(RTA_TABLE, RT_TABLE_MAIN),
+        )
+
+
+class NetlinkBackend(Backend):
+    """Translate the `ip` commands we generate into rtnetlink requests
+    - One socket per netns, opened on first use and reused
+    - Anything we don't translate is ran by the SubprocessBackend"""
+
+    name = "netlink"
+
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> None:
+        super().__init__(max_in_flight)
+        self.fallback = SubprocessBackend(max_in_flight)
+        self.sockets: Dict[str, NetlinkSocket] = {}
+        self.sockets_lock = Lock()
+
+    def close(self) -> None:
+        with self.sockets_lock:
+            for nl_sock in self.sockets.values():
+                nl_sock.close()
+            self.sockets = {}
+
+    def socket(self, netns_name: str = "") -> NetlinkSocket:
+        with self.sockets_lock:
+            if netns_name not in self.sockets:
+                self.sockets[netns_name] = NetlinkSocket(netns_name)
+            return self.sockets[netns_name]
+
+    def forget(self, netns_name: str) -> None:
+        """Drop a netns socket (e.g. when the netns is deleted)"""
+        with self.sockets_lock:
+            nl_sock = self.sockets.pop(netns_name, None)
+        if nl_sock:
+            nl_sock.close()
+
+    def _parse_global_opts(
+        self, args: Sequence[str], netns_name: str
+    ) -> Tuple[List[str], str, Set[str]]:
+        """Strip the `ip` global options we understand
+        - returns (args, netns_name, set of flag options)"""
+        remaining = list(args)
+        opts: Set[str] = set()
+        while remaining and remaining[0].startswith("-"):
+            opt = remaining.pop(0)
+            if opt == "-n" and remaining:
+                netns_name = remaining.pop(0)
+            elif opt == "-batch" and remaining and remaining[0] == "-":
+                remaining.pop(0)
+                opts.add(opt)
+            elif opt in GLOBAL_FLAGS:
+                opts.add(opt)
+            else:
+                raise UnsupportedCommand(f"ip global option {opt}")
+        return remaining, netns_name, opts
+
+    def execute(
+        self,
+        args: Sequence[str],
+        netns_name: str = "",
+        opts: AbstractSet[str] = frozenset(),
+    ) -> str:
+        """Run one `ip` command (without the ip binary) via netlink
+        - Returns stdout text - raises NetlinkError on failure"""
+        if len(args) < 2:
+            raise UnsupportedCommand(" ".join(args))
+
+        obj, verb, rest = args[0], args[1], list(args[2:])
+        if obj == "netns" and verb in {"del", "delete"} and len(rest) == 1:
+            # Our socket in the netns would keep it alive
+            self.forget(rest[0])
+            try:
+                delete_netns(rest[0])
+            except OSError as oe:
+                raise NetlinkError(
+                    oe.errno,
+                    f'Cannot remove namespace file "{netns_path(rest[0])}": '
+                    + str(oe.strerror),
+                ) from oe
+            return ""
+        if (
+            obj == "route"
+            and verb in {"show", "list"}
+            and rest in ([], ["table", "all"])
+            and "-j" in opts
+        ):
+            family = socket.AF_INET6 if "-6" in opts else socket.AF_INET
+            routes = self.socket(netns_name).route_dump(family, all_tables=bool(rest))
+            return dumps(routes) + "\n"
+        if verb in {"show", "list"} and not rest and "-j" in opts:
+            if obj == "link":
+                return dumps(self.socket(netns_name).link_dump()) + "\n"
+            if obj in {"addr", "address"}:
+                return dumps(self.socket(netns_name).addr_dump()) + "\n"
+        if obj == "link" and verb == "add":
+            if rest[1:3] == ["type", "veth"] and len(rest) in (5, 6):
+                self.socket(netns_name).link_add_veth(rest[0], rest[-1])
+                return ""
+            if (
+                len(rest) == 7
+                and rest[1] == "link"
+                and rest[3:5] == ["type", "macvlan"]
+                and rest[5] == "mode"
+            ):
+                self.socket(netns_name).link_add_macvlan(rest[0], rest[2], rest[6])
+                return ""
+        elif obj == "link" and verb in {"del", "delete"} and len(rest) in (1, 2):
+            self.socket(netns_name).link_del(rest[-1])
+            return ""
+        elif (
+            obj == "link" and verb == "show" and rest[:1] == ["dev"] and len(rest) == 2
+        ):
+            nl_sock = self.socket(netns_name)
+            return f"{nl_sock.link_index(rest[1])}: {rest[1]}\n"
+        elif obj == "link" and verb == "set":
+            if rest in (["up", "dev", rest[-1]], ["dev", rest[-1], "up"]):
+                self.socket(netns_name).link_set_up(rest[-1])
+                return ""
+            if len(rest) == 3 and rest[1] == "netns":
+                self.socket(netns_name).link_set_netns(rest[0], rest[2])
+                return ""
+        elif (
+            obj in {"addr", "address"}
+            and verb in {"add", "replace"}
+            and len(rest) == 3
+            and rest[1] == "dev"
+        ):
+            self.socket(netns_name).addr_add(
+                rest[0], rest[2], replace=verb == "replace"
+            )
+            return ""
+        elif (
+            obj in {"addr", "address"}
+            and verb in {"del", "delete"}
+            and len(rest) == 3
+            and rest[1] == "dev"
+        ):
+            self.socket(netns_name).addr_del(rest[0], rest[2])
+            return ""
+        elif obj == "route" and verb in {"del", "delete"} and len(rest) == 1:
+            self.socket(netns_name).route_del(rest[0])
+            return ""
+        elif obj == "route" and verb in {"add", "replace"} and len(rest) % 2:
+            route_opts = dict(zip(rest[1::2], rest[2::2]))
+            if set(route_opts) <= {"via", "dev"}:
+                self.socket(netns_name).route_add(
+                    rest[0],
+                    route_opts.get("via", ""),
+                    route_opts.get("dev", ""),
+                    replace=verb == "replace",
+                )
+                return ""
+            if set(route_opts) == {"nhid"} and route_opts["nhid"].isdigit():
+                self.socket(netns_name).route_add(
+                    rest[0], replace=verb == "replace", nhid=int(route_opts["nhid"])
+                )
+                return ""
+        raise UnsupportedCommand(" ".join(args))
+
+    def _run_batch(
+        self, lines: str, netns_name: str, opts: AbstractSet[str]
+    ) -> Tuple[int, str, str]:
+        """Emulate `ip -batch -` output so Batch can parse our failures"""
+        stdout: List[str] = []
+        stderr: List[str] = []
+        returncode = 0
+        for line_number, line in enumerate(lines.splitlines(), 1):
+            args = shlex.split(line, comments=True)
+            if not args:
+                continue
+            try:
+                stdout.append(self.execute(args, netns_name, opts))
+            except UnsupportedCommand:
+                cp = self.fallback.run(
+                    [self.IP] + args, netns_name, stdout=PIPE, stderr=PIPE
+                )
+                stdout.append(cp.stdout.decode("utf-8"))
+                if cp.returncode:
+                    stderr.append(cp.stderr.decode("utf-8").strip())
+                    stderr.append(f"Command failed -:{line_number}")
+                    returncode = 1
+            except (NetlinkError, ValueError, KeyError) as err:
+                stderr.append(self._error_message(err))
+                stderr.append(f"Command failed -:{line_number}")
+                returncode = 1
+            if returncode and "-force" not in opts:
+                break
+        return returncode, "".join(stdout), "\n".join(stderr) + "\n" if stderr else ""
+
+    def _error_message(self, err: Exception) -> str:
+        if isinstance(err, NetlinkError):
+            if str(err.strerror).startswith("Cannot "):
+                return str(err.strerror)
+            return f"RTNETLINK answers: {err.strerror}"
+        return f"Error: {err}"
+
+    def run(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        cp = self._run_netlink(cmd, netns_name, kwargs)
+        if cp is None:
+            cp = self.fallback.run(cmd, netns_name, **kwargs)
+            self._fallback_ran(cmd)
+        return cp
+
+    async def run_async(
+        self, cmd: Sequence[str], netns_name: str = "", **kwargs: Any
+    ) -> CompletedProcess:
+        """Netlink requests are quick syscalls so are made inline
+        - Fallback commands are asyncio subprocesses"""
+        cp = self._run_netlink(cmd, netns_name, kwargs)
+        if cp is None:
+            cp = await self.fallback.run_async(cmd, netns_name, **kwargs)
+            self._fallback_ran(cmd)
+        return cp
+
+    def _fallback_ran(self, cmd: Sequence[str]) -> None:
+        if list(cmd[1:3]) in (["netns", "del"], ["netns", "delete"]):
+            self.forget(cmd[3])
+
+    def _run_netlink(
+        self, cmd: Sequence[str], netns_name: str, kwargs: Dict[str, Any]
+    ) -> Optional[CompletedProcess]:
+        """Run cmd via netlink - None if we need to fall back to subprocess"""
+        if not cmd or os.path.basename(cmd[0]) != "ip":
+            return None
+
+        try:
+            args, target_netns, opts = self._parse_global_opts(cmd[1:], netns_name)
+            if "-batch" in opts:
+                input_text = kwargs.get("input") or ""
+                if isinstance(input_text, bytes):
+                    input_text = input_text.decode("utf-8")
+                returncode, stdout, stderr = self._run_batch(
+                    input_text, target_netns, opts
+                )
+            else:
+                try:
+                    stdout, stderr, returncode = (
+                        self.execute(args, target_netns, opts),
+                        "",
+                        0,
+                    )
+                except (NetlinkError, ValueError, KeyError) as err:
+                    stdout, stderr, returncode = "", self._error_message(err) + "\n", 1
+        except UnsupportedCommand as uc:
+            LOG.debug(f"netlink backend falling back to subprocess for: {uc}")
+            return None
+
+        LOG.debug(
+            f"netlink ran '{' '.join(cmd)}' in "
+            + f"{target_netns if target_netns else 'default'} namespace "
+            + f"(returned {returncode})"
+        )
+        return self._completed_process(cmd, returncode, stdout, stderr, kwargs)
+
+    def _completed_process(
+        self,
+        cmd: Sequence[str],
+        returncode: int,
+        stdout: str,
+        stderr: str,
+        kwargs: Dict[str, Any],
+    ) -> CompletedProcess:
+        """Hand back output like subprocess.run() would for the same kwargs"""
+        text = bool(
+            kwargs.get("encoding")
+            or kwargs.get("text")
+            or kwargs.get("universal_newlines")
+        )
+        outputs: List[Optional[Any]] = []
+        for output, target, stream in (
+            (stdout, kwargs.get("stdout"), sys.stdout),
+            (stderr, kwargs.get("stderr"), sys.stderr),
+        ):
+            if target == PIPE:
+                outputs.append(output if text else output.encode("utf-8"))
+                continue
+            if target is None and output:
+                stream.write(output)
+            outputs.append(None)
+
+        if kwargs.get("check") and returncode:
+            raise CalledProcessError(returncode, cmd, outputs[0], outputs[1])
+        return CompletedProcess(cmd, returncode, outputs[0], outputs[1])
@@ -1,54 +1,172 @@
 import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import partial
+from hashlib import sha256
 from ipaddress import ip_interface, ip_network
-from pathlib import Path
-from subprocess import CompletedProcess, DEVNULL, run
-from typing import Dict, List, Optional, Sequence
+from json import dumps, loads
+from subprocess import CalledProcessError, CompletedProcess, DEVNULL, PIPE
+from threading import Lock
+from time import monotonic
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
-from json2netns.consts import DEFAULT_IP, IPInterface
+from json2netns.backend import get_backend
+from json2netns.batch import Batch, BatchFailure, log_failures
+from json2netns.consts import DEFAULT_IP, DEFAULT_NAMESPACE_CACHE, IPInterface
 from json2netns.interfaces import Interface, Loopback, MacVlan, Veth
-from json2netns.route import Route
+from json2netns.inventory import get_inventory
+from json2netns.metrics import count, NAMESPACES, NEXTHOPS, ROUTES
+from json2netns.model import intern_name, Prefix, RouteEntry
+from json2netns.nsenter import netns_path
+from json2netns.route import MultipathRoute, Nexthop, NexthopRoute, Route, RouteTable
+from json2netns.routefeed import FeedStats, file_version, RouteFeed
+from json2netns.scheduler import TaskGraph
+from json2netns.trace import traced
 
 
 LOG = logging.getLogger(__name__)
+# check_commands header -> key in the JSON check output
+CHECK_JSON_KEYS = {
+    "## Addresses": "addresses",
+    "## Routes (v4)": "routes_v4",
+    "## Routes (v6)": "routes_v6",
+}
+
+
+@dataclass
+class CheckResult:
+    """Output of a namespace's check commands - ip -j JSON if json_output
+    - Errors (e.g. missing netns) are kept out of the output for logging"""
+
+    name: str
+    json_output: bool = False
+    outputs: Dict[str, str] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    seconds: float = 0.0
+
+    def render(self) -> str:
+        lines = [f"# Checking {self.name}"]
+        for header, output in self.outputs.items():
+            lines.append(header)
+            if output.strip():
+                lines.append(output.rstrip("\n"))
+        return "\n".join(lines)
+
+    def to_dict(self) -> Dict[str, Any]:
+        ns_dict: Dict[str, Any] = {"seconds": round(self.seconds, 6)}
+        for header, output in self.outputs.items():
+            ns_dict[CHECK_JSON_KEYS[header]] = (
+                loads(output) if self.json_output and output.strip() else output
+            )
+        if self.errors:
+            ns_dict["errors"] = {
+                CHECK_JSON_KEYS[header]: error for header, error in self.errors.items()
+            }
+        return ns_dict
 
 
 class Namespace:
     IP = DEFAULT_IP
+    trace_arg = "namespace"
     check_commands = {
         "## Addresses": (IP, "addr", "show"),
         "## Routes (v4)": (IP, "route", "show"),
         "## Routes (v6)": (IP, "-6", "route", "show"),
     }
 
+    # Slotted + no references to the config dicts so 10ks of namespaces stay small
+    __slots__ = (
+        "name",
+        "ns_path",
+        "id",
+        "interfaces",
+        "nexthops",
+        "routes",
+        "route_files",
+        "oob",
+        "oob_prefixes",
+        "physical_int",
+    )
+
     def __init__(self, name: str, ns_config: Dict, config: Dict) -> None:
-        self.name = name
-        self.ns_path = Path(f"/run/netns/{self.name}")
-        self.config = config
+        self.name = intern_name(name)
+        self.ns_path = netns_path(self.name)
         if ns_config["id"] < 1:
             # The global oob and other resources will always be 0
             raise ValueError("A namespace ID must be > 0")
-        self.id = ns_config["id"]
-        self.interfaces = self._create_interface_objects()
-        self.routes = ns_config["routes"]
+        self.id: int = ns_config["id"]
+        self.physical_int = intern_name(config.get("physical_int", ""))
+        self.interfaces = self._create_interface_objects(ns_config["interfaces"])
+        self.nexthops = self._create_nexthop_objects(ns_config.get("nexthops", {}))
+        self.routes = tuple(
+            RouteEntry(
+                route_name,
+                attributes["dest_prefix"],
+                attributes.get("next_hop_ip", ""),
+                attributes.get("egress_if_name", ""),
+                attributes.get("multipath", ()),
+                attributes.get("nexthop", ""),
+            )
+            for route_name, attributes in ns_config["routes"].items()
+        )
+        # Big route dumps streamed in by route_files_add()
+        self.route_files: Tuple[str, ...] = tuple(
+            str(route_file) for route_file in ns_config.get("route_files", ())
+        )
 
-        self.oob = ns_config["oob"]
-        self.oob_prefixes = None
+        self.oob: bool = ns_config["oob"]
+        self.oob_prefixes: Tuple[Prefix, ...] = ()
         if self.oob:
-            self.oob_prefixes = [
-                ip_network(prefix) for prefix in config["oob"]["prefixes"]
-            ]
+            self.oob_prefixes = tuple(
+                self._oob_network(prefix) for prefix in config["oob"]["prefixes"]
+            )
 
-    def _create_interface_objects(self) -> Dict[str, Interface]:
+    def _create_nexthop_objects(self, nexthops: Dict) -> Tuple[Nexthop, ...]:
+        """Gateway nexthops first as groups can only use existing nexthops"""
+        nhids = {nh_name: attributes["id"] for nh_name, attributes in nexthops.items()}
+        nexthop_objs = [
+            Nexthop(
+                intern_name(nh_name),
+                self.name,
+                attributes["id"],
+                attributes.get("next_hop_ip", ""),
+                intern_name(attributes.get("egress_if_name", "")),
+                tuple(
+                    (nhids.get(member, 0), weight)
+                    for member, weight in attributes.get("group", {}).items()
+                ),
+            )
+            for nh_name, attributes in nexthops.items()
+        ]
+        return tuple(sorted(nexthop_objs, key=lambda nexthop: bool(nexthop.group)))
+
+    @staticmethod
+    def _oob_network(prefix: str) -> Prefix:
+        network = Prefix.parse(prefix)
+        if network.range()[0] != network.addr:
+            raise ValueError(f"{prefix} has host bits set")
+        return network
+
+    def _create_interface_objects(self, int_configs: Dict) -> Dict[str, Interface]:
         """Read namespace interfaces out of config and create Interface objects"""
         interfaces: Dict[str, Interface] = {}
-        for name, int_conf in self.config["namespaces"][self.name][
-            "interfaces"
-        ].items():
+        for name, int_conf in int_configs.items():
             if int_conf["type"].lower() in {"lo", "loopback"}:
                 interfaces["lo"] = Loopback(int_conf["prefixes"])
             elif int_conf["type"].lower() == "macvlan":
                 interfaces[name] = MacVlan(
-                    name, self.config["physical_int"], int_conf["prefixes"]
+                    name, self.physical_int, int_conf["prefixes"]
                 )
             elif int_conf["type"].lower() == "veth":
                 interfaces[name] = Veth(
@@ -69,62 +187,279 @@ class Namespace:
         self, delete: bool, check: bool = True
     ) -> Optional[CompletedProcess]:
         """Create or delete the entire netns"""
+        if not self._needs_create_or_delete(delete):
+            return None
+
+        op = "Delete" if delete else "Add"
+        d = "d" if delete else "ed"
+        cp = get_backend().run(
+            (f"{self.IP}", "netns", op.lower(), self.name), check=check
+        )
+        LOG.info(f"{op}{d} {self.name} namespace")
+        if cp.returncode == 0:
+            count(NAMESPACES, result="deleted" if delete else "created")
+        return cp
+
+    def _needs_create_or_delete(self, delete: bool) -> bool:
         if not delete and self.ns_path.exists():
             LOG.info(f"{self.name} namespace already exists ...")
-            return None
         elif delete and not self.ns_path.exists():
             LOG.info(f"{self.name} namespace does not exist ...")
+        else:
+            return True
+        count(NAMESPACES, result="skipped")
+        return False
+
+    async def _create_or_delete_async(
+        self, delete: bool, check: bool = True
+    ) -> Optional[CompletedProcess]:
+        if not self._needs_create_or_delete(delete):
             return None
 
-        op = "Delete" if delete else "Add"
-        d = "d" if delete else "ed"
-        cp = run((f"{self.IP}", "netns", op.lower(), self.name), check=check)
-        LOG.info(f"{op}{d} {self.name} namespace")
+        op = "delete" if delete else "add"
+        cp = await get_backend().run_async(
+            [self.IP, "netns", op, self.name], check=check
+        )
+        LOG.info(f"{op.title()}{'d' if delete else 'ed'} {self.name} namespace")
+        if cp.returncode == 0:
+            count(NAMESPACES, result="deleted" if delete else "created")
         return cp
 
     def check(self) -> None:
+        print(self.check_result().render(), flush=True)
+
+    @traced
+    def check_result(self, json_output: bool = False) -> CheckResult:
+        """Capture the check commands output - errors are recorded, not raised"""
+        result = CheckResult(self.name, json_output)
+        start = monotonic()
         for header, cmd in self.check_commands.items():
-            print(header, flush=True)
-            self.exec_in_ns(cmd, check=False)
+            if json_output:
+                cmd = (cmd[0], "-j", *cmd[1:])
+            cp = get_backend().run(
+                cmd,
+                self.name,
+                check=False,
+                stdout=PIPE,
+                stderr=PIPE,
+                encoding="utf-8",
+            )
+            result.outputs[header] = cp.stdout if cp.stdout else ""
+            if cp.returncode:
+                result.errors[header] = cp.stderr.strip() if cp.stderr else ""
+        result.seconds = monotonic() - start
+        return result
 
+    @traced
     def create(self, delete: bool = False) -> None:
         self._create_or_delete(delete=False)
 
+    @traced
+    async def create_async(self) -> None:
+        await self._create_or_delete_async(delete=False)
+
+    @traced
     def delete(self) -> None:
         self._create_or_delete(delete=True)
+        self._forget_links()
 
-    def create_oob(self) -> None:
-        """If configured, add a OOB device to connect to global namespace
-        + bridge with a physical interface"""
+    @traced
+    async def delete_async(self) -> None:
+        await self._create_or_delete_async(delete=True)
+        self._forget_links()
+
+    def _forget_links(self) -> None:
+        inventory = get_inventory()
+        if inventory:
+            inventory.forget(self.name)
+
+    def oob_interface(self) -> Optional[MacVlan]:
+        """Build the OOB macvlan interface object if configured"""
         if not self.oob:
             LOG.debug(f"No oob configred for {self.name}")
-            return
+            return None
 
-        physical_int = (
-            self.config["physical_int"] if "physical_int" in self.config else ""
-        )
-        if not physical_int:
+        if not self.physical_int:
             raise ValueError(
                 f"No Physical int to bridge macvlan OOB interface with for {self.name}"
             )
         oob_prefixes = self.oob_addrs()
-        oob_int = MacVlan(f"oob{self.id}", physical_int, oob_prefixes)
+        return MacVlan(f"oob{self.id}", self.physical_int, oob_prefixes)
+
+    def route_objects(self) -> List[Route]:
+        nhids = {nexthop.name: nexthop.id for nexthop in self.nexthops}
+        route_objs: List[Route] = []
+        for route in self.routes:
+            if route.nexthop:
+                route_objs.append(
+                    NexthopRoute(
+                        route.name,
+                        self.name,
+                        route.dest_prefix,
+                        "",
+                        "",
+                        route.nexthop,
+                        nhids.get(route.nexthop, 0),
+                    )
+                )
+            elif route.multipath:
+                route_objs.append(
+                    MultipathRoute(
+                        route.name, self.name, route.dest_prefix, "", "", route.hops
+                    )
+                )
+            else:
+                route_objs.append(
+                    Route(
+                        route.name,
+                        self.name,
+                        route.dest_prefix,
+                        route.next_hop_ip,
+                        route.egress_if_name,
+                    )
+                )
+        return route_objs
+
+    def batch_create(self, batch: Batch, created: Set[str]) -> None:
+        """Add the default netns commands for this namespace to batch
+        - netns creation, link creation + moving links into the netns
+        - created tracks link names already added to the batch (e.g. veth peers)"""
+        if not self.ns_path.exists():
+            batch.add(
+                ["netns", "add", self.name],
+                f"add {self.name} namespace",
+                exists_ok=True,
+            )
+            count(NAMESPACES, result="created")
+        else:
+            count(NAMESPACES, result="skipped")
+
+        inventory = get_inventory()
+        for int_obj in self.interfaces.values():
+            if isinstance(int_obj, Loopback):
+                continue
+
+            if inventory and int_obj.exists(self.name):
+                LOG.debug(f"{int_obj.name} already in {self.name} namespace")
+                continue
+
+            if int_obj.name in created or (inventory and int_obj.exists()):
+                # Other end of a veth pair we've already created - just move it
+                int_obj.batch_set_netns(batch, self.name)
+                continue
+
+            int_obj.batch_create(batch, self.name)
+            created.add(int_obj.name)
+            if isinstance(int_obj, Veth):
+                created.add(int_obj.peer)
+
+        oob_int = self.oob_interface()
+        if oob_int and not (inventory and oob_int.exists(self.name)):
+            oob_int.batch_create(batch, self.name)
+
+    def batch_setup(self) -> Batch:
+        """Compile all commands ran inside the netns into one Batch
+        - Expects batch_create()'s commands to have already ran"""
+        batch = Batch(self.name)
+        for int_obj in self.interfaces.values():
+            int_obj.batch_configure(batch)
+
+        oob_int = self.oob_interface()
+        if oob_int:
+            oob_int.batch_configure(batch)
+
+        for route_obj in self.route_objects():
+            if isinstance(route_obj, NexthopRoute):
+                continue
+            cmd = route_obj.get_route(check_exists=False)
+            if cmd:
+                # replace like route_add() so re-runs repoint changed routes
+                batch.add(
+                    ["route", "replace"] + cmd[3:],
+                    f"route {route_obj.name} to {route_obj.dest_prefix}",
+                )
+                count(ROUTES, result="installed")
+        return batch
+
+    def batch_nexthops(self) -> Batch:
+        """The nexthops + routes using them as one Batch
+        - Every netns's batch_setup() needs to have ran so veth peers are up"""
+        batch = Batch(self.name)
+        for nexthop in self.nexthops:
+            batch.add(nexthop.replace_args(), f"nexthop {nexthop.name}")
+            count(NEXTHOPS, result="installed")
+
+        for route_obj in self.route_objects():
+            if not isinstance(route_obj, NexthopRoute):
+                continue
+            cmd = route_obj.get_route(check_exists=False)
+            if cmd:
+                # replace like route_add() so re-runs repoint changed routes
+                batch.add(
+                    ["route", "replace"] + cmd[3:],
+                    f"route {route_obj.name} to {route_obj.dest_prefix}",
+                )
+                count(ROUTES, result="installed")
+        return batch
+
+    @traced
+    def create_oob(self) -> None:
+        """If configured, add a OOB device to connect to global namespace
+        + bridge with a physical interface"""
+        oob_int = self.oob_interface()
+        if not oob_int:
+            return
+
+        inventory = get_inventory()
+        if inventory and oob_int.exists(self.name):
+            LOG.info(f"{oob_int.name} already in {self.name} namespace. Not creating")
+            return
+
         oob_int.create()
         oob_int.set_netns(self.name)
         oob_int.add_prefixes(self.name)
         oob_int.set_link_up(self.name)
 
+    @traced
+    async def create_oob_async(self) -> None:
+        oob_int = self.oob_interface()
+        if not oob_int:
+            return
+
+        if get_inventory() and await oob_int.exists_async(self.name):
+            LOG.info(f"{oob_int.name} already in {self.name} namespace. Not creating")
+            return
+
+        await oob_int.create_async()
+        await oob_int.set_netns_async(self.name)
+        await oob_int.add_prefixes_async(self.name)
+        await oob_int.set_link_up_async(self.name)
+
     def exec_in_ns(
         self, cmd: Sequence[str], check: bool = True, output: bool = True
     ) -> CompletedProcess:
         """Run command from inside the netns"""
         output_fd = None if output else DEVNULL
-        ns_cmd = [self.IP, "netns", "exec", self.name]
-        ns_cmd.extend(cmd)
-        LOG.debug(f"Running '{' '.join(ns_cmd)}' in {self.name} namespace")
-        cp = run(ns_cmd, check=check, stdout=output_fd, stderr=output_fd)
+        LOG.debug(f"Running '{' '.join(cmd)}' in {self.name} namespace")
+        cp = get_backend().run(
+            cmd, self.name, check=check, stdout=output_fd, stderr=output_fd
+        )
+        LOG.debug(
+            f"Finished running '{' '.join(cmd)}' {self.name} namespace "
+            + f"(returned {cp.returncode})"
+        )
+        return cp
+
+    async def exec_in_ns_async(
+        self, cmd: Sequence[str], check: bool = True, output: bool = True
+    ) -> CompletedProcess:
+        """Coroutine exec_in_ns() - no thread per command"""
+        output_fd = None if output else DEVNULL
+        cp = await get_backend().run_async(
+            cmd, self.name, check=check, stdout=output_fd, stderr=output_fd
+        )
         LOG.debug(
-            f"Finished running '{' '.join(ns_cmd)}' {self.name} namespace "
+            f"Finished running '{' '.join(cmd)}' {self.name} namespace "
             + f"(returned {cp.returncode})"
         )
         return cp
@@ -137,50 +472,200 @@ class Namespace:
             LOG.error(f"No oob prefiex to apply to {self.name}")
             return []
 
-        interfaces = []
-        for oob_net in self.oob_prefixes:
-            interfaces.append(
-                ip_interface(
-                    f"{str(oob_net.network_address + self.id)}/{int(oob_net.prefixlen)}"
+        return [
+            Prefix(
+                oob_net.version, oob_net.addr + self.id, oob_net.prefixlen
+            ).interface()
+            for oob_net in self.oob_prefixes
+        ]
+
+    def _nexthop_added(self, nexthop: Nexthop, returncode: int) -> int:
+        """Returns 1 if the nexthop failed to install"""
+        if returncode == 0:
+            count(NEXTHOPS, result="installed")
+            LOG.info(f"Installed nexthop {nexthop.name} into {self.name} namespace")
+            return 0
+
+        count(NEXTHOPS, result="failed")
+        LOG.error(
+            f"Nexthop {nexthop.name} was not installed into {self.name} namespace"
+        )
+        return 1
+
+    def nexthop_add(self) -> int:
+        """Replace every nexthop object - repoints any routes already using them
+        - Returns how many failed"""
+        failed = 0
+        for nexthop in self.nexthops:
+            cp = self.exec_in_ns([self.IP] + nexthop.replace_args(), check=False)
+            failed += self._nexthop_added(nexthop, cp.returncode)
+        return failed
+
+    async def nexthop_add_async(self) -> int:
+        """Coroutine nexthop_add() - the gateways then the groups concurrently"""
+        import asyncio
+
+        failed = 0
+        for is_group in (False, True):
+            nexthops = [nh for nh in self.nexthops if bool(nh.group) == is_group]
+            cps = await asyncio.gather(
+                *[
+                    self.exec_in_ns_async(
+                        [self.IP] + nexthop.replace_args(), check=False
+                    )
+                    for nexthop in nexthops
+                ]
+            )
+            for nexthop, cp in zip(nexthops, cps):
+                failed += self._nexthop_added(nexthop, cp.returncode)
+        return failed
+
+    def batch_routes(self, route_table: RouteTable) -> Tuple[Batch, Set[int], int]:
+        """`route replace` every route missing from or different in route_table
+        - Returns the Batch, its line numbers replacing a kernel route + how many
+          routes are already as configured"""
+        batch = Batch(self.name)
+        replaced: Set[int] = set()
+        unchanged = 0
+        for route_obj in self.route_objects():
+            # One bad route should not stop the rest being installed
+            try:
+                cmd = route_obj.get_route(check_exists=False)
+                if not cmd:
+                    continue
+
+                route_state = route_table.routes.get(
+                    ip_network(route_obj.dest_prefix, strict=False)
+                )
+                is_changed = route_state is not None and route_obj.changed(
+                    route_state
                 )
+            except ValueError as ve:
+                LOG.error(
+                    f"Route {route_obj.name} in {self.name} namespace is invalid: {ve}"
+                )
+                count(ROUTES, result="invalid")
+                continue
+
+            if route_state is not None:
+                if not is_changed:
+                    unchanged += 1
+                    continue
+                replaced.add(len(batch) + 1)
+            batch.add(
+                ["route", "replace"] + cmd[3:],
+                f"route {route_obj.name} to {route_obj.dest_prefix}",
             )
+        return batch, replaced, unchanged
 
-        return interfaces
+    def _routes_added(
+        self,
+        batch: Batch,
+        replaced: Set[int],
+        unchanged: int,
+        failures: List[BatchFailure],
+    ) -> int:
+        """Count + log the routes batch results - returns how many failed"""
+        log_failures(failures, self.name)
+        failed = {failure.line for failure in failures}
+        replaced_count = len(replaced - failed)
+        added_count = len(batch) - len(failed) - replaced_count
+        count(ROUTES, added_count, result="installed")
+        count(ROUTES, replaced_count, result="replaced")
+        count(ROUTES, unchanged, result="unchanged")
+        count(ROUTES, len(failed), result="failed")
+        LOG.info(
+            f"{self.name} namespace routes: {added_count} added, {replaced_count} "
+            + f"replaced, {unchanged} unchanged, {len(failed)} failed"
+        )
+        return len(failed)
 
-    def route_add(self) -> None:
-        for route_name, attributes in self.routes.items():
-            # Initialize route obj
-            route_obj = Route(
-                route_name,
-                self.name,
-                attributes["dest_prefix"],
-                attributes["next_hop_ip"],
-                attributes["egress_if_name"],
+    def _check_routes(self, failed: int, feed_stats: Optional[FeedStats]) -> None:
+        """Fail the routes task (so the journal leaves this namespace out + the
+        next create retries it) if any nexthop or route did not go in"""
+        if feed_stats:
+            failed += feed_stats.failed
+        if failed:
+            raise CalledProcessError(
+                1,
+                Batch(self.name).cmd(),
+                stderr=f"{failed} nexthops / routes failed in {self.name} namespace",
             )
-            # Send route to return formatted command list
-            cmd = route_obj.get_route()
-            if cmd != []:
-                rc = self.exec_in_ns(cmd).returncode
-                if rc == 0:
-                    LOG.info(
-                        f"Installed route {route_obj.dest_prefix} into {route_obj.netns_name} namespace"
-                    )
-                else:
-                    # Debug if you see this; the route should be valid by this point
-                    LOG.error(
-                        f"Route {route_obj.dest_prefix} was not installed into {route_obj.netns_name} namespace, plese check logs"
-                    )
 
-    def setup_links(self) -> None:
-        """Create virtual network device and assign to the netns"""
+    @traced
+    def route_files_add(self) -> Optional[FeedStats]:
+        """Stream the route_files routes in - chunks of `ip -batch` route replaces"""
+        if not self.route_files:
+            return None
+        return RouteFeed(self.name, self.route_files).install()
+
+    @traced
+    async def route_files_add_async(self) -> Optional[FeedStats]:
+        if not self.route_files:
+            return None
+        return await RouteFeed(self.name, self.route_files).install_async()
+
+    @traced
+    def route_add(self) -> None:
+        """Install every route with one `ip -batch` of `route replace`s
+        - One route table dump per address family spots the routes already there
+          + the ones going somewhere else, so re-runs converge"""
+        # Routes can only point at nexthops that exist
+        failed = self.nexthop_add()
+        batch, replaced, unchanged = self.batch_routes(RouteTable.load(self.name))
+        failed += self._routes_added(batch, replaced, unchanged, batch.run())
+        self._check_routes(failed, self.route_files_add())
+
+    @traced
+    async def route_add_async(self) -> None:
+        """Coroutine route_add()"""
+        failed = await self.nexthop_add_async()
+        route_table = await RouteTable.load_async(self.name)
+        batch, replaced, unchanged = self.batch_routes(route_table)
+        failed += self._routes_added(
+            batch, replaced, unchanged, await batch.run_async()
+        )
+        self._check_routes(failed, await self.route_files_add_async())
+
+    @traced
+    def setup_links(self, skip_veths: bool = False) -> None:
+        """Create virtual network device and assign to the netns
+        - skip_veths: veth pairs are created + moved by setup_veth_pair()"""
+        inventory = get_inventory()
         for _int_name, int_obj in self.interfaces.items():
-            if not int_obj.exists():
-                int_obj.create()
+            if skip_veths and isinstance(int_obj, Veth):
+                pass
+            # A LinkInventory makes spotting links already in the netns cheap
+            elif not (inventory and int_obj.exists(self.name)):
+                if not int_obj.exists():
+                    int_obj.create()
+                int_obj.set_netns(self.name)
 
-            int_obj.set_netns(self.name)
             int_obj.add_prefixes(self.name)
             int_obj.set_link_up(self.name)
 
+    @traced
+    async def setup_links_async(self, skip_veths: bool = False) -> None:
+        """Coroutine setup_links() - each link is set up concurrently"""
+        import asyncio
+
+        inventory = get_inventory()
+
+        async def setup_link(int_obj: Interface) -> None:
+            if skip_veths and isinstance(int_obj, Veth):
+                pass
+            elif not (inventory and await int_obj.exists_async(self.name)):
+                if not await int_obj.exists_async():
+                    await int_obj.create_async()
+                await int_obj.set_netns_async(self.name)
+
+            await int_obj.add_prefixes_async(self.name)
+            await int_obj.set_link_up_async(self.name)
+
+        await asyncio.gather(
+            *[setup_link(int_obj) for int_obj in self.interfaces.values()]
+        )
+
     def setup(self) -> None:
         """Coordination function to setup all the namespace elements
         - Designed to be idempotent - i.e. if it exists, move on"""
@@ -195,14 +680,380 @@ class Namespace:
 
         LOG.info(f"Finished setup of {self.name} namespace")
 
+    async def setup_async(self) -> None:
+        """Coroutine setup() - commands are asyncio subprocesses (no threads)"""
+        await self.create_async()
+        await self.setup_links_async()
+        await self.create_oob_async()
+        await self.route_add_async()
+        LOG.info(f"Finished setup of {self.name} namespace")
+
+    @traced
+    def setup_batched(self) -> List[BatchFailure]:
+        """setup() equivalent running all in netns commands via one `ip -batch`
+        - compile_default_batch()'s Batch needs to have ran first"""
+        batch = self.batch_setup()
+        failures = batch.run()
+        log_failures(failures, self.name)
+        LOG.info(
+            f"Finished batched setup of {self.name} namespace "
+            + f"({len(batch)} commands, {len(failures)} failures)"
+        )
+        self.route_files_add()
+        return failures
+
+    @traced
+    def setup_nexthops_batched(self) -> List[BatchFailure]:
+        """batch_nexthops() via one `ip -batch` - after every setup_batched()"""
+        batch = self.batch_nexthops()
+        failures = batch.run()
+        log_failures(failures, self.name)
+        return failures
+
+
+def config_hash(ns_config: Dict, config: Dict) -> str:
+    """Stable hash of everything a namespace is built from - without building it"""
+    hashed: Dict = {
+        "namespace": ns_config,
+        "physical_int": config.get("physical_int", ""),
+    }
+    if ns_config["oob"]:
+        hashed["oob"] = config["oob"]["prefixes"]
+    if ns_config.get("route_files"):
+        hashed["route_files"] = [
+            [str(route_file)] + file_version(str(route_file))
+            for route_file in ns_config["route_files"]
+        ]
+    return sha256(dumps(hashed, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class NamespaceIndex:
+    """What graph building + the journal need from every namespace's raw config
+    - Found in one pass so no Namespace object is built until a task runs"""
+
+    # veth name -> netns it lives in
+    veth_owners: Dict[str, str] = field(default_factory=dict)
+    # netns -> {veth name: peer name}
+    veths: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    oob: Set[str] = field(default_factory=set)
+    nexthops: Set[str] = field(default_factory=set)
+    # netns -> config_hash() - only filled when asked for
+    hashes: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def build(
+        cls, config: Dict, names: Iterable[str], hashes: bool = False
+    ) -> "NamespaceIndex":
+        index = cls()
+        for ns_name in names:
+            ns_config = config["namespaces"][ns_name]
+            ns_veths: Dict[str, str] = {}
+            for int_name, int_conf in ns_config["interfaces"].items():
+                if int_conf["type"].lower() == "veth":
+                    ns_veths[int_name] = int_conf["peer_name"]
+                    index.veth_owners[int_name] = ns_name
+            index.veths[ns_name] = ns_veths
+            if ns_config["oob"]:
+                index.oob.add(ns_name)
+            if ns_config.get("nexthops"):
+                index.nexthops.add(ns_name)
+            if hashes:
+                index.hashes[ns_name] = config_hash(ns_config, config)
+        return index
+
+    def peer_namespaces(self, ns_name: str) -> Set[str]:
+        """The other namespaces holding ns_name's veth peers"""
+        return {
+            self.veth_owners[peer]
+            for peer in self.veths.get(ns_name, {}).values()
+            if peer in self.veth_owners and self.veth_owners[peer] != ns_name
+        }
+
+
+class LazyNamespaces(Mapping[str, Namespace]):
+    """Namespaces built from the config only when something looks them up
+    - The most recently used cache_size are kept - the rest are rebuilt if needed
+    - Safe to look up from the scheduler's worker threads"""
+
+    def __init__(
+        self,
+        config: Dict,
+        names: Optional[Iterable[str]] = None,
+        cache_size: int = DEFAULT_NAMESPACE_CACHE,
+    ) -> None:
+        self.config = config
+        self.names = list(config["namespaces"] if names is None else names)
+        self._name_set = set(self.names)
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, Namespace]" = OrderedDict()
+        self.built = 0
+        self.lock = Lock()
+
+    def __getitem__(self, name: str) -> Namespace:
+        if name not in self._name_set:
+            raise KeyError(name)
+        with self.lock:
+            if name in self.cache:
+                self.cache.move_to_end(name)
+                return self.cache[name]
+
+            ns = Namespace(name, self.config["namespaces"][name], self.config)
+            self.built += 1
+            self.cache[name] = ns
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return ns
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._name_set
+
+    def with_nexthops(self) -> "LazyNamespaces":
+        """The namespaces configuring nexthops - found without building any"""
+        return self.subset(
+            name
+            for name in self.names
+            if self.config["namespaces"][name].get("nexthops")
+        )
+
+    def subset(self, names: Iterable[str]) -> "LazyNamespaces":
+        """Same config + cache size for only names"""
+        wanted = set(names)
+        return LazyNamespaces(
+            self.config,
+            [name for name in self.names if name in wanted],
+            self.cache_size,
+        )
+
+
+def run_namespace(
+    namespaces: Mapping[str, Namespace], ns_name: str, method: str, **kwargs: Any
+) -> Any:
+    """Look the namespace up when the task runs - not when the graph is built"""
+    return getattr(namespaces[ns_name], method)(**kwargs)
+
+
+async def run_namespace_async(
+    namespaces: Mapping[str, Namespace], ns_name: str, method: str, **kwargs: Any
+) -> Any:
+    return await getattr(namespaces[ns_name], method)(**kwargs)
+
+
+@traced
+def setup_veth_pair(
+    int_obj: Veth,
+    netns_name: str,
+    peer_obj: Optional[Veth] = None,
+    peer_netns_name: str = "",
+) -> None:
+    """Create a veth pair (if needed) + move each end into its netns"""
+    inventory = get_inventory()
+    if not (inventory and int_obj.exists(netns_name)):
+        if not int_obj.exists():
+            int_obj.create()
+        int_obj.set_netns(netns_name)
+    if peer_obj and not (inventory and peer_obj.exists(peer_netns_name)):
+        peer_obj.set_netns(peer_netns_name)
+
+
+@traced
+async def setup_veth_pair_async(
+    int_obj: Veth,
+    netns_name: str,
+    peer_obj: Optional[Veth] = None,
+    peer_netns_name: str = "",
+) -> None:
+    inventory = get_inventory()
+    if not (inventory and await int_obj.exists_async(netns_name)):
+        if not await int_obj.exists_async():
+            await int_obj.create_async()
+        await int_obj.set_netns_async(netns_name)
+    if peer_obj and not (inventory and await peer_obj.exists_async(peer_netns_name)):
+        await peer_obj.set_netns_async(peer_netns_name)
+
+
+def veth_pair(
+    namespaces: Mapping[str, Namespace],
+    netns_name: str,
+    int_name: str,
+    peer_netns_name: str = "",
+) -> Tuple[Veth, Optional[Veth]]:
+    int_obj = namespaces[netns_name].interfaces[int_name]
+    assert isinstance(int_obj, Veth)
+    peer_obj = (
+        namespaces[peer_netns_name].interfaces[int_obj.peer]
+        if peer_netns_name
+        else None
+    )
+    assert peer_obj is None or isinstance(peer_obj, Veth)
+    return int_obj, peer_obj
+
+
+def run_veth_pair(
+    namespaces: Mapping[str, Namespace],
+    netns_name: str,
+    int_name: str,
+    peer_netns_name: str = "",
+) -> None:
+    """Look both ends up when the task runs - like run_namespace()"""
+    int_obj, peer_obj = veth_pair(namespaces, netns_name, int_name, peer_netns_name)
+    setup_veth_pair(int_obj, netns_name, peer_obj, peer_netns_name)
+
+
+async def run_veth_pair_async(
+    namespaces: Mapping[str, Namespace],
+    netns_name: str,
+    int_name: str,
+    peer_netns_name: str = "",
+) -> None:
+    int_obj, peer_obj = veth_pair(namespaces, netns_name, int_name, peer_netns_name)
+    await setup_veth_pair_async(int_obj, netns_name, peer_obj, peer_netns_name)
+
+
+def build_create_graph(
+    interface_name: str,
+    namespaces: Mapping[str, "Namespace"],
+    config: Dict,
+    use_async: bool = False,
+    index: Optional[NamespaceIndex] = None,
+) -> TaskGraph:
+    """Turn the topology into a create TaskGraph
+    - netns -> veth pairs (need both ends' netns) -> addressing -> routes
+    - Per netns OOB links + the global OOB device are their own branches
+    - use_async: namespace tasks are coroutines ran on the event loop
+    - The graph comes from the raw config (index) + tasks look their namespace up
+      by name so LazyNamespaces only build it when it's worked on"""
+    graph = TaskGraph()
+    ns_task = partial(run_namespace_async if use_async else run_namespace, namespaces)
+    if index is None:
+        index = NamespaceIndex.build(config, namespaces)
+    links_deps: Dict[str, Set[str]] = {}
+    oob_namespaces: List[str] = []
+    for ns_name in namespaces:
+        graph.add(
+            f"netns:{ns_name}",
+            partial(ns_task, ns_name, "create_async" if use_async else "create"),
+            owners=[ns_name],
+        )
+        links_deps[ns_name] = {f"netns:{ns_name}"}
+        if ns_name in index.oob:
+            oob_namespaces.append(ns_name)
+
+    paired: Set[str] = set()
+    for ns_name in namespaces:
+        for int_name, peer in index.veths[ns_name].items():
+            if int_name in paired:
+                continue
+
+            peer_ns_name = index.veth_owners.get(peer, "")
+            if peer_ns_name not in namespaces:
+                peer_ns_name = ""
+            pair_ns = {ns_name} | ({peer_ns_name} if peer_ns_name else set())
+            task_name = f"veth:{int_name}/{peer}"
+            graph.add(
+                task_name,
+                partial(
+                    run_veth_pair_async if use_async else run_veth_pair,
+                    namespaces,
+                    ns_name,
+                    int_name,
+                    peer_ns_name,
+                ),
+                deps=[f"netns:{name}" for name in pair_ns],
+                owners=pair_ns,
+            )
+            paired.update((int_name, peer))
+            for name in pair_ns:
+                links_deps[name].add(task_name)
+
+    for ns_name in namespaces:
+        graph.add(
+            f"links:{ns_name}",
+            partial(
+                ns_task,
+                ns_name,
+                "setup_links_async" if use_async else "setup_links",
+                skip_veths=True,
+            ),
+            deps=links_deps[ns_name],
+            netns_name=ns_name,
+            owners=[ns_name],
+        )
+        routes_deps = [f"links:{ns_name}"]
+        if ns_name in index.nexthops:
+            # Nexthops need carrier - i.e. their veth peers up in other namespaces
+            routes_deps.extend(
+                f"links:{name}"
+                for name in sorted(index.peer_namespaces(ns_name))
+                if name in namespaces
+            )
+        if ns_name in oob_namespaces:
+            graph.add(
+                f"oob:{ns_name}",
+                partial(
+                    ns_task,
+                    ns_name,
+                    "create_oob_async" if use_async else "create_oob",
+                ),
+                deps=[f"netns:{ns_name}"],
+                netns_name=ns_name,
+                owners=[ns_name],
+            )
+            routes_deps.append(f"oob:{ns_name}")
+        graph.add(
+            f"routes:{ns_name}",
+            partial(ns_task, ns_name, "route_add_async" if use_async else "route_add"),
+            deps=routes_deps,
+            netns_name=ns_name,
+            owners=[ns_name],
+        )
+
+    if oob_namespaces:
+        graph.add(
+            f"global-oob:{interface_name}",
+            partial(setup_global_oob, interface_name, namespaces, config),
+        )
+    return graph
+
 
-def setup_all_veths(namespaces: Dict[str, "Namespace"]) -> int:
+def build_delete_graph(
+    interface_name: str,
+    namespaces: Mapping[str, "Namespace"],
+    use_async: bool = False,
+) -> TaskGraph:
+    """Deleting a netns deletes its links so every task is independent"""
+    graph = TaskGraph()
+    oob_int = MacVlan(interface_name, "deleting_only", [])
+    graph.add(f"global-oob:{interface_name}", oob_int.delete)
+    for ns_name in namespaces:
+        graph.add(
+            f"netns:{ns_name}",
+            partial(
+                run_namespace_async if use_async else run_namespace,
+                namespaces,
+                ns_name,
+                "delete_async" if use_async else "delete",
+            ),
+            owners=[ns_name],
+        )
+    return graph
+
+
+@traced
+def setup_all_veths(namespaces: Mapping[str, "Namespace"]) -> int:
     """Setup all veths in a namespace then move to netns where needed"""
     errors = 0
+    inventory = get_inventory()
     for _ns_name, ns in namespaces.items():
         LOG.debug(f"Setting up veths for {ns.name} namespace")
         for int_name, int_obj in ns.interfaces.items():
-            if int_obj.exists():
+            if int_obj.exists() or (inventory and int_obj.exists(ns.name)):
                 LOG.debug(f"{int_name} exists. Not creating")
                 continue
 
@@ -213,27 +1064,53 @@ def setup_all_veths(namespaces: Dict[str, "Namespace"]) -> int:
     return errors
 
 
+def global_oob_interface(
+    interface_name: str, namespaces: Mapping[str, "Namespace"], config: Dict
+) -> Optional[MacVlan]:
+    """Build the global OOB macvlan interface object if any netns wants oob"""
+    if not any(ns.oob for ns in namespaces.values()):
+        return None
+
+    oob_int_prefixes = []
+    if "oob" in config and "prefixes" in config["oob"]:
+        oob_int_prefixes = [ip_interface(ip) for ip in config["oob"]["prefixes"]]
+    return MacVlan(interface_name, config["physical_int"], oob_int_prefixes)
+
+
+@traced
 def setup_global_oob(
-    interface_name: str, namespaces: Dict[str, "Namespace"], config: Dict
+    interface_name: str, namespaces: Mapping[str, "Namespace"], config: Dict
 ) -> None:
     """Add Global OOB interface if any netns has oob set to true"""
-    oob_wanted = False
-    for _, ns in namespaces.items():
-        if ns.oob:
-            oob_wanted = True
-            break
-
-    if not oob_wanted:
+    oob_int = global_oob_interface(interface_name, namespaces, config)
+    if not oob_int:
         LOG.debug(
             "Not setting up a global OOB device. No namespace has an oob interface"
         )
         return None
 
-    oob_int_prefixes = []
-    if "oob" in config and "prefixes" in config["oob"]:
-        oob_int_prefixes = [ip_interface(ip) for ip in config["oob"]["prefixes"]]
+    if oob_int.exists():
+        LOG.info(f"Global OOB device {interface_name} exists. Not creating")
+        return None
 
-    oob_int = MacVlan(interface_name, config["physical_int"], oob_int_prefixes)
     oob_int.create()
     oob_int.add_prefixes()
     oob_int.set_link_up()
+
+
+@traced
+def compile_default_batch(
+    interface_name: str, namespaces: Mapping[str, "Namespace"], config: Dict
+) -> Batch:
+    """Compile all default netns commands (netns, veth, oob creation) into a Batch"""
+    batch = Batch()
+    created: Set[str] = set()
+    for ns in namespaces.values():
+        ns.batch_create(batch, created)
+
+    oob_int = global_oob_interface(interface_name, namespaces, config)
+    if oob_int and not (get_inventory() and oob_int.exists()):
+        oob_int.batch_create(batch)
+        oob_int.batch_configure(batch)
+
+    return batch
@@ -0,0 +1,169 @@
+import ctypes
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from threading import local
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+from json2netns.consts import NETNS_RUN_DIR
+
+
+LOG = logging.getLogger(__name__)
+CLONE_NEWNET = 0x40000000
+MNT_DETACH = 2
+# /proc/self is the main thread's view - setns() is per thread
+THREAD_NETNS_PATH = "/proc/thread-self/ns/net"
+
+
+class _ThreadNetns(local):
+    """Per thread state of workers pinned to a netns
+    - pinned: netns the thread is working on (None when not pinned)
+    - current: netns the thread is in right now ("" == where it started)"""
+
+    pinned: Optional[str] = None
+    current = ""
+    original_fd = -1
+
+
+_thread_netns = _ThreadNetns()
+
+
+def netns_path(netns_name: str) -> Path:
+    return NETNS_RUN_DIR / netns_name
+
+
+def set_netns_dir(path: Path) -> Path:
+    """Point netns_path() somewhere else (e.g. a dry run's pretend /run/netns)
+    - Returns the previous directory"""
+    global NETNS_RUN_DIR
+    previous = NETNS_RUN_DIR
+    NETNS_RUN_DIR = path
+    return previous
+
+
+def delete_netns(netns_name: str) -> None:
+    """What `ip netns del` does - lazy unmount + remove the netns's bind mount
+    - The kernel frees the netns once nothing else (e.g. sockets) holds it"""
+    path = netns_path(netns_name)
+    libc = ctypes.CDLL(None, use_errno=True)
+    # Like ip we only care if the file can't be removed
+    libc.umount2(str(path).encode("utf-8"), MNT_DETACH)
+    os.unlink(path)
+
+
+def setns(fd: int) -> None:
+    """Move the calling thread into the network namespace fd refers to
+    - os.setns() only exists on >= 3.12 so fallback to libc"""
+    os_setns = getattr(os, "setns", None)
+    if os_setns:
+        os_setns(fd, CLONE_NEWNET)
+        return
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.setns(fd, CLONE_NEWNET) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"setns failed: {os.strerror(errno)}")
+
+
+@contextmanager
+def enter_netns(netns_name: str) -> Iterator[None]:
+    """Run the with block's code (in this thread) inside netns_name
+    - Sockets opened inside stay in netns_name after we return"""
+    original_fd = os.open(THREAD_NETNS_PATH, os.O_RDONLY)
+    try:
+        target_fd = os.open(str(netns_path(netns_name)), os.O_RDONLY)
+        try:
+            setns(target_fd)
+        finally:
+            os.close(target_fd)
+        LOG.debug(f"Entered {netns_name} namespace")
+        try:
+            yield
+        finally:
+            setns(original_fd)
+    finally:
+        os.close(original_fd)
+
+
+def pinned_netns() -> Optional[str]:
+    """The netns the calling thread is pinned to (None if it's not)"""
+    return _thread_netns.pinned
+
+
+def switch_netns(netns_name: str) -> None:
+    """Move a pinned thread into netns_name or back to its original netns ("")
+    - No-op if the thread is already there"""
+    if _thread_netns.pinned is None:
+        raise RuntimeError("Only threads pinned via pin_netns() can switch netns")
+    if _thread_netns.current == netns_name:
+        return
+
+    if netns_name:
+        target_fd = os.open(str(netns_path(netns_name)), os.O_RDONLY)
+        try:
+            setns(target_fd)
+        finally:
+            os.close(target_fd)
+    else:
+        setns(_thread_netns.original_fd)
+    _thread_netns.current = netns_name
+    LOG.debug(f"Thread switched to {netns_name if netns_name else 'original'} netns")
+
+
+@contextmanager
+def pin_netns(netns_name: str) -> Iterator[None]:
+    """Pin the calling thread to netns_name for the with block
+    - Backends then run that netns's commands from inside it (no `ip netns exec`)
+    - The netns is entered on first use (it may not exist yet) and the
+      thread always returns to its original netns on exit"""
+    _thread_netns.original_fd = os.open(THREAD_NETNS_PATH, os.O_RDONLY)
+    _thread_netns.pinned = netns_name
+    try:
+        yield
+    finally:
+        try:
+            switch_netns("")
+        finally:
+            os.close(_thread_netns.original_fd)
+            _thread_netns.original_fd = -1
+            _thread_netns.pinned = None
+
+
+class NetnsWorkerPool:
+    """Thread pool where each job is pinned to the netns it works on
+    - pin=False gives a plain thread pool (commands use `ip netns exec`)"""
+
+    def __init__(self, max_workers: int, pin: bool = True) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="netns_worker"
+        )
+        self.pin = pin
+
+    def _run_pinned(self, netns_name: str, func: Callable, *args: Any) -> Any:
+        if not self.pin:
+            return func(*args)
+        with pin_netns(netns_name):
+            return func(*args)
+
+    async def run(self, netns_name: str, func: Callable, *args: Any) -> Any:
+        """Run func(*args) on a worker pinned to netns_name"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self._run_pinned, netns_name, func, *args
+        )
+
+    def map(self, netns_names: Iterable[str], func: Callable[[str], Any]) -> List[Any]:
+        """func(netns_name) for each netns on pinned workers - results in order
+        - run() without an event loop for actions that only run threads"""
+        futures = [
+            self.executor.submit(self._run_pinned, netns_name, func, netns_name)
+            for netns_name in netns_names
+        ]
+        return [future.result() for future in futures]
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from hashlib import sha256
+from json import dumps, loads
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from json2netns.batch import Batch, log_failures
+from json2netns.config import Config
+from json2netns.consts import DEFAULT_PLAN_CACHE_SIZE
+from json2netns.nsenter import netns_path, NetnsWorkerPool
+from json2netns.routefeed import file_version
+
+
+LOG = logging.getLogger(__name__)
+
+# Bump when what a compiled plan contains changes
+PLAN_FORMAT = 1
+ROUTE_FILES_KEY = b'"route_files"'
+PACKAGE_DIR = Path(__file__).parent
+
+
+def tool_version() -> str:
+    """Changes whenever json2netns does - installed version + its source files"""
+    # Slow to import so only plan cache runs pay for it
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        installed = version("json2netns")
+    except PackageNotFoundError:
+        installed = "source"
+    digest = sha256()
+    for path in sorted(PACKAGE_DIR.glob("*.py")):
+        stat = path.stat()
+        digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return f"{installed}+{digest.hexdigest()[:12]}"
+
+
+@dataclass
+class CompiledPlan:
+    """Every command of a create / delete as one `ip -batch` per netns
+    - Planned for a host with nothing (create) or everything (delete) of the config
+    - hashes are each namespace's config hash for the applied state journal"""
+
+    action: str
+    namespaces: List[str]
+    # (netns, batch lines) - the default netns ("") first
+    batches: List[Tuple[str, List[str]]]
+    hashes: Dict[str, str] = field(default_factory=dict)
+    validated: bool = False
+
+    def __len__(self) -> int:
+        return sum(len(lines) for _, lines in self.batches)
+
+    @classmethod
+    def from_dict(cls, plan: Dict[str, Any]) -> "CompiledPlan":
+        return cls(
+            plan["action"],
+            list(plan["namespaces"]),
+            [(netns_name, list(lines)) for netns_name, lines in plan["batches"]],
+            dict(plan.get("hashes", {})),
+            bool(plan.get("validated", False)),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "action": self.action,
+            "batches": self.batches,
+            "hashes": self.hashes,
+            "namespaces": self.namespaces,
+            "validated": self.validated,
+        }
+
+    def applies(self) -> bool:
+        """Does the host look like the plan expects? Otherwise take the normal path"""
+        want_existing = self.action == "delete"
+        for netns_name in self.namespaces:
+            if netns_path(netns_name).exists() != want_existing:
+                LOG.info(
+                    f"Cached {self.action} plan does not apply - {netns_name} "
+                    + f"namespace {'does not exist' if want_existing else 'exists'}"
+                )
+                return False
+        return True
+
+    @staticmethod
+    def _batch(netns_name: str, lines: List[str]) -> Batch:
+        batch = Batch(netns_name)
+        for line in lines:
+            batch.add(line.split(), line, exists_ok=True)
+        return batch
+
+    def rounds(self) -> List[Dict[str, List[str]]]:
+        """The netns batches after the default netns's, as rounds ran in parallel
+        - A netns's second batch (its nexthops) starts the next round"""
+        rounds: List[Dict[str, List[str]]] = [{}]
+        for netns_name, lines in self.batches:
+            if not netns_name:
+                continue
+            if netns_name in rounds[-1]:
+                rounds.append({})
+            rounds[-1][netns_name] = lines
+        return rounds
+
+    async def apply(self, pool: NetnsWorkerPool) -> Set[str]:
+        """Run the default netns batch then each netns's - returns failed namespaces"""
+        default_lines = [lines for netns_name, lines in self.batches if not netns_name]
+        failures = self._batch("", default_lines[0] if default_lines else []).run()
+        log_failures(failures)
+        failed: Set[str] = set()
+        for batches in self.rounds():
+            ns_failures = await asyncio.gather(
+                *[
+                    pool.run(netns_name, self._batch(netns_name, lines).run)
+                    for netns_name, lines in batches.items()
+                ]
+            )
+            for netns_name, ns_failure in zip(batches, ns_failures):
+                log_failures(ns_failure, netns_name)
+                if ns_failure:
+                    failed.add(netns_name)
+        # Everything depends on the default netns commands
+        return set(self.namespaces) if failures else failed
+
+
+class PlanCache:
+    """Compiled plans on disk keyed by config content, action + json2netns version
+    - Any change to the config, its route files or json2netns is a new key (a miss)
+    - At most size plans are kept - the least recently used are removed"""
+
+    def __init__(self, directory: Path, size: int = DEFAULT_PLAN_CACHE_SIZE) -> None:
+        self.directory = directory
+        self.size = size
+
+    def key(
+        self, config_path: Path, action: str, namespaces: Sequence[str] = ()
+    ) -> str:
+        """namespaces is the --namespace selection - every namespace when empty
+        - Route files of the selected namespaces are keyed on their size + mtime"""
+        selected = ",".join(sorted(set(namespaces)))
+        digest = sha256(
+            f"{PLAN_FORMAT}:{tool_version()}:{action}:{selected}\n".encode()
+        )
+        has_route_files = False
+        tail = b""
+        with config_path.open("rb") as cfp:
+            for chunk in iter(lambda: cfp.read(1 << 20), b""):
+                digest.update(chunk)
+                # Keep a tail so a key split across chunks is still found
+                has_route_files = has_route_files or ROUTE_FILES_KEY in tail + chunk
+                tail = chunk[-len(ROUTE_FILES_KEY) :]
+        # Only parse the config when it has route files
+        if has_route_files:
+            for ns_name, ns_config in Config(config_path).iter_namespaces():
+                if namespaces and ns_name not in namespaces:
+                    continue
+                for route_file in ns_config.get("route_files", ()):
+                    version = file_version(str(route_file))
+                    digest.update(f"{ns_name}:{route_file}:{version}\n".encode())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def load(self, key: str) -> Optional[CompiledPlan]:
+        plan_path = self.path(key)
+        try:
+            plan = CompiledPlan.from_dict(loads(plan_path.read_text()))
+        except FileNotFoundError:
+            LOG.debug(f"No cached plan {key}")
+            return None
+        except (KeyError, TypeError, ValueError) as err:
+            LOG.error(f"Ignoring corrupt cached plan {plan_path}: {err}")
+            return None
+        # mtime is when it was last used
+        os.utime(plan_path)
+        LOG.debug(f"Loaded cached {plan.action} plan {key} ({len(plan)} commands)")
+        return plan
+
+    def store(self, key: str, plan: CompiledPlan) -> None:
+        """Atomically write the plan then evict the least recently used plans"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        plan_path = self.path(key)
+        tmp_path = plan_path.with_suffix(".tmp")
+        tmp_path.write_text(dumps(plan.to_dict()))
+        os.replace(tmp_path, plan_path)
+        self.evict()
+
+    def evict(self) -> List[Path]:
+        plans = sorted(
+            self.directory.glob("*.json"),
+            key=lambda path: path.stat().st_mtime_ns,
+            reverse=True,
+        )
+        evicted = plans[self.size :]
+        for plan_path in evicted:
+            LOG.debug(f"Evicting cached plan {plan_path}")
+            plan_path.unlink(missing_ok=True)
+        return evicted
@@ -0,0 +1,378 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from ipaddress import ip_interface, ip_network
+from json import loads
+from pathlib import Path
+from subprocess import PIPE
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from json2netns.backend import get_backend
+from json2netns.batch import Batch, BatchFailure, log_failures, nexthop_round
+from json2netns.consts import DEFAULT_IP, IPInterface, IPNetwork
+from json2netns.interfaces import Interface, Loopback, Veth
+from json2netns.netns import global_oob_interface, Namespace
+from json2netns.nsenter import netns_path, NetnsWorkerPool
+from json2netns.route import Route, RouteState, same_address
+from json2netns.routefeed import feed_route_args, RouteFile
+from json2netns.trace import traced
+
+
+LOG = logging.getLogger(__name__)
+
+IP = DEFAULT_IP
+# Routes the kernel (connected, RA etc.) manages - never ours to remove
+UNMANAGED_ROUTE_PROTOCOLS = {"kernel", "ra", "redirect"}
+CHANGE_SYMBOLS = {"add": "+", "del": "-"}
+
+
+def _ip_json(args: List[str], netns_name: str) -> List[Dict[str, Any]]:
+    cp = get_backend().run([IP, "-j"] + args, netns_name, check=True, stdout=PIPE)
+    output = cp.stdout.decode("utf-8").strip()
+    return list(loads(output)) if output else []
+
+
+@dataclass
+class LinkState:
+    name: str
+    up: bool = False
+    # Global scope addresses - the only addresses we'll remove
+    prefixes: Set[IPInterface] = field(default_factory=set)
+    # Link/host scope addresses (e.g. fe80::/64 + 127.0.0.1/8) the kernel adds
+    kernel_prefixes: Set[IPInterface] = field(default_factory=set)
+
+    def has_prefix(self, prefix: IPInterface) -> bool:
+        return prefix in self.prefixes or prefix in self.kernel_prefixes
+
+
+@dataclass
+class NexthopState:
+    gateway: str = ""
+    dev: str = ""
+    # (id, weight) of a group's nexthops
+    group: Tuple[Tuple[int, int], ...] = ()
+
+
+@dataclass
+class NetnsState:
+    """What the kernel has in a netns ("" is the default netns)
+    - One `ip -j addr show` + one `ip -j route show` per address family"""
+
+    name: str
+    exists: bool = True
+    links: Dict[str, LinkState] = field(default_factory=dict)
+    # Main table unicast routes not managed by the kernel
+    routes: Dict[IPNetwork, RouteState] = field(default_factory=dict)
+    # id -> nexthop object
+    nexthops: Dict[int, NexthopState] = field(default_factory=dict)
+
+    def add_json_links(self, links: Iterable[Dict[str, Any]]) -> None:
+        for link in links:
+            link_state = LinkState(link["ifname"], "UP" in link.get("flags", []))
+            for addr in link.get("addr_info", []):
+                if "local" not in addr:
+                    continue
+                prefix = ip_interface(f"{addr['local']}/{addr['prefixlen']}")
+                if addr.get("scope", "global") == "global":
+                    link_state.prefixes.add(prefix)
+                else:
+                    link_state.kernel_prefixes.add(prefix)
+            self.links[link_state.name] = link_state
+
+    def add_json_routes(self, routes: Iterable[Dict[str, Any]], version: int) -> None:
+        for route in routes:
+            if route.get("type", "unicast") != "unicast":
+                continue
+            if route.get("protocol", "boot") in UNMANAGED_ROUTE_PROTOCOLS:
+                continue
+            dst = route.get("dst", "")
+            if not dst:
+                continue
+            if dst == "default":
+                dst = "0.0.0.0/0" if version == 4 else "::/0"
+            self.routes[ip_network(dst, strict=False)] = RouteState.from_json(route)
+
+    def add_json_nexthops(self, nexthops: Iterable[Dict[str, Any]]) -> None:
+        for nexthop in nexthops:
+            self.nexthops[nexthop["id"]] = NexthopState(
+                nexthop.get("gateway", ""),
+                nexthop.get("dev", ""),
+                tuple(
+                    (member["id"], member.get("weight", 1))
+                    for member in nexthop.get("group", [])
+                ),
+            )
+
+    @classmethod
+    def load(cls, netns_name: str, nexthops: bool = False) -> "NetnsState":
+        """nexthops also reads the netns's nexthop objects"""
+        if netns_name and not netns_path(netns_name).exists():
+            return cls(netns_name, exists=False)
+
+        state = cls(netns_name)
+        state.add_json_links(_ip_json(["addr", "show"], netns_name))
+        for version in (4, 6):
+            state.add_json_routes(
+                _ip_json([f"-{version}", "route", "show"], netns_name), version
+            )
+        if nexthops:
+            state.add_json_nexthops(_ip_json(["nexthop", "show"], netns_name))
+        return state
+
+
+@dataclass
+class Change:
+    netns_name: str
+    args: List[str]
+    description: str
+
+    def __str__(self) -> str:
+        symbol = CHANGE_SYMBOLS.get(self.args[1], "~")
+        ns_label = self.netns_name if self.netns_name else "default"
+        return f"{symbol} [{ns_label}] {' '.join(self.args)} ({self.description})"
+
+
+class Plan:
+    """Minimal, ordered set of ip commands to make the kernel match the config
+    - Default netns changes (netns, link creation + moves) are applied first"""
+
+    def __init__(self) -> None:
+        self.changes: List[Change] = []
+
+    def __len__(self) -> int:
+        return len(self.changes)
+
+    def add(self, netns_name: str, args: List[str], description: str) -> None:
+        self.changes.append(Change(netns_name, args, description))
+
+    def batches(self, nexthops: bool = False) -> Dict[str, Batch]:
+        """Each netns's changes - nexthops for the nexthop round's changes"""
+        batches: Dict[str, Batch] = {}
+        for change in self.changes:
+            if nexthop_round(change.args) != nexthops:
+                continue
+            if change.netns_name not in batches:
+                batches[change.netns_name] = Batch(change.netns_name)
+            batches[change.netns_name].add(change.args, change.description)
+        return batches
+
+    def summary(self) -> str:
+        counts = {"add": 0, "change": 0, "del": 0}
+        for change in self.changes:
+            verb = change.args[1]
+            counts[verb if verb in counts else "change"] += 1
+        return (
+            f"{counts['add']} to add, {counts['change']} to change, "
+            + f"{counts['del']} to remove"
+        )
+
+    def render(self) -> str:
+        if not self.changes:
+            return "No changes. Kernel state matches the config."
+        return "\n".join([str(c) for c in self.changes] + [f"Plan: {self.summary()}"])
+
+    @traced
+    async def apply(self, pool: NetnsWorkerPool) -> List[BatchFailure]:
+        """Run the default netns batch then each netns batch in parallel
+        - Then each netns's nexthop round batch, once every link is up"""
+        batches = self.batches()
+        failures: List[BatchFailure] = []
+        default_batch = batches.pop("", None)
+        if default_batch:
+            failures.extend(default_batch.run())
+            log_failures(failures)
+
+        async def run_netns_batch(batch: Batch) -> List[BatchFailure]:
+            ns_failures: List[BatchFailure] = await pool.run(
+                batch.netns_name, batch.run
+            )
+            log_failures(ns_failures, batch.netns_name)
+            return ns_failures
+
+        for ns_batches in (batches, self.batches(nexthops=True)):
+            for ns_failures in await asyncio.gather(
+                *[run_netns_batch(batch) for batch in ns_batches.values()]
+            ):
+                failures.extend(ns_failures)
+        return failures
+
+
+class Reconciler:
+    """Diff the desired topology against the kernel state into a Plan
+    - Removes addresses + routes in managed netns that are not in the config
+    - Namespaces + links not in the config are left alone"""
+
+    def __init__(
+        self,
+        namespaces: Mapping[str, Namespace],
+        config: Dict,
+        oob_interface_name: str,
+    ) -> None:
+        self.namespaces = namespaces
+        self.config = config
+        self.oob_interface_name = oob_interface_name
+
+    @traced
+    async def load_states(self, pool: NetnsWorkerPool) -> Dict[str, NetnsState]:
+        """Read the default netns + every configured netns once"""
+        states: Dict[str, NetnsState] = {"": NetnsState.load("")}
+        ns_states = await asyncio.gather(
+            *[
+                pool.run(name, NetnsState.load, name, bool(ns.nexthops))
+                for name, ns in self.namespaces.items()
+            ]
+        )
+        for state in ns_states:
+            states[state.name] = state
+        return states
+
+    def _links(self, ns: Namespace) -> List[Interface]:
+        links = list(ns.interfaces.values())
+        oob_int = ns.oob_interface()
+        if oob_int:
+            links.append(oob_int)
+        return links
+
+    def _plan_link(
+        self,
+        plan: Plan,
+        netns_name: str,
+        int_obj: Interface,
+        link_state: Optional[LinkState],
+    ) -> None:
+        if link_state is None:
+            # Links moved between netns lose their addresses + go down
+            link_state = LinkState(int_obj.name)
+
+        desired = set(int_obj.prefixes)
+        for prefix in sorted(link_state.prefixes - desired, key=str):
+            plan.add(
+                netns_name,
+                ["addr", "del", str(prefix), "dev", int_obj.name],
+                f"stale address on {int_obj.name}",
+            )
+        for prefix in int_obj.prefixes:
+            if not link_state.has_prefix(prefix):
+                plan.add(
+                    netns_name,
+                    int_obj.add_prefix_args(prefix),
+                    f"address on {int_obj.name}",
+                )
+        if not link_state.up:
+            plan.add(netns_name, int_obj.set_link_up_args(), f"{int_obj.name} link up")
+
+    def _plan_nexthops(self, plan: Plan, ns: Namespace, state: NetnsState) -> None:
+        for nexthop in ns.nexthops:
+            nexthop_state = state.nexthops.get(nexthop.id)
+            if nexthop_state is None:
+                plan.add(ns.name, nexthop.replace_args(), f"nexthop {nexthop.name}")
+            elif (
+                nexthop.group != nexthop_state.group
+                or not same_address(nexthop.next_hop_ip, nexthop_state.gateway)
+                or (not nexthop.group and nexthop.egress_if_name != nexthop_state.dev)
+            ):
+                plan.add(ns.name, nexthop.replace_args(), f"nexthop {nexthop.name}")
+
+    def _plan_stale_nexthops(
+        self, plan: Plan, ns: Namespace, state: NetnsState
+    ) -> None:
+        """After the routes have moved off them - groups before their members"""
+        nhids = {nexthop.id for nexthop in ns.nexthops}
+        stale = [nhid for nhid in state.nexthops if nhid not in nhids]
+        for nhid in sorted(stale, key=lambda nhid: not state.nexthops[nhid].group):
+            plan.add(ns.name, ["nexthop", "del", "id", str(nhid)], "stale nexthop")
+
+    @staticmethod
+    def _plan_route(
+        plan: Plan,
+        route_obj: Route,
+        args: List[str],
+        stale_routes: Dict[IPNetwork, RouteState],
+    ) -> None:
+        """args are the route's `route add` args without the ip binary"""
+        description = f"route {route_obj.name} to {route_obj.dest_prefix}"
+        route_state = stale_routes.pop(
+            ip_network(route_obj.dest_prefix, strict=False), None
+        )
+        if route_state is None:
+            plan.add(route_obj.netns_name, args, description)
+        elif route_obj.changed(route_state):
+            plan.add(route_obj.netns_name, ["route", "replace"] + args[2:], description)
+
+    def _plan_routes(self, plan: Plan, ns: Namespace, state: NetnsState) -> None:
+        stale_routes = dict(state.routes)
+        for route_obj in ns.route_objects():
+            cmd = route_obj.get_route(check_exists=False)
+            if cmd:
+                self._plan_route(plan, route_obj, cmd[1:], stale_routes)
+
+        # route_files routes are already validated as they're read
+        for route_file in ns.route_files:
+            path = Path(route_file)
+            try:
+                for line_number, dest_prefix, next_hop_ip, egress in RouteFile(path):
+                    route_obj = Route(
+                        f"{path.name}:{line_number}",
+                        ns.name,
+                        dest_prefix,
+                        next_hop_ip,
+                        egress,
+                    )
+                    args = ["route", "add", dest_prefix]
+                    args += feed_route_args(next_hop_ip, egress)
+                    self._plan_route(plan, route_obj, args, stale_routes)
+            except (OSError, UnicodeDecodeError) as err:
+                # Unknown routes may be in the file, so none are stale
+                LOG.error(
+                    f"Unable to read route file {path}: {err} - not removing "
+                    + f"{ns.name} namespace stale routes"
+                )
+                return
+
+        for dest in sorted(stale_routes, key=str):
+            plan.add(ns.name, ["route", "del", str(dest)], "stale route")
+
+    def plan(self, states: Dict[str, NetnsState]) -> Plan:
+        plan = Plan()
+        default_links: Set[str] = set(states[""].links)
+        for ns in self.namespaces.values():
+            state = states[ns.name]
+            if not state.exists:
+                plan.add("", ["netns", "add", ns.name], f"{ns.name} namespace")
+
+            for int_obj in self._links(ns):
+                # Every netns has a loopback
+                if isinstance(int_obj, Loopback) or int_obj.name in state.links:
+                    continue
+                if int_obj.name not in default_links:
+                    plan.add(
+                        "", int_obj.create_args(), f"{int_obj.type} {int_obj.name}"
+                    )
+                    default_links.add(int_obj.name)
+                    if isinstance(int_obj, Veth):
+                        default_links.add(int_obj.peer)
+                plan.add(
+                    "",
+                    int_obj.set_netns_args(ns.name),
+                    f"move {int_obj.name} to {ns.name} namespace",
+                )
+                default_links.discard(int_obj.name)
+
+        oob_int = global_oob_interface(
+            self.oob_interface_name, self.namespaces, self.config
+        )
+        if oob_int:
+            if oob_int.name not in default_links:
+                plan.add("", oob_int.create_args(), f"global oob {oob_int.name}")
+            self._plan_link(plan, "", oob_int, states[""].links.get(oob_int.name))
+
+        for ns in self.namespaces.values():
+            state = states[ns.name]
+            for int_obj in self._links(ns):
+                self._plan_link(plan, ns.name, int_obj, state.links.get(int_obj.name))
+            self._plan_nexthops(plan, ns, state)
+            self._plan_routes(plan, ns, state)
+            self._plan_stale_nexthops(plan, ns, state)
+
+        LOG.info(f"Plan: {plan.summary()}")
+        return plan
@@ -1,19 +1,132 @@
 import logging
 from dataclasses import dataclass
 from ipaddress import ip_address, ip_network
-from subprocess import check_output
-from typing import List
+from json import loads
+from subprocess import PIPE
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 
-from json2netns.consts import DEFAULT_IP
+from json2netns.backend import get_backend
+from json2netns.consts import DEFAULT_IP, IPNetwork, MAX_WEIGHT
+from json2netns.metrics import count, ROUTES
 
 
 LOG = logging.getLogger(__name__)
 
 IP = DEFAULT_IP
+# Kernel managed route types - never clash with the unicast routes we add
+IGNORED_ROUTE_TYPES = {"anycast", "broadcast", "local", "multicast"}
+
+
+def same_address(address: str, other: str) -> bool:
+    """Compare addresses however they're written (e.g. fd00::02 == fd00::2)"""
+    if not address or not other:
+        return address == other
+    return ip_address(address) == ip_address(other)
+
+
+@dataclass
+class RouteState:
+    gateway: str = ""
+    dev: str = ""
+    nhid: int = 0
+    # ECMP (gateway, dev, weight) of multipath routes
+    nexthops: Tuple[Tuple[str, str, int], ...] = ()
+
+    @classmethod
+    def from_json(cls, route: Dict[str, Any]) -> "RouteState":
+        """From one route of `ip -j route show`"""
+        return cls(
+            route.get("gateway", ""),
+            route.get("dev", ""),
+            route.get("nhid", 0),
+            tuple(
+                (hop.get("gateway", ""), hop.get("dev", ""), hop.get("weight", 1))
+                for hop in route.get("nexthops", [])
+            ),
+        )
+
+
+class RouteTable:
+    """Exact match index of the destination prefixes in a netns's route tables
+    - Built from one `ip -j route show table all` dump per address family
+    - routes has where each main table unicast route goes, to spot changed routes"""
+
+    def __init__(self, netns_name: str = "") -> None:
+        self.netns_name = netns_name
+        self.prefixes: Set[IPNetwork] = set()
+        self.routes: Dict[IPNetwork, RouteState] = {}
+
+    def __contains__(self, prefix: object) -> bool:
+        if not isinstance(prefix, str):
+            return prefix in self.prefixes
+        # strict=False normalizes host bits e.g. 10.1.1.1/24 -> 10.1.1.0/24
+        return ip_network(prefix, strict=False) in self.prefixes
+
+    def __len__(self) -> int:
+        return len(self.prefixes)
+
+    def add(self, prefix: Union[str, IPNetwork]) -> None:
+        self.prefixes.add(ip_network(prefix, strict=False))
+
+    def add_json_routes(self, routes: Iterable[Dict[str, Any]], version: int) -> None:
+        """Index `ip -j route show` output
+        - Host routes have no prefix length (10.6.9.6 == 10.6.9.6/32)"""
+        for route in routes:
+            if route.get("type", "unicast") in IGNORED_ROUTE_TYPES:
+                continue
+            dst = route.get("dst", "")
+            if not dst:
+                continue
+            if dst == "default":
+                dst = "0.0.0.0/0" if version == 4 else "::/0"
+            prefix = ip_network(dst, strict=False)
+            self.prefixes.add(prefix)
+            if route.get("type", "unicast") == "unicast" and (
+                route.get("table", "main") == "main"
+            ):
+                self.routes[prefix] = RouteState.from_json(route)
+
+    def add_json_output(self, stdout: bytes, version: int) -> None:
+        output = stdout.decode("utf-8").strip()
+        self.add_json_routes(loads(output) if output else [], version)
+
+    @staticmethod
+    def dump_cmd(version: int) -> List[str]:
+        return [IP, "-j", f"-{version}", "route", "show", "table", "all"]
+
+    @classmethod
+    def load(cls, netns_name: str) -> "RouteTable":
+        route_table = cls(netns_name)
+        backend = get_backend()
+        for version in (4, 6):
+            cp = backend.run(cls.dump_cmd(version), netns_name, check=True, stdout=PIPE)
+            route_table.add_json_output(cp.stdout, version)
+        LOG.debug(f"Loaded {len(route_table)} prefixes from {netns_name} route tables")
+        return route_table
+
+    @classmethod
+    async def load_async(cls, netns_name: str) -> "RouteTable":
+        import asyncio
+
+        route_table = cls(netns_name)
+        backend = get_backend()
+        cps = await asyncio.gather(
+            *[
+                backend.run_async(
+                    cls.dump_cmd(version), netns_name, check=True, stdout=PIPE
+                )
+                for version in (4, 6)
+            ]
+        )
+        for version, cp in zip((4, 6), cps):
+            route_table.add_json_output(cp.stdout, version)
+        LOG.debug(f"Loaded {len(route_table)} prefixes from {netns_name} route tables")
+        return route_table
 
 
 @dataclass
 class Route:
+    __slots__ = ("name", "netns_name", "dest_prefix", "next_hop_ip", "egress_if_name")
     name: str
     netns_name: str
     dest_prefix: str
@@ -22,7 +135,10 @@ class Route:
 
     # TODO Add support for IPv4 via IPv6 next hops (should probably open separate issue)
     def __proto_match_validated(self) -> bool:
-        """Check to make sure the destination IP and next-hop match protocols (v4/v6)"""
+        """Check to make sure the destination IP and next-hop match protocols (v4/v6)
+        - Routes out an egress interface only have no next hop to match"""
+        if not self.next_hop_ip:
+            return True
         if ip_network(self.dest_prefix).version == ip_address(self.next_hop_ip).version:
             return True
         else:
@@ -31,6 +147,9 @@ class Route:
     def __route_validated(self) -> bool:
         """Check to make sure all elements exist that are needed for a valid route
         , then validate those elements"""
+        if not (self.next_hop_ip or self.egress_if_name):
+            LOG.error(f"{self.dest_prefix} needs a next hop IP or egress interface.")
+            return False
         if self.dest_prefix and (self.next_hop_ip or self.egress_if_name):
             # Check for bad destination prefix, if so skip route installation
             try:
@@ -48,99 +167,210 @@ class Route:
                 return False
         return True
 
-    def route_exists(self) -> bool:
-        """Checks if route exists already (maintain idempotency)"""
-        route_4_cmd = [
-            IP,
-            "netns",
-            "exec",
-            self.netns_name,
-            IP,
-            "route",
-            "show",
-        ]
-        route_6_cmd = [
-            IP,
-            "netns",
-            "exec",
-            self.netns_name,
-            IP,
-            "-6",
-            "route",
-            "show",
-        ]
-
-        cp = (check_output(route_4_cmd)).decode("utf-8")
-        cp = cp + (check_output(route_6_cmd)).decode("utf-8")
-
-        # Linux outputs host routes without /32 subnet mask
-        # Search for /32 in route, if doesn't exist search in table, return result
-        if self.dest_prefix.find("/32") == -1:
-            if cp.find(self.dest_prefix) == -1:
-                return False
-            else:
-                return True
-        # If /32 exists in route, strip it, search in table, return result
-        else:
-            if cp.find(self.dest_prefix.strip(r"\/32")) == -1:
-                return False
-            else:
-                return True
+    def route_exists(self, route_table: Optional[RouteTable] = None) -> bool:
+        """Checks if route exists already (maintain idempotency)
+        - Pass a RouteTable snapshot to avoid dumping the netns's routes per route"""
+        if route_table is None:
+            route_table = RouteTable.load(self.netns_name)
+        return self.dest_prefix in route_table
 
-    def get_route(self) -> List[str]:
-        """Generate cmd list for use with ns class"""
+    async def route_exists_async(
+        self, route_table: Optional[RouteTable] = None
+    ) -> bool:
+        if route_table is None:
+            route_table = await RouteTable.load_async(self.netns_name)
+        return self.dest_prefix in route_table
+
+    def validated(self) -> bool:
+        """Log why if the route can't be installed"""
         # check that it's a valid destination address and next hop format
         if not self.__route_validated():
             LOG.error(
                 f"Route validation failed, skipping installation of {self.dest_prefix}"
             )
-            return []
+            return False
         # check that the destination and next hop are members of same protocol (v4/v6)
         # Add support for IPv4 via IPv6 next hops (should probably open separate issue)
         if not self.__proto_match_validated():
             LOG.error(
                 f"Destination and next hop protocol mismatch, skipping installation of {self.dest_prefix}"
             )
+            return False
+        return True
+
+    def route_args(self) -> List[str]:
+        """What follows the destination prefix in `ip route add`"""
+        # send route with next hop ip and next hop interface
+        if self.next_hop_ip and self.egress_if_name:
+            return ["via", self.next_hop_ip, "dev", self.egress_if_name]
+        # send route with next hop ip
+        elif self.next_hop_ip:
+            return ["via", self.next_hop_ip]
+        # send route with next hop dev
+        return ["dev", self.egress_if_name]
+
+    def changed(self, route_state: RouteState) -> bool:
+        """Does the kernel's route to dest_prefix go somewhere else?"""
+        return bool(
+            route_state.nhid
+            or route_state.nexthops
+            or not same_address(self.next_hop_ip, route_state.gateway)
+            or (self.egress_if_name and self.egress_if_name != route_state.dev)
+        )
+
+    def get_route(
+        self, check_exists: bool = True, route_table: Optional[RouteTable] = None
+    ) -> List[str]:
+        """Generate cmd list for use with ns class
+        - check_exists=False skips the route table lookup (e.g. when batching)"""
+        if not self.validated():
+            count(ROUTES, result="invalid")
             return []
         # check to see if the destination prefix exists in the namespace route table
-        if self.route_exists():
+        if check_exists and self.route_exists(route_table):
             LOG.error(
                 f"Route already exists in table, skipping installation of {self.dest_prefix}"
             )
+            count(ROUTES, result="skipped")
             return []
-        # We have checked the route doesn't exist, generate cmd list:
-        # send route with next hop ip and next hop interface
-        if self.next_hop_ip and self.egress_if_name:
-            cmd = [
-                IP,
-                "route",
-                "add",
-                self.dest_prefix,
-                "via",
-                self.next_hop_ip,
-                "dev",
-                self.egress_if_name,
-            ]
+        # We have checked the route doesn't exist, generate cmd list
+        return [IP, "route", "add", self.dest_prefix] + self.route_args()
 
-        elif self.dest_prefix:
-            # send route with next hop ip
-            cmd = [
-                IP,
-                "route",
-                "add",
-                self.dest_prefix,
-                "via",
-                self.next_hop_ip,
-            ]
 
-        elif self.egress_if_name:
-            # send route with next hop dev
-            cmd = [
-                IP,
-                "route",
-                "add",
-                self.dest_prefix,
-                "dev",
-                self.egress_if_name,
-            ]
-        return cmd
+def valid_network(prefix: str) -> bool:
+    try:
+        ip_network(prefix)
+    except ValueError:
+        LOG.error(f"{prefix} is not a valid network address.")
+        return False
+    return True
+
+
+@dataclass
+class MultipathRoute(Route):
+    """An ECMP route - traffic is spread over weighted (next hop, egress) legs"""
+
+    __slots__ = ("hops",)
+    # (next_hop_ip, egress_if_name, weight)
+    hops: Tuple[Tuple[str, str, int], ...]
+
+    def validated(self) -> bool:
+        if not self.hops or not valid_network(self.dest_prefix):
+            LOG.error(
+                f"Route validation failed, skipping installation of {self.dest_prefix}"
+            )
+            return False
+        version = ip_network(self.dest_prefix).version
+        for next_hop_ip, egress_if_name, weight in self.hops:
+            if not (next_hop_ip or egress_if_name) or not 1 <= weight <= MAX_WEIGHT:
+                LOG.error(
+                    f"Invalid next hop {next_hop_ip or egress_if_name} (weight "
+                    + f"{weight}), skipping installation of {self.dest_prefix}"
+                )
+                return False
+            if next_hop_ip:
+                try:
+                    next_hop_version = ip_address(next_hop_ip).version
+                except ValueError:
+                    LOG.error(f"{next_hop_ip} is not a valid ip address.")
+                    return False
+                if next_hop_version != version:
+                    LOG.error(
+                        "Destination and next hop protocol mismatch, skipping "
+                        + f"installation of {self.dest_prefix}"
+                    )
+                    return False
+        return True
+
+    def changed(self, route_state: RouteState) -> bool:
+        if route_state.nhid or len(self.hops) != len(route_state.nexthops):
+            return True
+        unmatched = list(route_state.nexthops)
+        for next_hop_ip, egress_if_name, weight in self.hops:
+            for hop in unmatched:
+                if (
+                    same_address(next_hop_ip, hop[0])
+                    and (not egress_if_name or egress_if_name == hop[1])
+                    and weight == hop[2]
+                ):
+                    unmatched.remove(hop)
+                    break
+            else:
+                return True
+        return False
+
+    def route_args(self) -> List[str]:
+        args: List[str] = []
+        for next_hop_ip, egress_if_name, weight in self.hops:
+            args.append("nexthop")
+            if next_hop_ip:
+                args.extend(["via", next_hop_ip])
+            if egress_if_name:
+                args.extend(["dev", egress_if_name])
+            args.extend(["weight", str(weight)])
+        return args
+
+
+@dataclass
+class NexthopRoute(Route):
+    """A route via a shared nexthop object (nhid)
+    - Replacing the nexthop repoints every route using it at once"""
+
+    __slots__ = ("nexthop", "nhid")
+    nexthop: str
+    # 0 if the nexthop isn't configured in the namespace
+    nhid: int
+
+    def validated(self) -> bool:
+        if not valid_network(self.dest_prefix):
+            LOG.error(
+                f"Route validation failed, skipping installation of {self.dest_prefix}"
+            )
+            return False
+        if self.nhid < 1:
+            LOG.error(
+                f"No {self.nexthop} nexthop in {self.netns_name}, skipping "
+                + f"installation of {self.dest_prefix}"
+            )
+            return False
+        return True
+
+    def changed(self, route_state: RouteState) -> bool:
+        return self.nhid != route_state.nhid
+
+    def route_args(self) -> List[str]:
+        return ["nhid", str(self.nhid)]
+
+
+@dataclass
+class Nexthop:
+    """A shared `ip nexthop` object in a netns that routes point at by id
+    - Either a gateway (next_hop_ip and/or egress_if_name) or a group of other
+      nexthops' (id, weight)
+    - Always installed with replace, so it's idempotent + repoints its routes"""
+
+    __slots__ = ("name", "netns_name", "id", "next_hop_ip", "egress_if_name", "group")
+    name: str
+    netns_name: str
+    id: int
+    next_hop_ip: str
+    egress_if_name: str
+    group: Tuple[Tuple[int, int], ...]
+
+    def group_arg(self) -> str:
+        """id[,weight]/... as `ip nexthop` takes (and shows) it"""
+        return "/".join(
+            str(nh_id) if weight == 1 else f"{nh_id},{weight}"
+            for nh_id, weight in self.group
+        )
+
+    def replace_args(self) -> List[str]:
+        args = ["nexthop", "replace", "id", str(self.id)]
+        if self.group:
+            return args + ["group", self.group_arg()]
+        if self.next_hop_ip:
+            args.extend(["via", self.next_hop_ip])
+        return args + ["dev", self.egress_if_name]
+
+    def del_args(self) -> List[str]:
+        return ["nexthop", "del", "id", str(self.id)]
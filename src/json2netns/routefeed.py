@@ -0,0 +1,187 @@
+import gzip
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from json2netns.batch import Batch, BatchFailure, log_failures
+from json2netns.config import MAX_INTERFACE_NAME_LEN
+from json2netns.consts import DEFAULT_ROUTE_CHUNK_SIZE
+from json2netns.metrics import count, ROUTES
+from json2netns.model import network_range, parse_address, parse_prefix
+
+
+LOG = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 1.0
+# Only the first few bad lines of a file are logged - then just counted
+MAX_LOGGED_INVALID = 10
+# A header line naming the columns (dest_prefix,next_hop_ip,...) is skipped
+HEADER = "dest_prefix"
+
+
+def open_route_file(path: Path) -> TextIO:
+    """Route dumps are often compressed - .gz files are read as they stream"""
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    return path.open("r", encoding="utf-8")
+
+
+def file_version(route_file: str) -> List[int]:
+    """Size + mtime so config hashes change when a route file does, unread"""
+    try:
+        stat = Path(route_file).stat()
+    except OSError:
+        return [-1, 0]
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def parse_route_line(line: str) -> Optional[Tuple[str, str, str]]:
+    """dest_prefix,next_hop_ip[,egress_if_name] or the same whitespace separated
+    - None for blank + comment lines, raises ValueError if the route is invalid"""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    fields = [f.strip() for f in line.split(",")] if "," in line else line.split()
+    if len(fields) > 3:
+        raise ValueError(f"expected at most 3 fields, got {len(fields)}")
+    dest_prefix, next_hop_ip, egress_if_name = (fields + ["", ""])[:3]
+
+    version, addr, length = parse_prefix(dest_prefix)
+    if network_range(version, addr, length)[0] != addr:
+        raise ValueError(f"{dest_prefix} has host bits set")
+    if not next_hop_ip and not egress_if_name:
+        raise ValueError(f"{dest_prefix} has no next hop or egress interface")
+    if next_hop_ip and parse_address(next_hop_ip)[0] != version:
+        raise ValueError(f"{next_hop_ip} is not IPv{version} like {dest_prefix}")
+    if len(egress_if_name) > MAX_INTERFACE_NAME_LEN:
+        raise ValueError(f"{egress_if_name} is not a valid interface name")
+    return dest_prefix, next_hop_ip, egress_if_name
+
+
+def feed_route_args(next_hop_ip: str, egress_if_name: str) -> List[str]:
+    args = ["via", next_hop_ip] if next_hop_ip else []
+    return args + (["dev", egress_if_name] if egress_if_name else [])
+
+
+class RouteFile:
+    """A route_files file streamed a line at a time - never read into memory
+    - Yields (line number, dest_prefix, next_hop_ip, egress_if_name) of each
+      valid route, logging + counting the invalid ones"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.invalid = 0
+
+    def __iter__(self) -> Iterator[Tuple[int, str, str, str]]:
+        self.invalid = 0
+        with open_route_file(self.path) as rfp:
+            for line_number, line in enumerate(rfp, 1):
+                if line_number == 1 and line.startswith(HEADER):
+                    continue
+                try:
+                    route = parse_route_line(line)
+                except ValueError as ve:
+                    self.invalid += 1
+                    if self.invalid <= MAX_LOGGED_INVALID:
+                        LOG.error(f"{self.path}:{line_number}: {ve} - skipping")
+                    continue
+                if route:
+                    yield (line_number,) + route
+        if self.invalid > MAX_LOGGED_INVALID:
+            LOG.error(f"{self.path}: {self.invalid} invalid routes skipped")
+
+
+@dataclass
+class FeedStats:
+    installed: int = 0
+    invalid: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.installed / self.seconds if self.seconds else 0.0
+
+
+class RouteFeed:
+    """Install a namespace's route_files in chunks of `ip -batch` route replaces
+    - Only chunk_size routes are held at once, so 1M+ route tables are fine
+    - replace keeps re-runs idempotent + repoints routes going elsewhere
+    - Progress is logged per chunk, routes/sec at the end"""
+
+    def __init__(
+        self,
+        netns_name: str,
+        route_files: Iterable[str],
+        chunk_size: int = DEFAULT_ROUTE_CHUNK_SIZE,
+    ) -> None:
+        self.netns_name = netns_name
+        self.route_files = [Path(route_file) for route_file in route_files]
+        self.chunk_size = chunk_size
+        self.stats = FeedStats()
+        self.last_progress = 0.0
+
+    def chunks(self) -> Iterator[Tuple[Path, Batch]]:
+        for path in self.route_files:
+            route_file = RouteFile(path)
+            batch = Batch(self.netns_name)
+            try:
+                for line_number, dest_prefix, next_hop_ip, egress in route_file:
+                    batch.add(
+                        ["route", "replace", dest_prefix]
+                        + feed_route_args(next_hop_ip, egress),
+                        f"{path.name}:{line_number}",
+                    )
+                    if len(batch) >= self.chunk_size:
+                        yield path, batch
+                        batch = Batch(self.netns_name)
+            except (OSError, UnicodeDecodeError) as err:
+                LOG.error(f"Unable to read route file {path}: {err}")
+                self.stats.failed += 1
+            if batch:
+                yield path, batch
+            self.stats.invalid += route_file.invalid
+            count(ROUTES, route_file.invalid, result="invalid")
+
+    def _chunk_done(
+        self, path: Path, batch: Batch, failures: List[BatchFailure], start: float
+    ) -> None:
+        log_failures(failures, self.netns_name)
+        self.stats.installed += len(batch) - len(failures)
+        self.stats.failed += len(failures)
+        self.stats.seconds = monotonic() - start
+        count(ROUTES, len(batch) - len(failures), result="installed")
+        count(ROUTES, len(failures), result="failed")
+        if self.stats.seconds - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = self.stats.seconds
+            LOG.info(
+                f"{self.netns_name} namespace: {self.stats.installed:,} routes "
+                + f"installed ({path.name}, {self.stats.rate:,.0f} routes/s)"
+            )
+
+    def _finished(self) -> FeedStats:
+        LOG.info(
+            f"Installed {self.stats.installed:,} routes from {len(self.route_files)} "
+            + f"route files into {self.netns_name} namespace in "
+            + f"{self.stats.seconds:.1f}s ({self.stats.rate:,.0f} routes/s) - "
+            + f"{self.stats.invalid} invalid, {self.stats.failed} failed"
+        )
+        return self.stats
+
+    def install(self) -> FeedStats:
+        start = monotonic()
+        for path, batch in self.chunks():
+            self._chunk_done(path, batch, batch.run(), start)
+        self.stats.seconds = monotonic() - start
+        return self._finished()
+
+    async def install_async(self) -> FeedStats:
+        """Coroutine install() - chunks still go one at a time, the kernel takes
+        route changes one at a time anyway"""
+        start = monotonic()
+        for path, batch in self.chunks():
+            self._chunk_done(path, batch, await batch.run_async(), start)
+        self.stats.seconds = monotonic() - start
+        return self._finished()
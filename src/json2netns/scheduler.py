@@ -0,0 +1,193 @@
+import logging
+from dataclasses import dataclass, field
+from inspect import iscoroutinefunction
+from time import monotonic
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from json2netns.nsenter import NetnsWorkerPool
+
+
+LOG = logging.getLogger(__name__)
+
+
+@dataclass
+class Task:
+    name: str
+    func: Callable[[], Any]
+    deps: Set[str] = field(default_factory=set)
+    # Which netns a worker should run func in ("" is the default netns)
+    netns_name: str = ""
+    # Namespaces this task helps build - for working out which fully succeeded
+    owners: Set[str] = field(default_factory=set)
+    start: float = 0.0
+    end: float = 0.0
+    error: Optional[BaseException] = None
+    skipped: bool = False
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class TaskGraph:
+    """DAG of tasks ran on a NetnsWorkerPool as soon as their dependencies finish
+    - Coroutine function tasks are awaited on the event loop (no worker thread)
+    - A failed task's dependents (+ theirs) are skipped; other branches carry on"""
+
+    def __init__(self) -> None:
+        self.tasks: Dict[str, Task] = {}
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        deps: Iterable[str] = (),
+        netns_name: str = "",
+        owners: Iterable[str] = (),
+    ) -> Task:
+        if name in self.tasks:
+            raise ValueError(f"Task {name} is already in the graph")
+        task = Task(name, func, set(deps), netns_name, set(owners))
+        self.tasks[name] = task
+        return task
+
+    def topological_order(self) -> List[Task]:
+        """Kahn's algorithm - raises ValueError on unknown deps or cycles"""
+        dependents: Dict[str, List[str]] = {name: [] for name in self.tasks}
+        waiting: Dict[str, int] = {}
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep not in self.tasks:
+                    raise ValueError(f"{task.name} depends on unknown task {dep}")
+                dependents[dep].append(task.name)
+            waiting[task.name] = len(task.deps)
+
+        ready = [name for name, count in waiting.items() if count == 0]
+        order: List[Task] = []
+        while ready:
+            name = ready.pop()
+            order.append(self.tasks[name])
+            for dependent in dependents[name]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(order) != len(self.tasks):
+            cycle = sorted(set(self.tasks) - {task.name for task in order})
+            raise ValueError(f"Task graph has a cycle involving: {', '.join(cycle)}")
+        return order
+
+    def _run_task(self, task: Task) -> None:
+        task.start = monotonic()
+        try:
+            task.func()
+        finally:
+            task.end = monotonic()
+
+    async def _run_task_async(self, task: Task) -> None:
+        task.start = monotonic()
+        try:
+            await task.func()
+        finally:
+            task.end = monotonic()
+
+    async def run(self, pool: NetnsWorkerPool) -> List[Task]:
+        """Run every task - returns the failed + skipped tasks"""
+        import asyncio
+
+        self.topological_order()
+        dependents: Dict[str, List[str]] = {name: [] for name in self.tasks}
+        waiting: Dict[str, int] = {}
+        for task in self.tasks.values():
+            for dep in task.deps:
+                dependents[dep].append(task.name)
+            waiting[task.name] = len(task.deps)
+
+        not_ok: List[Task] = []
+
+        def skip_dependents(name: str) -> None:
+            for dependent in dependents[name]:
+                dep_task = self.tasks[dependent]
+                if not dep_task.skipped:
+                    dep_task.skipped = True
+                    not_ok.append(dep_task)
+                    skip_dependents(dependent)
+
+        running: Dict[asyncio.Future, Task] = {}
+
+        def submit(name: str) -> None:
+            task = self.tasks[name]
+            if task.skipped:
+                return
+            if iscoroutinefunction(task.func):
+                future = asyncio.ensure_future(self._run_task_async(task))
+            else:
+                future = asyncio.ensure_future(
+                    pool.run(task.netns_name, self._run_task, task)
+                )
+            running[future] = task
+
+        for name, count in waiting.items():
+            if count == 0:
+                submit(name)
+
+        while running:
+            done, _ = await asyncio.wait(
+                running.keys(), return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                task = running.pop(future)
+                if future.exception():
+                    task.error = future.exception()
+                    LOG.error(f"Task {task.name} failed: {task.error}")
+                    not_ok.append(task)
+                    skip_dependents(task.name)
+                    continue
+
+                LOG.debug(f"Task {task.name} took {task.duration:.3f}s")
+                for dependent in dependents[task.name]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        submit(dependent)
+
+        for task in not_ok:
+            if task.skipped:
+                LOG.error(f"Skipped {task.name} as a dependency failed")
+        return not_ok
+
+    def failed_owners(self, not_ok: Iterable[Task]) -> Set[str]:
+        owners: Set[str] = set()
+        for task in not_ok:
+            owners.update(task.owners)
+        return owners
+
+    def critical_path(self) -> List[Task]:
+        """Longest chain of dependent tasks by run time"""
+        finish: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+        for task in self.topological_order():
+            longest_dep = max(task.deps, key=lambda dep: finish[dep], default=None)
+            previous[task.name] = longest_dep
+            finish[task.name] = task.duration + (
+                finish[longest_dep] if longest_dep else 0.0
+            )
+
+        if not finish:
+            return []
+        name: Optional[str] = max(finish, key=lambda task_name: finish[task_name])
+        path: List[Task] = []
+        while name:
+            path.append(self.tasks[name])
+            name = previous[name]
+        return list(reversed(path))
+
+    def log_critical_path(self) -> None:
+        path = self.critical_path()
+        if not path:
+            return
+        total = sum(task.duration for task in path)
+        steps = " -> ".join(f"{task.name} ({task.duration:.3f}s)" for task in path)
+        LOG.info(f"Critical path {total:.3f}s over {len(self)} tasks: {steps}")
@@ -0,0 +1,132 @@
+import logging
+from time import monotonic, sleep
+from typing import Dict, List, Set
+
+from json2netns.batch import Batch, BatchFailure, log_failures
+from json2netns.consts import DEFAULT_TEARDOWN_TIMEOUT
+from json2netns.inventory import get_inventory, LinkInventory
+from json2netns.metrics import count, NAMESPACES
+from json2netns.netns import LazyNamespaces
+from json2netns.nsenter import netns_path
+from json2netns.trace import traced
+
+
+LOG = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 1.0
+
+
+def namespace_links(ns_config: Dict) -> Set[str]:
+    """Links a namespace's config creates - veth peers + its oob macvlan too"""
+    names: Set[str] = set()
+    for int_name, int_conf in ns_config["interfaces"].items():
+        if int_conf["type"].lower() in {"lo", "loopback"}:
+            continue
+        names.add(int_name)
+        if int_conf["type"].lower() == "veth":
+            names.add(int_conf["peer_name"])
+    if ns_config["oob"]:
+        names.add(f"oob{ns_config['id']}")
+    return names
+
+
+class Teardown:
+    """Fast delete of many namespaces
+    - One `ip -force -batch` deletes every netns + the global oob device
+    - No per interface deletes - links die with their netns
+    - wait() polls /run/netns + the default netns links until the kernel is done
+    - Works off names + the raw config - never builds a Namespace"""
+
+    def __init__(
+        self,
+        namespaces: LazyNamespaces,
+        oob_interface_name: str,
+        timeout: float = DEFAULT_TEARDOWN_TIMEOUT,
+        poll_interval: float = 0.1,
+    ) -> None:
+        self.namespaces = namespaces
+        self.oob_interface_name = oob_interface_name
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        inventory = get_inventory()
+        self.inventory = inventory if inventory else LinkInventory()
+        self.leftover_links: Set[str] = set()
+
+    def _default_netns_links(self) -> Set[str]:
+        """Fresh dump of the default netns links"""
+        self.inventory.forget("")
+        return self.inventory.links_in("")
+
+    def _doomed_links(self) -> Set[str]:
+        """Links the kernel destroys when the namespaces go
+        - e.g. veth peers left in the default netns"""
+        names: Set[str] = set()
+        for ns_name in self.namespaces:
+            names.update(namespace_links(self.namespaces.config["namespaces"][ns_name]))
+        return names
+
+    def batch(self) -> Batch:
+        batch = Batch()
+        for ns_name in self.namespaces:
+            if netns_path(ns_name).exists():
+                batch.add(["netns", "del", ns_name], f"delete {ns_name} namespace")
+                count(NAMESPACES, result="deleted")
+            else:
+                count(NAMESPACES, result="skipped")
+
+        default_links = self._default_netns_links()
+        if self.oob_interface_name in default_links:
+            batch.add(
+                ["link", "del", self.oob_interface_name],
+                f"delete global oob {self.oob_interface_name}",
+            )
+        self.leftover_links = self._doomed_links() & default_links
+        return batch
+
+    def pending(self) -> List[str]:
+        """Namespaces + links the kernel has not finished removing"""
+        remaining = [
+            ns_name for ns_name in self.namespaces if netns_path(ns_name).exists()
+        ]
+        if self.leftover_links:
+            self.leftover_links &= self._default_netns_links()
+            remaining.extend(sorted(self.leftover_links))
+        return remaining
+
+    @traced
+    def wait(self) -> List[str]:
+        """Poll until everything is gone or we time out - returns what is left"""
+        start = monotonic()
+        last_progress = start
+        total = len(self.namespaces) + len(self.leftover_links)
+        remaining = self.pending()
+        while remaining and monotonic() - start < self.timeout:
+            now = monotonic()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                LOG.info(
+                    f"Teardown: {total - len(remaining)}/{total} namespaces + "
+                    + f"links gone ({now - start:.1f}s)"
+                )
+                last_progress = now
+            sleep(self.poll_interval)
+            remaining = self.pending()
+
+        elapsed = monotonic() - start
+        if remaining:
+            LOG.error(
+                f"Teardown timed out after {elapsed:.1f}s with {len(remaining)} "
+                + f"left: {', '.join(remaining[:10])}"
+            )
+        else:
+            LOG.info(f"Teardown: all {total} namespaces + links gone ({elapsed:.1f}s)")
+        return remaining
+
+    @traced
+    def run(self) -> List[BatchFailure]:
+        batch = self.batch()
+        LOG.info(f"Deleting {len(batch)} namespaces + devices via one ip -batch")
+        failures = batch.run()
+        log_failures(failures)
+        for ns_name in self.namespaces:
+            self.inventory.forget(ns_name)
+        return failures
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+from subprocess import CalledProcessError, PIPE
+from typing import Any, List, Optional
+from unittest.mock import patch
+
+from json2netns.backend import get_backend, set_backend, SubprocessBackend
+
+
+BASE_MODULE = "json2netns.backend"
+IP = "/usr/sbin/ip"
+
+
+class BackendTests(unittest.TestCase):
+    def test_set_backend(self) -> None:
+        new_backend = SubprocessBackend()
+        previous = set_backend(new_backend)
+        try:
+            self.assertIs(new_backend, get_backend())
+        finally:
+            set_backend(previous)
+
+    def test_subprocess_run(self) -> None:
+        backend = SubprocessBackend()
+        with patch(f"{BASE_MODULE}.run") as mock_run:
+            backend.run([IP, "link", "show"], check=False)
+            self.assertEqual([IP, "link", "show"], mock_run.call_args[0][0])
+            backend.run([IP, "link", "show"], "left", check=False)
+            self.assertEqual(
+                [IP, "netns", "exec", "left", IP, "link", "show"],
+                mock_run.call_args[0][0],
+            )
+            self.assertEqual({"check": False}, mock_run.call_args[1])
+
+    def test_subprocess_run_async(self) -> None:
+        backend = SubprocessBackend()
+        cp = asyncio.run(
+            backend.run_async(["echo", "hi"], stdout=PIPE, encoding="utf-8")
+        )
+        self.assertEqual("hi\n", cp.stdout)
+        with self.assertRaises(CalledProcessError):
+            asyncio.run(backend.run_async(["false"], check=True))
+
+    def test_run_async_bounded(self) -> None:
+        backend = SubprocessBackend(max_in_flight=2)
+        calls: List[Any] = []
+        in_flight = [0, 0]
+
+        class FakeProc:
+            returncode = 0
+
+            async def communicate(self, input: Optional[bytes] = None) -> Any:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+                await asyncio.sleep(0.01)
+                in_flight[0] -= 1
+                return b"", b""
+
+        async def fake_exec(*cmd: str, **kwargs: Any) -> FakeProc:
+            calls.append(cmd)
+            return FakeProc()
+
+        async def run_many() -> None:
+            await asyncio.gather(
+                *[backend.run_async([IP, "link", "show"], "left") for _ in range(6)]
+            )
+
+        with patch("asyncio.create_subprocess_exec", fake_exec):
+            asyncio.run(run_many())
+        self.assertEqual(6, len(calls))
+        self.assertEqual(2, in_flight[1])
+        self.assertEqual((IP, "netns", "exec", "left", IP, "link", "show"), calls[0])
@@ -2,15 +2,44 @@
 
 import argparse
 import asyncio
+import sys
 import unittest
+from functools import partial
+from json import loads
 from pathlib import Path
+from subprocess import CompletedProcess, PIPE, run
+from tempfile import TemporaryDirectory
+from typing import Any, Sequence
 from unittest.mock import patch
 
 import json2netns.main
+from json2netns.backend import set_backend
 from json2netns.config import Config
+from json2netns.dryrun import dry_run_host, DryRunBackend
+from json2netns.journal import AppliedJournal
+from json2netns.tests.backend import BackendTests  # noqa: F401
+from json2netns.tests.batch import BatchTests  # noqa: F401
+from json2netns.tests.dryrun import DryRunTests  # noqa: F401
 from json2netns.tests.interfaces import InterfaceTests  # noqa: F401
+from json2netns.tests.inventory import InventoryTests  # noqa: F401
+from json2netns.tests.journal import JournalTests  # noqa: F401
+from json2netns.tests.metrics import MetricsTests  # noqa: F401
+from json2netns.tests.model import ModelTests  # noqa: F401
+from json2netns.tests.netlink import (  # noqa: F401
+    NetlinkAttributeTests,
+    NetlinkBackendTests,
+    NetlinkSocketTests,
+)
 from json2netns.tests.netns import NetNSTests  # noqa: F401
+from json2netns.tests.nsenter import NsenterTests  # noqa: F401
+from json2netns.tests.plancache import PlanCacheTests  # noqa: F401
+from json2netns.tests.reconcile import ReconcileTests  # noqa: F401
 from json2netns.tests.route import RouteTests  # noqa: F401
+from json2netns.tests.routefeed import RouteFeedTests  # noqa: F401
+from json2netns.tests.scheduler import SchedulerTests  # noqa: F401
+from json2netns.tests.teardown import TeardownTests  # noqa: F401
+from json2netns.tests.trace import TraceTests  # noqa: F401
+from json2netns.tests.watch import WatchTests  # noqa: F401
 
 
 BASE_PATH = Path(__file__).parent.parent.resolve()
@@ -25,28 +54,185 @@ class MainTests(unittest.TestCase):
 
     def test_async_main_check(self) -> None:
         ns = argparse.Namespace(
-            action="check", config=str(SAMPLE_CONF), debug=True, workers=1
+            action="check",
+            config=str(SAMPLE_CONF),
+            debug=True,
+            json=False,
+            namespace=None,
+            setns=False,
+            validate=True,
+            workers=1,
         )
-        with patch("json2netns.netns.Namespace.check") as mock_check, patch(
-            "json2netns.main.print"
-        ) as mock_print, patch("json2netns.main.amiroot", returm_value=True):
+        with patch(
+            "json2netns.backend.run",
+            return_value=CompletedProcess([], 0, "[]\n", ""),
+        ) as mock_run, patch("json2netns.main.print") as mock_print, patch(
+            "json2netns.main.amiroot", returm_value=True
+        ):
+            self.assertEqual(0, asyncio.run(json2netns.main.async_main(ns)))
+            # 3 check commands per namespace + one print of every namespace
+            self.assertEqual(6, mock_run.call_count)
+            self.assertEqual(1, mock_print.call_count)
+            self.assertTrue(mock_print.call_args[0][0].startswith("# Checking left\n"))
+
+            ns.json = True
+            self.assertEqual(0, asyncio.run(json2netns.main.async_main(ns)))
+            check_json = loads(mock_print.call_args[0][0])
+            self.assertEqual(["left", "right"], sorted(check_json["namespaces"]))
+            self.assertEqual([], check_json["namespaces"]["left"]["routes_v6"])
+            self.assertIn("-j", mock_run.call_args[0][0])
+
+            # Only the selected namespaces are built + checked
+            ns.namespace = ["right"]
+            mock_run.reset_mock()
             self.assertEqual(0, asyncio.run(json2netns.main.async_main(ns)))
-            self.assertEqual(2, mock_check.call_count)
-            self.assertEqual(3, mock_print.call_count)
+            self.assertEqual(
+                ["right"], list(loads(mock_print.call_args[0][0])["namespaces"])
+            )
+            self.assertEqual(3, mock_run.call_count)
+
+            ns.namespace = ["right", "middle"]
+            with patch("json2netns.main.LOG.error") as mock_error:
+                self.assertEqual(2, asyncio.run(json2netns.main.async_main(ns)))
+                self.assertIn("middle", mock_error.call_args[0][0])
+
+    def test_async_main_create_failed_routes(self) -> None:
+        def fail_routes(
+            dry_run: DryRunBackend,
+            cmd: Sequence[str],
+            netns_name: str = "",
+            **kwargs: Any,
+        ) -> CompletedProcess:
+            cp = DryRunBackend.run(dry_run, cmd, netns_name, **kwargs)
+            if "-batch" in cmd and "route replace" in kwargs.get("input", ""):
+                cp.returncode = 2
+                cp.stderr = "Error: Nexthop has invalid gateway.\nCommand failed -:1\n"
+            return cp
+
+        with dry_run_host() as (dry_run, state_dir):
+            ns = argparse.Namespace(
+                action="create",
+                asyncio=False,
+                batch=False,
+                config=str(SAMPLE_CONF),
+                force=False,
+                namespace=None,
+                setns=False,
+                state_dir=str(state_dir),
+                validate=False,
+                workers=1,
+            )
+            previous_backend = set_backend(dry_run)
+            try:
+                with patch.object(
+                    dry_run, "run", side_effect=partial(fail_routes, dry_run)
+                ), patch("json2netns.batch.LOG.error"), patch(
+                    "json2netns.scheduler.LOG.error"
+                ), patch(
+                    "json2netns.main.LOG.error"
+                ):
+                    self.assertEqual(12, asyncio.run(json2netns.main.async_main(ns)))
+            finally:
+                set_backend(previous_backend)
+            # Neither namespace is journaled so the next create retries them
+            journal = AppliedJournal(state_dir)
+            journal.load()
+            self.assertEqual({}, journal.hashes)
+
+    def test_check_main(self) -> None:
+        ns = argparse.Namespace(
+            action="check",
+            config=str(SAMPLE_CONF),
+            json=False,
+            namespace=["left"],
+            setns=False,
+            validate=False,
+            workers=2,
+        )
+        with patch(
+            "json2netns.backend.run",
+            return_value=CompletedProcess([], 0, "[]\n", ""),
+        ) as mock_run, patch("json2netns.main.print") as mock_print:
+            self.assertEqual(0, json2netns.main.check_main(ns))
+            self.assertEqual(3, mock_run.call_count)
+            self.assertTrue(mock_print.call_args[0][0].startswith("# Checking left\n"))
+
+    def test_lazy_imports(self) -> None:
+        # check + --help never import asyncio or the modules only other actions use
+        cp = run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, json2netns.main, json2netns.netns; "
+                + "print(' '.join(sorted(sys.modules)))",
+            ],
+            check=True,
+            cwd=BASE_PATH.parent,
+            stdout=PIPE,
+            encoding="utf-8",
+        )
+        modules = set(cp.stdout.split())
+        self.assertIn("json2netns.netns", modules)
+        for module in (
+            "asyncio",
+            "importlib.metadata",
+            "json2netns.netlink",
+            "json2netns.plancache",
+            "json2netns.reconcile",
+        ):
+            self.assertNotIn(module, modules)
 
     def test_main(self) -> None:
         ns = argparse.Namespace(
-            action="check", config=str(SAMPLE_CONF), debug=True, workers=1
+            action="check",
+            backend="subprocess",
+            config=str(SAMPLE_CONF),
+            debug=True,
+            dry_run=False,
+            dry_run_batch="",
+            max_in_flight=64,
+            metrics="",
+            namespace=None,
+            plan_cache=False,
+            trace="",
+            workers=1,
         )
         with patch(
             "argparse.ArgumentParser.parse_args", return_value=ns
-        ) as mock_pa, patch(
+        ) as mock_pa, patch("json2netns.main.amiroot", return_value=True), patch(
+            "json2netns.main.check_main", return_value=0
+        ) as mock_check_main, patch(
             "json2netns.main.async_main", return_value=0
         ) as mock_async_main:
             self.assertEqual(0, json2netns.main.main())
-            self.assertEqual(1, mock_async_main.call_count)
+            # check runs without an event loop
+            self.assertEqual(1, mock_check_main.call_count)
+            self.assertEqual(0, mock_async_main.call_count)
             self.assertEqual(1, mock_pa.call_count)
 
+            ns.action = "create"
+            self.assertEqual(0, json2netns.main.main())
+            self.assertEqual(1, mock_async_main.call_count)
+
+    def test_main_not_root(self) -> None:
+        ns = argparse.Namespace(
+            action="check",
+            config=str(SAMPLE_CONF),
+            debug=False,
+            dry_run=False,
+            dry_run_batch="",
+            plan_cache=False,
+            setns=False,
+        )
+        # Privileges are checked before the config is loaded
+        with patch("argparse.ArgumentParser.parse_args", return_value=ns), patch(
+            "json2netns.main.amiroot", return_value=False
+        ), patch("json2netns.main.LOG.error"), patch(
+            "json2netns.main.load_namespaces"
+        ) as mock_load:
+            self.assertEqual(69, json2netns.main.main())
+            self.assertEqual(0, mock_load.call_count)
+
     def test_bad_args(self) -> None:
         ns = argparse.Namespace(
             action="check", config=str(BASE_PATH / "not_there"), debug=True, workers=1
@@ -57,6 +243,17 @@ class MainTests(unittest.TestCase):
         ns.config = str(SAMPLE_CONF)
         self.assertEqual(2, json2netns.main.validate_args(ns))
 
+        ns.action = "check"
+        ns.dry_run = True
+        ns.dry_run_batch = ""
+        ns.plan_cache = False
+        ns.setns = False
+        self.assertEqual(2, json2netns.main.validate_args(ns))
+        ns.action = "create"
+        self.assertEqual(0, json2netns.main.validate_args(ns))
+        ns.setns = True
+        self.assertEqual(2, json2netns.main.validate_args(ns))
+
 
 class ConfigTests(unittest.TestCase):
     def setUp(self) -> None:
@@ -65,6 +262,192 @@ class ConfigTests(unittest.TestCase):
     def test_load_config(self) -> None:
         self.assertTrue(isinstance(self.config.load(), dict))
 
+    def test_load_streaming(self) -> None:
+        loaded = self.config.load()
+        for chunk_size in (1, 7, 4096):
+            self.assertEqual(loaded, self.config.load_streaming(chunk_size))
+        self.assertEqual(
+            ["left", "right"],
+            [ns_name for ns_name, _ in self.config.iter_namespaces(chunk_size=5)],
+        )
+
+        with TemporaryDirectory() as td:
+            config = Config(Path(td) / "topology.json")
+            config.path.write_text('{"namespaces": {}, "physical_int": 1234}')
+            self.assertEqual(
+                {"namespaces": {}, "physical_int": 1234}, config.load_streaming(2)
+            )
+            config.path.write_text('{"namespaces": {"left": {"id": 1')
+            with self.assertRaises(ValueError):
+                config.load_streaming(4)
+            config.path.write_text('{"namespaces": {}} []')
+            with self.assertRaises(ValueError):
+                config.load_streaming()
+            config.path.write_text('{"namespaces": [], 1: 2}')
+            with self.assertRaises(ValueError):
+                config.load_streaming()
+
+    def test_validate(self) -> None:
+        self.assertEqual([], self.config.validate(self.config.load()))
+
+    def test_validate_errors(self) -> None:
+        topology = self.config.load()
+        left = topology["namespaces"]["left"]
+        right = topology["namespaces"]["right"]
+        right["id"] = 1
+        left["interfaces"]["left0"]["peer_name"] = "right1"
+        left["interfaces"]["lo"]["prefixes"].append("10.1.1.0/25")
+        right["interfaces"]["lo"]["prefixes"].append("10.6.9.1/32")
+        left["routes"]["route1"]["next_hop_ip"] = "10.1.2.2"
+        left["routes"]["route2"]["egress_if_name"] = "left1"
+        right["routes"]["route1"]["dest_prefix"] = "10.6.9.5/24"
+        right["routes"]["route2"]["next_hop_ip"] = "10.1.1.1"
+        with patch("json2netns.config.LOG.error"):
+            errors = self.config.validate(topology)
+        self.assertEqual(
+            [
+                "right: id 1 is already used by left",
+                "left left0: veth peer right1 is not configured",
+                "right right0: peer left0 (left) has peer_name right1, not right0",
+                "right lo: address 10.6.9.1 is also on left lo",
+                # Duplicate ids mean duplicate oob addresses
+                "right oob1: address 10.255.255.1 is also on left oob1",
+                "right oob1: address fddd::1 is also on left oob1",
+                "left left0: 10.1.1.1/24 overlaps 10.1.1.0/25 on lo",
+                "left route1: next hop 10.1.2.2 is not connected",
+                "left route2: egress interface left1 does not exist",
+                "left route2: next hop fd00::2 is not connected via left1",
+                "right route1: 10.6.9.5/24 has host bits set",
+                "right route2: next hop 10.1.1.1 is not IPv6",
+            ],
+            errors,
+        )
+
+    def test_validate_route_files(self) -> None:
+        topology = self.config.load()
+        topology["namespaces"]["left"]["route_files"] = [str(SAMPLE_CONF)]
+        self.assertEqual([], self.config.validate(topology))
+        topology["namespaces"]["left"]["route_files"] = ["/not_there.csv"]
+        topology["namespaces"]["right"]["route_files"] = "/routes.csv"
+        with patch("json2netns.config.LOG.error"):
+            self.assertEqual(
+                [
+                    "left: route file /not_there.csv does not exist",
+                    "right: route_files must be a list of file paths",
+                ],
+                self.config.validate(topology),
+            )
+
+    def test_validate_nexthops(self) -> None:
+        topology = self.config.load()
+        left = topology["namespaces"]["left"]
+        left["nexthops"] = {
+            "right": {"id": 1, "next_hop_ip": "10.1.1.2", "egress_if_name": "left0"},
+            "right6": {"id": 2, "next_hop_ip": "fd00::2", "egress_if_name": "left0"},
+            "lo": {"id": 3, "egress_if_name": "lo"},
+            "ecmp": {"id": 10, "group": {"right": 1, "lo": 256}},
+        }
+        left["routes"]["shared"] = {"dest_prefix": "10.7.0.0/16", "nexthop": "ecmp"}
+        left["routes"]["multipath"] = {
+            "dest_prefix": "fd00:7::/64",
+            "multipath": [
+                {"next_hop_ip": "fd00::2", "weight": 2},
+                {"next_hop_ip": "fd00::3", "egress_if_name": "left0"},
+            ],
+        }
+        self.assertEqual([], self.config.validate(topology))
+
+        left["nexthops"].update(
+            {
+                "dup": {"id": 1, "next_hop_ip": "10.1.1.3", "egress_if_name": "left0"},
+                "nodev": {"id": 4, "next_hop_ip": "10.1.1.3"},
+                "far": {"id": 5, "next_hop_ip": "10.9.9.9", "egress_if_name": "left0"},
+                "mixed": {"id": 11, "group": {"right": 1, "right6": 1}},
+                "nested": {"id": 12, "group": {"ecmp": 1, "missing": 0}},
+                "empty": {"id": 0, "group": {}},
+            }
+        )
+        left["routes"]["shared6"] = {"dest_prefix": "fd00:8::/64", "nexthop": "ecmp"}
+        left["routes"]["unknown"] = {"dest_prefix": "10.8.0.0/16", "nexthop": "nope"}
+        left["routes"]["multipath"]["multipath"].append(
+            {"next_hop_ip": "10.1.1.2", "weight": 257}
+        )
+        left["routes"]["no_legs"] = {"dest_prefix": "10.9.0.0/16", "multipath": []}
+        with patch("json2netns.config.LOG.error"):
+            errors = self.config.validate(topology)
+        self.assertEqual(
+            [
+                "left nexthop dup: id 1 is already used by right",
+                "left nexthop nodev: needs an egress_if_name",
+                "left nexthop far: next hop 10.9.9.9 is not connected via left0",
+                "left nexthop empty: id must be an integer 1 - 4294967295",
+                "left nexthop mixed: group mixes IPv4 and IPv6 nexthops",
+                "left nexthop nested: group member ecmp is a group",
+                "left nexthop nested: group member missing is not configured",
+                "left nexthop nested: missing weight must be 1 - 256",
+                "left nexthop empty: group needs at least one nexthop",
+                "left multipath: weight must be 1 - 256",
+                "left multipath: next hop 10.1.1.2 is not IPv6",
+                "left shared6: nexthop ecmp is not IPv6",
+                "left unknown: nexthop nope is not configured",
+                "left no_legs: multipath needs at least one next hop",
+            ],
+            errors,
+        )
+
+    def test_validate_bad_values(self) -> None:
+        topology = self.config.load()
+        del topology["physical_int"]
+        topology["oob"]["prefixes"] = ["10.255.255.0/31", "fddd::/129"]
+        left = topology["namespaces"]["left"]
+        left["id"] = "1"
+        left["interfaces"]["left0"]["prefixes"] = ["10.1.1.256/24"]
+        left["interfaces"]["mv0"] = {"type": "macvlan", "prefixes": []}
+        left["interfaces"]["tun0"] = {"type": "tun", "prefixes": []}
+        right = topology["namespaces"]["right"]
+        right["interfaces"]["right0"]["peer_name"] = ""
+        right["interfaces"]["a_very_long_veth_name"] = {
+            "type": "veth",
+            "peer_name": "left0",
+        }
+        right["routes"]["route1"] = {"dest_prefix": "10.6.9.5", "next_hop_ip": ""}
+        right["routes"]["route2"]["dest_prefix"] = "fd00:5::/xx"
+        topology["namespaces"]["a/b"] = {
+            "id": 3,
+            "interfaces": {"left0": {"type": "veth", "peer_name": "right0"}},
+            "oob": False,
+            "routes": {"route1": {"dest_prefix": "::/0", "next_hop_ip": "fd00::z"}},
+        }
+        with patch("json2netns.config.LOG.error"):
+            errors = self.config.validate(topology)
+        self.assertEqual(
+            [
+                "left: id must be an integer > 0 (got 1)",
+                "left left0: 10.1.1.256 is not a valid IP address",
+                "left mv0: macvlan needs a physical_int",
+                "left tun0: unsupported type 'tun'",
+                "left: oob needs a physical_int",
+                "right a_very_long_veth_name: not a valid interface name",
+                "right: oob needs a physical_int",
+                "right: id 2 does not fit in oob 10.255.255.0/31",
+                "oob: fddd::/129 has an invalid prefix length",
+                "'a/b' is not a valid namespace name",
+                "a/b left0: veth name already used in left (veths are created in one "
+                + "netns)",
+                "a/b left0: peer right0 (right) has peer_name , not left0",
+                "right right0: veth has no peer_name",
+                "right a_very_long_veth_name: peer left0 (a/b) has peer_name right0, "
+                + "not a_very_long_veth_name",
+                "left route1: next hop 10.1.1.2 is not connected",
+                "left route2: next hop fd00::2 is not connected",
+                "right route1: needs a next_hop_ip or egress_if_name",
+                "right route2: fd00:5::/xx has an invalid prefix length",
+                "a/b route1: fd00::z is not a valid IP address",
+            ],
+            errors,
+        )
+        self.assertEqual(["Config has no namespaces"], self.config.validate({}))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import unittest
+from subprocess import CompletedProcess
+from unittest.mock import patch
+
+from json2netns.batch import Batch
+
+
+BASE_BACKEND_MODULE = "json2netns.backend"
+IP_BATCH_STDERR = """\
+RTNETLINK answers: File exists
+Command failed -:1
+Error: ipv4: Address already assigned.
+Command failed -:2
+Cannot find device "left0"
+Command failed -:3
+Cannot find device "nope"
+Command failed -:4
+"""
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.batch = Batch("left")
+        self.batch.add(
+            ["link", "add", "left0", "type", "veth", "peer", "right0"],
+            "create veth left0",
+            exists_ok=True,
+        )
+        self.batch.add(
+            ["addr", "add", "10.1.1.1/24", "dev", "left0"],
+            "add 10.1.1.1/24 to left0",
+            exists_ok=True,
+        )
+        self.batch.add(
+            ["link", "set", "up", "dev", "left0"], "set left0 link up", check=False
+        )
+        self.batch.add(
+            ["route", "add", "10.6.9.6/32", "via", "10.1.1.2", "dev", "nope"],
+            "route route1 to 10.6.9.6/32",
+        )
+
+    def test_cmd(self) -> None:
+        self.assertEqual(
+            ["/usr/sbin/ip", "-n", "left", "-force", "-batch", "-"], self.batch.cmd()
+        )
+        self.assertEqual(["/usr/sbin/ip", "-force", "-batch", "-"], Batch().cmd())
+
+    def test_lines(self) -> None:
+        self.assertEqual(4, len(self.batch))
+        self.assertEqual("addr add 10.1.1.1/24 dev left0", self.batch.lines()[1])
+
+    def test_parse_failures(self) -> None:
+        failures = self.batch.parse_failures(IP_BATCH_STDERR)
+        self.assertEqual([1, 2, 3, 4], [f.line for f in failures])
+        self.assertEqual('Cannot find device "nope"', failures[3].message)
+        self.assertEqual("route route1 to 10.6.9.6/32", failures[3].command.description)
+        # Unknown line numbers are logged and dropped
+        self.assertEqual([], self.batch.parse_failures("Oops\nCommand failed -:69\n"))
+        # Errors after the last failed line are kept with it
+        failures = self.batch.parse_failures("Command failed -:4\nCannot find device\n")
+        self.assertEqual("Cannot find device", failures[0].message)
+
+    def test_run(self) -> None:
+        with patch(
+            f"{BASE_BACKEND_MODULE}.run",
+            return_value=CompletedProcess([], 1, stdout="", stderr=IP_BATCH_STDERR),
+        ) as mock_run:
+            failures = self.batch.run()
+            self.assertEqual(1, mock_run.call_count)
+            self.assertEqual(
+                "\n".join(self.batch.lines()) + "\n", mock_run.call_args[1]["input"]
+            )
+            # Only the route is a real failure - exists + check=False are ignored
+            self.assertEqual(1, len(failures))
+            self.assertEqual(4, failures[0].line)
+
+    def test_run_ip_failed(self) -> None:
+        # ip failing before running any line fails the whole batch
+        with patch(
+            f"{BASE_BACKEND_MODULE}.run",
+            return_value=CompletedProcess(
+                [],
+                255,
+                stdout="",
+                stderr='Cannot open network namespace "left": No such file',
+            ),
+        ):
+            failures = self.batch.run()
+        self.assertEqual([1, 2, 3, 4], [failure.line for failure in failures])
+        self.assertIn("Cannot open network namespace", failures[0].message)
+
+    def test_run_empty(self) -> None:
+        with patch(f"{BASE_BACKEND_MODULE}.run") as mock_run:
+            self.assertEqual([], Batch().run())
+            self.assertEqual(0, mock_run.call_count)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import unittest
+from pathlib import Path
+from subprocess import CalledProcessError, PIPE
+from tempfile import TemporaryDirectory
+
+from json2netns.backend import set_backend
+from json2netns.config import Config
+from json2netns.consts import DEFAULT_IP as IP
+from json2netns.dryrun import DryRunBackend
+from json2netns.inventory import link_inventory
+from json2netns.netns import LazyNamespaces, Namespace, setup_global_oob
+from json2netns.nsenter import set_netns_dir
+from json2netns.teardown import Teardown
+
+
+BASE_PATH = Path(__file__).parent.parent.resolve()
+SAMPLE_JSON_CONF_PATH = BASE_PATH / "sample.json"
+
+
+class DryRunTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = TemporaryDirectory()
+        self.netns_dir = Path(self.td.name) / "netns"
+        self.netns_dir.mkdir()
+        self.previous_netns_dir = set_netns_dir(self.netns_dir)
+        self.backend = DryRunBackend(self.netns_dir)
+        self.previous_backend = set_backend(self.backend)
+        self.config = Config(SAMPLE_JSON_CONF_PATH).load()
+        self.namespaces = {
+            ns_name: Namespace(ns_name, ns_config, self.config)
+            for ns_name, ns_config in self.config["namespaces"].items()
+        }
+
+    def tearDown(self) -> None:
+        set_backend(self.previous_backend)
+        set_netns_dir(self.previous_netns_dir)
+        self.td.cleanup()
+
+    def test_create(self) -> None:
+        with link_inventory():
+            setup_global_oob("oob0", self.namespaces, self.config)
+            for ns in self.namespaces.values():
+                ns.setup()
+
+        commands = [" ".join(args) for _, args in self.backend.commands]
+        self.assertEqual(
+            "link add oob0 link ens192 type macvlan mode bridge", commands[0]
+        )
+        self.assertIn("netns add left", commands)
+        # The veth pair is created once - right0 is already there for right
+        self.assertEqual(1, commands.count("link add left0 type veth peer right0"))
+        self.assertIn("link set right0 netns right", commands)
+        self.assertIn(
+            ("left", ["route", "replace", "10.6.9.6/32", "via", "10.1.1.2"]),
+            self.backend.commands,
+        )
+        # Queries (link + route dumps) are answered, not recorded
+        self.assertFalse(any("show" in command for command in commands))
+        self.assertTrue((self.netns_dir / "right").exists())
+        self.assertEqual({"lo", "left0", "oob1"}, self.backend.links["left"])
+
+    def test_delete(self) -> None:
+        self.backend.assume_created(self.namespaces, ["oob0"])
+        with link_inventory():
+            teardown = Teardown(LazyNamespaces(self.config), "oob0", timeout=1)
+            self.assertEqual([], teardown.run())
+            self.assertEqual([], teardown.wait())
+
+        # One batch in the default netns
+        self.assertEqual(
+            [
+                ("", ["netns", "del", "left"]),
+                ("", ["netns", "del", "right"]),
+                ("", ["link", "del", "oob0"]),
+            ],
+            self.backend.commands,
+        )
+        self.assertEqual([], list(self.netns_dir.iterdir()))
+
+    def test_run(self) -> None:
+        cp = self.backend.run(
+            [IP, "link", "show", "dev", "left0"], "left", stdout=PIPE, stderr=PIPE
+        )
+        self.assertEqual((1, b"", b""), (cp.returncode, cp.stdout, cp.stderr))
+        with self.assertRaises(CalledProcessError):
+            self.backend.run([IP, "link", "show", "dev", "left0"], check=True)
+        self.backend.run([IP, "-n", "left", "link", "add", "dummy0", "type", "dummy"])
+        cp = self.backend.run(
+            [IP, "-j", "link", "show"], "left", stdout=PIPE, encoding="utf-8"
+        )
+        self.assertEqual('[{"ifname": "dummy0"}]', cp.stdout)
+        self.backend.run(
+            [IP, "-n", "left", "-force", "-batch", "-"],
+            input=b"link del dummy0\n\n",
+        )
+        self.assertEqual(set(), self.backend.links["left"])
+        self.assertEqual(
+            [
+                ("left", ["link", "add", "dummy0", "type", "dummy"]),
+                ("left", ["link", "del", "dummy0"]),
+            ],
+            self.backend.commands,
+        )
+
+    def test_script(self) -> None:
+        self.backend.run([IP, "netns", "add", "left"])
+        self.backend.run([IP, "addr", "add", "10.1.1.1/24", "dev", "left0"], "left")
+        self.assertEqual(
+            f"#!/bin/sh\n# create plan\nset -e\n{IP} netns add left\n"
+            + f"{IP} -n left addr add 10.1.1.1/24 dev left0\n",
+            self.backend.script("create plan"),
+        )
+
+        plan_dir = Path(self.td.name) / "plan"
+        paths = self.backend.write_batches(plan_dir)
+        self.assertEqual(
+            ["apply.sh", "default.batch", "netns-left.batch"],
+            [path.name for path in paths],
+        )
+        self.assertEqual("netns add left\n", paths[1].read_text())
+        apply_lines = paths[0].read_text().splitlines()
+        self.assertEqual(
+            [f"{IP} -batch default.batch", f"{IP} -n left -batch netns-left.batch"],
+            apply_lines[-2:],
+        )
+
+    def test_nexthop_batches(self) -> None:
+        self.backend.run([IP, "netns", "add", "left"])
+        self.backend.run([IP, "link", "set", "up", "dev", "left0"], "left")
+        self.backend.run(
+            [IP, "nexthop", "replace", "id", "1", "via", "10.1.1.2", "dev", "left0"],
+            "left",
+        )
+        self.backend.run([IP, "route", "add", "10.7.0.0/16", "nhid", "1"], "left")
+        self.backend.run([IP, "route", "add", "10.8.0.0/16", "via", "10.1.1.2"], "left")
+        self.assertEqual(
+            [
+                ("", ["netns add left"]),
+                (
+                    "left",
+                    ["link set up dev left0", "route add 10.8.0.0/16 via 10.1.1.2"],
+                ),
+                (
+                    "left",
+                    [
+                        "nexthop replace id 1 via 10.1.1.2 dev left0",
+                        "route add 10.7.0.0/16 nhid 1",
+                    ],
+                ),
+            ],
+            self.backend.batches(),
+        )
+        paths = self.backend.write_batches(Path(self.td.name) / "plan")
+        self.assertEqual(
+            ["apply.sh", "default.batch", "netns-left.batch", "nexthops-left.batch"],
+            [path.name for path in paths],
+        )
+        self.assertEqual(
+            f"{IP} -n left -batch nexthops-left.batch",
+            paths[0].read_text().splitlines()[-1],
+        )
+
+
+if __name__ == "__main__":  # pragma: nocover
+    unittest.main()
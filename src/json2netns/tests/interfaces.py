@@ -9,6 +9,7 @@ from json2netns.interfaces import (
 )
 
 
+BASE_BACKEND_MODULE = "json2netns.backend"
 BASE_MODULE = "json2netns.interfaces"
 
 
@@ -29,6 +30,6 @@ class InterfaceTests(unittest.TestCase):
         )
 
     def test_delete(self) -> None:
-        with patch(f"{BASE_MODULE}.run") as mock_run:
+        with patch(f"{BASE_BACKEND_MODULE}.run") as mock_run:
             self.assertIsNone(self.interface.delete())
             self.assertEqual(1, mock_run.call_count)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import unittest
+from subprocess import CompletedProcess
+from unittest.mock import patch
+
+from json2netns.interfaces import Veth
+from json2netns.inventory import get_inventory, link_inventory
+
+
+BASE_BACKEND_MODULE = "json2netns.backend"
+LINKS_JSON = b'[{"ifindex": 1, "ifname": "lo"}, {"ifindex": 2, "ifname": "eth0"}]'
+
+
+class InventoryTests(unittest.TestCase):
+    def test_link_inventory(self) -> None:
+        self.assertIsNone(get_inventory())
+        with link_inventory() as inventory:
+            self.assertIs(inventory, get_inventory())
+        self.assertIsNone(get_inventory())
+
+    def test_one_dump_per_netns(self) -> None:
+        with patch(
+            f"{BASE_BACKEND_MODULE}.run",
+            return_value=CompletedProcess([], 0, LINKS_JSON),
+        ) as mock_run, patch("json2netns.inventory.netns_path") as mock_path:
+            mock_path.return_value.exists.return_value = True
+            with link_inventory() as inventory:
+                self.assertTrue(inventory.exists("eth0"))
+                self.assertFalse(inventory.exists("left0"))
+                self.assertTrue(inventory.exists("lo", "left"))
+                self.assertEqual(2, mock_run.call_count)
+                self.assertEqual(2, inventory.dumps)
+
+                inventory.move("eth0", "left")
+                self.assertFalse(inventory.exists("eth0"))
+                self.assertTrue(inventory.exists("eth0", "left"))
+                # Forgotten netns are re-read from the kernel
+                inventory.forget("left")
+                self.assertTrue(inventory.exists("lo", "left"))
+                self.assertEqual(3, inventory.dumps)
+
+            mock_path.return_value.exists.return_value = False
+            with link_inventory() as inventory:
+                self.assertEqual(set(), inventory.links_in("right"))
+                self.assertEqual(0, inventory.dumps)
+
+    def test_interfaces_update_inventory(self) -> None:
+        veth = Veth("left0", "right0", [])
+        with patch(
+            f"{BASE_BACKEND_MODULE}.run",
+            return_value=CompletedProcess([], 0, LINKS_JSON),
+        ) as mock_run, patch("json2netns.inventory.netns_path") as mock_path:
+            mock_path.return_value.exists.return_value = True
+            with link_inventory() as inventory:
+                self.assertFalse(veth.exists())
+                veth.create()
+                self.assertTrue(veth.exists())
+                self.assertTrue(inventory.exists("right0"))
+                self.assertTrue(veth.set_netns("left"))
+                self.assertTrue(veth.exists("left"))
+                self.assertFalse(veth.exists())
+                veth.delete("left")
+                self.assertFalse(veth.exists("left"))
+                self.assertFalse(inventory.exists("right0"))
+                # 2 dumps + create, move and delete
+                self.assertEqual(5, mock_run.call_count)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import unittest
+from copy import deepcopy
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict
+from unittest.mock import patch
+
+from json2netns.config import Config
+from json2netns.journal import AppliedJournal, unchanged_namespaces
+from json2netns.netns import NamespaceIndex
+
+
+BASE_PATH = Path(__file__).parent.parent.resolve()
+NETNS_PATH = "json2netns.journal.netns_path"
+SAMPLE_JSON_CONF_PATH = BASE_PATH / "sample.json"
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.config = Config(SAMPLE_JSON_CONF_PATH).load()
+        self.td = TemporaryDirectory()
+        self.state_dir = Path(self.td.name) / "json2netns"
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def index(self, config: Dict) -> NamespaceIndex:
+        return NamespaceIndex.build(config, config["namespaces"], hashes=True)
+
+    def test_save_load(self) -> None:
+        hashes = self.index(self.config).hashes
+        journal = AppliedJournal(self.state_dir)
+        journal.load()
+        self.assertEqual({}, journal.hashes)
+        for ns_name, ns_hash in hashes.items():
+            journal.record(ns_name, ns_hash)
+        journal.save()
+
+        loaded_journal = AppliedJournal(self.state_dir)
+        loaded_journal.load()
+        self.assertEqual(journal.hashes, loaded_journal.hashes)
+        with patch(NETNS_PATH, return_value=Path(self.td.name)):
+            self.assertTrue(loaded_journal.unchanged("left", hashes["left"]))
+            loaded_journal.forget("left")
+            self.assertFalse(loaded_journal.unchanged("left", hashes["left"]))
+
+        journal.path.write_text("{not json")
+        corrupt_journal = AppliedJournal(self.state_dir)
+        corrupt_journal.load()
+        self.assertEqual({}, corrupt_journal.hashes)
+
+    def test_config_hash(self) -> None:
+        left_hash = self.index(self.config).hashes["left"]
+        reordered_config = deepcopy(self.config)
+        reordered_config["namespaces"]["left"] = dict(
+            reversed(list(self.config["namespaces"]["left"].items()))
+        )
+        self.assertEqual(left_hash, self.index(reordered_config).hashes["left"])
+
+        # OOB namespaces depend on the global oob config
+        oob_config = deepcopy(self.config)
+        oob_config["oob"]["prefixes"] = ["10.254.254.0/24"]
+        self.assertNotEqual(left_hash, self.index(oob_config).hashes["left"])
+
+        route_file_config = deepcopy(self.config)
+        route_file_config["namespaces"]["left"]["route_files"] = [
+            str(SAMPLE_JSON_CONF_PATH)
+        ]
+        self.assertNotEqual(left_hash, self.index(route_file_config).hashes["left"])
+
+    def test_unchanged_namespaces(self) -> None:
+        journal = AppliedJournal(self.state_dir)
+        for ns_name, ns_hash in self.index(self.config).hashes.items():
+            journal.record(ns_name, ns_hash)
+        # Pretend the netns exist
+        with patch(NETNS_PATH, return_value=Path(self.td.name)):
+            self.assertEqual(
+                {"left", "right"},
+                unchanged_namespaces(self.index(self.config), journal),
+            )
+
+            # Changing left also needs right as it holds left0's veth peer
+            new_config = deepcopy(self.config)
+            new_config["namespaces"]["left"]["routes"] = {}
+            self.assertEqual(
+                set(), unchanged_namespaces(self.index(new_config), journal)
+            )
+
+            # Namespaces with no peers in the changed namespace are still skipped
+            new_config["namespaces"]["right"]["interfaces"].pop("right0")
+            new_config["namespaces"]["left"]["interfaces"].pop("left0")
+            index = self.index(new_config)
+            journal.record("right", index.hashes["right"])
+            self.assertEqual({"right"}, unchanged_namespaces(index, journal))
+
+        # Missing netns are never skipped
+        with patch(NETNS_PATH, return_value=Path(self.td.name) / "not_there"):
+            self.assertEqual(set(), unchanged_namespaces(index, journal))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import unittest
+from pathlib import Path
+from subprocess import CompletedProcess
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from json2netns.backend import SubprocessBackend
+from json2netns.config import Config
+from json2netns.consts import DEFAULT_IP as IP
+from json2netns.interfaces import Veth
+from json2netns.metrics import (
+    ACTION_SECONDS,
+    count,
+    EXIT_CODE,
+    get_metrics,
+    INTERFACES,
+    Metrics,
+    NAMESPACES,
+    PHASE_SECONDS,
+    ROUTES,
+    set_metrics,
+    SUBPROCESSES,
+)
+from json2netns.netns import Namespace
+from json2netns.route import RouteTable
+
+
+BASE_PATH = Path(__file__).parent.parent.resolve()
+SAMPLE_JSON_CONF_PATH = BASE_PATH / "sample.json"
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.metrics = Metrics({"action": "create"}, buckets=(0.1, 1.0))
+
+    def tearDown(self) -> None:
+        set_metrics(None)
+
+    def test_disabled(self) -> None:
+        self.assertIsNone(get_metrics())
+        count(NAMESPACES, result="created")
+        self.assertEqual({}, self.metrics.values)
+
+    def test_render(self) -> None:
+        self.metrics.inc(NAMESPACES, result="created")
+        self.metrics.inc(NAMESPACES, 2, result="created")
+        self.metrics.inc(ROUTES, result='bad "route"\n')
+        for seconds in (1.0, 0.05, 2.5):
+            self.metrics.observe(PHASE_SECONDS, seconds, phase="Namespace.create")
+        self.metrics.record_run(0, 3.25)
+        self.assertEqual(3, self.metrics.get(NAMESPACES, result="created"))
+        with self.assertRaises(ValueError):
+            self.metrics.inc("json2netns_typo_total")
+
+        lines = self.metrics.render().splitlines()
+        self.assertIn("# TYPE json2netns_namespaces_total counter", lines)
+        self.assertIn(
+            'json2netns_namespaces_total{action="create",result="created"} 3', lines
+        )
+        self.assertIn(
+            r'json2netns_routes_total{action="create",result="bad \"route\"\n"} 1',
+            lines,
+        )
+        self.assertIn('json2netns_last_run_exit_code{action="create"} 0', lines)
+        phase_labels = 'action="create",phase="Namespace.create"'
+        start = lines.index("# TYPE json2netns_phase_duration_seconds histogram") + 1
+        self.assertEqual(
+            [
+                f'json2netns_phase_duration_seconds_bucket{{{phase_labels},le="0.1"}} 1',
+                f'json2netns_phase_duration_seconds_bucket{{{phase_labels},le="1.0"}} 2',
+                f'json2netns_phase_duration_seconds_bucket{{{phase_labels},le="+Inf"}} 3',
+                f"json2netns_phase_duration_seconds_sum{{{phase_labels}}} 3.55",
+                f"json2netns_phase_duration_seconds_count{{{phase_labels}}} 3",
+            ],
+            lines[start : start + 5],
+        )
+        self.assertIn(f"# TYPE {ACTION_SECONDS} histogram", lines)
+
+    def test_write(self) -> None:
+        self.metrics.set(EXIT_CODE, 11)
+        with TemporaryDirectory() as td:
+            prom_path = Path(td) / "json2netns.prom"
+            self.metrics.write(prom_path)
+            self.assertEqual([prom_path], list(Path(td).iterdir()))
+            self.assertIn(
+                'json2netns_last_run_exit_code{action="create"} 11',
+                prom_path.read_text(),
+            )
+
+    def test_code_paths(self) -> None:
+        set_metrics(self.metrics)
+        config = Config(SAMPLE_JSON_CONF_PATH).load()
+        ns = Namespace("left", config["namespaces"]["left"], config)
+        ns.ns_path = BASE_PATH / "not_there"
+        veth = Veth("left0", "right0", [])
+        route_table = RouteTable("left")
+        route_table.add("fd00:6::/64")
+
+        with patch(
+            "json2netns.backend.run", return_value=CompletedProcess([], 0)
+        ), patch("json2netns.backend.pinned_netns", return_value=None):
+            SubprocessBackend().run([IP, "-n", "left", "link", "show"], "left")
+            ns.create()
+            veth.create()
+            veth.set_netns("left")
+            ns.batch_setup()
+            ns.route_objects()[-1].get_route(route_table=route_table)
+
+        self.assertEqual(
+            {"ip link add": 1, "ip link set": 1, "ip link show": 1, "ip netns add": 1},
+            {
+                dict(labels)["command"]: value
+                for (name, labels), value in self.metrics.values.items()
+                if name == SUBPROCESSES
+            },
+        )
+        self.assertEqual(1, self.metrics.get(NAMESPACES, result="created"))
+        self.assertEqual(1, self.metrics.get(INTERFACES, result="created", type="veth"))
+        self.assertEqual(1, self.metrics.get(INTERFACES, result="moved", type="veth"))
+        self.assertEqual(2, self.metrics.get(ROUTES, result="installed"))
+        self.assertEqual(1, self.metrics.get(ROUTES, result="skipped"))
+        # @traced phases are timed even without --trace
+        phases = {dict(labels)["phase"] for _, labels in self.metrics.histograms}
+        self.assertEqual({"Namespace.create"}, phases)
+
+
+if __name__ == "__main__":  # pragma: nocover
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import unittest
+from ipaddress import ip_interface, ip_network
+
+from json2netns.interfaces import Veth
+from json2netns.model import intern_name, Prefix, RouteEntry
+
+
+class ModelTests(unittest.TestCase):
+    def test_prefix(self) -> None:
+        prefix = Prefix.parse("10.1.1.1/24")
+        self.assertEqual("10.1.1.1/24", str(prefix))
+        self.assertEqual("10.1.1.1", prefix.address)
+        self.assertEqual(ip_interface("10.1.1.1/24"), prefix.interface())
+        self.assertEqual(ip_network("10.1.1.0/24"), prefix.network())
+        self.assertEqual((0x0A010100, 0x0A0101FF), prefix.range())
+        self.assertEqual("fd00::1/128", str(Prefix.parse("fd00:0::1")))
+
+        self.assertEqual(prefix, Prefix.parse(ip_interface("10.1.1.1/24")))
+        self.assertEqual(
+            Prefix.parse("fd00::/64"), Prefix.parse(ip_network("fd00::/64"))
+        )
+        self.assertIs(prefix, Prefix.parse(prefix))
+        self.assertEqual(1, len({prefix, Prefix.parse("10.1.1.1/24")}))
+        self.assertNotEqual(prefix, "10.1.1.1/24")
+        for bad_prefix in ("10.1.1/24", "10.1.1.1/33", "fd00::/x"):
+            with self.assertRaises(ValueError):
+                Prefix.parse(bad_prefix)
+
+    def test_route_entry(self) -> None:
+        route = RouteEntry("route1", "fd00:6::/64", "fd00::2", "")
+        self.assertEqual("fd00:6::/64", route.dest_prefix)
+        self.assertEqual("fd00::2", route.next_hop_ip)
+        # Bad values are kept as is for Route validation to reject
+        route = RouteEntry("route1", "10.6.9.300/32", "10.1.1.z", "left0")
+        self.assertEqual("10.6.9.300/32", route.dest_prefix)
+        self.assertEqual("10.1.1.z", route.next_hop_ip)
+        self.assertEqual("", RouteEntry("r", "10.6.9.6/32", "", "left0").next_hop_ip)
+        # Routes via the same next hop share its Prefix
+        other = RouteEntry("route2", "fd00:7::/64", "fd00::2", "")
+        self.assertIs(other.next_hop, RouteEntry("r", "::/0", "fd00::2", "").next_hop)
+
+    def test_compact(self) -> None:
+        veth = Veth("".join(["left", "0"]), "right0", ["10.1.1.1/24"])
+        self.assertIs(intern_name("left0"), veth.name)
+        self.assertFalse(hasattr(veth, "__dict__"))
+        self.assertEqual([ip_interface("10.1.1.1/24")], veth.prefixes)
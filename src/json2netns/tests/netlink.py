@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+import errno
+import socket
+import unittest
+from subprocess import CalledProcessError, CompletedProcess, DEVNULL, PIPE
+from unittest.mock import Mock, patch
+
+from json2netns.netlink import (
+    IFA_ADDRESS,
+    IFA_LOCAL,
+    IFADDRMSG,
+    IFINFOMSG,
+    IFLA_IFNAME,
+    NetlinkBackend,
+    NetlinkError,
+    NetlinkSocket,
+    nla,
+    nla_nested,
+    nla_str,
+    nla_u32,
+    parse_multipath,
+    parse_nlas,
+    RTA_DST,
+    RTA_GATEWAY,
+    RTA_MULTIPATH,
+    RTA_NH_ID,
+    RTA_OIF,
+    RTA_TABLE,
+    RTMSG,
+    RTNEXTHOP,
+)
+
+
+BASE_BACKEND_MODULE = "json2netns.backend"
+IP = "/usr/sbin/ip"
+
+
+class NetlinkAttributeTests(unittest.TestCase):
+    def test_nla(self) -> None:
+        # 4 byte header + 5 byte payload padded to 12
+        packed = nla_str(IFLA_IFNAME, "left")
+        self.assertEqual(12, len(packed))
+        self.assertEqual(b"\x09\x00\x03\x00left\x00\x00\x00\x00", packed)
+        self.assertEqual(b"\x08\x00\x01\x00\x45\x00\x00\x00", nla_u32(1, 69))
+
+    def test_parse_nlas(self) -> None:
+        packed = nla_str(IFLA_IFNAME, "right0") + nla_nested(18, nla(1, b"veth"))
+        attrs = parse_nlas(packed)
+        self.assertEqual(b"right0\x00", attrs[IFLA_IFNAME])
+        self.assertEqual({1: b"veth"}, parse_nlas(attrs[18]))
+
+
+class NetlinkSocketTests(unittest.TestCase):
+    def test_default_netns(self) -> None:
+        # Pinned threads open the default netns socket from their original netns
+        with patch("json2netns.netlink.socket.socket") as mock_socket, patch(
+            "json2netns.netlink.pinned_netns", return_value="left"
+        ), patch("json2netns.netlink.switch_netns") as mock_switch:
+            NetlinkSocket()
+            mock_switch.assert_called_once_with("")
+            self.assertEqual(1, mock_socket.call_count)
+        with patch("json2netns.netlink.socket.socket"), patch(
+            "json2netns.netlink.switch_netns"
+        ) as mock_switch:
+            NetlinkSocket()
+            self.assertEqual(0, mock_switch.call_count)
+
+    def test_link_dump(self) -> None:
+        nl_sock = NetlinkSocket.__new__(NetlinkSocket)
+        nl_sock.request = Mock(  # type: ignore
+            return_value=[
+                IFINFOMSG.pack(0, 772, 1, 1, 0) + nla_str(IFLA_IFNAME, "lo"),
+                IFINFOMSG.pack(0, 1, 69, 0, 0) + nla_str(IFLA_IFNAME, "left0"),
+            ]
+        )
+        self.assertEqual(
+            [
+                {"ifindex": 1, "ifname": "lo", "flags": ["UP"]},
+                {"ifindex": 69, "ifname": "left0", "flags": []},
+            ],
+            nl_sock.link_dump(),
+        )
+
+    def test_addr_dump(self) -> None:
+        nl_sock = NetlinkSocket.__new__(NetlinkSocket)
+        nl_sock.link_dump = Mock(  # type: ignore
+            return_value=[{"ifindex": 69, "ifname": "left0", "flags": ["UP"]}]
+        )
+        nl_sock.request = Mock(  # type: ignore
+            return_value=[
+                IFADDRMSG.pack(socket.AF_INET, 24, 0, 0, 69)
+                + nla(IFA_ADDRESS, bytes([10, 1, 1, 1]))
+                + nla(IFA_LOCAL, bytes([10, 1, 1, 1])),
+                IFADDRMSG.pack(socket.AF_INET6, 64, 0, 253, 69)
+                + nla(IFA_ADDRESS, bytes([0xFE, 0x80] + [0] * 13 + [1])),
+            ]
+        )
+        self.assertEqual(
+            [
+                {"family": "inet", "local": "10.1.1.1", "prefixlen": 24},
+                {"family": "inet6", "local": "fe80::1", "prefixlen": 64},
+            ],
+            [
+                {k: v for k, v in addr.items() if k != "scope"}
+                for addr in nl_sock.addr_dump()[0]["addr_info"]
+            ],
+        )
+        self.assertEqual("link", nl_sock.addr_dump()[0]["addr_info"][1]["scope"])
+
+    def test_route_dump(self) -> None:
+        nl_sock = NetlinkSocket.__new__(NetlinkSocket)
+        replies = [
+            RTMSG.pack(socket.AF_INET, 32, 0, 0, 254, 3, 0, 1, 0)
+            + nla(RTA_DST, bytes([10, 6, 9, 6]))
+            + nla(RTA_GATEWAY, bytes([10, 1, 1, 2]))
+            + nla_u32(RTA_OIF, 69)
+            + nla_u32(RTA_TABLE, 254),
+            RTMSG.pack(socket.AF_INET, 0, 0, 0, 254, 3, 0, 1, 0)
+            + nla_u32(RTA_TABLE, 254),
+            RTMSG.pack(socket.AF_INET, 8, 0, 0, 255, 2, 254, 2, 0)
+            + nla(RTA_DST, bytes([127, 0, 0, 0]))
+            + nla_u32(RTA_TABLE, 255),
+        ]
+        nl_sock.request = Mock(return_value=replies)  # type: ignore
+        nl_sock.link_names = Mock(return_value={69: "left0"})  # type: ignore
+        self.assertEqual(
+            [
+                {
+                    "dst": "10.6.9.6",
+                    "gateway": "10.1.1.2",
+                    "dev": "left0",
+                    "protocol": "boot",
+                },
+                {"dst": "default", "protocol": "boot"},
+            ],
+            nl_sock.route_dump(socket.AF_INET),
+        )
+        self.assertEqual(
+            {
+                "type": "local",
+                "dst": "127.0.0.0/8",
+                "protocol": "kernel",
+                "table": "local",
+            },
+            nl_sock.route_dump(socket.AF_INET, all_tables=True)[-1],
+        )
+
+    def test_route_dump_nexthops(self) -> None:
+        nl_sock = NetlinkSocket.__new__(NetlinkSocket)
+        gateway = nla(RTA_GATEWAY, bytes([10, 1, 1, 2]))
+        hops = RTNEXTHOP.pack(RTNEXTHOP.size + len(gateway), 0, 2, 69) + gateway
+        hops += RTNEXTHOP.pack(RTNEXTHOP.size, 0, 0, 70)
+        self.assertEqual(
+            [
+                {"gateway": "10.1.1.2", "dev": "left0", "weight": 3},
+                {"dev": "70", "weight": 1},
+            ],
+            parse_multipath(hops, {69: "left0"}),
+        )
+        nl_sock.request = Mock(  # type: ignore
+            return_value=[
+                RTMSG.pack(socket.AF_INET, 16, 0, 0, 254, 3, 0, 1, 0)
+                + nla(RTA_DST, bytes([10, 7, 0, 0]))
+                + nla_u32(RTA_NH_ID, 10)
+                + nla(RTA_MULTIPATH, hops)
+                + nla_u32(RTA_TABLE, 254)
+            ]
+        )
+        nl_sock.link_names = Mock(return_value={69: "left0"})  # type: ignore
+        route = nl_sock.route_dump(socket.AF_INET)[0]
+        self.assertEqual("10.7.0.0/16", route["dst"])
+        self.assertEqual(10, route["nhid"])
+        self.assertEqual(2, len(route["nexthops"]))
+
+
+class NetlinkBackendTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.backend = NetlinkBackend()
+        self.nl_sock = Mock()
+        self.nl_sock.link_index.return_value = 69
+        self.backend.socket = Mock(return_value=self.nl_sock)  # type: ignore
+
+    def test_execute(self) -> None:
+        self.backend.execute(["link", "add", "left0", "type", "veth", "peer", "right0"])
+        self.nl_sock.link_add_veth.assert_called_once_with("left0", "right0")
+        self.backend.execute(
+            ["link", "add", "oob1", "link", "eth0", "type", "macvlan", "mode", "bridge"]
+        )
+        self.nl_sock.link_add_macvlan.assert_called_once_with("oob1", "eth0", "bridge")
+        self.backend.execute(["link", "set", "left0", "netns", "left"])
+        self.nl_sock.link_set_netns.assert_called_once_with("left0", "left")
+        self.backend.execute(["link", "set", "up", "dev", "left0"], "left")
+        self.backend.socket.assert_called_with("left")  # type: ignore
+        self.nl_sock.link_set_up.assert_called_once_with("left0")
+        self.backend.execute(["addr", "add", "10.1.1.1/24", "dev", "left0"], "left")
+        self.nl_sock.addr_add.assert_called_once_with(
+            "10.1.1.1/24", "left0", replace=False
+        )
+        self.backend.execute(["route", "add", "10.6.9.6/32", "via", "10.1.1.2"])
+        self.nl_sock.route_add.assert_called_once_with(
+            "10.6.9.6/32", "10.1.1.2", "", replace=False
+        )
+        self.backend.execute(["route", "replace", "10.7.0.0/16", "nhid", "10"])
+        self.nl_sock.route_add.assert_called_with("10.7.0.0/16", replace=True, nhid=10)
+        self.assertEqual(
+            "69: left0\n", self.backend.execute(["link", "show", "dev", "left0"])
+        )
+        self.backend.execute(["addr", "del", "10.1.1.1/24", "dev", "left0"], "left")
+        self.nl_sock.addr_del.assert_called_once_with("10.1.1.1/24", "left0")
+        self.backend.execute(["route", "del", "10.6.9.6/32"], "left")
+        self.nl_sock.route_del.assert_called_once_with("10.6.9.6/32")
+        self.nl_sock.addr_dump.return_value = []
+        self.assertEqual("[]\n", self.backend.execute(["addr", "show"], "", {"-j"}))
+
+    def test_run(self) -> None:
+        cp = self.backend.run(
+            [IP, "link", "set", "up", "dev", "lo"], "left", stdout=PIPE, stderr=PIPE
+        )
+        self.assertEqual(0, cp.returncode)
+        self.assertEqual(b"", cp.stdout)
+
+        self.nl_sock.link_index.side_effect = NetlinkError(
+            errno.ENODEV, 'Cannot find device "left0"'
+        )
+        cp = self.backend.run(
+            [IP, "link", "show", "dev", "left0"], stdout=DEVNULL, stderr=DEVNULL
+        )
+        self.assertEqual(1, cp.returncode)
+
+        self.nl_sock.route_add.side_effect = NetlinkError(errno.EEXIST, "File exists")
+        with self.assertRaises(CalledProcessError):
+            self.backend.run(
+                [IP, "route", "add", "10.6.9.6/32", "via", "10.1.1.2"],
+                "left",
+                check=True,
+                stderr=PIPE,
+            )
+
+    def test_netns_del(self) -> None:
+        self.backend.sockets["left"] = self.nl_sock
+        with patch("json2netns.netlink.delete_netns") as mock_delete:
+            self.assertEqual("", self.backend.execute(["netns", "del", "left"]))
+            mock_delete.assert_called_once_with("left")
+            self.assertNotIn("left", self.backend.sockets)
+
+            mock_delete.side_effect = FileNotFoundError(errno.ENOENT, "No such file")
+            cp = self.backend.run(
+                [IP, "netns", "delete", "right"], stdout=PIPE, stderr=PIPE
+            )
+            self.assertEqual(1, cp.returncode)
+            self.assertIn("Cannot remove namespace file", cp.stderr.decode())
+
+    def test_run_batch(self) -> None:
+        self.nl_sock.addr_add.side_effect = [
+            None,
+            NetlinkError(errno.EEXIST, "File exists"),
+        ]
+        cp = self.backend.run(
+            [IP, "-n", "left", "-force", "-batch", "-"],
+            input="addr add 10.1.1.1/24 dev left0\naddr add fd00::1/64 dev left0\n",
+            stdout=PIPE,
+            stderr=PIPE,
+            encoding="utf-8",
+        )
+        self.assertEqual(1, cp.returncode)
+        self.assertEqual(
+            "RTNETLINK answers: File exists\nCommand failed -:2\n", cp.stderr
+        )
+        self.backend.socket.assert_called_with("left")  # type: ignore
+
+    def test_run_fallback(self) -> None:
+        with patch(
+            f"{BASE_BACKEND_MODULE}.run", return_value=CompletedProcess([], 0)
+        ) as mock_run:
+            self.backend.run([IP, "netns", "add", "left"], check=True)
+            self.backend.run([IP, "-6", "route", "show"], "left")
+            self.assertEqual(
+                [IP, "netns", "exec", "left", IP, "-6", "route", "show"],
+                mock_run.call_args[0][0],
+            )
+            self.assertEqual(2, mock_run.call_count)
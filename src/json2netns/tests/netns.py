@@ -1,23 +1,52 @@
 #!/usr/bin/env python3
 
+import asyncio
 import logging
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from ipaddress import IPv4Interface, IPv6Interface
 from pathlib import Path
-from subprocess import CompletedProcess
+from subprocess import CalledProcessError, CompletedProcess
+from typing import Dict
 from unittest.mock import patch
 
 from json2netns.config import Config
-from json2netns.netns import Namespace, setup_all_veths, setup_global_oob
-from json2netns.route import Route
+from json2netns.consts import DEFAULT_IP
+from json2netns.journal import AppliedJournal, unchanged_namespaces
+from json2netns.netns import (
+    build_create_graph,
+    build_delete_graph,
+    compile_default_batch,
+    config_hash,
+    LazyNamespaces,
+    Namespace,
+    NamespaceIndex,
+    setup_all_veths,
+    setup_global_oob,
+)
+from json2netns.route import MultipathRoute, NexthopRoute, Route, RouteTable
+from json2netns.routefeed import FeedStats
 
 BASE_PATH = Path(__file__).parent.parent.resolve()
+BASE_BACKEND_MODULE = "json2netns.backend"
 BASE_MODULE = "json2netns.netns"
 BASE_ROUTE_MODULE = "json2netns.route"
 BASE_INT_MODULE = "json2netns.interfaces"
 LOG = logging.getLogger(__name__)
 SAMPLE_JSON_CONF_PATH = BASE_PATH / "sample.json"
+NEXTHOPS = {
+    "spines": {"id": 10, "group": {"right": 1, "right_b": 2}},
+    "right": {"id": 1, "next_hop_ip": "10.1.1.2", "egress_if_name": "left0"},
+    "right_b": {"id": 2, "next_hop_ip": "10.1.1.3", "egress_if_name": "left0"},
+}
+NEXTHOP_ROUTES = {
+    "shared": {"dest_prefix": "10.7.0.0/16", "nexthop": "spines"},
+    "ecmp": {
+        "dest_prefix": "10.8.0.0/16",
+        "multipath": [{"next_hop_ip": "10.1.1.2"}, {"next_hop_ip": "10.1.1.3"}],
+    },
+}
 
 
 def log_cmds_ran(*args, **kwargs) -> CompletedProcess:
@@ -40,42 +69,384 @@ class NetNSTests(unittest.TestCase):
         with self.assertRaises(ValueError):
             Namespace("bad_id", bad_config["namespaces"]["left"], bad_config)
 
+    def test_netns_dir(self) -> None:
+        self.assertEqual(Path("/run/netns/left"), self.test_ns.ns_path)
+        # e.g. JSON2NETNS_NETNS_DIR for benchmarks against a fake ip
+        with patch("json2netns.nsenter.NETNS_RUN_DIR", Path("/tmp/netns")):
+            ns = Namespace("left", self.config["namespaces"]["left"], self.config)
+        self.assertEqual(Path("/tmp/netns/left"), ns.ns_path)
+
+    def test_batch_setup(self) -> None:
+        batch = self.test_ns.batch_setup()
+        self.assertEqual("left", batch.netns_name)
+        lines = batch.lines()
+        # 2 left0 + 4 lo + 2 oob prefixes, 3 link ups and 2 routes
+        self.assertEqual(13, len(lines))
+        self.assertIn("addr add 10.1.1.1/24 dev left0", lines)
+        self.assertIn("link set up dev oob1", lines)
+        self.assertEqual("route replace 10.6.9.6/32 via 10.1.1.2", lines[-2])
+
+    def nexthop_config(self) -> Dict:
+        config = deepcopy(self.config)
+        config["namespaces"]["left"]["nexthops"] = NEXTHOPS
+        config["namespaces"]["left"]["routes"].update(NEXTHOP_ROUTES)
+        return config
+
+    def nexthop_ns(self) -> Namespace:
+        config = self.nexthop_config()
+        return Namespace("left", config["namespaces"]["left"], config)
+
+    def test_nexthops(self) -> None:
+        ns = self.nexthop_ns()
+        # Gateways before the groups using them
+        self.assertEqual(
+            ["right", "right_b", "spines"], [nh.name for nh in ns.nexthops]
+        )
+        self.assertEqual(((1, 1), (2, 2)), ns.nexthops[-1].group)
+        nexthop_route, multipath_route = ns.route_objects()[-2:]
+        # Asserts narrow the types for mypy
+        assert isinstance(nexthop_route, NexthopRoute)
+        self.assertEqual(10, nexthop_route.nhid)
+        assert isinstance(multipath_route, MultipathRoute)
+        self.assertEqual(
+            (("10.1.1.2", "", 1), ("10.1.1.3", "", 1)), multipath_route.hops
+        )
+        self.assertNotEqual(
+            config_hash(self.config["namespaces"]["left"], self.config),
+            config_hash(self.nexthop_config()["namespaces"]["left"], self.config),
+        )
+
+        # Nexthop routes wait for the nexthop round
+        lines = ns.batch_setup().lines()
+        self.assertNotIn("route replace 10.7.0.0/16 nhid 10", lines)
+        self.assertEqual(
+            "route replace 10.8.0.0/16 nexthop via 10.1.1.2 weight 1 nexthop via "
+            + "10.1.1.3 weight 1",
+            lines[-1],
+        )
+        self.assertEqual(
+            [
+                "nexthop replace id 1 via 10.1.1.2 dev left0",
+                "nexthop replace id 2 via 10.1.1.3 dev left0",
+                "nexthop replace id 10 group 1/2,2",
+                "route replace 10.7.0.0/16 nhid 10",
+            ],
+            ns.batch_nexthops().lines(),
+        )
+        self.assertEqual(0, len(self.test_ns.batch_nexthops()))
+
+    def test_nexthop_add(self) -> None:
+        ns = self.nexthop_ns()
+        with patch.object(
+            Namespace, "exec_in_ns", return_value=CompletedProcess("", returncode=0)
+        ) as mock_exec_in_ns, patch.object(
+            RouteTable, "load", return_value=RouteTable("left")
+        ), patch(
+            f"{BASE_BACKEND_MODULE}.run", return_value=CompletedProcess([], 0, "", "")
+        ):
+            ns.route_add()
+        cmds = [call[0][0] for call in mock_exec_in_ns.call_args_list]
+        self.assertEqual(
+            [DEFAULT_IP, "nexthop", "replace", "id", "10", "group", "1/2,2"], cmds[2]
+        )
+        self.assertEqual(3, len(cmds))
+        batch, _, _ = ns.batch_routes(RouteTable("left"))
+        self.assertIn("route replace 10.7.0.0/16 nhid 10", batch.lines())
+
+        with patch(
+            "json2netns.backend.SubprocessBackend.run_async",
+            side_effect=lambda cmd, *args, **kwargs: CompletedProcess(
+                cmd, 2 if "nexthop" in cmd else 0, b""
+            ),
+        ), patch(f"{BASE_MODULE}.LOG.error") as mock_error:
+            self.assertEqual(3, asyncio.run(ns.nexthop_add_async()))
+            self.assertEqual(3, mock_error.call_count)
+
+    def test_setup_async(self) -> None:
+        self.test_ns.ns_path = Path("/not_there")
+        with patch(
+            "json2netns.backend.SubprocessBackend.run_async",
+            return_value=CompletedProcess([], 0, b"", ""),
+        ) as mock_run_async:
+            asyncio.run(self.test_ns.setup_async())
+            # netns add + left0 5 + lo 7 + oob 5 + 2 route dumps + 1 route batch
+            self.assertEqual(21, mock_run_async.call_count)
+            self.assertEqual(
+                [DEFAULT_IP, "netns", "add", "left"],
+                mock_run_async.call_args_list[0][0][0],
+            )
+
+    def test_build_graphs(self) -> None:
+        namespaces = {
+            ns_name: Namespace(ns_name, ns_config, self.config)
+            for ns_name, ns_config in self.config["namespaces"].items()
+        }
+        graph = build_create_graph("oob0", namespaces, self.config)
+        # 2 x (netns, links, oob, routes) + 1 veth pair + global oob
+        self.assertEqual(10, len(graph))
+        veth_task = graph.tasks["veth:left0/right0"]
+        self.assertEqual({"netns:left", "netns:right"}, veth_task.deps)
+        self.assertEqual({"left", "right"}, veth_task.owners)
+        self.assertIn("veth:left0/right0", graph.tasks["links:right"].deps)
+        self.assertEqual({"links:left", "oob:left"}, graph.tasks["routes:left"].deps)
+        # Nexthops need the veth peers up too
+        config = self.nexthop_config()
+        namespaces["left"] = self.nexthop_ns()
+        graph = build_create_graph("oob0", namespaces, config)
+        self.assertEqual(
+            {"links:left", "links:right", "oob:left"}, graph.tasks["routes:left"].deps
+        )
+        self.assertEqual("left", graph.tasks["routes:left"].netns_name)
+        self.assertEqual(3, len(build_delete_graph("oob0", namespaces)))
+
+    def test_lazy_namespaces(self) -> None:
+        namespaces = LazyNamespaces(self.config, cache_size=1)
+        self.assertEqual(["left", "right"], list(namespaces))
+        self.assertEqual(0, namespaces.built)
+        self.assertIs(namespaces["left"], namespaces["left"])
+        self.assertEqual("right", namespaces["right"].name)
+        # left was evicted so gets rebuilt
+        self.assertEqual("left", namespaces["left"].name)
+        self.assertEqual(3, namespaces.built)
+        with self.assertRaises(KeyError):
+            namespaces["not_there"]
+
+        self.assertEqual(0, len(namespaces.with_nexthops()))
+        right_only = namespaces.subset(["right", "not_there"])
+        self.assertEqual(1, len(right_only))
+        self.assertNotIn("left", right_only)
+
+    def test_lazy_namespaces_threads(self) -> None:
+        namespaces = LazyNamespaces(self.ring_config(50), cache_size=4)
+        names = list(namespaces) * 8
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            built = list(executor.map(lambda name: namespaces[name].name, names))
+        self.assertEqual(names, built)
+        self.assertEqual(4, len(namespaces.cache))
+        self.assertGreaterEqual(namespaces.built, 50)
+
+    def test_lazy_create_graph(self) -> None:
+        namespaces = LazyNamespaces(self.config, cache_size=1)
+        graph = build_create_graph("oob0", namespaces, self.config)
+        self.assertEqual(0, namespaces.built)
+        with patch.object(Namespace, "create") as mock_create:
+            graph.tasks["netns:right"].func()
+            graph.tasks["netns:left"].func()
+        self.assertEqual(2, mock_create.call_count)
+        # Tasks build their namespace when they run
+        self.assertEqual(2, namespaces.built)
+
+    def ring_config(self, size: int) -> Dict:
+        """size namespaces - each with a veth pair to the next"""
+        config = deepcopy(self.config)
+        config["namespaces"] = {
+            f"ns{i}": {
+                "id": i + 1,
+                "interfaces": {
+                    f"ns{i}r": {
+                        "prefixes": [],
+                        "peer_name": f"ns{(i + 1) % size}l",
+                        "type": "veth",
+                    },
+                    f"ns{i}l": {
+                        "prefixes": [],
+                        "peer_name": f"ns{(i - 1) % size}r",
+                        "type": "veth",
+                    },
+                },
+                "oob": False,
+                "routes": {},
+            }
+            for i in range(size)
+        }
+        return config
+
+    def test_lazy_create_graph_builds(self) -> None:
+        config = self.ring_config(50)
+        namespaces = LazyNamespaces(config, cache_size=4)
+        # Everything before the tasks run comes from the raw config
+        index = NamespaceIndex.build(config, namespaces, hashes=True)
+        journal = AppliedJournal(Path("/not_there"))
+        self.assertEqual(set(), unchanged_namespaces(index, journal))
+        graph = build_create_graph("oob0", namespaces, config, index=index)
+        # 50 x (netns, links, routes) + 50 veth pairs
+        self.assertEqual(200, len(graph))
+        self.assertEqual({"ns1", "ns49"}, index.peer_namespaces("ns0"))
+        self.assertEqual(0, namespaces.built)
+
+        with patch.object(Namespace, "create"):
+            for ns_name in namespaces:
+                graph.tasks[f"netns:{ns_name}"].func()
+        for ns_name, ns_hash in index.hashes.items():
+            journal.record(ns_name, ns_hash)
+        # One build per namespace - hashing never builds any
+        self.assertEqual(50, namespaces.built)
+
+        with patch(f"{BASE_MODULE}.setup_veth_pair") as mock_setup:
+            graph.tasks["veth:ns0r/ns1l"].func()
+        int_obj, netns_name, peer_obj, peer_netns_name = mock_setup.call_args[0]
+        self.assertEqual(("ns0r", "ns0"), (int_obj.name, netns_name))
+        self.assertEqual(("ns1l", "ns1"), (peer_obj.name, peer_netns_name))
+
+    def test_compile_default_batch(self) -> None:
+        namespaces = {
+            ns_name: Namespace(ns_name, ns_conf, self.config)
+            for ns_name, ns_conf in self.config["namespaces"].items()
+        }
+        with patch("pathlib.Path.exists", lambda _: False):
+            lines = compile_default_batch("oob0", namespaces, self.config).lines()
+        self.assertEqual(
+            [
+                "netns add left",
+                "link add left0 type veth peer right0",
+                "link set left0 netns left",
+                "link add oob1 link ens192 type macvlan mode bridge",
+                "link set oob1 netns left",
+                "netns add right",
+                # right0 was created as left0's peer so only gets moved
+                "link set right0 netns right",
+                "link add oob2 link ens192 type macvlan mode bridge",
+                "link set oob2 netns right",
+                "link add oob0 link ens192 type macvlan mode bridge",
+                "addr add fddd::/64 dev oob0",
+                "addr add 10.255.255.0/24 dev oob0",
+                "link set up dev oob0",
+            ],
+            lines,
+        )
+
     def test_check(self) -> None:
-        with patch(f"{BASE_MODULE}.run") as mock_run, patch(
-            f"{BASE_MODULE}.print"
-        ) as mock_print:
+        with patch(
+            f"{BASE_BACKEND_MODULE}.run",
+            return_value=CompletedProcess([], 0, "1: lo\n", ""),
+        ) as mock_run, patch(f"{BASE_MODULE}.print") as mock_print:
             self.test_ns.check()
             # Mocked objects should be both called for each check command
             expected_calls = len(self.test_ns.check_commands)
             self.assertEqual(expected_calls, mock_run.call_count)
-            self.assertEqual(expected_calls, mock_print.call_count)
+            self.assertEqual(1, mock_print.call_count)
+
+    def test_check_result(self) -> None:
+        with patch(
+            f"{BASE_BACKEND_MODULE}.run",
+            return_value=CompletedProcess(
+                [], 1, "", 'Cannot open network namespace "left"'
+            ),
+        ):
+            result = self.test_ns.check_result(json_output=True)
+        self.assertEqual(
+            'Cannot open network namespace "left"',
+            result.to_dict()["errors"]["addresses"],
+        )
+        self.assertEqual("", result.to_dict()["routes_v4"])
+        self.assertEqual(
+            "# Checking left\n## Addresses\n## Routes (v4)\n## Routes (v6)",
+            result.render(),
+        )
 
     def test_create(self) -> None:
-        with patch(f"{BASE_MODULE}.run") as mock_run, patch(
-            f"{BASE_MODULE}.Path.exists", lambda _: False
+        with patch(f"{BASE_BACKEND_MODULE}.run") as mock_run, patch(
+            "pathlib.Path.exists", lambda _: False
         ):
             self.test_ns.create()
             self.assertEqual(1, mock_run.call_count)
 
     def test_delete(self) -> None:
-        with patch(f"{BASE_MODULE}.run") as mock_run, patch(
-            f"{BASE_MODULE}.Path.exists", lambda _: True
+        with patch(f"{BASE_BACKEND_MODULE}.run") as mock_run, patch(
+            "pathlib.Path.exists", lambda _: True
         ):
             self.test_ns.delete()
             self.assertEqual(1, mock_run.call_count)
 
     def test_route_add(self) -> None:
-        with patch.object(Route, "get_route") as mock_get_route, patch.object(
-            Namespace, "exec_in_ns", return_value=CompletedProcess("", returncode=0)
-        ) as mock_exec_in_ns:
+        route_table = RouteTable("left")
+        route_table.add_json_routes(
+            [{"dst": "10.6.9.6", "gateway": "10.1.1.2", "dev": "left0"}], 4
+        )
+        batch, replaced, unchanged = self.test_ns.batch_routes(route_table)
+        self.assertEqual(["route replace fd00:6::/64 via fd00::2"], batch.lines())
+        self.assertEqual((set(), 1), (replaced, unchanged))
+
+        # Already there but via another next hop
+        route_table.add_json_routes([{"dst": "fd00:6::/64", "gateway": "fd00::3"}], 6)
+        with patch.object(
+            RouteTable, "load", return_value=route_table
+        ) as mock_load, patch(
+            f"{BASE_BACKEND_MODULE}.run", return_value=CompletedProcess([], 0, "", "")
+        ) as mock_run, patch(
+            f"{BASE_MODULE}.LOG.info"
+        ) as mock_info:
             self.test_ns.route_add()
-            expected_calls = len(self.test_ns.routes)
-            self.assertEqual(expected_calls, mock_exec_in_ns.call_count)
-            self.assertEqual(expected_calls, mock_get_route.call_count)
+            self.assertEqual(1, mock_load.call_count)
+            # One ip -batch for all the routes
+            self.assertEqual(1, mock_run.call_count)
+            mock_info.assert_called_with(
+                "left namespace routes: 0 added, 1 replaced, 1 unchanged, 0 failed"
+            )
+
+        # A route raising is counted invalid + the rest still get installed
+        with patch.object(RouteTable, "load", return_value=route_table), patch.object(
+            Route, "changed", side_effect=[ValueError("bad"), True]
+        ), patch(
+            f"{BASE_BACKEND_MODULE}.run", return_value=CompletedProcess([], 0, "", "")
+        ) as mock_run, patch(
+            f"{BASE_MODULE}.LOG.error"
+        ) as mock_error:
+            self.test_ns.route_add()
+            self.assertEqual(1, mock_run.call_count)
+            self.assertEqual(1, mock_error.call_count)
+
+    def test_route_files(self) -> None:
+        ns_config = deepcopy(self.config["namespaces"]["left"])
+        ns_config["route_files"] = [str(SAMPLE_JSON_CONF_PATH)]
+        ns = Namespace("left", ns_config, self.config)
+        self.assertEqual((str(SAMPLE_JSON_CONF_PATH),), ns.route_files)
+        self.assertIsNone(self.test_ns.route_files_add())
+
+        stats = FeedStats(installed=10)
+        with patch(
+            "json2netns.routefeed.RouteFeed.install", return_value=stats
+        ) as mock_install, patch.object(
+            RouteTable, "load", return_value=RouteTable("left")
+        ), patch(
+            f"{BASE_BACKEND_MODULE}.run", return_value=CompletedProcess([], 0, "", "")
+        ):
+            ns.route_add()
+            self.assertEqual(1, mock_install.call_count)
+            self.assertEqual(stats, ns.route_files_add())
+            # Routes from files that fail fail the routes task too
+            stats.failed = 1
+            with self.assertRaises(CalledProcessError):
+                ns.route_add()
+
+    def test_route_add_failed(self) -> None:
+        # Failed routes fail the task so the journal leaves the namespace out
+        with patch.object(
+            RouteTable, "load", return_value=RouteTable("left")
+        ), patch(
+            f"{BASE_BACKEND_MODULE}.run",
+            return_value=CompletedProcess(
+                [], 2, "", "Error: Nexthop has invalid gateway.\nCommand failed -:2\n"
+            ),
+        ), patch(
+            f"{BASE_MODULE}.LOG.info"
+        ) as mock_info:
+            with self.assertRaises(CalledProcessError):
+                self.test_ns.route_add()
+            mock_info.assert_called_with(
+                "left namespace routes: 1 added, 0 replaced, 0 unchanged, 1 failed"
+            )
+
+    def test_setup_batched(self) -> None:
+        with patch(
+            f"{BASE_BACKEND_MODULE}.run", return_value=CompletedProcess([], 0, "", "")
+        ) as mock_run:
+            self.assertEqual([], self.test_ns.setup_batched())
+            self.assertEqual(1, mock_run.call_count)
 
     def test_setup_links(self) -> None:
-        with patch(f"{BASE_INT_MODULE}.run") as mock_run:
-            # with patch(f"{BASE_INT_MODULE}.run", log_cmds_ran):
+        with patch(f"{BASE_BACKEND_MODULE}.run") as mock_run:
+            # with patch(f"{BASE_BACKEND_MODULE}.run", log_cmds_ran):
             self.test_ns.setup_links()
             # added two calls 11 -> 13 for prefixes added in
             # commit 92f49a3a460ceb3daa7febc272f11b7c9a3ea0a3
@@ -98,7 +469,7 @@ class NetNSTests(unittest.TestCase):
     def test_setup_all_veths(self) -> None:
         # This test can not be ran in an env where a left0 interface can exist
         ns_dict = {"left": self.test_ns}
-        with patch(f"{BASE_INT_MODULE}.run") as mock_int_run:
+        with patch(f"{BASE_BACKEND_MODULE}.run") as mock_int_run:
             setup_all_veths(ns_dict)
             # 2 exists calls and 1 create
             self.assertEqual(3, mock_int_run.call_count)
@@ -106,9 +477,10 @@ class NetNSTests(unittest.TestCase):
     def test_setup_global_oob(self) -> None:
         test_ns_dict = {"test_ns": deepcopy(self.test_ns)}
         # Test when we want a global OOB interface
-        with patch(f"{BASE_INT_MODULE}.run") as mock_run:
+        with patch(f"{BASE_BACKEND_MODULE}.run") as mock_run:
             self.assertIsNone(setup_global_oob("unittest0", test_ns_dict, self.config))
-            self.assertEqual(4, mock_run.call_count)
+            # exists check, create, 2 prefixes and link up
+            self.assertEqual(5, mock_run.call_count)
 
         # Test when we don't want a global OOB interface
         test_ns_dict["test_ns"].oob = False
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from json2netns.backend import SubprocessBackend
+from json2netns.nsenter import (
+    delete_netns,
+    NetnsWorkerPool,
+    pin_netns,
+    pinned_netns,
+    switch_netns,
+)
+
+
+BASE_MODULE = "json2netns.nsenter"
+IP = "/usr/sbin/ip"
+
+
+class NsenterTests(unittest.TestCase):
+    def test_switch_netns_unpinned(self) -> None:
+        with self.assertRaises(RuntimeError):
+            switch_netns("left")
+
+    def test_delete_netns(self) -> None:
+        with patch(f"{BASE_MODULE}.ctypes.CDLL") as mock_cdll, patch(
+            f"{BASE_MODULE}.os.unlink"
+        ) as mock_unlink:
+            delete_netns("left")
+            mock_cdll.return_value.umount2.assert_called_once_with(
+                b"/run/netns/left", 2
+            )
+            mock_unlink.assert_called_once_with(Path("/run/netns/left"))
+
+    def test_pin_netns(self) -> None:
+        with patch(f"{BASE_MODULE}.os.open", return_value=69) as mock_open, patch(
+            f"{BASE_MODULE}.os.close"
+        ) as mock_close, patch(f"{BASE_MODULE}.setns") as mock_setns:
+            with pin_netns("left"):
+                self.assertEqual("left", pinned_netns())
+                # Lazy - we don't enter until something needs to run inside
+                self.assertEqual(0, mock_setns.call_count)
+                switch_netns("left")
+                switch_netns("left")
+                self.assertEqual(1, mock_setns.call_count)
+                switch_netns("")
+                self.assertEqual(2, mock_setns.call_count)
+                switch_netns("left")
+
+            # We always go back to the original netns
+            self.assertEqual(4, mock_setns.call_count)
+            self.assertIsNone(pinned_netns())
+            self.assertEqual(mock_open.call_count, mock_close.call_count)
+
+    def test_pinned_subprocess_backend(self) -> None:
+        backend = SubprocessBackend()
+        with patch(f"{BASE_MODULE}.os.open", return_value=69), patch(
+            f"{BASE_MODULE}.os.close"
+        ), patch(f"{BASE_MODULE}.setns") as mock_setns, patch(
+            "json2netns.backend.run"
+        ) as mock_run:
+            with pin_netns("left"):
+                backend.run([IP, "addr", "show"], "left")
+                # No `ip netns exec` wrapper needed
+                self.assertEqual([IP, "addr", "show"], mock_run.call_args[0][0])
+                backend.run([IP, "link", "show"])
+                backend.run([IP, "addr", "show"], "right")
+                self.assertEqual(
+                    [IP, "netns", "exec", "right", IP, "addr", "show"],
+                    mock_run.call_args[0][0],
+                )
+            # Enter left, back to original for the 2 non left cmds
+            self.assertEqual(2, mock_setns.call_count)
+
+    def test_worker_pool(self) -> None:
+        pool = NetnsWorkerPool(2, pin=False)
+        self.assertEqual(None, asyncio.run(pool.run("left", pinned_netns)))
+
+        pool = NetnsWorkerPool(2)
+        with patch(f"{BASE_MODULE}.os.open", return_value=69), patch(
+            f"{BASE_MODULE}.os.close"
+        ), patch(f"{BASE_MODULE}.setns"):
+            self.assertEqual("left", asyncio.run(pool.run("left", pinned_netns)))
+            self.assertEqual(
+                ["left", "right"],
+                pool.map(["left", "right"], lambda netns_name: pinned_netns()),
+            )
+        pool.shutdown()
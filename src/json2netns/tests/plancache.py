@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import os
+import unittest
+from json import dumps
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from json2netns.backend import set_backend
+from json2netns.dryrun import dry_run_host
+from json2netns.main import compile_plan
+from json2netns.nsenter import NetnsWorkerPool
+from json2netns.plancache import CompiledPlan, PlanCache, tool_version
+
+
+BASE_PATH = Path(__file__).parent.parent.resolve()
+SAMPLE_JSON_CONF_PATH = BASE_PATH / "sample.json"
+
+
+class PlanCacheTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = TemporaryDirectory()
+        self.cache = PlanCache(Path(self.td.name) / "plans", size=2)
+        self.plan = CompiledPlan(
+            "create",
+            ["left"],
+            [("", ["netns add left"]), ("left", ["link set up dev lo"])],
+            {"left": "abc"},
+        )
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def test_key(self) -> None:
+        config_path = Path(self.td.name) / "topology.json"
+        config_path.write_text('{"namespaces": {}}')
+        key = self.cache.key(config_path, "create")
+        self.assertEqual(key, self.cache.key(config_path, "create"))
+        self.assertNotEqual(key, self.cache.key(config_path, "delete"))
+        left_key = self.cache.key(config_path, "create", ["left"])
+        self.assertNotEqual(key, left_key)
+        self.assertEqual(
+            self.cache.key(config_path, "create", ["right", "left"]),
+            self.cache.key(config_path, "create", ["left", "right", "left"]),
+        )
+        config_path.write_text('{"namespaces": {} }')
+        self.assertNotEqual(key, self.cache.key(config_path, "create"))
+        with patch("json2netns.plancache.tool_version", return_value="2099.1.1"):
+            self.assertNotEqual(key, self.cache.key(config_path, "delete"))
+        self.assertIn("+", tool_version())
+
+    def test_key_route_files(self) -> None:
+        route_file = Path(self.td.name) / "routes.txt"
+        route_file.write_text("10.6.0.0/24,10.1.1.2\n")
+        config_path = Path(self.td.name) / "topology.json"
+        config_path.write_text(
+            dumps({"namespaces": {"left": {"route_files": [str(route_file)]}}})
+        )
+        key = self.cache.key(config_path, "create")
+        left_key = self.cache.key(config_path, "create", ["left"])
+        right_key = self.cache.key(config_path, "create", ["right"])
+        self.assertEqual(key, self.cache.key(config_path, "create"))
+        # Changing a route file is a miss for namespaces using it
+        route_file.write_text("10.6.0.0/24,10.1.1.2\n10.6.1.0/24,10.1.1.2\n")
+        self.assertNotEqual(key, self.cache.key(config_path, "create"))
+        self.assertNotEqual(left_key, self.cache.key(config_path, "create", ["left"]))
+        self.assertEqual(right_key, self.cache.key(config_path, "create", ["right"]))
+
+    def test_store_load(self) -> None:
+        self.assertIsNone(self.cache.load("a"))
+        self.cache.store("a", self.plan)
+        loaded = self.cache.load("a")
+        self.assertEqual(self.plan, loaded)
+        self.assertEqual(2, len(self.plan))
+
+        self.cache.path("a").write_text('{"action": "create"}')
+        with patch("json2netns.plancache.LOG.error") as mock_error:
+            self.assertIsNone(self.cache.load("a"))
+            self.assertEqual(1, mock_error.call_count)
+
+    def test_lru(self) -> None:
+        for age, key in enumerate(("a", "b")):
+            self.cache.store(key, self.plan)
+            os.utime(self.cache.path(key), (age, age))
+        # Using a makes b the least recently used
+        self.assertIsNotNone(self.cache.load("a"))
+        self.cache.store("c", self.plan)
+        self.assertEqual(
+            ["a.json", "c.json"],
+            sorted(path.name for path in self.cache.directory.iterdir()),
+        )
+
+    def test_applies_apply(self) -> None:
+        with dry_run_host() as (dry_run, _):
+            previous_backend = set_backend(dry_run)
+            try:
+                self.assertTrue(self.plan.applies())
+                failed = asyncio.run(self.plan.apply(NetnsWorkerPool(1)))
+                with patch("json2netns.plancache.LOG.info"):
+                    self.assertFalse(self.plan.applies())
+            finally:
+                set_backend(previous_backend)
+        self.assertEqual(set(), failed)
+        self.assertEqual(
+            [
+                ("", ["netns", "add", "left"]),
+                ("left", ["link", "set", "up", "dev", "lo"]),
+            ],
+            dry_run.commands,
+        )
+
+    def test_rounds(self) -> None:
+        self.plan.batches.extend(
+            [("right", ["link set up dev lo"]), ("left", ["route add ::/0 nhid 1"])]
+        )
+        self.assertEqual(
+            [
+                {"left": ["link set up dev lo"], "right": ["link set up dev lo"]},
+                {"left": ["route add ::/0 nhid 1"]},
+            ],
+            self.plan.rounds(),
+        )
+
+    def test_compile_plan(self) -> None:
+        args = argparse.Namespace(
+            action="create",
+            asyncio=False,
+            batch=True,
+            config=str(SAMPLE_JSON_CONF_PATH),
+            force=False,
+            max_in_flight=64,
+            namespace=None,
+            setns=False,
+            state_dir=self.td.name,
+            validate=True,
+            workers=1,
+        )
+        returncode, plan = asyncio.run(compile_plan(args))
+        self.assertEqual(0, returncode)
+        assert plan is not None
+        self.assertEqual(["left", "right"], plan.namespaces)
+        self.assertEqual(["", "left", "right"], [name for name, _ in plan.batches])
+        self.assertIn("netns add left", plan.batches[0][1])
+        self.assertEqual(["left", "right"], sorted(plan.hashes))
+        self.assertTrue(plan.validated)
+        # The real journal is left alone
+        self.assertEqual([], list(Path(self.td.name).iterdir()))
+
+
+if __name__ == "__main__":  # pragma: nocover
+    unittest.main()
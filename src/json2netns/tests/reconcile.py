@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+from copy import deepcopy
+from ipaddress import ip_interface, ip_network
+from pathlib import Path
+from subprocess import CompletedProcess
+from tempfile import TemporaryDirectory
+from typing import Dict
+from unittest.mock import patch
+
+from json2netns.batch import BatchCommand, BatchFailure
+from json2netns.config import Config
+from json2netns.consts import GLOBAL_OOB_INTERFACE
+from json2netns.netns import Namespace
+from json2netns.nsenter import NetnsWorkerPool
+from json2netns.reconcile import (
+    LinkState,
+    NetnsState,
+    NexthopState,
+    Plan,
+    Reconciler,
+    RouteState,
+)
+
+
+BASE_PATH = Path(__file__).parent.parent.resolve()
+BASE_MODULE = "json2netns.reconcile"
+SAMPLE_JSON_CONF_PATH = BASE_PATH / "sample.json"
+ADDR_JSON = b"""[
+    {"ifname": "lo", "flags": ["LOOPBACK", "UP"], "addr_info": [
+        {"family": "inet", "local": "127.0.0.1", "prefixlen": 8, "scope": "host"},
+        {"family": "inet", "local": "10.6.9.1", "prefixlen": 32, "scope": "global"}
+    ]},
+    {"ifname": "left0", "flags": ["BROADCAST"], "addr_info": []}
+]"""
+ROUTE_JSON = b"""[
+    {"dst": "10.1.1.0/24", "dev": "left0", "protocol": "kernel"},
+    {"dst": "10.6.9.6", "gateway": "10.1.1.3", "protocol": "boot"},
+    {"dst": "default", "gateway": "10.1.1.254", "protocol": "static"}
+]"""
+
+
+class ReconcileTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.config = Config(SAMPLE_JSON_CONF_PATH).load()
+        self.namespaces: Dict[str, Namespace] = {
+            ns_name: Namespace(ns_name, ns_config, self.config)
+            for ns_name, ns_config in self.config["namespaces"].items()
+        }
+        self.reconciler = Reconciler(self.namespaces, self.config, GLOBAL_OOB_INTERFACE)
+
+    def converged_states(self) -> Dict[str, NetnsState]:
+        """Kernel state matching sample.json exactly"""
+        states = {"": NetnsState("")}
+        oob_int = self.namespaces["left"].oob_interface()
+        assert oob_int is not None
+        states[""].links["oob0"] = LinkState(
+            "oob0",
+            True,
+            {ip_interface(p) for p in self.config["oob"]["prefixes"]},
+        )
+        for ns in self.namespaces.values():
+            state = NetnsState(ns.name)
+            for int_obj in self.reconciler._links(ns):
+                state.links[int_obj.name] = LinkState(
+                    int_obj.name, True, set(int_obj.prefixes)
+                )
+            for route_obj in ns.route_objects():
+                state.routes[ip_network(route_obj.dest_prefix)] = RouteState(
+                    route_obj.next_hop_ip
+                )
+            states[ns.name] = state
+        return states
+
+    def test_netns_state_load(self) -> None:
+        with patch(
+            "json2netns.backend.run",
+            side_effect=[
+                CompletedProcess([], 0, ADDR_JSON),
+                CompletedProcess([], 0, ROUTE_JSON),
+                CompletedProcess([], 0, b""),
+            ],
+        ), patch(f"{BASE_MODULE}.netns_path") as mock_path:
+            mock_path.return_value.exists.return_value = True
+            state = NetnsState.load("left")
+
+        self.assertTrue(state.links["lo"].up)
+        self.assertFalse(state.links["left0"].up)
+        self.assertEqual({ip_interface("10.6.9.1/32")}, state.links["lo"].prefixes)
+        self.assertTrue(state.links["lo"].has_prefix(ip_interface("127.0.0.1/8")))
+        # Kernel connected routes are not ours to manage
+        self.assertEqual(
+            {
+                ip_network("10.6.9.6/32"): RouteState("10.1.1.3"),
+                ip_network("0.0.0.0/0"): RouteState("10.1.1.254"),
+            },
+            state.routes,
+        )
+
+        with patch(f"{BASE_MODULE}.netns_path") as mock_path:
+            mock_path.return_value.exists.return_value = False
+            self.assertFalse(NetnsState.load("left").exists)
+
+    def test_plan_converged(self) -> None:
+        plan = self.reconciler.plan(self.converged_states())
+        self.assertEqual(0, len(plan))
+        self.assertEqual("No changes. Kernel state matches the config.", plan.render())
+
+    def test_plan_from_scratch(self) -> None:
+        states = {"": NetnsState("")}
+        for ns_name in self.namespaces:
+            states[ns_name] = NetnsState(ns_name, exists=False)
+        plan = self.reconciler.plan(states)
+
+        default_args = [c.args for c in plan.changes if not c.netns_name]
+        self.assertEqual(["netns", "add", "left"], default_args[0])
+        # The veth pair is only created once
+        self.assertEqual(
+            1, sum(1 for a in default_args if a[:2] == ["link", "add"] and "veth" in a)
+        )
+        self.assertIn(["link", "set", "right0", "netns", "right"], default_args)
+        self.assertEqual(["", "left", "right"], list(plan.batches()))
+        self.assertIn(
+            ["route", "add", "10.6.9.6/32", "via", "10.1.1.2"],
+            [c.args for c in plan.changes],
+        )
+        self.assertEqual("28 to add, 11 to change, 0 to remove", plan.summary())
+
+    def test_plan_drift(self) -> None:
+        states = self.converged_states()
+        left = states["left"]
+        left.links["left0"].prefixes.add(ip_interface("10.99.0.1/24"))
+        left.links["lo"].up = False
+        left.routes[ip_network("10.6.9.6/32")] = RouteState("10.1.1.3")
+        left.routes[ip_network("10.77.0.0/16")] = RouteState("10.1.1.2")
+        # right0 never made it into its netns
+        del states["right"].links["right0"]
+        states[""].links["right0"] = LinkState("right0")
+        plan = self.reconciler.plan(states)
+
+        self.assertEqual(
+            [
+                ("", ["link", "set", "right0", "netns", "right"]),
+                ("left", ["addr", "del", "10.99.0.1/24", "dev", "left0"]),
+                ("left", ["link", "set", "up", "dev", "lo"]),
+                ("left", ["route", "replace", "10.6.9.6/32", "via", "10.1.1.2"]),
+                ("left", ["route", "del", "10.77.0.0/16"]),
+                ("right", ["addr", "add", "fd00::2/64", "dev", "right0"]),
+                ("right", ["addr", "add", "10.1.1.2/24", "dev", "right0"]),
+                ("right", ["link", "set", "up", "dev", "right0"]),
+            ],
+            [(c.netns_name, c.args) for c in plan.changes],
+        )
+        self.assertEqual(
+            "- [left] route del 10.77.0.0/16 (stale route)", str(plan.changes[4])
+        )
+
+    def test_nexthop_state(self) -> None:
+        state = NetnsState("left")
+        state.add_json_nexthops(
+            [
+                {"id": 1, "gateway": "10.1.1.2", "dev": "left0"},
+                {"id": 10, "group": [{"id": 1, "weight": 2}, {"id": 2}]},
+            ]
+        )
+        self.assertEqual(
+            {
+                1: NexthopState("10.1.1.2", "left0"),
+                10: NexthopState(group=((1, 2), (2, 1))),
+            },
+            state.nexthops,
+        )
+        state.add_json_routes(
+            [
+                {"dst": "10.7.0.0/16", "nhid": 10, "nexthops": []},
+                {
+                    "dst": "10.8.0.0/16",
+                    "nexthops": [
+                        {"gateway": "10.1.1.2", "dev": "left0", "weight": 1},
+                        {"gateway": "10.1.1.3", "dev": "left0", "weight": 3},
+                    ],
+                },
+            ],
+            4,
+        )
+        self.assertEqual(10, state.routes[ip_network("10.7.0.0/16")].nhid)
+        self.assertEqual(
+            (("10.1.1.2", "left0", 1), ("10.1.1.3", "left0", 3)),
+            state.routes[ip_network("10.8.0.0/16")].nexthops,
+        )
+
+    def test_plan_nexthops(self) -> None:
+        ns_config = deepcopy(self.config["namespaces"]["left"])
+        ns_config["nexthops"] = {
+            "spines": {"id": 10, "group": {"right": 1}},
+            "right": {"id": 1, "next_hop_ip": "10.1.1.2", "egress_if_name": "left0"},
+        }
+        ns_config["routes"]["shared"] = {
+            "dest_prefix": "10.7.0.0/16",
+            "nexthop": "spines",
+        }
+        self.namespaces["left"] = Namespace("left", ns_config, self.config)
+        states = self.converged_states()
+        left = states["left"]
+        left.nexthops[1] = NexthopState("10.1.1.3", "left0")
+        left.nexthops[10] = NexthopState(group=((1, 1),))
+        # An old group + member nothing uses now
+        left.nexthops[20] = NexthopState(group=((2, 1),))
+        left.nexthops[2] = NexthopState("10.1.1.4", "left0")
+        plan = self.reconciler.plan(states)
+
+        self.assertEqual(
+            [
+                ["nexthop", "replace", "id", "1", "via", "10.1.1.2", "dev", "left0"],
+                ["route", "replace", "10.7.0.0/16", "nhid", "10"],
+                ["nexthop", "del", "id", "20"],
+                ["nexthop", "del", "id", "2"],
+            ],
+            [c.args for c in plan.changes],
+        )
+        self.assertEqual([], list(plan.batches()))
+        self.assertEqual(["left"], list(plan.batches(nexthops=True)))
+
+        left.nexthops[1] = NexthopState("10.1.1.2", "left0")
+        del left.nexthops[20], left.nexthops[2]
+        left.routes[ip_network("10.7.0.0/16")] = RouteState(nhid=10)
+        self.assertEqual(0, len(self.reconciler.plan(states)))
+
+    def test_plan_route_files(self) -> None:
+        states = self.converged_states()
+        left = states["left"]
+        left.routes[ip_network("10.20.0.0/24")] = RouteState("10.1.1.2")
+        left.routes[ip_network("10.21.0.0/24")] = RouteState("10.1.1.3")
+        left.routes[ip_network("10.77.0.0/16")] = RouteState("10.1.1.2")
+        with TemporaryDirectory() as td:
+            route_file = Path(td) / "routes.csv"
+            route_file.write_text(
+                "10.20.0.0/24,10.1.1.2\n10.21.0.0/24,10.1.1.2\n10.22.0.0/24,10.1.1.2\n"
+            )
+            self.namespaces["left"].route_files = (str(route_file),)
+            plan = self.reconciler.plan(states)
+            self.assertEqual(
+                [
+                    ["route", "replace", "10.21.0.0/24", "via", "10.1.1.2"],
+                    ["route", "add", "10.22.0.0/24", "via", "10.1.1.2"],
+                    ["route", "del", "10.77.0.0/16"],
+                ],
+                [c.args for c in plan.changes],
+            )
+            self.assertEqual(
+                "~ [left] route replace 10.21.0.0/24 via 10.1.1.2 "
+                + "(route routes.csv:2 to 10.21.0.0/24)",
+                str(plan.changes[0]),
+            )
+
+        # Routes in an unreadable file may be any of them, so none are stale
+        with patch(f"{BASE_MODULE}.LOG.error") as mock_error:
+            plan = self.reconciler.plan(states)
+            self.assertEqual(1, mock_error.call_count)
+        self.assertEqual(0, len(plan))
+
+    def test_plan_apply(self) -> None:
+        plan = Plan()
+        plan.add("", ["netns", "add", "left"], "left namespace")
+        plan.add("left", ["link", "set", "up", "dev", "lo"], "lo link up")
+        failure = BatchFailure(
+            1,
+            BatchCommand(["link", "set", "up", "dev", "lo"], "lo link up"),
+            "Cannot find device",
+        )
+        pool = NetnsWorkerPool(1, pin=False)
+        with patch(
+            "json2netns.batch.Batch.run", side_effect=[[], [failure]]
+        ) as mock_run:
+            self.assertEqual([failure], asyncio.run(plan.apply(pool)))
+            self.assertEqual(2, mock_run.call_count)
+        pool.shutdown()
@@ -2,16 +2,24 @@
 
 import logging
 import unittest
+from ipaddress import ip_network
 from pathlib import Path
 from subprocess import CompletedProcess
 from typing import List
 from unittest.mock import patch
 
 from json2netns.config import Config
-from json2netns.route import Route
+from json2netns.route import (
+    MultipathRoute,
+    Nexthop,
+    NexthopRoute,
+    Route,
+    RouteState,
+    RouteTable,
+)
 
 BASE_PATH = Path(__file__).parent.parent.resolve()
-BASE_MODULE = "json2netns.route"
+BASE_BACKEND_MODULE = "json2netns.backend"
 LOG = logging.getLogger(__name__)
 SAMPLE_JSON_CONF_PATH = BASE_PATH / "sample.json"
 
@@ -80,23 +88,101 @@ class RouteTests(unittest.TestCase):
             self.bad_nexthop_obj._Route__proto_match_validated()
 
     def test_route_exists(self) -> None:
-        with patch(f"{BASE_MODULE}.check_output") as mock_check_output:
+        with patch(f"{BASE_BACKEND_MODULE}.run") as mock_run:
             # Use first route in sample.json to test -> 10.6.9.6 via 10.1.1.2
             # Route that isn't in table
-            mock_check_output.return_value = b"10.1.1.0/24 dev ens192"
+            mock_run.return_value = CompletedProcess(
+                [], 0, b'[{"dst":"10.1.1.0/24","dev":"ens192"}]'
+            )
             self.assertFalse(self.route_list[0].route_exists())
-            # Host route that is in table
-            mock_check_output.return_value = b"10.6.9.6/32 via 10.1.1.2"
+            # One dump per address family
+            self.assertEqual(2, mock_run.call_count)
+            # Host route that is in table - ip shows no /32
+            mock_run.return_value = CompletedProcess(
+                [], 0, b'[{"dst":"10.6.9.6","gateway":"10.1.1.2"}]'
+            )
             self.assertTrue(self.route_list[0].route_exists())
 
             # Use second route in sample.json to test v6 non-host -> fd00:6::/64 via fd00::1
             # v6 route that isn't in the table
-            mock_check_output.return_value = b"fd00::64/64 dev ens192"
+            mock_run.return_value = CompletedProcess(
+                [], 0, b'[{"dst":"fd00::64/64","dev":"ens192"}]'
+            )
             self.assertFalse(self.route_list[1].route_exists())
             # v6 route that is in table
-            mock_check_output.return_value = b"fd00:6::/64 dev ens192"
+            mock_run.return_value = CompletedProcess(
+                [], 0, b'[{"dst":"fd00:6::/64","dev":"ens192"}]'
+            )
             self.assertTrue(self.route_list[1].route_exists())
 
+    def test_route_exists_table(self) -> None:
+        route_table = RouteTable("left")
+        with patch(f"{BASE_BACKEND_MODULE}.run") as mock_run:
+            self.assertFalse(self.route_list[0].route_exists(route_table))
+            route_table.add("10.6.9.6/32")
+            self.assertTrue(self.route_list[0].route_exists(route_table))
+            self.assertEqual(0, mock_run.call_count)
+
+    def test_route_table(self) -> None:
+        route_table = RouteTable("left")
+        route_table.add_json_routes(
+            [
+                {"dst": "default", "gateway": "10.1.1.254"},
+                {"dst": "10.1.1.10", "gateway": "10.1.1.2"},
+                {"dst": "10.1.1.0/24", "dev": "left0"},
+                {"type": "local", "dst": "10.1.1.1", "table": "local"},
+                {"type": "broadcast", "dst": "10.1.1.255", "table": "local"},
+            ],
+            4,
+        )
+        route_table.add_json_routes([{"dst": "fd00::/64"}, {"dst": "fd00::1"}], 6)
+        self.assertEqual(5, len(route_table))
+        self.assertIn("0.0.0.0/0", route_table)
+        self.assertIn("10.1.1.10/32", route_table)
+        self.assertIn("10.1.1.0/24", route_table)
+        self.assertIn("fd00::1/128", route_table)
+        self.assertIn("fd00:0::/64", route_table)
+        # No substring matches + no kernel local/broadcast routes
+        self.assertNotIn("10.1.1.1/32", route_table)
+        self.assertNotIn("10.1.1.255/32", route_table)
+        self.assertNotIn("::/0", route_table)
+        # Where main table routes go
+        self.assertEqual(
+            RouteState("10.1.1.254"), route_table.routes[ip_network("0.0.0.0/0")]
+        )
+        self.assertEqual(
+            RouteState(dev="left0"), route_table.routes[ip_network("10.1.1.0/24")]
+        )
+        self.assertEqual(5, len(route_table.routes))
+
+    def test_route_changed(self) -> None:
+        route = Route("r1", "left", "10.6.9.6/32", "10.1.1.2", "")
+        self.assertFalse(route.changed(RouteState("10.1.1.2", "left0")))
+        self.assertTrue(route.changed(RouteState("10.1.1.3", "left0")))
+        self.assertTrue(route.changed(RouteState(nhid=1)))
+        v6_route = Route("r2", "left", "fd00:6::/64", "fd00::02", "left0")
+        self.assertFalse(v6_route.changed(RouteState("fd00::2", "left0")))
+        self.assertTrue(v6_route.changed(RouteState("fd00::2", "left1")))
+
+        multipath = MultipathRoute(
+            "r3",
+            "left",
+            "10.7.0.0/16",
+            "",
+            "",
+            (("10.1.1.2", "", 1), ("10.1.1.3", "", 2)),
+        )
+        hops = (("10.1.1.3", "left0", 2), ("10.1.1.2", "left0", 1))
+        self.assertFalse(multipath.changed(RouteState(nexthops=hops)))
+        self.assertTrue(multipath.changed(RouteState(nexthops=hops[:1])))
+        self.assertTrue(
+            multipath.changed(RouteState(nexthops=(hops[0], ("10.1.1.2", "", 2))))
+        )
+
+        nexthop_route = NexthopRoute("r4", "left", "10.8.0.0/16", "", "", "nh", 10)
+        self.assertFalse(nexthop_route.changed(RouteState(nhid=10)))
+        self.assertTrue(nexthop_route.changed(RouteState("10.1.1.2")))
+
     def test_get_route(self) -> None:
         # Use first host route in sample.json to test -> 10.6.9.6 via 10.1.1.2
         # Checks within this method are done above, thus mocked
@@ -111,3 +197,93 @@ class RouteTests(unittest.TestCase):
                 self.route_list[0].get_route(),
                 ["/usr/sbin/ip", "route", "add", "10.6.9.6/32", "via", "10.1.1.2"],
             )
+
+    def test_dev_route(self) -> None:
+        # Routes out an egress interface with no next hop are valid
+        route = Route("r1", "left", "10.0.0.0/24", "", "left0")
+        self.assertEqual(
+            ["/usr/sbin/ip", "route", "add", "10.0.0.0/24", "dev", "left0"],
+            route.get_route(check_exists=False),
+        )
+        self.assertFalse(route.changed(RouteState("", "left0")))
+        self.assertTrue(route.changed(RouteState("10.0.0.1", "left0")))
+        self.assertTrue(route.changed(RouteState("", "left1")))
+
+        # Routes need one of them though
+        self.assertEqual(
+            [], Route("r2", "left", "10.0.0.0/24", "", "").get_route(check_exists=False)
+        )
+
+    def test_multipath_route(self) -> None:
+        route = MultipathRoute(
+            "ecmp",
+            "left",
+            "10.7.0.0/16",
+            "",
+            "",
+            (("10.1.1.2", "", 1), ("10.1.1.3", "left0", 3)),
+        )
+        with patch.object(Route, "route_exists", return_value=False):
+            self.assertEqual(
+                [
+                    "/usr/sbin/ip",
+                    "route",
+                    "add",
+                    "10.7.0.0/16",
+                    "nexthop",
+                    "via",
+                    "10.1.1.2",
+                    "weight",
+                    "1",
+                    "nexthop",
+                    "via",
+                    "10.1.1.3",
+                    "dev",
+                    "left0",
+                    "weight",
+                    "3",
+                ],
+                route.get_route(),
+            )
+
+        with patch("json2netns.route.LOG.error") as mock_error:
+            for hops in (
+                (),
+                (("fd00::2", "", 1),),
+                (("10.1.1.z", "", 1),),
+                (("10.1.1.2", "", 0),),
+                (("", "", 1),),
+            ):
+                route.hops = hops
+                self.assertEqual([], route.get_route(check_exists=False))
+            self.assertEqual(5, mock_error.call_count)
+
+    def test_nexthop_route(self) -> None:
+        route = NexthopRoute("shared", "left", "10.7.0.0/16", "", "", "ecmp", 10)
+        self.assertEqual(
+            ["/usr/sbin/ip", "route", "add", "10.7.0.0/16", "nhid", "10"],
+            route.get_route(check_exists=False),
+        )
+        with patch("json2netns.route.LOG.error") as mock_error:
+            route.nhid = 0
+            self.assertEqual([], route.get_route(check_exists=False))
+            route.dest_prefix = "10.7.0.0/33"
+            self.assertEqual([], route.get_route(check_exists=False))
+            self.assertEqual(3, mock_error.call_count)
+
+    def test_nexthop(self) -> None:
+        gateway = Nexthop("right", "left", 1, "10.1.1.2", "left0", ())
+        self.assertEqual(
+            ["nexthop", "replace", "id", "1", "via", "10.1.1.2", "dev", "left0"],
+            gateway.replace_args(),
+        )
+        self.assertEqual(
+            ["nexthop", "replace", "id", "3", "dev", "lo"],
+            Nexthop("lo", "left", 3, "", "lo", ()).replace_args(),
+        )
+        group = Nexthop("ecmp", "left", 10, "", "", ((1, 1), (2, 3)))
+        self.assertEqual(
+            ["nexthop", "replace", "id", "10", "group", "1/2,3"],
+            group.replace_args(),
+        )
+        self.assertEqual(["nexthop", "del", "id", "10"], group.del_args())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import asyncio
+import gzip
+import unittest
+from pathlib import Path
+from subprocess import CompletedProcess
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from json2netns.routefeed import file_version, parse_route_line, RouteFeed, RouteFile
+
+
+BASE_BACKEND_MODULE = "json2netns.backend"
+BASE_MODULE = "json2netns.routefeed"
+ROUTES_CSV = """\
+dest_prefix,next_hop_ip,egress_if_name
+10.20.0.0/24,10.1.1.2,left0
+# A comment
+
+10.21.0.0/24,10.1.1.2
+10.22.0.0/16,,left0
+10.0.0.1/8,10.1.1.2,left0
+"""
+
+
+class RouteFeedTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = TemporaryDirectory()
+        self.csv_path = Path(self.td.name) / "routes.csv"
+        self.csv_path.write_text(ROUTES_CSV)
+        self.gz_path = Path(self.td.name) / "routes6.txt.gz"
+        with gzip.open(self.gz_path, "wt") as gfp:
+            gfp.write("2001:db8::/64 fd00::2\n2001:db8:1::/64 fd00::2 left0\n")
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def test_parse_route_line(self) -> None:
+        self.assertIsNone(parse_route_line("  \n"))
+        self.assertIsNone(parse_route_line("# 10.1.1.0/24,10.1.1.2"))
+        self.assertEqual(
+            ("10.20.0.0/24", "10.1.1.2", "left0"),
+            parse_route_line(" 10.20.0.0/24 , 10.1.1.2 , left0\n"),
+        )
+        self.assertEqual(
+            ("fd00:6::/64", "fd00::2", ""), parse_route_line("fd00:6::/64\tfd00::2")
+        )
+        for bad_line in (
+            "10.20.0.0/24",
+            "10.20.0.1/24,10.1.1.2",
+            "10.20.0.0/24,fd00::2",
+            "10.20.0.0/24,10.1.1.256",
+            "10.20.0.0/33,10.1.1.2",
+            "10.20.0.0/24,10.1.1.2,left0,extra",
+            "10.20.0.0/24,,a_very_long_interface",
+        ):
+            with self.assertRaises(ValueError):
+                parse_route_line(bad_line)
+
+    def test_route_file(self) -> None:
+        route_file = RouteFile(self.csv_path)
+        with patch(f"{BASE_MODULE}.LOG.error") as mock_error:
+            self.assertEqual(
+                [
+                    (2, "10.20.0.0/24", "10.1.1.2", "left0"),
+                    (5, "10.21.0.0/24", "10.1.1.2", ""),
+                    (6, "10.22.0.0/16", "", "left0"),
+                ],
+                list(route_file),
+            )
+            self.assertEqual(1, mock_error.call_count)
+        self.assertEqual(1, route_file.invalid)
+        self.assertEqual(2, len(list(RouteFile(self.gz_path))))
+
+    def test_install(self) -> None:
+        feed = RouteFeed("left", [str(self.csv_path), str(self.gz_path)], 2)
+        # A chunk of 2 + the csv's last route, then the gzip file's 2
+        with patch(
+            f"{BASE_BACKEND_MODULE}.run",
+            side_effect=[
+                CompletedProcess([], 0, "", ""),
+                CompletedProcess(
+                    [], 1, "", 'Cannot find device "left0"\nCommand failed -:1\n'
+                ),
+                CompletedProcess([], 0, "", ""),
+            ],
+        ) as mock_run, patch(f"{BASE_MODULE}.LOG.error"), patch(
+            "json2netns.batch.LOG.error"
+        ):
+            stats = feed.install()
+        self.assertEqual(3, mock_run.call_count)
+        self.assertEqual(
+            "route replace 10.20.0.0/24 via 10.1.1.2 dev left0\n"
+            + "route replace 10.21.0.0/24 via 10.1.1.2\n",
+            mock_run.call_args_list[0][1]["input"],
+        )
+        self.assertEqual(
+            "route replace 2001:db8::/64 via fd00::2\n"
+            + "route replace 2001:db8:1::/64 via fd00::2 dev left0\n",
+            mock_run.call_args_list[2][1]["input"],
+        )
+        self.assertEqual((4, 1, 1), (stats.installed, stats.invalid, stats.failed))
+
+    def test_install_async(self) -> None:
+        feed = RouteFeed("left", [str(self.gz_path), "/not_there.csv"])
+        with patch(
+            "json2netns.backend.SubprocessBackend.run_async",
+            return_value=CompletedProcess([], 0, "", ""),
+        ) as mock_run_async, patch(f"{BASE_MODULE}.LOG.error") as mock_error:
+            stats = asyncio.run(feed.install_async())
+            self.assertEqual(1, mock_run_async.call_count)
+            self.assertEqual(1, mock_error.call_count)
+        self.assertEqual((2, 1), (stats.installed, stats.failed))
+        self.assertGreater(stats.rate, 0)
+
+    def test_file_version(self) -> None:
+        version = file_version(str(self.csv_path))
+        self.assertEqual(len(ROUTES_CSV), version[0])
+        self.assertEqual([-1, 0], file_version("/not_there.csv"))
+
+
+if __name__ == "__main__":  # pragma: nocover
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+from functools import partial
+from typing import List
+
+from json2netns.nsenter import NetnsWorkerPool
+from json2netns.scheduler import TaskGraph
+
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.pool = NetnsWorkerPool(4, pin=False)
+        self.ran: List[str] = []
+
+    def tearDown(self) -> None:
+        self.pool.shutdown()
+
+    def record(self, name: str) -> None:
+        self.ran.append(name)
+
+    def raise_error(self) -> None:
+        raise OSError("RTNETLINK answers: File exists")
+
+    def test_run_order(self) -> None:
+        graph = TaskGraph()
+        graph.add("routes:left", lambda: self.record("routes:left"), ["links:left"])
+        graph.add("netns:left", lambda: self.record("netns:left"))
+        graph.add("netns:right", lambda: self.record("netns:right"))
+        graph.add(
+            "veth:left0/right0",
+            lambda: self.record("veth:left0/right0"),
+            ["netns:left", "netns:right"],
+        )
+        graph.add(
+            "links:left", lambda: self.record("links:left"), ["veth:left0/right0"]
+        )
+        self.assertEqual([], asyncio.run(graph.run(self.pool)))
+        self.assertEqual(
+            ["veth:left0/right0", "links:left", "routes:left"], self.ran[2:]
+        )
+        for duration, task in enumerate(graph.tasks.values()):
+            task.start, task.end = 0.0, float(duration + 1)
+        self.assertEqual(
+            ["netns:right", "veth:left0/right0", "links:left", "routes:left"],
+            [task.name for task in graph.critical_path()],
+        )
+
+    def test_failure_skips_dependents(self) -> None:
+        graph = TaskGraph()
+        graph.add("netns:left", self.raise_error, owners=["left"])
+        graph.add("links:left", lambda: self.record("links:left"), ["netns:left"])
+        graph.add(
+            "routes:left",
+            lambda: self.record("routes:left"),
+            ["links:left"],
+            owners=["left"],
+        )
+        graph.add("netns:right", lambda: self.record("netns:right"), owners=["right"])
+        not_ok = asyncio.run(graph.run(self.pool))
+        self.assertEqual(["netns:right"], self.ran)
+        self.assertEqual(
+            ["links:left", "netns:left", "routes:left"],
+            sorted(task.name for task in not_ok),
+        )
+        self.assertIsInstance(graph.tasks["netns:left"].error, OSError)
+        self.assertEqual({"left"}, graph.failed_owners(not_ok))
+
+    def test_bad_graphs(self) -> None:
+        graph = TaskGraph()
+        graph.add("a", lambda: None, ["b"])
+        with self.assertRaises(ValueError):
+            graph.add("a", lambda: None)
+        with self.assertRaises(ValueError):
+            graph.topological_order()
+        graph.add("b", lambda: None, ["a"])
+        with self.assertRaises(ValueError):
+            asyncio.run(graph.run(self.pool))
+        self.assertEqual([], TaskGraph().critical_path())
+
+    def test_coroutine_tasks(self) -> None:
+        async def record_async(name: str) -> None:
+            await asyncio.sleep(0)
+            self.record(name)
+
+        graph = TaskGraph()
+        graph.add("netns:left", partial(record_async, "netns:left"))
+        graph.add("links:left", lambda: self.record("links:left"), ["netns:left"])
+        graph.add("routes:left", partial(record_async, "routes:left"), ["links:left"])
+        self.assertEqual([], asyncio.run(graph.run(self.pool)))
+        self.assertEqual(["netns:left", "links:left", "routes:left"], self.ran)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import unittest
+from pathlib import Path
+from subprocess import CompletedProcess
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from json2netns.config import Config
+from json2netns.inventory import link_inventory
+from json2netns.netns import LazyNamespaces
+from json2netns.nsenter import set_netns_dir
+from json2netns.teardown import namespace_links, Teardown
+
+
+BASE_PATH = Path(__file__).parent.parent.resolve()
+SAMPLE_JSON_CONF_PATH = BASE_PATH / "sample.json"
+LINKS_JSON = (
+    b'[{"ifindex": 1, "ifname": "lo"}, {"ifindex": 2, "ifname": "oob0"}, '
+    + b'{"ifindex": 3, "ifname": "right0"}]'
+)
+
+
+class TeardownTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.config = Config(SAMPLE_JSON_CONF_PATH).load()
+        self.td = TemporaryDirectory()
+        self.netns_dir = Path(self.td.name)
+        self.previous_netns_dir = set_netns_dir(self.netns_dir)
+        self.namespaces = LazyNamespaces(self.config)
+        for ns_name in self.namespaces:
+            # Pretend the netns exists
+            (self.netns_dir / ns_name).touch()
+
+    def tearDown(self) -> None:
+        set_netns_dir(self.previous_netns_dir)
+        self.td.cleanup()
+
+    def test_batch(self) -> None:
+        (self.netns_dir / "right").unlink()
+        with patch(
+            "json2netns.backend.run",
+            return_value=CompletedProcess([], 0, LINKS_JSON, ""),
+        ), link_inventory():
+            teardown = Teardown(self.namespaces, "oob0")
+            batch = teardown.batch()
+        self.assertEqual(["netns del left", "link del oob0"], batch.lines())
+        # No per interface deletes - right0 goes when its netns does
+        self.assertEqual({"right0"}, teardown.leftover_links)
+        # Found from the config - no Namespace is built
+        self.assertEqual(0, self.namespaces.built)
+
+    def test_namespace_links(self) -> None:
+        self.assertEqual(
+            {"left0", "right0", "oob1"},
+            namespace_links(self.config["namespaces"]["left"]),
+        )
+
+    def test_wait(self) -> None:
+        with patch(
+            "json2netns.backend.run",
+            return_value=CompletedProcess([], 0, LINKS_JSON, ""),
+        ) as mock_run:
+            teardown = Teardown(self.namespaces, "oob0", poll_interval=0)
+            self.assertEqual([], teardown.run())
+            self.assertEqual(["left", "right", "right0"], sorted(teardown.pending()))
+
+            for ns_name in self.namespaces:
+                (self.netns_dir / ns_name).unlink()
+            mock_run.return_value = CompletedProcess(
+                [], 0, b'[{"ifindex": 1, "ifname": "lo"}]'
+            )
+            self.assertEqual([], teardown.wait())
+            # Nothing left to poll the links for
+            run_count = mock_run.call_count
+            self.assertEqual([], teardown.pending())
+            self.assertEqual(run_count, mock_run.call_count)
+
+    def test_wait_timeout(self) -> None:
+        with patch(
+            "json2netns.backend.run",
+            return_value=CompletedProcess([], 0, LINKS_JSON, ""),
+        ):
+            teardown = Teardown(self.namespaces, "oob0", timeout=0, poll_interval=0)
+            teardown.batch()
+            self.assertEqual(["left", "right", "right0"], teardown.wait())
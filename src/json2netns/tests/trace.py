@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+from pathlib import Path
+from subprocess import CalledProcessError, CompletedProcess
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock
+
+from json2netns.backend import TracingBackend
+from json2netns.consts import DEFAULT_IP as IP
+from json2netns.interfaces import Veth
+from json2netns.trace import (
+    command_type,
+    get_tracer,
+    NULL_SPAN,
+    set_tracer,
+    span,
+    traced,
+    Tracer,
+)
+
+
+@traced
+def create_veth(veth: Veth) -> str:
+    with span("create", "command", cmd="ip link add"):
+        return veth.name
+
+
+@traced
+async def create_veth_async(veth: Veth) -> str:
+    return create_veth(veth)
+
+
+class TraceTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tracer = Tracer()
+        self.veth = Veth("left0", "right0", ["10.1.1.1/24"])
+
+    def tearDown(self) -> None:
+        set_tracer(None)
+
+    def test_disabled(self) -> None:
+        self.assertIsNone(get_tracer())
+        self.assertIs(NULL_SPAN, span("create"))
+        with span("create") as noop:
+            noop.set(rc=0)
+        self.assertEqual("left0", create_veth(self.veth))
+        self.assertEqual([], self.tracer.spans)
+
+    def test_spans(self) -> None:
+        self.assertIsNone(set_tracer(self.tracer))
+        self.assertEqual("left0", create_veth(self.veth))
+        self.assertEqual("left0", asyncio.run(create_veth_async(self.veth)))
+        with self.assertRaises(CalledProcessError):
+            with span("failing", "command", namespace="left"):
+                raise CalledProcessError(2, [IP, "route", "add"])
+
+        names = [(name, cat) for name, cat, *_ in self.tracer.spans]
+        self.assertEqual(
+            [
+                ("create", "command"),
+                ("create_veth", "phase"),
+                ("create", "command"),
+                ("create_veth", "phase"),
+                ("create_veth_async", "phase"),
+                ("failing", "command"),
+            ],
+            names,
+        )
+        # Commands inherit the interface / namespace of the phase they're in
+        self.assertEqual("left0", self.tracer.spans[0][5]["interface"])
+        self.assertEqual("MainThread", self.tracer.spans[0][5]["worker"])
+        self.assertTrue(self.tracer.spans[0][6])
+        self.assertFalse(self.tracer.spans[1][6])
+        self.assertEqual(2, self.tracer.spans[5][5]["rc"])
+        # The asyncio task is its own row
+        self.assertNotEqual(self.tracer.spans[0][4], self.tracer.spans[2][4])
+
+        with TemporaryDirectory() as td:
+            trace_path = Path(td) / "trace.json"
+            self.tracer.write(trace_path)
+            self.assertTrue(trace_path.exists())
+        events = self.tracer.chrome_trace()["traceEvents"]
+        self.assertEqual(
+            ["M", "M", "X", "X", "X", "X", "X", "X"], [e["ph"] for e in events]
+        )
+        self.assertTrue(all(e["dur"] >= 0 for e in events if e["ph"] == "X"))
+
+    def test_summary(self) -> None:
+        set_tracer(self.tracer)
+        with span("Namespace.create", namespace="left"):
+            with span("ip netns add", "command"):
+                pass
+            with span("ip link add", "command", namespace="left", rc=2):
+                pass
+        with span("Namespace.route_add", namespace="right"):
+            pass
+        lines = self.tracer.summary().splitlines()
+        self.assertEqual("Slowest 2 of 2 namespaces", lines[0])
+        self.assertTrue(lines[2].startswith("left"))
+        namespace, _, commands, failed = lines[2].split()
+        self.assertEqual(("left", "2", "0"), (namespace, commands, failed))
+        self.assertEqual("ip", lines[-1].split()[0])
+        self.assertIn("ip link add", self.tracer.summary())
+
+    def test_command_type(self) -> None:
+        self.assertEqual("ip addr add", command_type([IP, "addr", "add", "x"]))
+        self.assertEqual(
+            "ip route show",
+            command_type([IP, "netns", "exec", "left", IP, "-j", "route", "show"]),
+        )
+        self.assertEqual("ip link set", command_type([IP, "-n", "left", "link", "set"]))
+        self.assertEqual(
+            "ip -batch", command_type([IP, "-n", "left", "-force", "-batch", "-"])
+        )
+
+    def test_tracing_backend(self) -> None:
+        inner = MagicMock(max_in_flight=4, IP=IP)
+        inner.name = "subprocess"
+        inner.run.return_value = CompletedProcess([], 0)
+
+        async def run_async(*args: object, **kwargs: object) -> CompletedProcess:
+            return CompletedProcess([], 1)
+
+        inner.run_async = run_async
+        backend = TracingBackend(inner)
+        self.assertEqual("subprocess+trace", backend.name)
+        set_tracer(self.tracer)
+        backend.run([IP, "-force", "-batch", "-"], "left", input="a\nb\n")
+        asyncio.run(backend.run_async([IP, "link", "show"]))
+        backend.close()
+        inner.close.assert_called_once()
+
+        batch, show = self.tracer.spans
+        self.assertEqual("ip -batch", batch[0])
+        self.assertEqual(
+            {"left", 2, 0}, {batch[5][k] for k in ("namespace", "lines", "rc")}
+        )
+        self.assertEqual(1, show[5]["rc"])
+        self.assertNotIn("namespace", show[5])
+
+
+if __name__ == "__main__":  # pragma: nocover
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from json import dumps
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from json2netns.backend import set_backend
+from json2netns.config import Config
+from json2netns.dryrun import dry_run_host
+from json2netns.nsenter import NetnsWorkerPool
+from json2netns.watch import ConfigWatcher, WatchDaemon
+
+
+BASE_MODULE = "json2netns.watch"
+BASE_PATH = Path(__file__).parent.parent.resolve()
+SAMPLE_JSON_CONF_PATH = BASE_PATH / "sample.json"
+
+
+class WatchTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = TemporaryDirectory()
+        self.config_path = Path(self.td.name) / "topology.json"
+        self.topology = Config(SAMPLE_JSON_CONF_PATH).load()
+        self.config_path.write_text(dumps(self.topology))
+        self.pool = NetnsWorkerPool(1, pin=False)
+
+    def tearDown(self) -> None:
+        self.pool.shutdown()
+        self.td.cleanup()
+
+    def test_watcher(self) -> None:
+        watcher = ConfigWatcher(self.config_path, debounce=0.01)
+        try:
+            self.assertGreaterEqual(watcher.fd, 0)
+            self.assertFalse(watcher.wait(0.01))
+            # Other files in the directory are ignored
+            (Path(self.td.name) / "other.json").write_text("{}")
+            self.assertFalse(watcher.wait(0.01))
+            # Saved in place or replaced via a rename
+            self.config_path.write_text("{}")
+            self.assertTrue(watcher.wait(1))
+            tmp_path = Path(self.td.name) / ".topology.json.tmp"
+            tmp_path.write_text("{}")
+            os.replace(tmp_path, self.config_path)
+            self.assertTrue(watcher.wait(1))
+        finally:
+            watcher.close()
+        self.assertEqual(-1, watcher.fd)
+
+    def test_watcher_polling(self) -> None:
+        with patch(
+            f"{BASE_MODULE}.ConfigWatcher._inotify", side_effect=OSError("no")
+        ), patch(f"{BASE_MODULE}.LOG.info"):
+            watcher = ConfigWatcher(self.config_path, 0.01, poll_interval=0.01)
+        self.assertEqual(-1, watcher.fd)
+        self.assertFalse(watcher.wait(0.02))
+        self.config_path.write_text("{}")
+        self.assertTrue(watcher.wait(1))
+
+    def test_changes(self) -> None:
+        daemon = WatchDaemon(self.config_path, self.pool)
+        try:
+            # Everything is new at first
+            versions, changed, removed = daemon.changes(self.topology)
+            self.assertEqual((["left", "right"], []), (changed, removed))
+            daemon.topology = self.topology
+            daemon.applied = versions
+
+            topology = Config(SAMPLE_JSON_CONF_PATH).load()
+            self.assertEqual(([], []), daemon.changes(topology)[1:])
+            topology["namespaces"]["right"]["id"] = 69
+            del topology["namespaces"]["left"]
+            self.assertEqual((["right"], ["left"]), daemon.changes(topology)[1:])
+            # The global config changes every namespace
+            topology["physical_int"] = "eth1"
+            self.assertEqual((["right"], ["left"]), daemon.changes(topology)[1:])
+
+            daemon.selected = {"left"}
+            self.assertEqual(([], ["right"]), daemon.changes(self.topology)[1:])
+        finally:
+            daemon.close()
+
+    def test_apply(self) -> None:
+        daemon = WatchDaemon(self.config_path, self.pool, validate=True)
+        with dry_run_host() as (dry_run, _):
+            previous_backend = set_backend(dry_run)
+            try:
+                topology = daemon.load()
+                assert topology is not None
+                self.assertEqual(0, daemon.apply(topology))
+                self.assertIn(("", ["netns", "add", "left"]), dry_run.commands)
+                self.assertEqual(["left", "right"], sorted(daemon.applied))
+
+                dry_run.commands.clear()
+                with patch(f"{BASE_MODULE}.LOG.info") as mock_info:
+                    self.assertEqual(0, daemon.apply(daemon.load() or {}))
+                    self.assertIn("No namespace changes", mock_info.call_args[0][0])
+                self.assertEqual([], dry_run.commands)
+
+                # Only right is read + changed (the dry run never has the links
+                # so they're always created in the default netns)
+                topology = daemon.load() or {}
+                topology["namespaces"]["right"]["interfaces"]["lo"]["prefixes"].append(
+                    "10.69.69.69/32"
+                )
+                self.assertEqual(0, daemon.apply(topology))
+                self.assertEqual({"", "right"}, {ns for ns, _ in dry_run.commands})
+
+                # Removed namespaces are deleted
+                dry_run.commands.clear()
+                topology = daemon.load() or {}
+                del topology["namespaces"]["right"]
+                # A removal that fails is retried on the next save
+                with patch(f"{BASE_MODULE}.Teardown.wait", return_value=["right"]):
+                    self.assertEqual(1, daemon.apply(topology))
+                self.assertIn(("", ["netns", "del", "right"]), dry_run.commands)
+                self.assertEqual(["left", "right"], sorted(daemon.applied))
+                # The dry run leaves right's veth peers in the default netns
+                with patch(f"{BASE_MODULE}.Teardown.wait", return_value=[]):
+                    self.assertEqual(0, daemon.apply(topology))
+                self.assertEqual(["left"], sorted(daemon.applied))
+            finally:
+                set_backend(previous_backend)
+                daemon.close()
+
+    def test_load_broken(self) -> None:
+        daemon = WatchDaemon(self.config_path, self.pool)
+        try:
+            self.config_path.write_text('{"namespaces": {')
+            with patch(f"{BASE_MODULE}.LOG.error") as mock_error:
+                self.assertIsNone(daemon.load())
+                self.assertEqual(1, mock_error.call_count)
+        finally:
+            daemon.close()
+
+    def test_serve(self) -> None:
+        daemon = WatchDaemon(self.config_path, self.pool)
+        watcher = ConfigWatcher(self.config_path)
+        try:
+            with patch.object(
+                watcher, "wait", side_effect=[True, KeyboardInterrupt()]
+            ), patch.object(daemon, "apply", return_value=0) as mock_apply, patch(
+                f"{BASE_MODULE}.LOG.info"
+            ):
+                self.assertEqual(0, daemon.serve(watcher))
+            # The initial apply + one save
+            self.assertEqual(2, mock_apply.call_count)
+        finally:
+            watcher.close()
+            daemon.close()
+
+
+if __name__ == "__main__":  # pragma: nocover
+    unittest.main()
@@ -0,0 +1,293 @@
+import json
+import logging
+import os
+import sys
+import threading
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from pathlib import Path
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from json2netns import metrics
+
+
+LOG = logging.getLogger(__name__)
+F = TypeVar("F", bound=Callable[..., Any])
+SUMMARY_LIMIT = 10
+
+# Innermost open phase span of this thread / asyncio task
+_current_phase: ContextVar[Optional["Span"]] = ContextVar(
+    "json2netns_phase", default=None
+)
+
+
+class NullSpan:
+    """What span() returns when tracing is off - does nothing"""
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
+    def set(self, **args: Any) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start", "parent", "_token")
+
+    def __init__(
+        self, tracer: Optional["Tracer"], name: str, cat: str, args: Dict
+    ) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0
+        self.parent: Optional[Span] = None
+        self._token: Any = None
+
+    def __enter__(self) -> "Span":
+        self.parent = _current_phase.get()
+        if self.cat == "phase":
+            self._token = _current_phase.set(self)
+        elif self.parent:
+            # e.g. veth commands ran in the default netns for a namespace
+            for key in ("namespace", "interface"):
+                if key in self.parent.args and key not in self.args:
+                    self.args[key] = self.parent.args[key]
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        end = perf_counter_ns()
+        if self._token is not None:
+            _current_phase.reset(self._token)
+        if exc is not None:
+            self.args["error"] = str(exc) or exc_type.__name__
+            returncode = getattr(exc, "returncode", None)
+            if returncode is not None:
+                self.args["rc"] = returncode
+        if self.tracer is not None:
+            self.tracer.add(self, end)
+        run_metrics = metrics.get_metrics()
+        if run_metrics is not None and self.cat == "phase":
+            run_metrics.observe(
+                metrics.PHASE_SECONDS, (end - self.start) / 1e9, phase=self.name
+            )
+
+    def set(self, **args: Any) -> None:
+        self.args.update(args)
+
+
+class Tracer:
+    """Collects spans of phases (Namespace.create etc.) + external commands
+    - chrome_trace() is Chrome trace-event JSON (chrome://tracing / Perfetto)
+    - Each thread + asyncio task is its own trace row (tid)"""
+
+    def __init__(self) -> None:
+        self.origin = perf_counter_ns()
+        self.lock = threading.Lock()
+        # (name, category, start ns, end ns, tid, args, nested in a phase)
+        self.spans: List[Tuple[str, str, int, int, int, Dict, bool]] = []
+        self.workers: Dict[Tuple[Optional[int], int], Tuple[int, str]] = {}
+
+    def span(self, name: str, cat: str = "phase", **args: Any) -> Span:
+        return Span(self, name, cat, args)
+
+    def _worker(self) -> Tuple[int, str]:
+        thread = threading.current_thread()
+        # No task can be running if nothing imported asyncio (e.g. check)
+        asyncio = sys.modules.get("asyncio")
+        try:
+            task = asyncio.current_task() if asyncio else None
+        except RuntimeError:
+            task = None
+        key = (thread.ident, id(task) if task else 0)
+        with self.lock:
+            if key not in self.workers:
+                worker = f"{thread.name}/{task.get_name()}" if task else thread.name
+                self.workers[key] = (len(self.workers) + 1, worker)
+            return self.workers[key]
+
+    def add(self, span: Span, end: int) -> None:
+        tid, worker = self._worker()
+        span.args["worker"] = worker
+        self.spans.append(
+            (
+                span.name,
+                span.cat,
+                span.start,
+                end,
+                tid,
+                span.args,
+                span.parent is not None,
+            )
+        )
+
+    def chrome_trace(self) -> Dict:
+        pid = os.getpid()
+        events: List[Dict] = [
+            {
+                "args": {"name": worker},
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+            }
+            for tid, worker in self.workers.values()
+        ]
+        for name, cat, start, end, tid, args, _ in self.spans:
+            events.append(
+                {
+                    "args": args,
+                    "cat": cat,
+                    "dur": (end - start) / 1000,
+                    "name": name,
+                    "ph": "X",
+                    "pid": pid,
+                    "tid": tid,
+                    "ts": (start - self.origin) / 1000,
+                }
+            )
+        return {"displayTimeUnit": "ms", "traceEvents": events}
+
+    def write(self, path: Path) -> None:
+        with path.open("w") as tfp:
+            json.dump(self.chrome_trace(), tfp)
+        LOG.info(f"Wrote {len(self.spans)} trace spans to {path}")
+
+    def summary(self, limit: int = SUMMARY_LIMIT) -> str:
+        """Table of the slowest namespaces (outermost phase time) + command types"""
+        # namespace -> [phase seconds, commands, failures]
+        namespaces: Dict[str, List[Any]] = {}
+        # command type -> [count, total seconds, max seconds, failures]
+        commands: Dict[str, List[Any]] = {}
+        for name, cat, start, end, _, args, nested in self.spans:
+            seconds = (end - start) / 1e9
+            namespace = args.get("namespace", "")
+            failed = 1 if args.get("error") or args.get("rc") else 0
+            if cat == "command":
+                stats = commands.setdefault(name, [0, 0.0, 0.0, 0])
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+                stats[3] += failed
+                if namespace:
+                    namespaces.setdefault(namespace, [0.0, 0, 0])[1] += 1
+            elif cat == "phase" and namespace:
+                ns_stats = namespaces.setdefault(namespace, [0.0, 0, 0])
+                if not nested:
+                    ns_stats[0] += seconds
+                ns_stats[2] += failed
+
+        lines = [
+            f"Slowest {min(limit, len(namespaces))} of {len(namespaces)} namespaces",
+            f"{'namespace':<24} {'seconds':>9} {'commands':>9} {'failed':>7}",
+        ]
+        for namespace, (seconds, count, failed) in sorted(
+            namespaces.items(), key=lambda item: item[1][0], reverse=True
+        )[:limit]:
+            lines.append(f"{namespace:<24} {seconds:>9.3f} {count:>9} {failed:>7}")
+        lines.extend(
+            [
+                "",
+                f"{'command':<24} {'count':>7} {'total s':>9} {'mean ms':>9} "
+                + f"{'max ms':>9} {'failed':>7}",
+            ]
+        )
+        for name, (count, total, longest, failed) in sorted(
+            commands.items(), key=lambda item: item[1][1], reverse=True
+        ):
+            lines.append(
+                f"{name:<24} {count:>7} {total:>9.3f} {total / count * 1000:>9.2f} "
+                + f"{longest * 1000:>9.2f} {failed:>7}"
+            )
+        return "\n".join(lines)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def set_tracer(tracer: Optional[Tracer]) -> Optional[Tracer]:
+    """Turn tracing on (or off with None) + return the previous tracer"""
+    global _tracer
+    previous = _tracer
+    _tracer = tracer
+    return previous
+
+
+def span(name: str, cat: str = "phase", **args: Any) -> Any:
+    """Time a with block as a span - a no-op object when tracing is off"""
+    tracer = _tracer
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, name, cat, args)
+
+
+def _span_args(args: Sequence[Any]) -> Dict[str, Any]:
+    # Namespace + Interface objects say what their name is in a span
+    if args:
+        trace_arg = getattr(args[0], "trace_arg", "")
+        if trace_arg:
+            return {trace_arg: args[0].name}
+    return {}
+
+
+def traced(func: F) -> F:
+    """Record each call of func (a function or coroutine function) as a phase span
+    - Its duration also goes to the phase histogram when metrics are on"""
+    name = func.__qualname__
+
+    if iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            tracer = _tracer
+            if tracer is None and metrics.get_metrics() is None:
+                return await func(*args, **kwargs)
+            with Span(tracer, name, "phase", _span_args(args)):
+                return await func(*args, **kwargs)
+
+        return async_wrapper  # type: ignore
+
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        tracer = _tracer
+        if tracer is None and metrics.get_metrics() is None:
+            return func(*args, **kwargs)
+        with Span(tracer, name, "phase", _span_args(args)):
+            return func(*args, **kwargs)
+
+    return wrapper  # type: ignore
+
+
+def command_type(cmd: Sequence[str]) -> str:
+    """Group commands for the summary e.g. `ip -n x addr add ...` -> ip addr add"""
+    args = list(cmd[1:])
+    if args[:2] == ["netns", "exec"] and len(args) > 3:
+        args = args[4:]
+    if "-batch" in args:
+        return "ip -batch"
+    words: List[str] = []
+    skip_next = False
+    for arg in args:
+        if skip_next:
+            skip_next = False
+        elif arg in {"-n", "-netns"}:
+            skip_next = True
+        elif not arg.startswith("-"):
+            words.append(arg)
+            if len(words) == 2:
+                break
+    return " ".join(["ip"] + words)
@@ -0,0 +1,282 @@
+import asyncio
+import ctypes
+import logging
+import os
+import select
+import signal
+import struct
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from json2netns.config import Config
+from json2netns.consts import (
+    DEFAULT_TEARDOWN_TIMEOUT,
+    DEFAULT_WATCH_DEBOUNCE,
+    GLOBAL_OOB_INTERFACE,
+)
+from json2netns.netns import LazyNamespaces
+from json2netns.nsenter import NetnsWorkerPool
+from json2netns.reconcile import Reconciler
+from json2netns.routefeed import file_version
+from json2netns.teardown import Teardown
+
+
+LOG = logging.getLogger(__name__)
+
+# <sys/inotify.h> - editors either rewrite the file in place (close_write) or
+# write a temp file + rename it over the config (moved_to)
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# wd, mask, cookie, name length - then the NUL padded name
+INOTIFY_EVENT = struct.Struct("iIII")
+POLL_INTERVAL = 1.0
+
+
+class ConfigWatcher:
+    """Waits for the config file to be saved
+    - inotify watches its directory so files replaced via rename are seen too
+    - Polls the file's size + mtime where inotify isn't available"""
+
+    def __init__(
+        self,
+        path: Path,
+        debounce: float = DEFAULT_WATCH_DEBOUNCE,
+        poll_interval: float = POLL_INTERVAL,
+    ) -> None:
+        self.path = path
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.version = file_version(str(path))
+        self.fd = -1
+        try:
+            self.fd = self._inotify()
+        except (AttributeError, OSError) as err:
+            LOG.info(f"No inotify ({err}) - polling {path} for changes")
+
+    def _inotify(self) -> int:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = int(libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC))
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directory = str(self.path.resolve().parent).encode("utf-8")
+        if libc.inotify_add_watch(fd, directory, WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f"Unable to watch {directory.decode('utf-8')}")
+        return fd
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _inotify_saved(self, timeout: Optional[float]) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        data = os.read(self.fd, 64 * 1024)
+        config_name = os.fsencode(self.path.name)
+        saved = False
+        offset = 0
+        while offset < len(data):
+            name_len = INOTIFY_EVENT.unpack_from(data, offset)[3]
+            name_start = offset + INOTIFY_EVENT.size
+            name = data[name_start : name_start + name_len].rstrip(b"\0")
+            saved |= name == config_name
+            offset = name_start + name_len
+        return saved
+
+    def _poll_saved(self, timeout: Optional[float]) -> bool:
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            version = file_version(str(self.path))
+            if version != self.version:
+                self.version = version
+                return True
+            if deadline is None:
+                sleep(self.poll_interval)
+            elif monotonic() >= deadline:
+                return False
+            else:
+                sleep(min(self.poll_interval, deadline - monotonic()))
+
+    def saved(self, timeout: Optional[float] = None) -> bool:
+        """Was the config saved within timeout seconds? (None waits forever)"""
+        if self.fd >= 0:
+            return self._inotify_saved(timeout)
+        return self._poll_saved(timeout)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the config is saved + then left alone for debounce seconds
+        - Saves in quick succession (editors, generators) are one change
+        - False if timeout seconds pass without a save"""
+        deadline = None if timeout is None else monotonic() + timeout
+        while not self.saved(
+            None if deadline is None else max(0.0, deadline - monotonic())
+        ):
+            if deadline is not None and monotonic() >= deadline:
+                return False
+        while self.saved(self.debounce):
+            LOG.debug(f"{self.path} saved again - waiting for it to settle")
+        return True
+
+
+class WatchDaemon:
+    """Apply the config then only the namespaces that changed on each save
+    - A namespace changes when its config or route files do (or the global
+      config does) - only those are rebuilt, read from the kernel + reconciled
+    - Namespaces removed from the config are deleted
+    - The parsed config, worker threads, backend (e.g. netlink sockets) + event
+      loop are kept between saves"""
+
+    def __init__(
+        self,
+        config_path: Path,
+        pool: NetnsWorkerPool,
+        validate: bool = False,
+        selected: Optional[Sequence[str]] = None,
+        oob_interface_name: str = GLOBAL_OOB_INTERFACE,
+        delete_timeout: float = DEFAULT_TEARDOWN_TIMEOUT,
+    ) -> None:
+        self.config = Config(config_path)
+        self.pool = pool
+        self.validate = validate
+        self.selected = set(selected) if selected else None
+        self.oob_interface_name = oob_interface_name
+        self.delete_timeout = delete_timeout
+        self.loop = asyncio.new_event_loop()
+        # The last applied topology + each namespace's version of it
+        self.topology: Dict[str, Any] = {"namespaces": {}}
+        self.applied: Dict[str, Tuple[Dict, List[List[int]]]] = {}
+
+    def close(self) -> None:
+        self.loop.close()
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """The config as saved - None (keeping what's applied) if it's broken"""
+        try:
+            topology = self.config.load_streaming()
+        except (OSError, ValueError) as err:
+            LOG.error(f"Unable to load {self.config.path}: {err} - waiting for a fix")
+            return None
+        if self.validate and self.config.validate(topology):
+            LOG.error(f"{self.config.path} is not valid - waiting for a fix")
+            return None
+        return topology
+
+    def versions(
+        self, topology: Dict[str, Any]
+    ) -> Dict[str, Tuple[Dict, List[List[int]]]]:
+        """Each (selected) namespace's config + the versions of its route files"""
+        return {
+            name: (
+                ns_config,
+                [file_version(path) for path in ns_config.get("route_files", [])],
+            )
+            for name, ns_config in topology["namespaces"].items()
+            if self.selected is None or name in self.selected
+        }
+
+    def changes(
+        self, topology: Dict[str, Any]
+    ) -> Tuple[Dict[str, Tuple[Dict, List[List[int]]]], List[str], List[str]]:
+        """(new versions, changed namespaces, removed namespaces)"""
+        versions = self.versions(topology)
+        global_changed = {
+            key: value for key, value in topology.items() if key != "namespaces"
+        } != {key: value for key, value in self.topology.items() if key != "namespaces"}
+        changed = [
+            name
+            for name, version in versions.items()
+            if global_changed or self.applied.get(name) != version
+        ]
+        removed = [name for name in self.applied if name not in versions]
+        return versions, changed, removed
+
+    def _remove(
+        self, topology: Dict[str, Any], removed: List[str]
+    ) -> Tuple[int, Set[str]]:
+        """Delete removed namespaces - the global oob device only if it's unused
+        - Built from their applied config as topology no longer has them
+        - Returns (failures, the removed namespaces still there)"""
+        oob_in_use = any(
+            ns_config.get("oob") for ns_config in topology["namespaces"].values()
+        )
+        removed_topology = dict(
+            self.topology,
+            namespaces={name: self.applied[name][0] for name in removed},
+        )
+        teardown = Teardown(
+            LazyNamespaces(removed_topology),
+            "" if oob_in_use else self.oob_interface_name,
+            timeout=self.delete_timeout,
+        )
+        failures = teardown.run()
+        remaining = teardown.wait()
+        return len(failures) + len(remaining), set(remaining) & set(removed)
+
+    def _reconcile(
+        self, topology: Dict[str, Any], changed: List[str]
+    ) -> Tuple[int, int]:
+        """Read + reconcile only the changed namespaces - (changes, failures)"""
+        namespaces = LazyNamespaces(topology).subset(changed)
+        reconciler = Reconciler(namespaces, topology, self.oob_interface_name)
+        plan = reconciler.plan(
+            self.loop.run_until_complete(reconciler.load_states(self.pool))
+        )
+        return len(plan), len(self.loop.run_until_complete(plan.apply(self.pool)))
+
+    def apply(self, topology: Dict[str, Any]) -> int:
+        """Make the kernel match the changed namespaces - returns failure count
+        - Failed namespaces + removals are retried on the next save"""
+        start = monotonic()
+        versions, changed, removed = self.changes(topology)
+        if not changed and not removed:
+            LOG.info(f"No namespace changes in {self.config.path}")
+            self.topology = topology
+            return 0
+
+        failures, not_removed = (
+            self._remove(topology, removed) if removed else (0, set())
+        )
+        change_count, plan_failures = (
+            self._reconcile(topology, changed) if changed else (0, 0)
+        )
+        failures += plan_failures
+
+        self.topology = topology
+        for name in removed:
+            # Still applied so they're removed again on the next save
+            if name not in not_removed:
+                self.applied.pop(name, None)
+        if not plan_failures:
+            self.applied.update((name, versions[name]) for name in changed)
+        LOG.info(
+            f"Applied {change_count} changes to {len(changed)} changed namespaces "
+            + f"({len(removed)} removed) in {monotonic() - start:.3f}s"
+        )
+        if failures:
+            LOG.error(f"{failures} changes failed - retrying on the next save")
+        return failures
+
+    def serve(self, watcher: ConfigWatcher) -> int:
+        """Apply the config then each save of it until SIGINT / SIGTERM"""
+        previous_sigterm = signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            topology = self.load()
+            if topology is not None:
+                self.apply(topology)
+            LOG.info(f"Watching {self.config.path} for changes")
+            while True:
+                watcher.wait()
+                topology = self.load()
+                if topology is not None:
+                    self.apply(topology)
+        except KeyboardInterrupt:
+            LOG.info(f"Stopped watching {self.config.path}")
+        finally:
+            signal.signal(signal.SIGTERM, previous_sigterm)
+        return 0
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import argparse
+import gc
+import logging
+import sys
+import tracemalloc
+from ipaddress import ip_address
+from pathlib import Path
+from time import monotonic
+from typing import Dict
+
+
+LOG = logging.getLogger(__name__)
+PROJECT_DIR = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(PROJECT_DIR / "src"))
+
+from json2netns.netns import Namespace  # noqa: E402
+
+
+def build_config(ns_count: int, route_count: int) -> Dict:
+    """Ring of namespaces with route_count routes spread across them"""
+    routes_per_ns = route_count // ns_count
+    namespaces = {}
+    for idx in range(ns_count):
+        left_net = 0x64000000 + idx * 2
+        right_net = 0x64000000 + ((idx - 1) % ns_count) * 2
+        routes = {}
+        for route_idx in range(routes_per_ns):
+            dest = ip_address(0x0B000000 + (idx * routes_per_ns + route_idx) * 4)
+            routes[f"route{route_idx}"] = {
+                "dest_prefix": f"{dest}/30",
+                "next_hop_ip": str(ip_address(left_net + 1)),
+                "egress_if_name": "",
+            }
+        namespaces[f"ns{idx}"] = {
+            "id": idx + 1,
+            "interfaces": {
+                "lo": {
+                    "prefixes": [
+                        f"{ip_address(0x0A000000 + idx)}/32",
+                        f"fd00:{idx:x}::/64",
+                    ],
+                    "type": "loopback",
+                },
+                f"r{idx}a": {
+                    "peer_name": f"r{(idx + 1) % ns_count}b",
+                    "prefixes": [f"{ip_address(left_net)}/31"],
+                    "type": "veth",
+                },
+                f"r{idx}b": {
+                    "peer_name": f"r{(idx - 1) % ns_count}a",
+                    "prefixes": [f"{ip_address(right_net + 1)}/31"],
+                    "type": "veth",
+                },
+            },
+            "oob": True,
+            "routes": routes,
+        }
+    return {
+        "namespaces": namespaces,
+        "oob": {"prefixes": ["fddd::/64", "10.128.0.0/9"]},
+        "physical_int": "eth0",
+    }
+
+
+def main() -> int:
+    """Measure the memory the Namespace model uses per namespace + route"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "-d", "--debug", action="store_true", help="Verbose debug output"
+    )
+    parser.add_argument(
+        "--namespaces", type=int, default=10000, help="Number of namespaces"
+    )
+    parser.add_argument(
+        "--routes", type=int, default=1000000, help="Total routes across namespaces"
+    )
+    args = parser.parse_args()
+
+    log_level = logging.DEBUG if args.debug else logging.INFO
+    logging.basicConfig(
+        format="[%(asctime)s] %(levelname)s: %(message)s (%(filename)s:%(lineno)d)",
+        level=log_level,
+    )
+    LOG.debug(f"Starting {sys.argv[0]} ...")
+
+    tracemalloc.start()
+    config = build_config(args.namespaces, args.routes)
+    gc.collect()
+    config_bytes = tracemalloc.get_traced_memory()[0]
+
+    start = monotonic()
+    namespaces = {
+        ns_name: Namespace(ns_name, ns_config, config)
+        for ns_name, ns_config in config["namespaces"].items()
+    }
+    build_time = monotonic() - start
+    route_total = sum(len(ns.routes) for ns in namespaces.values())
+    # What stays alive once the parsed JSON is dropped
+    del config
+    gc.collect()
+    model_bytes = tracemalloc.get_traced_memory()[0]
+
+    print(f"namespaces:           {len(namespaces)}")
+    print(f"routes:               {route_total}")
+    print(f"config dict:          {config_bytes / 2**20:.1f} MiB")
+    print(f"namespace model:      {model_bytes / 2**20:.1f} MiB (config dropped)")
+    print(f"per namespace:        {model_bytes / len(namespaces):.0f} bytes")
+    if route_total:
+        route_bytes = model_bytes / route_total
+        print(f"per route (amortized): {route_bytes:.0f} bytes")
+    print(f"build time:           {build_time:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
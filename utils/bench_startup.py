@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import monotonic
+from typing import Dict, List
+
+
+LOG = logging.getLogger(__name__)
+PROJECT_DIR = Path(__file__).parent.parent.resolve()
+UTILS_DIR = PROJECT_DIR / "utils"
+sys.path.insert(0, str(UTILS_DIR))
+
+from gen_namespace_topology import generate, Ring, write_config  # noqa: E402
+
+
+# Milliseconds each run may take on top of a bare interpreter's startup
+STARTUP_BUDGETS_MS = {"import": 40.0, "help": 50.0, "check": 90.0}
+# The ip commands are not what's measured so they're a no-op
+STAND_IN_IP = "/bin/true"
+# Startup is what's measured so skip json2netns's root check
+RUNNER = (
+    "import sys; import json2netns.main as main; main.amiroot = lambda: True; "
+    + "sys.argv[0] = 'json2netns'; sys.exit(main.main())"
+)
+
+
+def time_runs(cmd: List[str], env: Dict[str, str], runs: int) -> List[float]:
+    """Wall seconds of each run of cmd"""
+    seconds: List[float] = []
+    for _ in range(runs):
+        start = monotonic()
+        subprocess.run(
+            cmd,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        seconds.append(monotonic() - start)
+    return seconds
+
+
+def bench_startup(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Time the interpreter, import, --help + a one namespace check of a big config
+    - Each is the median of args.runs runs minus the bare interpreter's"""
+    with TemporaryDirectory(prefix="j2n-startup-") as td:
+        config_path = Path(td) / "topology.json"
+        topology = Ring(args.namespaces)
+        with config_path.open("w") as cfp:
+            write_config(generate(topology, False), {"physical_int": "eth0"}, cfp)
+        env = dict(
+            os.environ,
+            JSON2NETNS_IP=STAND_IN_IP,
+            PYTHONPATH=os.pathsep.join(
+                filter(None, [str(PROJECT_DIR / "src"), os.environ.get("PYTHONPATH")])
+            ),
+        )
+        python = [sys.executable]
+        scenarios = {
+            "interpreter": python + ["-c", "pass"],
+            "import": python + ["-c", "import json2netns.main"],
+            "help": python + ["-c", RUNNER, "--help"],
+            "check": python
+            + ["-c", RUNNER, "-n", topology.name(0), str(config_path), "check"],
+        }
+
+        results: Dict[str, Dict[str, float]] = {}
+        for name, cmd in scenarios.items():
+            seconds = time_runs(cmd, env, args.runs)
+            results[name] = {"median_ms": median(seconds) * 1000}
+            results[name]["min_ms"] = min(seconds) * 1000
+            LOG.debug(f"{name}: {results[name]['median_ms']:.1f}ms median")
+    baseline = results["interpreter"]["median_ms"]
+    for name, result in results.items():
+        result["overhead_ms"] = result["median_ms"] - baseline
+        result["budget_ms"] = STARTUP_BUDGETS_MS.get(name, 0.0) * args.budget_scale
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'run':>12} {'median ms':>10} {'min ms':>8} {'overhead':>9} {'budget':>7}")
+    for name, result in results.items():
+        budget = f"{result['budget_ms']:.0f}" if result["budget_ms"] else "-"
+        print(
+            f"{name:>12} {result['median_ms']:>10.1f} {result['min_ms']:>8.1f} "
+            + f"{result['overhead_ms']:>9.1f} {budget:>7}"
+        )
+
+
+def main() -> int:
+    """Measure json2netns startup against a budget - exits 2 if any run is over it
+    - Overheads are on top of a bare interpreter so budgets hold across hosts"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "-d", "--debug", action="store_true", help="Verbose debug output"
+    )
+    parser.add_argument(
+        "--budget-scale",
+        type=float,
+        default=1.0,
+        help="Multiply every budget by this e.g. 2 on slow CI hosts",
+    )
+    parser.add_argument(
+        "--namespaces",
+        type=int,
+        default=1000,
+        help="Namespaces in the config check selects one of",
+    )
+    parser.add_argument("-o", "--output", help="Save the results as JSON here")
+    parser.add_argument("--runs", type=int, default=20, help="Runs of each command")
+    args = parser.parse_args()
+
+    log_level = logging.DEBUG if args.debug else logging.INFO
+    logging.basicConfig(
+        format="[%(asctime)s] %(levelname)s: %(message)s (%(filename)s:%(lineno)d)",
+        level=log_level,
+    )
+    LOG.debug(f"Starting {sys.argv[0]} ...")
+
+    results = bench_startup(args)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as ofp:
+            json.dump(results, ofp, indent=2, sort_keys=True)
+        LOG.info(f"Saved results to {args.output}")
+
+    over = [
+        f"{name} {result['overhead_ms']:.1f}ms > {result['budget_ms']:.0f}ms"
+        for name, result in results.items()
+        if result["budget_ms"] and result["overhead_ms"] > result["budget_ms"]
+    ]
+    for over_budget in over:
+        LOG.error(f"Over the startup budget: {over_budget}")
+    return 2 if over else 0
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
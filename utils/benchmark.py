@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shlex
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import monotonic
+from typing import Dict, List, Tuple
+
+
+LOG = logging.getLogger(__name__)
+PROJECT_DIR = Path(__file__).parent.parent.resolve()
+UTILS_DIR = PROJECT_DIR / "utils"
+sys.path.insert(0, str(UTILS_DIR))
+
+from fake_kernel import FakeIpServer, FakeKernel  # noqa: E402
+from gen_namespace_topology import (  # noqa: E402
+    Clos,
+    generate,
+    TOPOLOGIES,
+    Topology,
+    write_config,
+)
+
+
+ACTIONS = ("create", "check", "delete")
+DEFAULT_SIZES = "10,100,1000,10000"
+PHYSICAL_INT = "eth0"
+# Keys compared against a baseline - higher is worse for all of them
+REGRESSION_KEYS = ("seconds", "commands", "peak_rss_mib")
+# The fake ip needs no root so skip json2netns's check for it
+RUNNER = (
+    "import sys; import json2netns.main as main; main.amiroot = lambda: True; "
+    + "sys.argv[0] = 'json2netns'; sys.exit(main.main())"
+)
+
+
+def write_fake_ip(path: Path) -> None:
+    """fake_ip.py with this interpreter as its shebang - no PATH / pyenv lookups"""
+    source = (UTILS_DIR / "fake_ip.py").read_text()
+    path.write_text(f"#!{sys.executable} -IS\n" + source.split("\n", 1)[1])
+    path.chmod(0o755)
+
+
+def run_action(
+    cmd: List[str], env: Dict[str, str], log_path: Path
+) -> Tuple[int, float, float]:
+    """Run json2netns - returns exit code, wall seconds + peak RSS (MiB)"""
+    with log_path.open("w") as log_fp:
+        start = monotonic()
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=log_fp)
+        # wait4 for the child's rusage - ru_maxrss is in KiB on Linux
+        _, status, rusage = os.wait4(proc.pid, 0)
+        seconds = monotonic() - start
+    rc = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    proc.returncode = rc
+    return rc, seconds, rusage.ru_maxrss / 1024
+
+
+def bench_size(args: argparse.Namespace, size: int) -> Dict[str, Dict]:
+    """Generate a topology of size namespaces + run each action against a fake kernel"""
+    results: Dict[str, Dict] = {}
+    with TemporaryDirectory(prefix="j2n-bench-") as td:
+        work_dir = Path(td)
+        config_path = work_dir / "topology.json"
+        if args.topology == "clos":
+            topology: Topology = Clos(size, args.spines)
+        else:
+            topology = TOPOLOGIES[args.topology](size)
+        template = {
+            "oob": {"prefixes": ["fddd::/64", "10.128.0.0/9"]},
+            "physical_int": PHYSICAL_INT,
+        }
+        with config_path.open("w") as cfp:
+            write_config(generate(topology, args.oob), template, cfp)
+
+        netns_dir = work_dir / "netns"
+        netns_dir.mkdir()
+        ip_path = work_dir / "ip"
+        write_fake_ip(ip_path)
+        kernel = FakeKernel(netns_dir, args.latency, [PHYSICAL_INT])
+        server = FakeIpServer(work_dir / "ip.sock", kernel)
+        server.start()
+        env = dict(
+            os.environ,
+            FAKE_IP_SOCKET=str(work_dir / "ip.sock"),
+            JSON2NETNS_IP=str(ip_path),
+            JSON2NETNS_NETNS_DIR=str(netns_dir),
+            PYTHONPATH=os.pathsep.join(
+                filter(None, [str(PROJECT_DIR / "src"), os.environ.get("PYTHONPATH")])
+            ),
+        )
+        try:
+            for action in ACTIONS:
+                cmd = [
+                    sys.executable,
+                    "-c",
+                    RUNNER,
+                    "--state-dir",
+                    str(work_dir / "state"),
+                    *shlex.split(args.json2netns_args),
+                    str(config_path),
+                    action,
+                ]
+                log_path = work_dir / f"{action}.log"
+                kernel.reset_stats()
+                rc, seconds, peak_rss = run_action(cmd, env, log_path)
+                invocations = kernel.reset_stats()
+                commands = sum(inv["commands"] for inv in invocations)
+                results[action] = {
+                    "commands": commands,
+                    "commands_per_namespace": round(commands / size, 2),
+                    "failures": sum(1 for inv in invocations if inv["rc"]),
+                    "ip_processes": len(invocations),
+                    "peak_rss_mib": round(peak_rss, 1),
+                    "rc": rc,
+                    "seconds": round(seconds, 3),
+                }
+                if rc:
+                    log_tail = log_path.read_text().splitlines()[-5:]
+                    LOG.error(f"{size} namespace {action} returned {rc}:")
+                    for line in log_tail:
+                        LOG.error(f"  {line}")
+                if args.record:
+                    record_path = Path(args.record) / f"{size}-{action}.jsonl"
+                    with record_path.open("w") as rfp:
+                        for inv in invocations:
+                            rfp.write(json.dumps(inv) + "\n")
+                LOG.info(
+                    f"{size} namespaces {action}: {seconds:.2f}s {commands} commands "
+                    + f"via {len(invocations)} ip processes"
+                )
+            # Everything create made should be gone again
+            leftovers = len(kernel.namespaces) - 1
+            if leftovers:
+                LOG.error(f"{leftovers} namespaces left after {size} namespace delete")
+        finally:
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, Dict]]) -> None:
+    print(
+        f"{'namespaces':>10} {'action':>7} {'seconds':>9} {'ip procs':>9} "
+        + f"{'commands':>9} {'cmds/ns':>8} {'peak MiB':>9} {'rc':>3}"
+    )
+    for size, actions in results.items():
+        for action, result in actions.items():
+            print(
+                f"{size:>10} {action:>7} {result['seconds']:>9.3f} "
+                + f"{result['ip_processes']:>9} {result['commands']:>9} "
+                + f"{result['commands_per_namespace']:>8} "
+                + f"{result['peak_rss_mib']:>9.1f} {result['rc']:>3}"
+            )
+
+
+def compare(
+    results: Dict[str, Dict[str, Dict]],
+    baseline: Dict[str, Dict[str, Dict]],
+    threshold: float,
+) -> List[str]:
+    """Each result more than threshold (a fraction) worse than the baseline"""
+    regressions: List[str] = []
+    for size, actions in results.items():
+        for action, result in actions.items():
+            base = baseline.get(size, {}).get(action)
+            if not base:
+                continue
+            for key in REGRESSION_KEYS:
+                old, new = base.get(key), result.get(key)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                LOG.debug(f"{size} {action} {key}: {old} -> {new} ({change:+.1%})")
+                if change > threshold:
+                    regressions.append(
+                        f"{size} namespaces {action} {key}: {old} -> {new} "
+                        + f"({change:+.1%})"
+                    )
+    return regressions
+
+
+def git_revision() -> str:
+    cp = subprocess.run(
+        ["git", "-C", str(PROJECT_DIR), "rev-parse", "--short", "HEAD"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        encoding="utf-8",
+    )
+    return cp.stdout.strip() if cp.returncode == 0 else ""
+
+
+def main() -> int:
+    """Benchmark create, check + delete against a fake ip - no root or kernel needed
+    - Results are saved as JSON + can be compared to a previous run's"""
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "-d", "--debug", action="store_true", help="Verbose debug output"
+    )
+    parser.add_argument(
+        "--compare", help="Previous results JSON to check for regressions against"
+    )
+    parser.add_argument(
+        "--json2netns-args",
+        default="",
+        help="Extra json2netns arguments e.g. '--batch --workers 8'",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Simulated seconds per command"
+    )
+    parser.add_argument(
+        "--oob", action="store_true", help="Give every namespace an oob interface"
+    )
+    parser.add_argument(
+        "-o", "--output", default="bench_results.json", help="Where to save results"
+    )
+    parser.add_argument("--record", help="Directory to save every ip invocation to")
+    parser.add_argument(
+        "--sizes", default=DEFAULT_SIZES, help="Comma separated namespace counts"
+    )
+    parser.add_argument(
+        "--spines", type=int, default=4, help="Spine namespaces in a clos topology"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Fraction worse than --compare results that counts as a regression",
+    )
+    parser.add_argument(
+        "-t",
+        "--topology",
+        choices=sorted(TOPOLOGIES),
+        default="ring",
+        help="Shape of the generated topologies",
+    )
+    args = parser.parse_args()
+
+    log_level = logging.DEBUG if args.debug else logging.INFO
+    logging.basicConfig(
+        format="[%(asctime)s] %(levelname)s: %(message)s (%(filename)s:%(lineno)d)",
+        level=log_level,
+    )
+    LOG.debug(f"Starting {sys.argv[0]} ...")
+
+    if args.record:
+        Path(args.record).mkdir(parents=True, exist_ok=True)
+    results: Dict[str, Dict[str, Dict]] = {}
+    for size in (int(size) for size in args.sizes.split(",")):
+        try:
+            results[str(size)] = bench_size(args, size)
+        except ValueError as ve:
+            LOG.error(f"Unable to benchmark {size} namespaces: {ve}")
+            return 1
+
+    print_results(results)
+    output = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "json2netns_args": args.json2netns_args,
+            "latency": args.latency,
+            "python": platform.python_version(),
+            "topology": args.topology,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as ofp:
+        json.dump(output, ofp, indent=2, sort_keys=True)
+    LOG.info(f"Saved results to {args.output}")
+
+    failed = [
+        f"{size} {action}"
+        for size, actions in results.items()
+        for action, result in actions.items()
+        if result["rc"] or result["failures"]
+    ]
+    if failed:
+        LOG.error(f"Failed runs (see above): {', '.join(failed)}")
+
+    if args.compare:
+        with open(args.compare) as cfp:
+            baseline = json.load(cfp)
+        regressions = compare(results, baseline["results"], args.threshold)
+        for regression in regressions:
+            LOG.error(f"Regression: {regression}")
+        if regressions:
+            return 2
+        LOG.info(f"No regressions vs. {args.compare}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
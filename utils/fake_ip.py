@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+# Stand-in `ip` for benchmarks - forwards its argv + stdin to a FakeKernel
+# (utils/fake_kernel.py) over the FAKE_IP_SOCKET unix socket + prints the result.
+# Kept to a few stdlib imports as its startup is part of every command.
+
+import json
+import os
+import socket
+import sys
+import time
+
+
+SOCKET_ENV = "FAKE_IP_SOCKET"
+
+
+def main() -> int:
+    argv = sys.argv[1:]
+    stdin = ""
+    if "-batch" in argv and argv[argv.index("-batch") + 1 :][:1] == ["-"]:
+        stdin = sys.stdin.read()
+
+    request = json.dumps({"argv": argv, "stdin": stdin}).encode("utf-8")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(os.environ[SOCKET_ENV])
+        sock.sendall(request)
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    reply = json.loads(b"".join(chunks))
+
+    # Simulated kernel time - slept here so concurrent commands overlap
+    if reply["latency"]:
+        time.sleep(reply["latency"])
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    return int(reply["rc"])
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
@@ -0,0 +1,763 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import socketserver
+import sys
+from dataclasses import dataclass, field
+from ipaddress import ip_address, ip_interface, ip_network
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+LOG = logging.getLogger(__name__)
+# Errors + exit codes as `ip` reports them
+EXISTS = "RTNETLINK answers: File exists"
+NO_ADDRESS = "RTNETLINK answers: Cannot assign requested address"
+NO_NEXTHOP = "Error: Nexthop id does not exist."
+NO_ROUTE = "RTNETLINK answers: No such process"
+OBJECTS = {
+    "a": "addr",
+    "addr": "addr",
+    "address": "addr",
+    "l": "link",
+    "link": "link",
+    "netns": "netns",
+    "nexthop": "nexthop",
+    "nh": "nexthop",
+    "r": "route",
+    "ro": "route",
+    "route": "route",
+}
+
+
+class IpError(Exception):
+    def __init__(self, message: str, rc: int = 2) -> None:
+        super().__init__(message)
+        self.rc = rc
+
+
+def no_device(name: str) -> IpError:
+    return IpError(f'Cannot find device "{name}"', 1)
+
+
+@dataclass
+class Link:
+    name: str
+    kind: str
+    index: int
+    up: bool = False
+    peer: str = ""
+    peer_netns: str = ""
+    parent: str = ""
+    # (address, prefix length, scope)
+    addrs: List[Tuple[str, int, str]] = field(default_factory=list)
+
+    def flags(self) -> List[str]:
+        flags = ["LOOPBACK"] if self.kind == "loopback" else ["BROADCAST", "MULTICAST"]
+        return flags + (["UP", "LOWER_UP"] if self.up else [])
+
+    def json(self) -> Dict:
+        link = {
+            "ifindex": self.index,
+            "ifname": self.name,
+            "flags": self.flags(),
+            "mtu": 65536 if self.kind == "loopback" else 1500,
+            "operstate": "UP" if self.up else "DOWN",
+            "link_type": "loopback" if self.kind == "loopback" else "ether",
+        }
+        if self.peer or self.parent:
+            link["link"] = self.peer or self.parent
+        return link
+
+    def addr_json(self) -> Dict:
+        link = self.json()
+        link["addr_info"] = [
+            {
+                "family": "inet6" if ":" in address else "inet",
+                "local": address,
+                "prefixlen": prefixlen,
+                "scope": scope,
+            }
+            for address, prefixlen, scope in self.addrs
+        ]
+        return link
+
+
+@dataclass
+class Netns:
+    links: Dict[str, Link] = field(default_factory=dict)
+    # version -> destination -> route
+    routes: Dict[int, Dict[str, Dict]] = field(default_factory=lambda: {4: {}, 6: {}})
+    # id -> nexthop object
+    nexthops: Dict[int, Dict] = field(default_factory=dict)
+
+
+class FakeKernel:
+    """In memory links, addresses, routes + namespaces driven by `ip` argv
+    - Records every invocation + how many commands (batch lines) it ran
+    - latency is the simulated kernel time per command the client sleeps"""
+
+    def __init__(
+        self, netns_dir: Path, latency: float = 0.0, links: Sequence[str] = ()
+    ) -> None:
+        self.netns_dir = netns_dir
+        self.latency = latency
+        self.lock = Lock()
+        self.next_index = 1
+        self.namespaces: Dict[str, Netns] = {"": self._new_netns()}
+        for name in links:
+            self._add_link("", name, "ether").up = True
+        self.invocations: List[Dict] = []
+
+    def _new_netns(self) -> Netns:
+        netns = Netns()
+        self._add_link(netns, "lo", "loopback")
+        return netns
+
+    def _add_link(self, netns: object, name: str, kind: str) -> Link:
+        if isinstance(netns, str):
+            netns = self.namespaces[netns]
+        assert isinstance(netns, Netns)
+        link = Link(name, kind, self.next_index)
+        self.next_index += 1
+        netns.links[name] = link
+        return link
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "invocations": len(self.invocations),
+                "commands": sum(inv["commands"] for inv in self.invocations),
+                "failures": sum(1 for inv in self.invocations if inv["rc"]),
+            }
+
+    def reset_stats(self) -> List[Dict]:
+        with self.lock:
+            invocations, self.invocations = self.invocations, []
+            return invocations
+
+    def handle(self, argv: List[str], stdin: str = "") -> Dict:
+        """Run one `ip` invocation - returns rc, stdout, stderr + latency"""
+        with self.lock:
+            out: List[str] = []
+            err: List[str] = []
+            try:
+                rc, commands = self._ip(argv, stdin, out, err)
+            except IpError as ie:
+                rc, commands = ie.rc, 1
+                err.append(f"{ie}\n")
+            self.invocations.append({"argv": argv, "commands": commands, "rc": rc})
+        return {
+            "rc": rc,
+            "stdout": "".join(out),
+            "stderr": "".join(err),
+            "latency": self.latency * commands,
+        }
+
+    def _ip(
+        self, argv: List[str], stdin: str, out: List[str], err: List[str]
+    ) -> Tuple[int, int]:
+        netns = ""
+        opts = {"json": False, "version": 0, "force": False}
+        batch_file = ""
+        args = list(argv)
+        while args and args[0].startswith("-"):
+            opt = args.pop(0)
+            if opt in {"-n", "-netns"}:
+                netns = args.pop(0)
+            elif opt in {"-j", "-json"}:
+                opts["json"] = True
+            elif opt in {"-4", "-6"}:
+                opts["version"] = int(opt[1])
+            elif opt == "-force":
+                opts["force"] = True
+            elif opt in {"-b", "-batch"}:
+                batch_file = args.pop(0)
+        if netns:
+            self._netns(netns)
+        if args[:2] == ["netns", "exec"] and len(args) > 3:
+            # ip is the only thing ran in a netns - run it as `ip -n`
+            self._netns(args[2])
+            if os.path.basename(args[3]) != "ip":
+                raise IpError(f"fake ip can only exec ip in {args[2]}", 1)
+            return self._ip(["-n", args[2]] + args[4:], stdin, out, err)
+
+        if not batch_file:
+            self._command(netns, args, opts, out)
+            return 0, 1
+
+        lines = stdin if batch_file == "-" else Path(batch_file).read_text()
+        rc = 0
+        commands = 0
+        for line_number, line in enumerate(lines.splitlines(), 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            commands += 1
+            try:
+                self._command(netns, line.split(), opts, out)
+            except IpError as ie:
+                rc = 1
+                err.append(f"{ie}\nCommand failed {batch_file}:{line_number}\n")
+                if not opts["force"]:
+                    break
+        return rc, commands
+
+    def _netns(self, name: str) -> Netns:
+        if name not in self.namespaces:
+            raise IpError(
+                f'Cannot open network namespace "{name}": No such file or directory',
+                1,
+            )
+        return self.namespaces[name]
+
+    def _command(
+        self, netns_name: str, args: List[str], opts: Dict, out: List[str]
+    ) -> None:
+        if not args or args[0] not in OBJECTS:
+            raise IpError(f'Object "{args[0] if args else ""}" is unknown', 255)
+        obj = OBJECTS[args[0]]
+        if obj == "netns":
+            self._netns_command(args[1:], out)
+            return
+        netns = self._netns(netns_name)
+        verb = args[1] if len(args) > 1 else "show"
+        if obj == "link":
+            self._link_command(netns_name, netns, verb, args[2:], opts, out)
+        elif obj == "addr":
+            self._addr_command(netns, verb, args[2:], opts, out)
+        elif obj == "nexthop":
+            self._nexthop_command(netns, verb, args[2:], opts, out)
+        else:
+            self._route_command(netns, verb, args[2:], opts, out)
+
+    def _netns_command(self, args: List[str], out: List[str]) -> None:
+        verb = args[0] if args else "list"
+        if verb == "add":
+            if args[1] in self.namespaces:
+                raise IpError(
+                    f'Cannot create namespace file "{self.netns_dir / args[1]}": '
+                    + "File exists",
+                    1,
+                )
+            self.namespaces[args[1]] = self._new_netns()
+            (self.netns_dir / args[1]).touch()
+        elif verb in {"del", "delete"}:
+            if args[1] not in self.namespaces:
+                raise IpError(
+                    f'Cannot remove namespace file "{self.netns_dir / args[1]}": '
+                    + "No such file or directory",
+                    1,
+                )
+            # The kernel destroys the other end of every veth in the netns
+            for link in self.namespaces.pop(args[1]).links.values():
+                if link.peer:
+                    self._drop_link(link.peer_netns, link.peer)
+            (self.netns_dir / args[1]).unlink()
+        elif verb in {"list", "show"}:
+            out.extend(f"{name}\n" for name in sorted(self.namespaces) if name)
+        else:
+            raise IpError(f'Command "{verb}" is unknown, try "ip netns help".', 255)
+
+    def _drop_link(self, netns_name: str, name: str) -> None:
+        netns = self.namespaces.get(netns_name)
+        if netns and netns.links.pop(name, None):
+            self._drop_routes(netns, name)
+
+    def _drop_routes(self, netns: Netns, dev: str) -> None:
+        for routes in netns.routes.values():
+            for dst in [dst for dst, route in routes.items() if route["dev"] == dev]:
+                del routes[dst]
+        for nhid in [nhid for nhid, nh in netns.nexthops.items() if nh["dev"] == dev]:
+            self._drop_nexthop(netns, nhid)
+
+    def _drop_nexthop(self, netns: Netns, nhid: int) -> None:
+        """Routes using a nexthop go with it + it leaves any groups"""
+        netns.nexthops.pop(nhid, None)
+        for routes in netns.routes.values():
+            for dst in [
+                dst for dst, route in routes.items() if route.get("nhid") == nhid
+            ]:
+                del routes[dst]
+        for group_id, nexthop in list(netns.nexthops.items()):
+            if nexthop["group"] and nhid in dict(nexthop["group"]):
+                nexthop["group"] = [m for m in nexthop["group"] if m[0] != nhid]
+                if not nexthop["group"]:
+                    self._drop_nexthop(netns, group_id)
+
+    def _nexthop_command(
+        self, netns: Netns, verb: str, args: List[str], opts: Dict, out: List[str]
+    ) -> None:
+        if verb in {"show", "list"}:
+            shown = sorted(netns.nexthops.items())
+            if opts["json"]:
+                out.append(
+                    json.dumps([nexthop_json(nhid, nh) for nhid, nh in shown]) + "\n"
+                )
+            else:
+                out.extend(nexthop_text(nhid, nh) + "\n" for nhid, nh in shown)
+            return
+        if verb not in {"add", "replace", "del", "delete"} or "id" not in args:
+            raise IpError(f'Command "{verb}" is unknown, try "ip nexthop help".', 255)
+
+        try:
+            nhid = int(args[args.index("id") + 1])
+        except (IndexError, ValueError):
+            raise IpError("Error: Invalid nexthop id.")
+        if verb in {"del", "delete"}:
+            if nhid not in netns.nexthops:
+                raise IpError(NO_NEXTHOP)
+            self._drop_nexthop(netns, nhid)
+            return
+        if verb == "add" and nhid in netns.nexthops:
+            raise IpError(EXISTS)
+
+        if "group" in args:
+            group = []
+            for member in args[args.index("group") + 1].split("/"):
+                member_id, _, weight = member.partition(",")
+                if int(member_id) not in netns.nexthops:
+                    raise IpError(NO_NEXTHOP)
+                group.append((int(member_id), int(weight or 1)))
+            netns.nexthops[nhid] = {"gateway": "", "dev": "", "group": group}
+            return
+
+        gateway = args[args.index("via") + 1] if "via" in args else ""
+        dev = args[args.index("dev") + 1] if "dev" in args else ""
+        if not dev:
+            raise IpError(
+                "Error: Device attribute required for non-blackhole and non-fdb "
+                + "nexthops."
+            )
+        if dev not in netns.links:
+            raise no_device(dev)
+        if gateway and not self._connected_dev(netns, gateway, dev):
+            raise IpError("Error: Nexthop has invalid gateway.")
+        netns.nexthops[nhid] = {"gateway": gateway, "dev": dev, "group": []}
+
+    def _link_command(
+        self,
+        netns_name: str,
+        netns: Netns,
+        verb: str,
+        args: List[str],
+        opts: Dict,
+        out: List[str],
+    ) -> None:
+        if verb == "add":
+            self._link_add(netns_name, netns, args)
+        elif verb == "set":
+            self._link_set(netns_name, netns, args)
+        elif verb in {"del", "delete"}:
+            name = args[1] if args[0] == "dev" else args[0]
+            link = netns.links.get(name)
+            if not link:
+                raise no_device(name)
+            self._drop_link(netns_name, name)
+            if link.peer:
+                self._drop_link(link.peer_netns, link.peer)
+        elif verb in {"show", "list"}:
+            links = self._selected_links(netns, args)
+            if opts["json"]:
+                out.append(json.dumps([link.json() for link in links]) + "\n")
+            else:
+                for link in links:
+                    out.append(
+                        f"{link.index}: {link.name}: <{','.join(link.flags())}> "
+                        + f"mtu {link.json()['mtu']} state {link.json()['operstate']}\n"
+                    )
+        else:
+            raise IpError(f'Command "{verb}" is unknown, try "ip link help".', 255)
+
+    def _selected_links(self, netns: Netns, args: List[str]) -> List[Link]:
+        names = [arg for arg in args if arg != "dev"]
+        if not names:
+            return sorted(netns.links.values(), key=lambda link: link.index)
+        if names[0] not in netns.links:
+            raise IpError(f'Device "{names[0]}" does not exist.', 1)
+        return [netns.links[names[0]]]
+
+    def _link_add(self, netns_name: str, netns: Netns, args: List[str]) -> None:
+        name = parent = kind = peer = ""
+        idx = 0
+        while idx < len(args):
+            arg = args[idx]
+            if arg == "link":
+                parent = args[idx + 1]
+                idx += 1
+            elif arg == "name":
+                name = args[idx + 1]
+                idx += 1
+            elif arg == "type":
+                kind = args[idx + 1]
+                type_args = args[idx + 2 :]
+                if kind == "veth" and "peer" in type_args:
+                    peer_args = type_args[type_args.index("peer") + 1 :]
+                    peer = peer_args[1] if peer_args[0] == "name" else peer_args[0]
+                break
+            else:
+                name = arg
+            idx += 1
+
+        if parent and parent not in netns.links:
+            raise no_device(parent)
+        if name in netns.links or (peer and peer in netns.links):
+            raise IpError(EXISTS)
+        link = self._add_link(netns, name, kind)
+        link.parent = parent
+        if peer:
+            peer_link = self._add_link(netns, peer, kind)
+            link.peer, link.peer_netns = peer, netns_name
+            peer_link.peer, peer_link.peer_netns = name, netns_name
+
+    def _link_set(self, netns_name: str, netns: Netns, args: List[str]) -> None:
+        name = target = ""
+        up: Optional[bool] = None
+        idx = 0
+        while idx < len(args):
+            arg = args[idx]
+            if arg in {"dev", "netns"}:
+                if arg == "dev":
+                    name = args[idx + 1]
+                else:
+                    target = args[idx + 1]
+                idx += 1
+            elif arg in {"up", "down"}:
+                up = arg == "up"
+            else:
+                name = arg
+            idx += 1
+
+        link = netns.links.get(name)
+        if not link:
+            raise no_device(name)
+        if target:
+            if target not in self.namespaces:
+                raise IpError(f'Invalid "netns" value "{target}"', 1)
+            target_netns = self.namespaces[target]
+            if name in target_netns.links:
+                raise IpError(EXISTS)
+            # Moving a link takes it down + flushes its addresses
+            del netns.links[name]
+            self._drop_routes(netns, name)
+            link.up = False
+            link.addrs = []
+            target_netns.links[name] = link
+            if link.peer:
+                peer_netns = self.namespaces.get(link.peer_netns)
+                if peer_netns and link.peer in peer_netns.links:
+                    peer_netns.links[link.peer].peer_netns = target
+        if up is not None and up != link.up:
+            link.up = up
+            if up and link.kind == "loopback" and not link.addrs:
+                link.addrs = [("127.0.0.1", 8, "host"), ("::1", 128, "host")]
+            if up:
+                for address, prefixlen, scope in link.addrs:
+                    self._add_connected(netns, link, address, prefixlen, scope)
+            else:
+                self._drop_routes(netns, name)
+
+    def _add_connected(
+        self, netns: Netns, link: Link, address: str, prefixlen: int, scope: str
+    ) -> None:
+        if scope != "global" or not link.up:
+            return
+        network = ip_interface(f"{address}/{prefixlen}").network
+        if network.num_addresses == 1:
+            # Host addresses only get a local table route
+            return
+        netns.routes[network.version][route_dst(network)] = {
+            "dev": link.name,
+            "gateway": "",
+            "protocol": "kernel",
+        }
+
+    def _addr_command(
+        self, netns: Netns, verb: str, args: List[str], opts: Dict, out: List[str]
+    ) -> None:
+        if verb in {"show", "list"}:
+            links = self._selected_links(netns, args)
+            if opts["json"]:
+                out.append(json.dumps([link.addr_json() for link in links]) + "\n")
+                return
+            for link in links:
+                out.append(f"{link.index}: {link.name}: <{','.join(link.flags())}>\n")
+                for address, prefixlen, scope in link.addrs:
+                    family = "inet6" if ":" in address else "inet"
+                    out.append(f"    {family} {address}/{prefixlen} scope {scope}\n")
+            return
+
+        if verb not in {"add", "del", "delete"} or "dev" not in args:
+            raise IpError(f'Command "{verb}" is unknown, try "ip addr help".', 255)
+        name = args[args.index("dev") + 1]
+        if name not in netns.links:
+            raise no_device(name)
+        link = netns.links[name]
+        try:
+            prefix = ip_interface(args[0])
+        except ValueError:
+            raise IpError(f'Error: inet prefix is expected rather than "{args[0]}".', 1)
+        entry = (str(prefix.ip), prefix.network.prefixlen, "global")
+        if verb == "add":
+            if entry in link.addrs:
+                raise IpError(EXISTS)
+            link.addrs.append(entry)
+            self._add_connected(netns, link, *entry)
+        else:
+            if entry not in link.addrs:
+                raise IpError(NO_ADDRESS)
+            link.addrs.remove(entry)
+            netns.routes[prefix.version].pop(route_dst(prefix.network), None)
+
+    def _route_command(
+        self, netns: Netns, verb: str, args: List[str], opts: Dict, out: List[str]
+    ) -> None:
+        if verb in {"show", "list"}:
+            version = opts["version"] or 4
+            shown = [
+                (dst, self._resolved(netns, route))
+                for dst, route in sorted(netns.routes[version].items())
+            ]
+            if opts["json"]:
+                out.append(
+                    json.dumps([route_json(dst, route) for dst, route in shown]) + "\n"
+                )
+            else:
+                out.extend(route_text(dst, route) + "\n" for dst, route in shown)
+            return
+        if verb not in {"add", "replace", "del", "delete"} or not args:
+            raise IpError(f'Command "{verb}" is unknown, try "ip route help".', 255)
+
+        dst = args[0]
+        gateway = args[args.index("via") + 1] if "via" in args else ""
+        dev = args[args.index("dev") + 1] if "dev" in args else ""
+        version = opts["version"]
+        if not version:
+            if dst == "default":
+                version = ip_address(gateway).version if gateway else 4
+            else:
+                version = 6 if ":" in dst else 4
+        try:
+            network = ip_network(
+                ("0.0.0.0/0" if version == 4 else "::/0") if dst == "default" else dst
+            )
+        except ValueError:
+            raise IpError("Error: Invalid prefix for given prefix length.")
+        key = route_dst(network)
+        routes = netns.routes[network.version]
+
+        if verb in {"del", "delete"}:
+            if key not in routes:
+                raise IpError(NO_ROUTE)
+            del routes[key]
+            return
+
+        nhid = 0
+        if "nhid" in args:
+            nhid = int(args[args.index("nhid") + 1])
+            if nhid not in netns.nexthops:
+                raise IpError(NO_NEXTHOP)
+            # Resolved when shown so replacing the nexthop repoints the route
+            hops = [{"gateway": "", "dev": "", "weight": 1}]
+        elif "nexthop" in args:
+            hops = []
+            for hop in " ".join(args[args.index("nexthop") :]).split("nexthop")[1:]:
+                hop_args = hop.split()
+                hops.append(
+                    self._hop(
+                        netns,
+                        hop_args[hop_args.index("via") + 1]
+                        if "via" in hop_args
+                        else "",
+                        hop_args[hop_args.index("dev") + 1]
+                        if "dev" in hop_args
+                        else "",
+                        int(hop_args[hop_args.index("weight") + 1])
+                        if "weight" in hop_args
+                        else 1,
+                    )
+                )
+        else:
+            hops = [self._hop(netns, gateway, dev, 1)]
+        if verb == "add" and key in routes:
+            raise IpError(EXISTS)
+        routes[key] = {
+            "dev": hops[0]["dev"] if len(hops) == 1 else "",
+            "gateway": hops[0]["gateway"] if len(hops) == 1 else "",
+            "protocol": "boot",
+            "nhid": nhid,
+            "nexthops": hops if len(hops) > 1 else [],
+        }
+
+    def _hop(self, netns: Netns, gateway: str, dev: str, weight: int) -> Dict:
+        if dev and dev not in netns.links:
+            raise no_device(dev)
+        if gateway:
+            connected = self._connected_dev(netns, gateway, dev)
+            if not connected:
+                raise IpError("Error: Nexthop has invalid gateway.")
+            dev = connected
+        return {"gateway": gateway, "dev": dev, "weight": weight}
+
+    def _resolved(self, netns: Netns, route: Dict) -> Dict:
+        """A route with its nexthop object's gateway(s) filled in"""
+        if not route.get("nhid"):
+            return route
+        hops = self._nexthop_hops(netns, route["nhid"])
+        if len(hops) > 1:
+            return dict(route, nexthops=hops)
+        return dict(route, gateway=hops[0]["gateway"], dev=hops[0]["dev"])
+
+    def _nexthop_hops(self, netns: Netns, nhid: int) -> List[Dict]:
+        nexthop = netns.nexthops[nhid]
+        if not nexthop["group"]:
+            return [{"gateway": nexthop["gateway"], "dev": nexthop["dev"], "weight": 1}]
+        return [
+            dict(self._nexthop_hops(netns, member_id)[0], weight=weight)
+            for member_id, weight in nexthop["group"]
+        ]
+
+    def _connected_dev(self, netns: Netns, gateway: str, dev: str) -> str:
+        gw_ip = ip_address(gateway)
+        for link in netns.links.values():
+            if not link.up or (dev and link.name != dev):
+                continue
+            for address, prefixlen, _ in link.addrs:
+                if gw_ip in ip_interface(f"{address}/{prefixlen}").network:
+                    return link.name
+        return ""
+
+
+def route_dst(network: object) -> str:
+    """How `ip route show` prints a destination"""
+    text = str(network)
+    if text in {"0.0.0.0/0", "::/0"}:
+        return "default"
+    address, _, prefixlen = text.partition("/")
+    return address if prefixlen in {"32", "128"} else text
+
+
+def route_json(dst: str, route: Dict) -> Dict:
+    entry: Dict[str, Any] = {"dst": dst}
+    if route.get("nhid"):
+        entry["nhid"] = route["nhid"]
+    if route["gateway"]:
+        entry["gateway"] = route["gateway"]
+    if route["dev"]:
+        entry["dev"] = route["dev"]
+    entry["protocol"] = route["protocol"]
+    if route["protocol"] == "kernel":
+        entry["scope"] = "link"
+    entry["flags"] = []
+    if route.get("nexthops"):
+        entry["nexthops"] = [dict(hop, flags=[]) for hop in route["nexthops"]]
+    return entry
+
+
+def route_text(dst: str, route: Dict) -> str:
+    nhid = f" nhid {route['nhid']}" if route.get("nhid") else ""
+    if route.get("nexthops"):
+        return f"{dst}{nhid}" + "".join(
+            f"\n\tnexthop via {hop['gateway']} dev {hop['dev']} weight {hop['weight']}"
+            for hop in route["nexthops"]
+        )
+    via = f" via {route['gateway']}" if route["gateway"] else ""
+    proto = " proto kernel scope link" if route["protocol"] == "kernel" else ""
+    return f"{dst}{nhid}{via} dev {route['dev']}{proto}"
+
+
+def nexthop_json(nhid: int, nexthop: Dict) -> Dict:
+    entry: Dict[str, Any] = {"id": nhid}
+    if nexthop["group"]:
+        entry["group"] = [
+            {"id": member_id, "weight": weight} if weight != 1 else {"id": member_id}
+            for member_id, weight in nexthop["group"]
+        ]
+    else:
+        if nexthop["gateway"]:
+            entry["gateway"] = nexthop["gateway"]
+        entry["dev"] = nexthop["dev"]
+        entry["scope"] = "link"
+    entry["flags"] = []
+    return entry
+
+
+def nexthop_text(nhid: int, nexthop: Dict) -> str:
+    if nexthop["group"]:
+        group = "/".join(
+            str(member_id) if weight == 1 else f"{member_id},{weight}"
+            for member_id, weight in nexthop["group"]
+        )
+        return f"id {nhid} group {group}"
+    via = f" via {nexthop['gateway']}" if nexthop["gateway"] else ""
+    return f"id {nhid}{via} dev {nexthop['dev']} scope link"
+
+
+class FakeIpServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves FakeKernel to utils/fake_ip.py clients over a unix socket"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, kernel: FakeKernel) -> None:
+        self.kernel = kernel
+        super().__init__(str(socket_path), FakeIpHandler)
+
+    def start(self) -> Thread:
+        thread = Thread(target=self.serve_forever, name="fake-ip", daemon=True)
+        thread.start()
+        return thread
+
+
+class FakeIpHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        request = json.loads(self.rfile.read())
+        server = self.server
+        assert isinstance(server, FakeIpServer)
+        reply = server.kernel.handle(request["argv"], request.get("stdin", ""))
+        self.wfile.write(json.dumps(reply).encode("utf-8"))
+
+
+def main() -> int:
+    """Run a fake kernel for fake_ip.py clients until interrupted"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "-d", "--debug", action="store_true", help="Verbose debug output"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds each command takes"
+    )
+    parser.add_argument(
+        "--link", action="append", default=[], help="Default netns links to add"
+    )
+    parser.add_argument("socket", help="Unix socket to listen on")
+    parser.add_argument("netns_dir", help="Where to create netns files")
+    args = parser.parse_args()
+
+    log_level = logging.DEBUG if args.debug else logging.INFO
+    logging.basicConfig(
+        format="[%(asctime)s] %(levelname)s: %(message)s (%(filename)s:%(lineno)d)",
+        level=log_level,
+    )
+    LOG.debug(f"Starting {sys.argv[0]} ...")
+
+    netns_dir = Path(args.netns_dir)
+    netns_dir.mkdir(parents=True, exist_ok=True)
+    kernel = FakeKernel(netns_dir, args.latency, args.link)
+    with FakeIpServer(Path(args.socket), kernel) as server:
+        LOG.info(f"Fake kernel listening on {args.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            LOG.info(f"Served {kernel.stats()}")
+    os.unlink(args.socket)
+    return 0
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
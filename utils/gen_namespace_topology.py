@@ -3,17 +3,255 @@
 import argparse
 import logging
 import sys
-from copy import deepcopy
+from ipaddress import IPv4Address, IPv6Address
 from json import dumps, load
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
 
 
 LOG = logging.getLogger(__name__)
 PROJECT_DIR = Path(__file__).parent.parent.resolve()
 
+# Point to point links get a /31 + /127 each, loopbacks a /32 + /128
+LINK_V4_BASE = IPv4Address("100.64.0.0")
+LINK_V4_MAX = 1 << 21  # /31s in 100.64.0.0/10
+LINK_V6_BASE = IPv6Address("fd01::")
+LOOPBACK_V4_BASE = IPv4Address("10.0.0.0")
+LOOPBACK_V6_BASE = IPv6Address("fd00::")
+
+
+class Topology:
+    """Namespaces 0..ns_count-1 + who they are linked to
+    - Port N of a namespace is its veth to neighbours(idx)[N]
+    - Subclasses override port() when index() on a big neighbour list is too slow"""
+
+    min_count = 2
+
+    def __init__(self, ns_count: int) -> None:
+        if ns_count < self.min_count:
+            raise ValueError(
+                f"{self.__class__.__name__} needs at least {self.min_count} namespaces"
+            )
+        self.ns_count = ns_count
+
+    def name(self, idx: int) -> str:
+        return f"ns{idx}"
+
+    def neighbours(self, idx: int) -> List[int]:
+        raise NotImplementedError
+
+    def port(self, idx: int, peer: int) -> int:
+        return self.neighbours(idx).index(peer)
+
+    def upstream(self, idx: int) -> Optional[int]:
+        """Neighbour to default route via - None means no default route"""
+        return None
+
+
+class Ring(Topology):
+    min_count = 3
+
+    def neighbours(self, idx: int) -> List[int]:
+        return [(idx + 1) % self.ns_count, (idx - 1) % self.ns_count]
+
+
+class Mesh(Topology):
+    def neighbours(self, idx: int) -> List[int]:
+        return [peer for peer in range(self.ns_count) if peer != idx]
+
+    def port(self, idx: int, peer: int) -> int:
+        return peer if peer < idx else peer - 1
+
+
+class HubAndSpoke(Topology):
+    def name(self, idx: int) -> str:
+        return "hub" if idx == 0 else f"spoke{idx}"
+
+    def neighbours(self, idx: int) -> List[int]:
+        return list(range(1, self.ns_count)) if idx == 0 else [0]
+
+    def port(self, idx: int, peer: int) -> int:
+        return peer - 1 if idx == 0 else 0
+
+    def upstream(self, idx: int) -> Optional[int]:
+        return 0 if idx else None
+
+
+class Clos(Topology):
+    """Two tier leaf + spine - every leaf is linked to every spine"""
+
+    def __init__(self, ns_count: int, spines: int = 4) -> None:
+        self.min_count = spines + 1
+        super().__init__(ns_count)
+        self.spines = spines
+
+    def name(self, idx: int) -> str:
+        if idx < self.spines:
+            return f"spine{idx}"
+        return f"leaf{idx - self.spines}"
+
+    def neighbours(self, idx: int) -> List[int]:
+        if idx < self.spines:
+            return list(range(self.spines, self.ns_count))
+        return list(range(self.spines))
+
+    def port(self, idx: int, peer: int) -> int:
+        return peer - self.spines if idx < self.spines else peer
+
+    def upstream(self, idx: int) -> Optional[int]:
+        return 0 if idx >= self.spines else None
+
+
+class FigureEight(Topology):
+    """Two rows joined at both ends + the middle, like sample_configs/figure_eight.json"""
+
+    min_count = 6
+
+    def __init__(self, ns_count: int) -> None:
+        super().__init__(ns_count)
+        if ns_count % 2:
+            raise ValueError("FigureEight needs an even number of namespaces")
+        self.columns = ns_count // 2
+        self.joined = {0, self.columns // 2, self.columns - 1}
+
+    def name(self, idx: int) -> str:
+        row, column = divmod(idx, self.columns)
+        return f"{'bottom' if row else 'top'}{column}"
+
+    def neighbours(self, idx: int) -> List[int]:
+        row, column = divmod(idx, self.columns)
+        peers = []
+        if column > 0:
+            peers.append(idx - 1)
+        if column < self.columns - 1:
+            peers.append(idx + 1)
+        if column in self.joined:
+            peers.append(column if row else idx + self.columns)
+        return peers
+
+
+TOPOLOGIES = {
+    "clos": Clos,
+    "figure8": FigureEight,
+    "hub": HubAndSpoke,
+    "mesh": Mesh,
+    "ring": Ring,
+}
+
+
+def interface_name(topology: Topology, idx: int, port: int) -> str:
+    return f"{topology.name(idx)}-{port}"
+
+
+def loopback_addresses(idx: int) -> Tuple[str, str]:
+    return str(LOOPBACK_V4_BASE + idx + 1), str(LOOPBACK_V6_BASE + idx + 1)
+
+
+def link_offsets(topology: Topology) -> List[int]:
+    """First link id of each namespace - a link's id is the lower namespace's offset
+    + its port, so the ids of links owned by the higher namespace go unused"""
+    offsets = []
+    total = 0
+    for idx in range(topology.ns_count):
+        offsets.append(total)
+        total += len(topology.neighbours(idx))
+    if total > LINK_V4_MAX:
+        raise ValueError(f"{total} ports do not fit in 100.64.0.0/10 /31s")
+    return offsets
+
+
+def link_addresses(
+    topology: Topology, offsets: List[int], idx: int, peer: int
+) -> Tuple[str, str]:
+    """This end's (v4, v6) addresses of the idx <-> peer link"""
+    low, high = sorted((idx, peer))
+    link_id = offsets[low] + topology.port(low, high)
+    end = 0 if idx == low else 1
+    return (
+        str(LINK_V4_BASE + link_id * 2 + end),
+        str(LINK_V6_BASE + link_id * 2 + end),
+    )
+
+
+def namespace_config(
+    topology: Topology, offsets: List[int], idx: int, oob: bool
+) -> Dict:
+    lo_v4, lo_v6 = loopback_addresses(idx)
+    interfaces: Dict[str, Dict] = {
+        "lo": {"prefixes": [f"{lo_v4}/32", f"{lo_v6}/128"], "type": "loopback"}
+    }
+    routes: Dict[str, Dict] = {}
+    next_hops: Dict[int, Tuple[str, str]] = {}
+    for port, peer in enumerate(topology.neighbours(idx)):
+        int_name = interface_name(topology, idx, port)
+        v4, v6 = link_addresses(topology, offsets, idx, peer)
+        interfaces[int_name] = {
+            "peer_name": interface_name(topology, peer, topology.port(peer, idx)),
+            "prefixes": [f"{v4}/31", f"{v6}/127"],
+            "type": "veth",
+        }
+        peer_v4, peer_v6 = link_addresses(topology, offsets, peer, idx)
+        next_hops[peer] = (peer_v4, peer_v6)
+        peer_lo_v4, peer_lo_v6 = loopback_addresses(peer)
+        peer_name = topology.name(peer)
+        routes[f"{peer_name}_v4"] = {
+            "dest_prefix": f"{peer_lo_v4}/32",
+            "egress_if_name": int_name,
+            "next_hop_ip": peer_v4,
+        }
+        routes[f"{peer_name}_v6"] = {
+            "dest_prefix": f"{peer_lo_v6}/128",
+            "egress_if_name": int_name,
+            "next_hop_ip": peer_v6,
+        }
+
+    upstream = topology.upstream(idx)
+    if upstream is not None:
+        upstream_v4, upstream_v6 = next_hops[upstream]
+        routes["default_v4"] = {
+            "dest_prefix": "0.0.0.0/0",
+            "egress_if_name": "",
+            "next_hop_ip": upstream_v4,
+        }
+        routes["default_v6"] = {
+            "dest_prefix": "::/0",
+            "egress_if_name": "",
+            "next_hop_ip": upstream_v6,
+        }
+
+    return {"id": idx + 1, "interfaces": interfaces, "oob": oob, "routes": routes}
+
+
+def generate(topology: Topology, oob: bool) -> Iterator[Tuple[str, Dict]]:
+    """Yield each (namespace name, config) - only one namespace is built at a time"""
+    offsets = link_offsets(topology)
+    for idx in range(topology.ns_count):
+        yield topology.name(idx), namespace_config(topology, offsets, idx, oob)
+
+
+def write_config(
+    namespaces: Iterator[Tuple[str, Dict]], template: Dict, out: TextIO
+) -> int:
+    """Stream the config out one namespace per line - returns the namespace count"""
+    count = 0
+    out.write('{"namespaces": {')
+    for ns_name, ns_config in namespaces:
+        out.write(f"{',' if count else ''}\n  {dumps(ns_name)}: ")
+        out.write(dumps(ns_config, sort_keys=True))
+        count += 1
+        if count % 10000 == 0:
+            LOG.info(f"-> Written {count} namespaces")
+    out.write("\n}")
+    for key in sorted(template):
+        if key != "namespaces":
+            out.write(f",\n{dumps(key)}: {dumps(template[key], sort_keys=True)}")
+    out.write("}\n")
+    return count
+
 
 def main() -> int:
-    """Generic join namespaces on a stick"""
+    """Generate ring / mesh / Clos / hub + spoke / figure eight namespace topologies
+    - veths, loopbacks, addressing + routes to each neighbour are all generated"""
 
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -21,7 +259,21 @@ def main() -> int:
     parser.add_argument(
         "-d", "--debug", action="store_true", help="Verbose debug output"
     )
-    parser.add_argument("config", help="Path to save JSON topology config")
+    parser.add_argument(
+        "--oob", action="store_true", help="Give every namespace an oob interface"
+    )
+    parser.add_argument("--physical-int", help="Override the base physical_int")
+    parser.add_argument(
+        "--spines", type=int, default=4, help="Spine namespaces in a clos topology"
+    )
+    parser.add_argument(
+        "-t",
+        "--topology",
+        choices=sorted(TOPOLOGIES),
+        default="ring",
+        help="Shape to link the namespaces in",
+    )
+    parser.add_argument("config", help="Path to save JSON topology config (- stdout)")
     parser.add_argument(
         "ns_count", type=int, default=1, help="Number of namespaces to put in config"
     )
@@ -36,23 +288,26 @@ def main() -> int:
 
     base_config = PROJECT_DIR / "sample_configs" / "base.json"
     with base_config.open("rb") as bcfp:
-        config = load(bcfp)
-    ns_base_config = deepcopy(config["namespaces"]["example_namespace"])
-    LOG.debug("Deleting default example_namesapce")
-    del config["namespaces"]["example_namespace"]
-
-    ns_count = args.ns_count + 1
-    for idx in range(1, int(ns_count)):
-        LOG.info(f"-> Making Namespace {idx}")
-        ns_conf = deepcopy(ns_base_config)
-        ns_name = f"ns{idx}"
-        ns_conf["id"] = idx
-
-        # TODO: Fix interfaces + automate addressing
+        template = load(bcfp)
+    if args.physical_int:
+        template["physical_int"] = args.physical_int
 
-        config["namespaces"][ns_name] = ns_conf
+    try:
+        if args.topology == "clos":
+            topology: Topology = Clos(args.ns_count, args.spines)
+        else:
+            topology = TOPOLOGIES[args.topology](args.ns_count)
+        namespaces = generate(topology, args.oob)
+        if args.config == "-":
+            count = write_config(namespaces, template, sys.stdout)
+        else:
+            with open(args.config, "w") as cfp:
+                count = write_config(namespaces, template, cfp)
+    except ValueError as ve:
+        LOG.error(f"Unable to generate a {args.topology} topology: {ve}")
+        return 1
 
-    print(dumps(config, indent=2, sort_keys=True))
+    LOG.info(f"Generated a {args.topology} topology of {count} namespaces")
     return 0
 
 